@@ -10,6 +10,7 @@ project_dir = Path(__file__).resolve().parents[1]
 # Define log output locations
 info_out = str(project_dir / 'info.log')
 error_out = str(project_dir / 'errors.log')
+query_profile_out = str(project_dir / 'query_profile.log')
 
 # Read log config file
 with open(project_dir / 'logging.yaml', 'rt') as f:
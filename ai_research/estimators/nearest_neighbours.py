@@ -0,0 +1,338 @@
+"""Approximate nearest neighbour search over abstract vectors.
+
+`IVFIndex` is an inverted file index: vectors are assigned to their closest
+k-means centroid and a query only scans the `n_probe` lists whose centroids
+are closest to it. Similarity is cosine. New vectors are added to the existing
+lists without retraining the centroids, so the index can grow incrementally;
+rebuild it when the corpus drifts far from the data it was trained on.
+"""
+import logging
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy import select
+
+from ai_research.mag.doc_vectors import fetch_matrix, fetch_vectors
+from ai_research.mag.mag_orm import HighDimDocVectorPacked, Paper, PaperFieldsOfStudy
+
+logger = logging.getLogger(__name__)
+
+MISSING_YEAR = -1
+
+
+def normalise(vectors):
+    """Scale rows to unit length. Zero rows are left as they are."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def spherical_kmeans(vectors, k, n_iter=20, seed=0, block_size=65536):
+    """Cluster unit vectors by cosine similarity.
+
+    Returns:
+        (numpy.ndarray) Unit-length centroids of shape (k, dim).
+
+    """
+    rng = np.random.RandomState(seed)
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(n_iter):
+        labels = np.concatenate(
+            [
+                np.argmax(vectors[i : i + block_size] @ centroids.T, axis=1)
+                for i in range(0, len(vectors), block_size)
+            ]
+        )
+        # Sum the vectors of each cluster with a cluster x vector indicator
+        n = len(labels)
+        indicator = sparse.csr_matrix(
+            (np.ones(n, dtype=vectors.dtype), (labels, np.arange(n))), shape=(k, n)
+        )
+        sums = np.asarray(indicator @ vectors, dtype=centroids.dtype)
+        empty = np.bincount(labels, minlength=k) == 0
+        # Restart empty clusters from random vectors
+        sums[empty] = vectors[rng.choice(len(vectors), empty.sum(), replace=False)]
+        centroids = normalise(sums)
+    return centroids
+
+
+def _top_k(scores, ids, k):
+    """Best k scores per row, sorted, with their ids."""
+    k = min(k, scores.shape[1])
+    if k == 0:
+        shape = (scores.shape[0], 0)
+        return np.empty(shape, np.float32), np.empty(shape, np.int64)
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-top, axis=1)
+    part = np.take_along_axis(part, order, axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    ids = ids[part] if ids.ndim == 1 else np.take_along_axis(ids, part, axis=1)
+    return top, ids
+
+
+def _pad(scores, ids, k):
+    """Pad result rows to k columns with -inf scores and id -1."""
+    n = k - scores.shape[1]
+    if n <= 0:
+        return scores, ids
+    return (
+        np.pad(scores, ((0, 0), (0, n)), constant_values=-np.inf),
+        np.pad(ids, ((0, 0), (0, n)), constant_values=-1),
+    )
+
+
+def exact_search(ids, vectors, queries, k=10, block_size=4096):
+    """Brute force cosine top-k, in blocks of the corpus to bound memory.
+
+    Returns:
+        scores (numpy.ndarray): Shape (n_queries, k), best first.
+        ids (numpy.ndarray): Paper ids of the neighbours, -1 if fewer than k.
+
+    """
+    queries = normalise(np.atleast_2d(queries))
+    ids = np.asarray(ids)
+    best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+    best_ids = np.full((len(queries), 0), -1, dtype=np.int64)
+    for start in range(0, len(ids), block_size):
+        block = normalise(vectors[start : start + block_size])
+        scores, block_ids = _top_k(
+            queries @ block.T, ids[start : start + block_size], k
+        )
+        best_scores, best_ids = _top_k(
+            np.hstack([best_scores, scores]), np.hstack([best_ids, block_ids]), k
+        )
+    return _pad(best_scores, best_ids, k)
+
+
+class IVFIndex:
+    """Inverted file index with cosine similarity.
+
+    Args:
+        n_lists (int): Number of k-means clusters. Around sqrt(n_papers) is a
+            good default.
+        seed (int): Seed of the k-means initialisation.
+
+    """
+
+    def __init__(self, n_lists=1024, seed=0):
+        self.n_lists = n_lists
+        self.seed = seed
+        self.centroids = None
+        self._lists = None
+        self._id_set = set()
+
+    def __len__(self):
+        return len(self._id_set)
+
+    def __contains__(self, paper_id):
+        return paper_id in self._id_set
+
+    def train(self, vectors, sample_size=100000):
+        """Fit the centroids on a sample of the vectors."""
+        vectors = np.asarray(vectors)
+        rng = np.random.RandomState(self.seed)
+        if len(vectors) > sample_size:
+            vectors = vectors[np.sort(rng.choice(len(vectors), sample_size, False))]
+        n_lists = min(self.n_lists, len(vectors))
+        self.centroids = spherical_kmeans(normalise(vectors), n_lists, seed=self.seed)
+        self._lists = [self._empty_list(vectors.shape[1]) for _ in range(n_lists)]
+        self._id_set = set()
+        return self
+
+    @staticmethod
+    def _empty_list(dim):
+        return {
+            "ids": np.empty(0, np.int64),
+            "years": np.empty(0, np.int32),
+            "vectors": np.empty((0, dim), np.float32),
+        }
+
+    def assign(self, vectors, n_probe=1):
+        """Indices of the n_probe closest lists of each vector."""
+        scores = normalise(vectors) @ self.centroids.T
+        n_probe = min(n_probe, len(self.centroids))
+        return np.argpartition(-scores, n_probe - 1, axis=1)[:, :n_probe]
+
+    def add(self, ids, vectors, years=None, block_size=65536):
+        """Add vectors to the index. Ids already in the index are skipped.
+
+        Args:
+            ids (array of int): Paper ids.
+            vectors (array): Matrix of shape (n, dim).
+            years (array of int): Publication year of each paper, used for
+                filtering. Missing years can be given as -1.
+
+        Returns:
+            (int) Number of vectors added.
+
+        """
+        if self.centroids is None:
+            raise ValueError("The index must be trained before adding vectors")
+        ids = np.asarray(ids, dtype=np.int64)
+        years = (
+            np.full(len(ids), MISSING_YEAR, np.int32)
+            if years is None
+            else np.asarray(years, dtype=np.int32)
+        )
+        new = np.array([i not in self._id_set for i in ids.tolist()], dtype=bool)
+        new_rows = np.flatnonzero(new)
+        # Only the first of repeated ids is added
+        _, first = np.unique(ids[new_rows], return_index=True)
+        new_rows = new_rows[np.sort(first)]
+
+        for start in range(0, len(new_rows), block_size):
+            rows = new_rows[start : start + block_size]
+            block = normalise(vectors[rows])
+            lists = self.assign(block)[:, 0]
+            for list_ in np.unique(lists):
+                members = lists == list_
+                entry = self._lists[list_]
+                entry["ids"] = np.concatenate([entry["ids"], ids[rows][members]])
+                entry["years"] = np.concatenate([entry["years"], years[rows][members]])
+                entry["vectors"] = np.vstack([entry["vectors"], block[members]])
+        self._id_set.update(ids[new_rows].tolist())
+        return len(new_rows)
+
+    def search(self, queries, k=10, n_probe=8, years=None, allowed_ids=None):
+        """Approximate cosine top-k for a batch of query vectors.
+
+        Args:
+            queries (array): Matrix of shape (n_queries, dim), or one vector.
+            k (int): Neighbours per query.
+            n_probe (int): Lists scanned per query. Higher is slower and more
+                accurate; n_probe = n_lists is exact.
+            years (tuple of int): Inclusive (first, last) publication years.
+            allowed_ids (array of int): Only return these paper ids, e.g. the
+                papers of a field of study (see `paper_ids_in_fields_of_study`).
+
+        Returns:
+            scores (numpy.ndarray): Shape (n_queries, k), best first.
+            ids (numpy.ndarray): Paper ids of the neighbours, -1 if fewer than k
+                candidates passed the filters.
+
+        """
+        queries = normalise(np.atleast_2d(queries))
+        probes = self.assign(queries, n_probe)
+        if allowed_ids is not None:
+            allowed_ids = np.unique(np.asarray(allowed_ids, dtype=np.int64))
+
+        cand_scores = [[] for _ in range(len(queries))]
+        cand_ids = [[] for _ in range(len(queries))]
+        for list_ in np.unique(probes):
+            entry = self._lists[list_]
+            mask = np.ones(len(entry["ids"]), dtype=bool)
+            if years is not None:
+                mask &= (entry["years"] >= years[0]) & (entry["years"] <= years[1])
+            if allowed_ids is not None:
+                mask &= np.isin(entry["ids"], allowed_ids, assume_unique=True)
+            if not mask.any():
+                continue
+            q = np.flatnonzero((probes == list_).any(axis=1))
+            scores, ids = _top_k(
+                queries[q] @ entry["vectors"][mask].T, entry["ids"][mask], k
+            )
+            for row, i in enumerate(q):
+                cand_scores[i].append(scores[row])
+                cand_ids[i].append(ids[row])
+
+        out_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        out_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        for i in range(len(queries)):
+            if not cand_ids[i]:
+                continue
+            scores, ids = _top_k(
+                np.concatenate(cand_scores[i])[None], np.concatenate(cand_ids[i]), k
+            )
+            out_scores[i, : scores.shape[1]] = scores[0]
+            out_ids[i, : ids.shape[1]] = ids[0]
+        return out_scores, out_ids
+
+    def save(self, path):
+        """Save the index to a `.npz` file."""
+        sizes = np.array([len(entry["ids"]) for entry in self._lists])
+        np.savez(
+            path,
+            n_lists=self.n_lists,
+            seed=self.seed,
+            centroids=self.centroids,
+            sizes=sizes,
+            ids=np.concatenate([e["ids"] for e in self._lists]),
+            years=np.concatenate([e["years"] for e in self._lists]),
+            vectors=np.vstack([e["vectors"] for e in self._lists]),
+        )
+
+    @classmethod
+    def load(cls, path):
+        """Load an index saved with `save`."""
+        with np.load(path) as data:
+            index = cls(n_lists=int(data["n_lists"]), seed=int(data["seed"]))
+            index.centroids = data["centroids"]
+            bounds = np.concatenate([[0], np.cumsum(data["sizes"])])
+            index._lists = [
+                {
+                    "ids": data["ids"][a:b],
+                    "years": data["years"][a:b],
+                    "vectors": data["vectors"][a:b],
+                }
+                for a, b in zip(bounds[:-1], bounds[1:])
+            ]
+        index._id_set = set(np.concatenate([e["ids"] for e in index._lists]).tolist())
+        return index
+
+
+def paper_years(engine, ids):
+    """Publication year of each paper id as an int array, -1 if unknown."""
+    table = Paper.__table__
+    years = {}
+    with engine.connect() as conn:
+        for start in range(0, len(ids), 50000):
+            chunk = [int(i) for i in ids[start : start + 50000]]
+            rows = conn.execute(
+                select([table.c.id, table.c.year_int]).where(table.c.id.in_(chunk))
+            )
+            years.update(rows.fetchall())
+    return np.array(
+        [MISSING_YEAR if years.get(i) is None else years[i] for i in ids.tolist()],
+        dtype=np.int32,
+    )
+
+
+def paper_ids_in_fields_of_study(engine, field_of_study_ids):
+    """Ids of the papers tagged with any of the fields of study."""
+    table = PaperFieldsOfStudy.__table__
+    with engine.connect() as conn:
+        rows = conn.execute(
+            select([table.c.paper_id])
+            .where(table.c.field_of_study_id.in_(list(field_of_study_ids)))
+            .distinct()
+        )
+        return np.array([r[0] for r in rows], dtype=np.int64)
+
+
+def build_index(engine, n_lists=None, seed=0):
+    """Train and fill an index from `high_dim_doc_vectors_packed`."""
+    ids, vectors = fetch_matrix(engine, HighDimDocVectorPacked)
+    if n_lists is None:
+        n_lists = max(1, int(np.sqrt(len(ids))))
+    index = IVFIndex(n_lists=n_lists, seed=seed).train(vectors)
+    index.add(ids, vectors, paper_years(engine, ids))
+    logger.info(f"Built an index of {len(index)} vectors in {n_lists} lists")
+    return index
+
+
+def update_index(index, engine):
+    """Add the packed vectors of papers that are not in the index yet."""
+    table = HighDimDocVectorPacked.__table__
+    with engine.connect() as conn:
+        all_ids = np.array(
+            [r[0] for r in conn.execute(select([table.c.id]))], dtype=np.int64
+        )
+    new_ids = np.array([i for i in all_ids.tolist() if i not in index])
+    if len(new_ids) == 0:
+        return 0
+    ids, vectors = fetch_vectors(engine, new_ids, HighDimDocVectorPacked)
+    n = index.add(ids, vectors, paper_years(engine, ids))
+    logger.info(f"Added {n} vectors to the index")
+    return n
@@ -0,0 +1,424 @@
+"""Near-duplicate title search with MinHash and LSH banding.
+
+Titles are normalised (ASCII, lower case, punctuation removed) and cut into
+character shingles. Each title gets a MinHash signature of `num_perm`
+multiply-shift hashes, whose agreement estimates the Jaccard similarity of
+two shingle sets. The signature is split into `bands` bands and two titles
+become candidates when they share all the values of at least one band, so a
+query only compares with a few candidates instead of every paper.
+
+The probability of a match is the posterior probability (uniform prior,
+agreeing hashes out of `num_perm`) that the Jaccard similarity of the titles
+is at least `match_threshold`. Like `Paper.prob`, it is a score in [0, 1].
+
+Signatures are saved to a `.npz` file and the band tables rebuilt on load.
+"""
+import logging
+import re
+import string
+import unicodedata
+
+import numpy as np
+import pandas as pd
+from scipy import sparse, stats
+from scipy.sparse.csgraph import connected_components
+from sqlalchemy import any_, func, literal, select
+from sqlalchemy.dialects.postgresql import ARRAY, BIGINT
+
+import ai_research
+from ai_research.mag.mag_orm import Paper
+
+logger = logging.getLogger(__name__)
+
+papers = Paper.__table__
+
+INDEX_PATH = ai_research.project_dir / "data" / "processed" / "title_index.npz"
+SEPARATOR = "\n"
+EMPTY = np.iinfo(np.uint32).max
+
+# Everything but letters, digits and the separator becomes a space
+_SPACES = str.maketrans(
+    {
+        chr(i): " "
+        for i in range(128)
+        if chr(i) not in string.ascii_letters + string.digits
+    }
+)
+del _SPACES[ord(SEPARATOR)]
+
+
+def normalise_titles(titles):
+    """ASCII, lower case titles without punctuation, as one text.
+
+    Returns:
+        text (str): " title " of every title, separated by SEPARATOR.
+        starts (numpy.ndarray): Position where each title starts.
+
+    """
+    text = SEPARATOR.join(
+        (t or "").replace(SEPARATOR, " ").replace("\r", " ") for t in titles
+    )
+    text = unicodedata.normalize("NFKD", text).encode("ascii", errors="ignore")
+    text = text.decode("ascii").lower().translate(_SPACES)
+    text = re.sub(" *\n *", " \n ", re.sub(" +", " ", text))
+    text = " " + text.strip(" ") + " "
+    chars = np.frombuffer(text.encode("ascii"), dtype=np.uint8)
+    starts = np.concatenate([[0], np.flatnonzero(chars == ord(SEPARATOR)) + 1])
+    return text, starts
+
+
+def shingles(titles, k=3):
+    """Character k-grams of titles packed into integers.
+
+    Returns:
+        grams (numpy.ndarray): uint64 k-grams, in title order.
+        owner (numpy.ndarray): Index of the title of each gram.
+
+    """
+    if not 0 < k <= 8:
+        raise ValueError("Shingles are 1 to 8 characters long")
+    text, starts = normalise_titles(titles)
+    chars = np.frombuffer(text.encode("ascii"), dtype=np.uint8).astype(np.uint64)
+    n = len(chars) - k + 1
+    if n <= 0:
+        empty = np.empty(0, dtype=np.uint64)
+        return empty, empty.astype(np.int64)
+    grams = np.zeros(n, dtype=np.uint64)
+    for j in range(k):
+        grams |= chars[j : j + n] << np.uint64(8 * j)
+    # Drop grams across the separator and those of blank titles (" ")
+    separators = np.concatenate([[0], np.cumsum(chars == ord(SEPARATOR))])
+    valid = separators[k:] == separators[:n]
+    blank = np.uint64(0x20202020_20202020 & ((1 << (8 * k)) - 1))
+    valid &= grams != blank
+    positions = np.flatnonzero(valid)
+    owner = np.searchsorted(starts, positions, side="right") - 1
+    return grams[positions], owner
+
+
+class MinHasher:
+    """MinHash signatures with multiply-shift hashing.
+
+    Args:
+        num_perm (int): Hashes per signature.
+        k (int): Shingle length in characters.
+        seed (int): Seed of the hash parameters.
+
+    """
+
+    def __init__(self, num_perm=64, k=3, seed=0):
+        self.num_perm = num_perm
+        self.k = k
+        self.seed = seed
+        rng = np.random.RandomState(seed)
+        high = np.iinfo(np.int64).max
+        self.a = rng.randint(0, high, size=num_perm, dtype=np.int64).astype(np.uint64)
+        self.a |= np.uint64(1)
+        self.b = rng.randint(0, high, size=num_perm, dtype=np.int64).astype(np.uint64)
+
+    def signatures(self, titles, block_size=20000):
+        """Signature of every title, EMPTY for titles without shingles.
+
+        Returns:
+            (numpy.ndarray) uint32 array of shape (n_titles, num_perm).
+
+        """
+        titles = list(titles)
+        out = np.full((len(titles), self.num_perm), EMPTY, dtype=np.uint32)
+        shift = np.uint64(32)
+        for start in range(0, len(titles), block_size):
+            grams, owner = shingles(titles[start : start + block_size], self.k)
+            if not len(grams):
+                continue
+            firsts = np.flatnonzero(np.r_[True, owner[1:] != owner[:-1]])
+            rows = start + owner[firsts]
+            for i in range(self.num_perm):
+                hashes = (self.a[i] * grams + self.b[i]) >> shift
+                out[rows, i] = np.minimum.reduceat(hashes, firsts)
+        return out
+
+
+def similarity(left, right, block_size=100000):
+    """Share of agreeing hashes of pairs of signatures."""
+    return np.concatenate(
+        [
+            (left[i : i + block_size] == right[i : i + block_size]).mean(axis=1)
+            for i in range(0, len(left), block_size)
+        ]
+        or [np.empty(0)]
+    )
+
+
+def match_probability(similarities, num_perm, threshold=0.8):
+    """Posterior probability that the Jaccard similarity is >= threshold."""
+    agree = np.round(np.asarray(similarities) * num_perm)
+    return stats.beta.sf(threshold, agree + 1, num_perm - agree + 1)
+
+
+def _spans(starts, lengths):
+    """Positions starts[i] .. starts[i] + lengths[i] and the i of each."""
+    owner = np.repeat(np.arange(len(starts)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(
+        np.cumsum(lengths) - lengths, lengths
+    )
+    return starts[owner] + offsets, owner
+
+
+class TitleIndex:
+    """LSH index of paper title signatures.
+
+    Args:
+        num_perm (int): Hashes per signature.
+        bands (int): LSH bands. num_perm / bands hashes per band; fewer
+            rows per band find less similar pairs at the cost of more
+            candidates.
+        k (int): Shingle length in characters.
+        seed (int): Seed of the hash parameters.
+        match_threshold (float): Jaccard similarity of a true match, used
+            for the match probability.
+
+    """
+
+    def __init__(self, num_perm=64, bands=16, k=3, seed=0, match_threshold=0.8):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.hasher = MinHasher(num_perm, k, seed)
+        self.bands = bands
+        self.match_threshold = match_threshold
+        self.ids = np.empty(0, dtype=np.int64)
+        self.signatures = np.empty((0, num_perm), dtype=np.uint32)
+        self._band_keys = None
+        self._band_order = None
+        rng = np.random.RandomState(seed + 1)
+        self._band_mix = rng.randint(
+            1, 2 ** 62, size=num_perm // bands, dtype=np.int64
+        ).astype(np.uint64) | np.uint64(1)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def num_perm(self):
+        return self.hasher.num_perm
+
+    def band_keys(self, signatures):
+        """One uint64 key per band of every signature."""
+        rows = self.num_perm // self.bands
+        bands = signatures.reshape(len(signatures), self.bands, rows).astype(np.uint64)
+        return (bands * self._band_mix).sum(axis=2, dtype=np.uint64)
+
+    def _build_bands(self):
+        keys = self.band_keys(self.signatures)
+        # Titles without shingles never become candidates
+        keys[(self.signatures == EMPTY).all(axis=1)] = 0
+        self._band_order = np.argsort(keys, axis=0, kind="stable")
+        self._band_keys = np.take_along_axis(keys, self._band_order, axis=0)
+
+    def add(self, ids, titles):
+        """Add papers to the index. Ids already in it are skipped.
+
+        Returns:
+            (int) Number of papers added.
+
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        ids, first = np.unique(ids, return_index=True)
+        new = ~np.isin(ids, self.ids)
+        rows = first[new]
+        titles = list(titles)
+        signatures = self.hasher.signatures([titles[i] for i in rows])
+        ids = np.concatenate([self.ids, ids[new]])
+        signatures = np.vstack([self.signatures, signatures])
+        order = np.argsort(ids, kind="stable")
+        self.ids, self.signatures = ids[order], signatures[order]
+        self._build_bands()
+        return len(rows)
+
+    def candidates(self, signatures, max_bucket=1000):
+        """Query - index row pairs sharing at least one band.
+
+        Args:
+            signatures (numpy.ndarray): Query signatures.
+            max_bucket (int): Most index rows taken from one bucket, so very
+                common titles do not blow up the candidate count.
+
+        Returns:
+            queries, rows (numpy.ndarray): Distinct candidate pairs.
+
+        """
+        keys = self.band_keys(signatures)
+        keys[(signatures == EMPTY).all(axis=1)] = 0
+        queries, rows = [], []
+        for band in range(self.bands):
+            sorted_keys = self._band_keys[:, band]
+            lo = np.searchsorted(sorted_keys, keys[:, band], side="left")
+            hi = np.searchsorted(sorted_keys, keys[:, band], side="right")
+            lengths = np.minimum(hi - lo, max_bucket)
+            lengths[keys[:, band] == 0] = 0
+            positions, owner = _spans(lo, lengths)
+            queries.append(owner)
+            rows.append(self._band_order[positions, band])
+        pairs = np.unique(np.concatenate(queries) * len(self) + np.concatenate(rows))
+        return pairs // max(len(self), 1), pairs % max(len(self), 1)
+
+    def match(self, titles, k=1, min_similarity=0.5, max_bucket=1000):
+        """Best matching papers of a batch of titles.
+
+        Args:
+            titles (list of str): Titles to look up.
+            k (int): Matches per title.
+            min_similarity (float): Smallest estimated Jaccard similarity.
+            max_bucket (int): See `candidates`.
+
+        Returns:
+            (pandas.DataFrame) query (position in titles), paper_id,
+            similarity and prob, best first. Titles without a match have no
+            row.
+
+        """
+        signatures = self.hasher.signatures(titles)
+        columns = ["query", "paper_id", "similarity", "prob"]
+        if not len(self) or not len(signatures):
+            return pd.DataFrame(columns=columns)
+        queries, rows = self.candidates(signatures, max_bucket)
+        sims = similarity(signatures[queries], self.signatures[rows])
+        keep = sims >= min_similarity
+        queries, rows, sims = queries[keep], rows[keep], sims[keep]
+        order = np.lexsort((self.ids[rows], -sims, queries))
+        queries, rows, sims = queries[order], rows[order], sims[order]
+        # Rank within each query
+        firsts = np.flatnonzero(np.r_[True, queries[1:] != queries[:-1]])
+        rank = np.arange(len(queries)) - np.repeat(
+            firsts, np.diff(np.r_[firsts, len(queries)])
+        )
+        top = rank < k
+        return pd.DataFrame(
+            {
+                "query": queries[top],
+                "paper_id": self.ids[rows[top]],
+                "similarity": sims[top],
+                "prob": match_probability(
+                    sims[top], self.num_perm, self.match_threshold
+                ),
+            },
+            columns=columns,
+        )
+
+    def duplicate_clusters(self, min_similarity=0.8, window=10):
+        """Clusters of indexed papers with near-identical titles.
+
+        Within every band bucket each paper is compared with the next
+        `window` papers of the bucket, and similar pairs are linked into
+        connected components.
+
+        Returns:
+            (pandas.DataFrame) paper_id and cluster (smallest paper id of
+            the cluster), for the papers of clusters of two or more.
+
+        """
+        n = len(self)
+        if not n:
+            return pd.DataFrame(columns=["paper_id", "cluster"])
+        left, right = [], []
+        for band in range(self.bands):
+            keys = self._band_keys[:, band]
+            order = self._band_order[:, band]
+            for d in range(1, min(window, n - 1) + 1):
+                same = np.flatnonzero((keys[d:] == keys[:-d]) & (keys[d:] != 0))
+                left.append(order[same])
+                right.append(order[same + d])
+        if not left:
+            return pd.DataFrame(columns=["paper_id", "cluster"])
+        pairs = np.unique(
+            np.minimum(np.concatenate(left), np.concatenate(right)) * n
+            + np.maximum(np.concatenate(left), np.concatenate(right))
+        )
+        left, right = pairs // n, pairs % n
+        keep = (
+            similarity(self.signatures[left], self.signatures[right]) >= min_similarity
+        )
+        graph = sparse.coo_matrix(
+            (np.ones(keep.sum(), dtype=np.int8), (left[keep], right[keep])),
+            shape=(n, n),
+        )
+        _, labels = connected_components(graph, directed=False)
+        sizes = np.bincount(labels)
+        members = np.flatnonzero(sizes[labels] > 1)
+        # ids are sorted, so the first member of a label has the smallest id
+        clusters, first = np.unique(labels[members], return_index=True)
+        cluster_ids = self.ids[members[first]]
+        return pd.DataFrame(
+            {
+                "paper_id": self.ids[members],
+                "cluster": cluster_ids[np.searchsorted(clusters, labels[members])],
+            }
+        )
+
+    def save(self, path=INDEX_PATH):
+        """Save the signatures and parameters to a `.npz` file."""
+        np.savez(
+            path,
+            ids=self.ids,
+            signatures=self.signatures,
+            params=np.array(
+                [self.num_perm, self.bands, self.hasher.k, self.hasher.seed]
+            ),
+            match_threshold=self.match_threshold,
+        )
+
+    @classmethod
+    def load(cls, path=INDEX_PATH):
+        """Load an index saved with `save`."""
+        with np.load(path) as data:
+            num_perm, bands, k, seed = data["params"].tolist()
+            index = cls(num_perm, bands, k, seed, float(data["match_threshold"]))
+            index.ids = data["ids"]
+            index.signatures = data["signatures"]
+        index._build_bands()
+        return index
+
+
+def read_titles(engine, paper_ids=None, chunksize=50000):
+    """id and title (or original title) of papers, sorted by id."""
+    title = func.coalesce(papers.c.title, papers.c.original_title)
+    queries = [select([papers.c.id, title])]
+    if paper_ids is not None:
+        queries = [
+            select([papers.c.id, title]).where(
+                papers.c.id
+                == any_(
+                    literal(
+                        [int(i) for i in paper_ids[i : i + chunksize]], ARRAY(BIGINT)
+                    )
+                )
+            )
+            for i in range(0, len(paper_ids), chunksize)
+        ]
+    rows = []
+    with engine.connect() as conn:
+        for query in queries:
+            rows.extend(conn.execute(query.order_by(papers.c.id)))
+    rows.sort()
+    return np.array([r[0] for r in rows], dtype=np.int64), [r[1] for r in rows]
+
+
+def build_index(engine, **kwargs):
+    """Index of the titles of every paper in `mag_papers`."""
+    index = TitleIndex(**kwargs)
+    index.add(*read_titles(engine))
+    logger.info(f"Built a title index of {len(index)} papers")
+    return index
+
+
+def update_index(index, engine):
+    """Add the papers that are not in the index yet."""
+    with engine.connect() as conn:
+        all_ids = np.array(
+            [r[0] for r in conn.execute(select([papers.c.id]))], dtype=np.int64
+        )
+    new_ids = np.setdiff1d(all_ids, index.ids)
+    if not len(new_ids):
+        return 0
+    n = index.add(*read_titles(engine, new_ids))
+    logger.info(f"Added {n} titles to the index")
+    return n
@@ -0,0 +1,472 @@
+"""Harvest MAG papers from the Academic Knowledge API.
+
+The harvest (papers of the configured fields of study, one shard per field
+and year) runs shards concurrently behind a shared token bucket. Pages of a
+shard are fetched in order, and `get_json` retries rate limiting and server
+errors with backoff.
+
+Every page is streamed to newline-delimited JSON files in the raw data
+directory, one per table (`mag_papers.jsonl`, `mag_authors.jsonl`, ...), as
+`make_dataset.py` loads them. Papers are deduplicated on their id across
+shards and runs. After a page is written, its paper ids and the next offset
+of its shard are checkpointed, so an interrupted or failed harvest resumes
+where each shard stopped. A page written just before a crash may be
+fetched again; its rows are upserted on their keys when loaded.
+
+`stub_app` serves the evaluate endpoint from a list of paper entities.
+
+    python ai_research/fetch_data.py
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+from pathlib import Path
+
+import aiohttp
+from aiohttp import web
+from dotenv import find_dotenv, load_dotenv
+
+import ai_research
+from ai_research.mag.http_lookup import LookupFailed, TokenBucket, get_json, run
+from ai_research.mag.mag_orm import (
+    Paper,
+    Author,
+    Affiliation,
+    FieldOfStudy,
+    Journal,
+    Conference,
+    PaperAuthor,
+    PaperFieldsOfStudy,
+    AuthorAffiliation,
+)
+
+logger = logging.getLogger(__name__)
+
+STATE_DIR = ai_research.project_dir / "data" / "interim" / "mag_harvest"
+ATTRIBUTES = [
+    "Id",
+    "Ti",
+    "DN",
+    "Y",
+    "D",
+    "CC",
+    "Pt",
+    "RId",
+    "DOI",
+    "PB",
+    "BT",
+    "IA",
+    "S",
+    "AA.AuId",
+    "AA.DAuN",
+    "AA.AfId",
+    "AA.DAfN",
+    "AA.S",
+    "F.FId",
+    "F.DFN",
+    "J.JId",
+    "J.JN",
+    "C.CId",
+    "C.CN",
+]
+# Entity tables repeated across papers, written once per run
+SHARED = {
+    Author.__tablename__,
+    Affiliation.__tablename__,
+    FieldOfStudy.__tablename__,
+}
+
+
+def shard_key(field, year):
+    return f"{field}|{year}"
+
+
+def shard_expression(field, year):
+    """Evaluate expression of the papers of a field of study and year."""
+    field = field.lower().replace("'", "\\'")
+    return f"And(Composite(F.FN='{field}'),Y={int(year)})"
+
+
+def invert_abstract(inverted):
+    """Abstract text of an inverted index {"IndexLength", "InvertedIndex"}."""
+    if not inverted:
+        return None
+    words = [None] * inverted["IndexLength"]
+    for word, positions in inverted["InvertedIndex"].items():
+        for position in positions:
+            words[position] = word
+    return " ".join(w for w in words if w is not None)
+
+
+def parse_paper(entity):
+    """Table rows of a paper entity.
+
+    Returns:
+        (dict) Table name to a list of records.
+
+    """
+    paper_id = entity["Id"]
+    urls = [source["U"] for source in entity.get("S", []) if "U" in source]
+    rows = {
+        Paper.__tablename__: [
+            {
+                "id": paper_id,
+                "prob": entity.get("logprob"),
+                "title": entity.get("Ti"),
+                "publication_type": entity.get("Pt"),
+                "year": str(entity["Y"]) if entity.get("Y") else None,
+                "date": entity.get("D"),
+                "citations": entity.get("CC"),
+                "original_title": entity.get("DN"),
+                "references": json.dumps(entity["RId"]) if "RId" in entity else None,
+                "doi": entity.get("DOI"),
+                "publisher": entity.get("PB"),
+                "bibtex_doc_type": entity.get("BT"),
+                "abstract": invert_abstract(entity.get("IA")),
+                "source": json.dumps(urls) if urls else None,
+            }
+        ]
+    }
+    for table in [
+        Author,
+        Affiliation,
+        FieldOfStudy,
+        Journal,
+        Conference,
+        PaperAuthor,
+        PaperFieldsOfStudy,
+        AuthorAffiliation,
+    ]:
+        rows[table.__tablename__] = []
+
+    for author in entity.get("AA", []):
+        rows[Author.__tablename__].append(
+            {"id": author["AuId"], "name": author.get("DAuN")}
+        )
+        rows[PaperAuthor.__tablename__].append(
+            {
+                "paper_id": paper_id,
+                "author_id": author["AuId"],
+                "order": author.get("S"),
+            }
+        )
+        if author.get("AfId"):
+            rows[Affiliation.__tablename__].append(
+                {"id": author["AfId"], "affiliation": author.get("DAfN")}
+            )
+        rows[AuthorAffiliation.__tablename__].append(
+            {
+                "affiliation_id": author.get("AfId"),
+                "author_id": author["AuId"],
+                "paper_id": paper_id,
+            }
+        )
+    for field in entity.get("F", []):
+        rows[FieldOfStudy.__tablename__].append(
+            {"id": field["FId"], "name": field.get("DFN")}
+        )
+        rows[PaperFieldsOfStudy.__tablename__].append(
+            {"paper_id": paper_id, "field_of_study_id": field["FId"]}
+        )
+    if entity.get("J"):
+        rows[Journal.__tablename__].append(
+            {
+                "id": entity["J"].get("JId"),
+                "journal_name": entity["J"].get("JN"),
+                "paper_id": paper_id,
+            }
+        )
+    if entity.get("C"):
+        rows[Conference.__tablename__].append(
+            {
+                "id": entity["C"].get("CId"),
+                "conference_name": entity["C"].get("CN"),
+                "paper_id": paper_id,
+            }
+        )
+    return rows
+
+
+class HarvestState:
+    """Next offset of every shard and ids of the papers written so far.
+
+    Offsets are kept in `checkpoint.json`, replaced atomically, and paper
+    ids are appended to `paper_ids.txt`.
+
+    Args:
+        directory (str or Path): Where the state files are kept.
+
+    """
+
+    def __init__(self, directory=STATE_DIR):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.checkpoint = self.directory / "checkpoint.json"
+        self.shards = {}
+        if self.checkpoint.exists():
+            with open(self.checkpoint, "rt") as f:
+                self.shards = json.load(f)
+        self.ids_path = self.directory / "paper_ids.txt"
+        self.paper_ids = set()
+        if self.ids_path.exists():
+            with open(self.ids_path, "rt") as f:
+                self.paper_ids = {int(line) for line in f if line.strip()}
+
+    def offset(self, shard):
+        return self.shards.get(shard, {}).get("offset", 0)
+
+    def done(self, shard):
+        return self.shards.get(shard, {}).get("done", False)
+
+    def add_papers(self, paper_ids):
+        with open(self.ids_path, "at") as f:
+            f.writelines(f"{i}\n" for i in paper_ids)
+        self.paper_ids.update(paper_ids)
+
+    def advance(self, shard, offset, done):
+        """Record the next offset of a shard."""
+        self.shards[shard] = {"offset": offset, "done": done}
+        tmp = self.checkpoint.with_suffix(".tmp")
+        with open(tmp, "wt") as f:
+            json.dump(self.shards, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.checkpoint)
+
+
+class HarvestWriter:
+    """Appends table rows to one newline-delimited JSON file per table.
+
+    Args:
+        output_dir (str or Path): Raw data directory.
+        state (HarvestState): Papers already written are skipped.
+
+    """
+
+    def __init__(self, output_dir, state):
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.state = state
+        self.written = {table: set() for table in SHARED}
+        self.files = {}
+
+    def _file(self, table):
+        if table not in self.files:
+            self.files[table] = open(self.output_dir / f"{table}.jsonl", "at")
+        return self.files[table]
+
+    def write(self, entities):
+        """Write the rows of new papers and record their ids.
+
+        Returns:
+            (int) Number of new papers.
+
+        """
+        new = {}
+        for entity in entities:
+            if entity["Id"] not in self.state.paper_ids:
+                new.setdefault(entity["Id"], entity)
+        for entity in new.values():
+            for table, records in parse_paper(entity).items():
+                f = self._file(table)
+                for record in records:
+                    if table in SHARED:
+                        if record["id"] in self.written[table]:
+                            continue
+                        self.written[table].add(record["id"])
+                    f.write(json.dumps(record) + "\n")
+        for f in self.files.values():
+            f.flush()
+        self.state.add_papers(list(new))
+        return len(new)
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+
+class MagClient:
+    """Academic Knowledge API evaluate requests.
+
+    Args:
+        api_key (str): Subscription key.
+        url (str): Evaluate endpoint.
+        page_size (int): Entities per request.
+        retries (int): See `get_json`.
+        backoff (float): See `get_json`.
+
+    """
+
+    def __init__(
+        self,
+        api_key=None,
+        url="https://api.labs.cognitive.microsoft.com/academic/v1.0/evaluate",
+        page_size=1000,
+        retries=5,
+        backoff=0.5,
+    ):
+        self.api_key = api_key
+        self.url = url
+        self.page_size = page_size
+        self.retries = retries
+        self.backoff = backoff
+
+    async def evaluate(self, session, expr, offset, limiter=None):
+        """One page of the entities matching an expression."""
+        params = {
+            "expr": expr,
+            "count": self.page_size,
+            "offset": offset,
+            "attributes": ",".join(ATTRIBUTES),
+        }
+        if self.api_key:
+            params["subscription-key"] = self.api_key
+        response = await get_json(
+            session, self.url, params, limiter, self.retries, self.backoff
+        )
+        return response.get("entities", [])
+
+
+async def _harvest_shard(session, client, shard, expr, state, writer, limiter, counts):
+    offset = state.offset(shard)
+    while True:
+        entities = await client.evaluate(session, expr, offset, limiter)
+        counts["papers"] += writer.write(entities)
+        offset += len(entities)
+        done = len(entities) < client.page_size
+        state.advance(shard, offset, done)
+        if done:
+            return
+
+
+async def _harvest(client, shards, state, writer, rate, concurrency):
+    limiter = TokenBucket(rate)
+    semaphore = asyncio.Semaphore(concurrency)
+    counts = {"papers": 0, "shards": 0, "failed": []}
+
+    async def one(session, shard, expr):
+        async with semaphore:
+            try:
+                await _harvest_shard(
+                    session, client, shard, expr, state, writer, limiter, counts
+                )
+                counts["shards"] += 1
+            except (LookupFailed, aiohttp.ClientError) as e:
+                logger.warning(f"Harvest of {shard} stopped: {e}")
+                counts["failed"].append(shard)
+
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(one(session, s, e) for s, e in shards.items()))
+    return counts
+
+
+def harvest(
+    client,
+    fields,
+    years,
+    output_dir,
+    state_dir=STATE_DIR,
+    rate=3,
+    concurrency=4,
+):
+    """Harvest the papers of some fields of study and years.
+
+    Args:
+        client (MagClient): API client.
+        fields (list of str): Field of study names.
+        years (iterable of int): Publication years.
+        output_dir (str or Path): Where the table files are appended to.
+        state_dir (str or Path): Where the checkpoints are kept.
+        rate (float): Requests per second.
+        concurrency (int): Shards harvested at once.
+
+    Returns:
+        (dict) Numbers of new papers and completed shards, and the keys of
+        the shards that failed. They resume from their last page next time.
+
+    """
+    state = HarvestState(state_dir)
+    shards = {
+        shard_key(field, year): shard_expression(field, year)
+        for field in fields
+        for year in years
+        if not state.done(shard_key(field, year))
+    }
+    if not shards:
+        logger.info("MAG harvest: all shards done")
+        return {"papers": 0, "shards": 0, "failed": []}
+    writer = HarvestWriter(output_dir, state)
+    try:
+        counts = run(_harvest(client, shards, state, writer, rate, concurrency))
+    finally:
+        writer.close()
+    logger.info(
+        f"MAG harvest: {counts['papers']} new papers from {counts['shards']} "
+        f"shards, {len(counts['failed'])} failed"
+    )
+    return counts
+
+
+def stub_app(entities, fail_after=None):
+    """Local stand-in for the evaluate endpoint.
+
+    Args:
+        entities (list of dict): Paper entities. An expression built by
+            `shard_expression` matches those with the field name in F.DFN
+            (lower-cased) and the year.
+        fail_after (int): Requests served before every request fails
+            with a 503 response.
+
+    Served (field, year, offset) requests are kept in app["served"].
+    """
+    app = web.Application()
+    served = app["served"] = []
+
+    async def evaluate(request):
+        if fail_after is not None and len(served) >= fail_after:
+            return web.json_response({}, status=503)
+        expr = request.query["expr"]
+        field = re.search(r"F\.FN='((?:[^'\\]|\\.)*)'", expr).group(1)
+        field = field.replace("\\'", "'")
+        year = int(re.search(r"Y=(\d+)", expr).group(1))
+        offset = int(request.query.get("offset", 0))
+        count = int(request.query.get("count", 10))
+        served.append((field, year, offset))
+        matches = sorted(
+            (
+                e
+                for e in entities
+                if e.get("Y") == year
+                and field in [f.get("DFN", "").lower() for f in e.get("F", [])]
+            ),
+            key=lambda e: e["Id"],
+        )
+        return web.json_response(
+            {"expr": expr, "entities": matches[offset : offset + count]}
+        )
+
+    app.router.add_get("/evaluate", evaluate)
+    return app
+
+
+def main():
+    config = ai_research.config["mag_harvest"]
+    client = MagClient(
+        os.getenv("mag_key"), config["url"], page_size=config["page_size"]
+    )
+    counts = harvest(
+        client,
+        config["fields"],
+        range(config["first_year"], config["last_year"] + 1),
+        ai_research.project_dir / config["output_dir"],
+        rate=config["rate"],
+        concurrency=config["concurrency"],
+    )
+    if counts["failed"]:
+        raise LookupFailed(f"Shards to resume: {counts['failed']}")
+
+
+if __name__ == "__main__":
+    load_dotenv(find_dotenv())
+    main()
@@ -0,0 +1,299 @@
+"""Infer the gender of authors from their first names, in bulk.
+
+Authors without an `author_gender` row are read in chunks. Their first names
+are extracted and deduplicated, and only names missing from the
+`first_name_gender` cache (or older than its TTL) are sent to the provider,
+in concurrent, rate-limited batches. Provider results are written to the
+cache and fanned back out to every author with that name with one bulk load.
+A rerun only queries names it has never seen.
+
+The default provider is genderize.io. `stub_app` serves the same API from a
+dict of names for tests and dry runs.
+
+    python ai_research/mag/author_gender.py
+"""
+import asyncio
+import datetime
+import logging
+import os
+
+import aiohttp
+import pandas as pd
+from aiohttp import web
+from dotenv import find_dotenv, load_dotenv
+from sqlalchemy import any_, create_engine, literal, select
+from sqlalchemy.dialects.postgresql import ARRAY, TEXT
+
+import ai_research
+from ai_research.mag.bulk_load import bulk_load
+from ai_research.mag.http_lookup import TokenBucket, get_json, run
+from ai_research.mag.mag_orm import Author, AuthorGender, FirstNameGender
+
+logger = logging.getLogger(__name__)
+
+authors = Author.__table__
+author_gender = AuthorGender.__table__
+name_cache = FirstNameGender.__table__
+
+# Leading initials, then a first name followed by at least one more token
+FIRST_NAME = r"^(?:[a-z]\s+)*([a-z][a-z'-]+)\s+\S"
+
+
+def first_names(full_names):
+    """Normalised first names of full names.
+
+    Names are transliterated to ASCII and lower-cased. Initials are skipped,
+    and names with only initials or a single token have no first name.
+
+    Args:
+        full_names (pandas.Series): Author names, e.g. "J. Ana-María López".
+
+    Returns:
+        (pandas.Series) First names ("ana-maría" -> "ana-maria"), None when
+        there is none.
+
+    """
+    names = (
+        full_names.fillna("")
+        .str.normalize("NFKD")
+        .str.encode("ascii", errors="ignore")
+        .str.decode("ascii")
+        .str.lower()
+        .str.replace(r"[^a-z'\s-]", " ", regex=True)
+        .str.strip()
+    )
+    first = names.str.extract(FIRST_NAME, expand=False)
+    return first.where(first.notnull(), None)
+
+
+class GenderizeProvider:
+    """genderize.io batch lookups.
+
+    Args:
+        url (str): API endpoint.
+        api_key (str): Optional API key.
+        batch_size (int): Names per request (at most 10 for genderize.io).
+
+    """
+
+    def __init__(self, url="https://api.genderize.io", api_key=None, batch_size=10):
+        self.url = url
+        self.api_key = api_key
+        self.batch_size = batch_size
+
+    async def lookup(self, session, names, limiter=None):
+        """Gender of a batch of names.
+
+        Returns:
+            (list of dict) first_name, gender, samples and probability.
+
+        """
+        params = [("name[]", name) for name in names]
+        if self.api_key:
+            params.append(("apikey", self.api_key))
+        results = await get_json(session, self.url, params, limiter)
+        return [
+            {
+                "first_name": r["name"],
+                "gender": r.get("gender"),
+                "samples": r.get("count"),
+                "probability": r.get("probability"),
+            }
+            for r in results
+        ]
+
+
+async def fetch_genders(provider, names, rate=5, concurrency=8):
+    """Look up names with concurrent, rate-limited batches.
+
+    Args:
+        provider: Object with a `batch_size` and an async
+            `lookup(session, names, limiter)`, e.g. `GenderizeProvider`.
+        names (list of str): Distinct names.
+        rate (float): Requests per second.
+        concurrency (int): Requests in flight.
+
+    Returns:
+        (pandas.DataFrame) first_name, gender, samples and probability.
+
+    """
+    limiter = TokenBucket(rate)
+    semaphore = asyncio.Semaphore(concurrency)
+    batches = [
+        names[i : i + provider.batch_size]
+        for i in range(0, len(names), provider.batch_size)
+    ]
+
+    async def lookup(session, batch):
+        async with semaphore:
+            return await provider.lookup(session, batch, limiter)
+
+    async with aiohttp.ClientSession() as session:
+        results = await asyncio.gather(*(lookup(session, b) for b in batches))
+    return pd.DataFrame(
+        [r for batch in results for r in batch],
+        columns=["first_name", "gender", "samples", "probability"],
+    )
+
+
+def read_authors(engine, all_authors=False, chunksize=200000):
+    """Chunks of id and name of the authors without a gender row."""
+    query = select([authors.c.id, authors.c.name.label("full_name")])
+    if not all_authors:
+        query = query.select_from(
+            authors.outerjoin(author_gender, author_gender.c.id == authors.c.id)
+        ).where(author_gender.c.id.is_(None))
+    with engine.connect() as conn:
+        # A server side cursor, so only one chunk is held in memory at a time
+        conn = conn.execution_options(stream_results=True)
+        yield from pd.read_sql(query.order_by(authors.c.id), conn, chunksize=chunksize)
+
+
+def read_cached(engine, names, ttl=None):
+    """Cached genders of names, ignoring entries older than `ttl`."""
+    query = select(
+        [
+            name_cache.c.first_name,
+            name_cache.c.gender,
+            name_cache.c.samples,
+            name_cache.c.probability,
+        ]
+    ).where(name_cache.c.first_name == any_(literal(list(names), ARRAY(TEXT))))
+    if ttl is not None:
+        query = query.where(name_cache.c.fetched_at >= datetime.datetime.now() - ttl)
+    return pd.read_sql(query, engine)
+
+
+def _records(df):
+    df = df.astype(object).where(df.notnull(), None)
+    return df.to_dict(orient="records")
+
+
+def infer_genders(
+    engine,
+    provider,
+    ttl=datetime.timedelta(days=365),
+    rate=5,
+    concurrency=8,
+    chunksize=200000,
+    all_authors=False,
+):
+    """Fill `author_gender` for the authors that do not have a row yet.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): Database with `mag_authors`.
+        provider: Gender lookup, see `fetch_genders`.
+        ttl (datetime.timedelta): Cached names older than this are queried
+            again. None keeps them forever.
+        rate (float): Provider requests per second.
+        concurrency (int): Provider requests in flight.
+        chunksize (int): Authors processed at a time.
+        all_authors (bool): Also redo authors that already have a row.
+
+    Returns:
+        (dict) Number of authors written and of names queried.
+
+    """
+    counts = {"authors": 0, "queried": 0}
+    for chunk in read_authors(engine, all_authors, chunksize):
+        chunk["first_name"] = first_names(chunk.full_name)
+        names = chunk.first_name.dropna().unique()
+
+        genders = read_cached(engine, names, ttl)
+        missing = sorted(set(names) - set(genders.first_name))
+        if missing:
+            fetched = run(fetch_genders(provider, missing, rate, concurrency))
+            # Names the provider did not return are cached as unknown
+            fetched = (
+                fetched.drop_duplicates("first_name")
+                .set_index("first_name")
+                .reindex(missing)
+                .rename_axis("first_name")
+                .reset_index()
+            )
+            fetched["fetched_at"] = datetime.datetime.now()
+            bulk_load(engine, FirstNameGender, _records(fetched))
+            genders = pd.concat([genders, fetched.drop(columns="fetched_at")])
+            counts["queried"] += len(missing)
+
+        rows = chunk.merge(genders, on="first_name", how="left")
+        rows["samples"] = rows.samples.astype(float).astype("Int64")
+        bulk_load(engine, AuthorGender, _records(rows))
+        counts["authors"] += len(rows)
+        logger.info(
+            f"author_gender: {counts['authors']} authors, "
+            f"{counts['queried']} names queried"
+        )
+    return counts
+
+
+def stub_app(genders, batch_size=10, rate_limit=None):
+    """Local stand-in for the genderize.io API.
+
+    Args:
+        genders (dict): Name to (gender, probability, count). Other names get
+            a null gender.
+        batch_size (int): Most names accepted per request.
+        rate_limit (int): Requests accepted per second. Extra requests get a
+            429 response.
+
+    The application counts the requests and names it served in
+    app["served"]["requests"] and app["served"]["names"].
+    """
+    app = web.Application()
+    served = app["served"] = {"requests": 0, "names": []}
+    window = {"start": 0.0, "count": 0}
+
+    async def handle(request):
+        loop = asyncio.get_event_loop()
+        if rate_limit is not None:
+            if loop.time() - window["start"] >= 1:
+                window["start"], window["count"] = loop.time(), 0
+            window["count"] += 1
+            if window["count"] > rate_limit:
+                return web.json_response(
+                    {"error": "Request limit reached"},
+                    status=429,
+                    headers={"Retry-After": "0.2"},
+                )
+        names = request.query.getall("name[]", [])
+        if len(names) > batch_size:
+            return web.json_response({"error": "Too many names"}, status=422)
+        served["requests"] += 1
+        served["names"].extend(names)
+        results = []
+        for name in names:
+            gender, probability, count = genders.get(name, (None, 0.0, 0))
+            results.append(
+                {
+                    "name": name,
+                    "gender": gender,
+                    "probability": probability,
+                    "count": count,
+                }
+            )
+        return web.json_response(results)
+
+    app.router.add_get("/", handle)
+    return app
+
+
+def main():
+    config = ai_research.config["author_gender"]
+    engine = create_engine(os.getenv("postgresdb"))
+    provider = GenderizeProvider(
+        config["url"], os.getenv("genderize_key"), config["batch_size"]
+    )
+    infer_genders(
+        engine,
+        provider,
+        ttl=datetime.timedelta(days=config["ttl_days"]),
+        rate=config["rate"],
+        concurrency=config["concurrency"],
+        chunksize=config["chunksize"],
+    )
+
+
+if __name__ == "__main__":
+    load_dotenv(find_dotenv())
+    main()
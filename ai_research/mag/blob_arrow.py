@@ -0,0 +1,287 @@
+"""Chunked storage of arrow datasets in PostgreSQL.
+
+A dataset is a `BlobArrowManifest` row holding the serialised schema, plus
+`BlobArrowChunk` rows each holding one serialised record batch of at most
+`chunk_rows` rows. Writers stream batches in without building the whole file
+in memory and readers stream batches out, read a range of chunks or rows, or
+spill the dataset to a local arrow file that is then memory-mapped.
+
+The manifest and its chunks are written in a single transaction, so readers
+only ever see complete datasets: a writer that fails leaves nothing behind.
+
+Chunks are deserialised without copying the bytes fetched from the database.
+"""
+import logging
+
+import pyarrow as pa
+from sqlalchemy import select, func
+
+from ai_research.mag.mag_orm import BlobArrow, BlobArrowManifest, BlobArrowChunk
+
+logger = logging.getLogger(__name__)
+
+manifests = BlobArrowManifest.__table__
+chunks = BlobArrowChunk.__table__
+
+
+class BlobArrowWriter:
+    """Streams arrow record batches into a chunked dataset.
+
+    Incoming batches are re-chunked to `chunk_rows` rows, so memory use is
+    bounded by one chunk whatever the size of the dataset. The writer holds a
+    transaction open until `close`, which commits the dataset, or `abort`,
+    which discards it. Used as a context manager, it aborts on an exception.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): Database holding the blob tables.
+        name (str): Name of the dataset.
+        schema (pyarrow.Schema): Schema of the record batches.
+        chunk_rows (int): Rows per stored chunk.
+
+    Example:
+        with BlobArrowWriter(engine, "metrics", table.schema) as writer:
+            for batch in table.to_batches():
+                writer.write_batch(batch)
+        manifest_id = writer.manifest_id
+
+    """
+
+    def __init__(self, engine, name, schema, chunk_rows=65536):
+        self.engine = engine
+        self.schema = schema
+        self.chunk_rows = chunk_rows
+        self._pending = []
+        self._pending_rows = 0
+        self.num_chunks = 0
+        self.num_rows = 0
+        self.size = 0
+        self._conn = engine.connect()
+        self._transaction = self._conn.begin()
+        self.manifest_id = self._conn.execute(
+            manifests.insert().values(
+                name=name,
+                schema=schema.serialize().to_pybytes(),
+                num_chunks=0,
+                num_rows=0,
+                size=0,
+            )
+        ).inserted_primary_key[0]
+
+    def write_batch(self, batch):
+        """Add a record batch to the dataset."""
+        if not batch.schema.equals(self.schema):
+            raise ValueError("Record batch schema does not match the dataset")
+        while batch.num_rows:
+            n = min(batch.num_rows, self.chunk_rows - self._pending_rows)
+            self._pending.append(batch.slice(0, n))
+            self._pending_rows += n
+            batch = batch.slice(n)
+            if self._pending_rows == self.chunk_rows:
+                self._flush()
+
+    def write_table(self, table):
+        """Add all rows of an arrow table to the dataset."""
+        for batch in table.to_batches():
+            self.write_batch(batch)
+
+    def _flush(self):
+        if not self._pending_rows:
+            return
+        table = pa.Table.from_batches(self._pending, schema=self.schema)
+        batch = table.combine_chunks().to_batches()[0]
+        blob = batch.serialize()
+        self._conn.execute(
+            chunks.insert().values(
+                manifest_id=self.manifest_id,
+                index=self.num_chunks,
+                row_offset=self.num_rows,
+                num_rows=batch.num_rows,
+                blob=blob.to_pybytes(),
+                size=blob.size,
+            )
+        )
+        self.num_chunks += 1
+        self.num_rows += batch.num_rows
+        self.size += blob.size
+        self._pending = []
+        self._pending_rows = 0
+
+    def close(self):
+        """Write the last partial chunk and the dataset totals, and commit."""
+        try:
+            self._flush()
+            self._conn.execute(
+                manifests.update()
+                .where(manifests.c.id == self.manifest_id)
+                .values(
+                    num_chunks=self.num_chunks, num_rows=self.num_rows, size=self.size
+                )
+            )
+            self._transaction.commit()
+        except Exception:
+            self.abort()
+            raise
+        self._conn.close()
+        logger.info(
+            f"Stored {self.num_rows} rows in {self.num_chunks} chunks "
+            f"({self.size} bytes) as blob_arrow_manifest {self.manifest_id}"
+        )
+        return self.manifest_id
+
+    def abort(self):
+        """Discard the dataset: neither the manifest nor any chunk is kept."""
+        if not self._conn.closed:
+            self._transaction.rollback()
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_batches(engine, name, batches, schema=None, chunk_rows=65536):
+    """Store an iterable of record batches and return the manifest id.
+
+    Raises:
+        ValueError: If there are no batches and no `schema` to store.
+
+    """
+    batches = iter(batches)
+    if schema is None:
+        first = next(batches, None)
+        if first is None:
+            raise ValueError("No record batches, and no schema given")
+        schema = first.schema
+        batches = _prepend(first, batches)
+    with BlobArrowWriter(engine, name, schema, chunk_rows=chunk_rows) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+    return writer.manifest_id
+
+
+def _prepend(first, rest):
+    yield first
+    yield from rest
+
+
+def read_schema(engine, manifest_id):
+    """Arrow schema of a stored dataset."""
+    with engine.connect() as conn:
+        blob = conn.execute(
+            select([manifests.c.schema]).where(manifests.c.id == manifest_id)
+        ).scalar()
+    if blob is None:
+        raise KeyError(f"No blob_arrow_manifest with id {manifest_id}")
+    return pa.ipc.read_schema(pa.py_buffer(blob))
+
+
+def _deserialise(blob, schema):
+    """Record batch backed by the fetched bytes, without copying them."""
+    return pa.ipc.read_record_batch(pa.py_buffer(blob), schema)
+
+
+def iter_batches(engine, manifest_id, start=0, stop=None, columns=None):
+    """Stream the record batches of a dataset.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): Database holding the blob tables.
+        manifest_id (int): Id of the dataset.
+        start (int): First chunk to read.
+        stop (int): Chunk to stop before. Defaults to the last chunk.
+        columns (list of str): Columns to keep. Defaults to all.
+
+    Yields:
+        (pyarrow.RecordBatch)
+
+    """
+    schema = read_schema(engine, manifest_id)
+    query = (
+        select([chunks.c.blob])
+        .where(chunks.c.manifest_id == manifest_id)
+        .where(chunks.c.index >= start)
+        .order_by(chunks.c.index)
+    )
+    if stop is not None:
+        query = query.where(chunks.c.index < stop)
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True).execute(query)
+        for (blob,) in result:
+            batch = _deserialise(blob, schema)
+            if columns is not None:
+                batch = pa.RecordBatch.from_arrays(
+                    [batch.column(batch.schema.get_field_index(c)) for c in columns],
+                    names=columns,
+                )
+            yield batch
+
+
+def read_rows(engine, manifest_id, offset, limit, columns=None):
+    """Read `limit` rows from row `offset`, fetching only the chunks needed."""
+    with engine.connect() as conn:
+        first, last = conn.execute(
+            select([func.min(chunks.c.index), func.max(chunks.c.index)])
+            .where(chunks.c.manifest_id == manifest_id)
+            .where(chunks.c.row_offset < offset + limit)
+            .where(chunks.c.row_offset + chunks.c.num_rows > offset)
+        ).first()
+        if first is None:
+            schema = read_schema(engine, manifest_id)
+            table = schema.empty_table()
+            return table if columns is None else table.select(columns)
+        first_offset = conn.execute(
+            select([chunks.c.row_offset])
+            .where(chunks.c.manifest_id == manifest_id)
+            .where(chunks.c.index == first)
+        ).scalar()
+    batches = list(iter_batches(engine, manifest_id, first, last + 1, columns))
+    table = pa.Table.from_batches(batches)
+    return table.slice(offset - first_offset, limit)
+
+
+def read_table(engine, manifest_id, columns=None):
+    """Read a whole dataset as an arrow table."""
+    batches = list(iter_batches(engine, manifest_id, columns=columns))
+    if not batches:
+        table = read_schema(engine, manifest_id).empty_table()
+        return table if columns is None else table.select(columns)
+    return pa.Table.from_batches(batches)
+
+
+def spill(engine, manifest_id, path):
+    """Stream a dataset to a local arrow file, one chunk at a time."""
+    schema = read_schema(engine, manifest_id)
+    with pa.OSFile(str(path), "wb") as sink:
+        with pa.ipc.new_file(sink, schema) as writer:
+            for batch in iter_batches(engine, manifest_id):
+                writer.write_batch(batch)
+    return path
+
+
+def open_spill(path):
+    """Memory-map a spilled arrow file. Columns are read without copying."""
+    source = pa.memory_map(str(path), "r")
+    return pa.ipc.open_file(source).read_all()
+
+
+def from_blob_arrow(engine, blob_id, name=None, chunk_rows=65536):
+    """Convert a single-row `BlobArrow` into a chunked dataset."""
+    with engine.connect() as conn:
+        blob = conn.execute(
+            select([BlobArrow.__table__.c.blob]).where(
+                BlobArrow.__table__.c.id == blob_id
+            )
+        ).scalar()
+    if blob is None:
+        raise KeyError(f"No blob_arrow with id {blob_id}")
+    reader = pa.ipc.open_file(pa.py_buffer(blob))
+    with BlobArrowWriter(
+        engine, name or f"blob_arrow_{blob_id}", reader.schema, chunk_rows=chunk_rows
+    ) as writer:
+        for i in range(reader.num_record_batches):
+            writer.write_batch(reader.get_batch(i))
+    return writer.manifest_id
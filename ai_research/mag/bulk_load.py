@@ -0,0 +1,405 @@
+"""Bulk loading of MAG harvests with PostgreSQL COPY.
+
+Records are streamed from JSON or CSV files in batches, copied into a
+temporary staging table and then upserted into the mapped table. Tables are
+always loaded parents first so that foreign keys resolve.
+"""
+import csv
+import io
+import json
+import logging
+from itertools import islice
+from pathlib import Path
+
+from sqlalchemy.types import Integer
+
+from ai_research.mag.mag_orm import (
+    Base,
+    Paper,
+    Author,
+    Affiliation,
+    FieldOfStudy,
+    Journal,
+    Conference,
+    PaperAuthor,
+    PaperFieldsOfStudy,
+    AuthorAffiliation,
+)
+
+logger = logging.getLogger(__name__)
+
+# Tables filled from a MAG harvest.
+MAG_GRAPH = [
+    Paper,
+    Author,
+    Affiliation,
+    FieldOfStudy,
+    Journal,
+    Conference,
+    PaperAuthor,
+    PaperFieldsOfStudy,
+    AuthorAffiliation,
+]
+
+_TEXT_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def read_json_records(path):
+    """Yield records from a JSON array or a newline-delimited JSON file."""
+    with open(path, "rt") as f:
+        first = f.read(1)
+        while first.isspace():
+            first = f.read(1)
+        if first == "[":
+            f.seek(0)
+            yield from json.load(f)
+            return
+        f.seek(0)
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_csv_records(path):
+    """Yield records from a CSV file with a header row.
+
+    Empty fields are read as nulls.
+    """
+    with open(path, "rt", newline="") as f:
+        for row in csv.DictReader(f):
+            yield {k: (v if v != "" else None) for k, v in row.items()}
+
+
+def read_records(path):
+    """Yield records from a file, picking the reader from its suffix."""
+    path = Path(path)
+    if path.suffix == ".csv":
+        return read_csv_records(path)
+    if path.suffix in (".json", ".jsonl", ".ndjson"):
+        return read_json_records(path)
+    raise ValueError(f"Unsupported file type: {path}")
+
+
+def batches(records, batch_size):
+    """Split an iterable of records into lists of at most batch_size."""
+    records = iter(records)
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def sort_by_dependency(mappings):
+    """Order ORM mappings so that parent tables come before their children."""
+    order = {table.name: i for i, table in enumerate(Base.metadata.sorted_tables)}
+    return sorted(mappings, key=lambda m: order[m.__tablename__])
+
+
+def _copy_value(value):
+    """Format a value for COPY ... FROM STDIN in PostgreSQL text format."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        # bytea hex format, with the backslash escaped for the text format
+        return "\\\\x" + bytes(value).hex()
+    if isinstance(value, (list, tuple)):
+        return _array_literal(value).translate(_TEXT_ESCAPES)
+    return str(value).translate(_TEXT_ESCAPES)
+
+
+def _array_literal(values):
+    """Format a list as a PostgreSQL array literal."""
+    items = []
+    for v in values:
+        if v is None:
+            items.append("NULL")
+        elif isinstance(v, str):
+            items.append('"' + v.replace("\\", "\\\\").replace('"', '\\"') + '"')
+        else:
+            items.append(str(v))
+    return "{" + ",".join(items) + "}"
+
+
+def _copy_buffer(batch, columns):
+    """Serialise a batch of records to a COPY text format buffer."""
+    buf = io.StringIO()
+    for record in batch:
+        buf.write("\t".join(_copy_value(record.get(c)) for c in columns))
+        buf.write("\n")
+    buf.seek(0)
+    return buf
+
+
+def load_columns(mapping):
+    """Columns of a mapping that are read from the input records.
+
+    Autoincrementing surrogate keys and generated columns are left for the
+    database to fill.
+    """
+    return [
+        c.name
+        for c in mapping.__table__.columns
+        if c.autoincrement is not True and c.computed is None
+    ]
+
+
+def _conflict_columns(mapping):
+    """Primary key columns used as the conflict target, if they are loaded."""
+    keys = mapping.__table__.primary_key.columns
+    if any(c.autoincrement is True for c in keys):
+        return []
+    return [c.name for c in keys]
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _staging_ddl(mapping, staging, dialect):
+    """CREATE statement for a temporary staging table of a mapping."""
+    columns = mapping.__table__.columns
+    defs = ", ".join(
+        f"{_quote(c.name)} {c.type.compile(dialect=dialect)}"
+        for c in columns
+        if c.name in load_columns(mapping)
+    )
+    return f"CREATE TEMP TABLE IF NOT EXISTS {staging} ({defs})"
+
+
+def _same_value(column, target, staged):
+    """Condition of a column having the same value in two rows, nulls included.
+
+    Nullable integer columns are compared as `coalesce(column, -1)`, the form
+    their natural key index is built on (MAG ids are never negative), so the
+    lookup can use the index. Other nullable columns fall back to IS NOT
+    DISTINCT FROM.
+    """
+    name = _quote(column.name)
+    if not column.nullable:
+        return f"{target}.{name} = {staged}.{name}"
+    if isinstance(column.type, Integer):
+        return f"coalesce({target}.{name}, -1) = coalesce({staged}.{name}, -1)"
+    return f"{target}.{name} IS NOT DISTINCT FROM {staged}.{name}"
+
+
+def _upsert_sql(mapping, staging, on_conflict):
+    """INSERT ... SELECT statement moving staged rows into the mapped table.
+
+    Tables with a natural primary key deduplicate on it and either update or
+    ignore conflicting rows. Tables with a surrogate key skip rows that are
+    already present with identical values, with an anti-join that looks each
+    staged row up in the index over their natural key (e.g.
+    `ix_mag_author_affiliation_natural_key`).
+    """
+    table = _quote(mapping.__tablename__)
+    columns = load_columns(mapping)
+    cols = ", ".join(_quote(c) for c in columns)
+    keys = _conflict_columns(mapping)
+
+    if not keys:
+        match = " AND ".join(
+            _same_value(mapping.__table__.c[c], "t", "s") for c in columns
+        )
+        return (
+            f"INSERT INTO {table} ({cols}) "
+            f"SELECT DISTINCT {cols} FROM {staging} s "
+            f"WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE {match})"
+        )
+
+    key_cols = ", ".join(_quote(c) for c in keys)
+    updates = [c for c in columns if c not in keys]
+    if on_conflict == "update" and updates:
+        action = "DO UPDATE SET " + ", ".join(
+            f"{_quote(c)} = EXCLUDED.{_quote(c)}" for c in updates
+        )
+    else:
+        action = "DO NOTHING"
+    return (
+        f"INSERT INTO {table} ({cols}) "
+        f"SELECT DISTINCT ON ({key_cols}) {cols} FROM {staging} "
+        f"ORDER BY {key_cols} "
+        f"ON CONFLICT ({key_cols}) {action}"
+    )
+
+
+def bulk_load(engine, mapping, records, batch_size=50000, on_conflict="update"):
+    """Load records into the table of an ORM mapping.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): PostgreSQL engine (psycopg2).
+        mapping: ORM class of the target table, e.g. `Paper`.
+        records (iterable of dict): Rows keyed by column name. Unknown keys are
+            ignored and missing columns are loaded as nulls.
+        batch_size (int): Number of records copied per transaction.
+        on_conflict (str): "update" overwrites rows with the same primary key,
+            "ignore" keeps the existing rows.
+
+    Returns:
+        (int) Number of records read.
+
+    """
+    if on_conflict not in ("update", "ignore"):
+        raise ValueError(f"Unknown on_conflict option: {on_conflict}")
+
+    columns = load_columns(mapping)
+    staging = f"staging_{mapping.__tablename__}"
+    copy_sql = f"COPY {staging} ({', '.join(_quote(c) for c in columns)}) FROM STDIN"
+    upsert_sql = _upsert_sql(mapping, staging, on_conflict)
+
+    n = 0
+    conn = engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(_staging_ddl(mapping, staging, engine.dialect))
+        for batch in batches(records, batch_size):
+            cur.copy_expert(copy_sql, _copy_buffer(batch, columns))
+            cur.execute(upsert_sql)
+            cur.execute(f"TRUNCATE {staging}")
+            conn.commit()
+            n += len(batch)
+            logger.debug(f"{mapping.__tablename__}: loaded {n} records")
+        cur.execute(f"DROP TABLE IF EXISTS {staging}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    logger.info(f"{mapping.__tablename__}: loaded {n} records")
+    return n
+
+
+def replace_rows(engine, mapping, condition, records, batch_size=50000):
+    """Replace the rows matching a condition with new records.
+
+    The matching rows are deleted and the records copied straight into the
+    table in a single transaction, so readers never see a partial slice.
+    Meant for derived tables with surrogate keys, e.g. one year of a metric.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): PostgreSQL engine (psycopg2).
+        mapping: ORM class of the target table.
+        condition: SQLAlchemy clause selecting the rows to replace, e.g.
+            `MetricCountryRCA.year == "2019"`.
+        records (iterable of dict): New rows keyed by column name.
+        batch_size (int): Number of records serialised per COPY.
+
+    Returns:
+        (int) Number of records copied.
+
+    """
+    return replace_tables(engine, [(mapping, condition, records)], batch_size)[0]
+
+
+def replace_tables(engine, replacements, batch_size=50000):
+    """Replace slices of several tables in a single transaction.
+
+    Like `replace_rows`, for derived tables that must agree with each other,
+    e.g. two metrics of the same year.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): PostgreSQL engine (psycopg2).
+        replacements (list): (mapping, condition, records) triples, as the
+            arguments of `replace_rows`.
+        batch_size (int): Number of records serialised per COPY.
+
+    Returns:
+        (list of int) Number of records copied into each table.
+
+    """
+    counts = []
+    conn = engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        for mapping, condition, records in replacements:
+            columns = load_columns(mapping)
+            delete_sql = str(
+                mapping.__table__.delete()
+                .where(condition)
+                .compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True})
+            )
+            copy_sql = (
+                f"COPY {_quote(mapping.__tablename__)} "
+                f"({', '.join(_quote(c) for c in columns)}) FROM STDIN"
+            )
+            cur.execute(delete_sql)
+            n = 0
+            for batch in batches(records, batch_size):
+                cur.copy_expert(copy_sql, _copy_buffer(batch, columns))
+                n += len(batch)
+            counts.append(n)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return counts
+
+
+def replace_from_select(engine, mapping, condition, query):
+    """Replace the rows matching a condition with the rows of a query.
+
+    Like `replace_rows`, but the new rows are computed and inserted by the
+    database, in the same transaction as the delete.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): PostgreSQL engine.
+        mapping: ORM class of the target table.
+        condition: SQLAlchemy clause selecting the rows to replace.
+        query (sqlalchemy.sql.Select): New rows, with columns labelled as the
+            target columns they fill.
+
+    Returns:
+        (int) Number of rows inserted.
+
+    """
+    table = mapping.__table__
+    with engine.begin() as conn:
+        conn.execute(table.delete().where(condition))
+        result = conn.execute(
+            table.insert().from_select([c.name for c in query.c], query)
+        )
+    return result.rowcount
+
+
+def bulk_load_files(engine, sources, batch_size=50000, on_conflict="update"):
+    """Load several tables from files, parents before children.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): PostgreSQL engine (psycopg2).
+        sources (dict): ORM class to path of a JSON, JSONL or CSV file.
+        batch_size (int): Number of records copied per transaction.
+        on_conflict (str): See `bulk_load`.
+
+    Returns:
+        (dict) Table name to number of records read.
+
+    """
+    counts = {}
+    for mapping in sort_by_dependency(sources):
+        counts[mapping.__tablename__] = bulk_load(
+            engine,
+            mapping,
+            read_records(sources[mapping]),
+            batch_size=batch_size,
+            on_conflict=on_conflict,
+        )
+    return counts
+
+
+def find_sources(input_dir, mappings=MAG_GRAPH):
+    """Find input files named after the tables, e.g. `mag_papers.jsonl`."""
+    input_dir = Path(input_dir)
+    sources = {}
+    for mapping in mappings:
+        for suffix in (".jsonl", ".ndjson", ".json", ".csv"):
+            path = input_dir / f"{mapping.__tablename__}{suffix}"
+            if path.exists():
+                sources[mapping] = path
+                break
+    return sources
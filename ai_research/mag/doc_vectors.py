@@ -0,0 +1,193 @@
+"""Packed float32 storage and memory-mapped loading of document vectors.
+
+`HighDimDocVector.vector` and `DocVector.vector_3d` are float arrays that
+PostgreSQL decodes element by element. `migrate` copies them once into the
+`*_packed` tables as little-endian float32 bytes, which load straight into
+NumPy. `export_npy` writes all vectors of a table to a sidecar `.npy` matrix
+with a sorted id index, and `load_vectors` memory-maps them back.
+"""
+import logging
+from pathlib import Path
+
+import numpy as np
+from sqlalchemy import select, func
+
+import ai_research
+from ai_research.mag.bulk_load import bulk_load
+from ai_research.mag.mag_orm import (
+    HighDimDocVector,
+    HighDimDocVectorPacked,
+    DocVector,
+    DocVectorPacked,
+)
+
+logger = logging.getLogger(__name__)
+
+VECTOR_DIR = ai_research.project_dir / "data" / "interim" / "doc_vectors"
+DTYPE = np.dtype("<f4")
+
+# Source table, packed table and vector column.
+PACKED = {
+    HighDimDocVector: (HighDimDocVectorPacked, "vector"),
+    DocVector: (DocVectorPacked, "vector_3d"),
+}
+PACKED_COLUMN = {packed: column for packed, column in PACKED.values()}
+
+
+def pack(vector):
+    """Pack a vector as little-endian float32 bytes."""
+    return np.asarray(vector, dtype=DTYPE).tobytes()
+
+
+def unpack(blob):
+    """Read packed float32 bytes as a vector, without copying."""
+    return np.frombuffer(blob, dtype=DTYPE)
+
+
+def migrate(engine, source=HighDimDocVector, chunksize=10000):
+    """Copy the float array vectors of a table into its packed table.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): Database holding the vector tables.
+        source: `HighDimDocVector` or `DocVector`.
+        chunksize (int): Rows read and written at a time.
+
+    Returns:
+        (int) Number of vectors migrated.
+
+    """
+    packed, column = PACKED[source]
+    table = source.__table__
+    others = [c for c in table.columns if c.name not in ("id", column)]
+
+    def records():
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True).execute(
+                select([table]).order_by(table.c.id)
+            )
+            for row in result:
+                record = {c.name: row[c] for c in others}
+                record["id"] = row["id"]
+                vector = row[column]
+                record[column] = None if vector is None else pack(vector)
+                yield record
+
+    n = bulk_load(engine, packed, records(), batch_size=chunksize)
+    logger.info(f"Packed {n} vectors from {table.name} into {packed.__tablename__}")
+    return n
+
+
+def fetch_matrix(engine, packed=HighDimDocVectorPacked, out=None, chunksize=10000):
+    """Read a packed vector table into one contiguous matrix.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): Database holding the vector tables.
+        packed: `HighDimDocVectorPacked` or `DocVectorPacked`.
+        out (str or Path): If given, the matrix is written to this `.npy` file
+            through a memory map instead of being held in memory.
+        chunksize (int): Rows fetched at a time.
+
+    Returns:
+        ids (numpy.ndarray): Sorted paper ids, one per row.
+        vectors (numpy.ndarray): Matrix of shape (n_papers, dim), float32.
+
+    """
+    table = packed.__table__
+    column = table.c[PACKED_COLUMN[packed]]
+    query = select([table.c.id, column]).where(column.isnot(None)).order_by(table.c.id)
+    with engine.connect() as conn:
+        n = conn.execute(
+            select([func.count()]).select_from(table).where(column.isnot(None))
+        ).scalar()
+        first = conn.execute(select([column]).where(column.isnot(None)).limit(1))
+        first = first.scalar()
+        dim = 0 if first is None else len(first) // DTYPE.itemsize
+
+        ids = np.empty(n, dtype=np.int64)
+        if out is None:
+            vectors = np.empty((n, dim), dtype=DTYPE)
+        else:
+            vectors = np.lib.format.open_memmap(
+                str(out), mode="w+", dtype=DTYPE, shape=(n, dim)
+            )
+
+        result = conn.execution_options(stream_results=True).execute(query)
+        i = 0
+        while True:
+            rows = result.fetchmany(chunksize)
+            if not rows:
+                break
+            ids[i : i + len(rows)] = [r[0] for r in rows]
+            vectors[i : i + len(rows)] = np.frombuffer(
+                b"".join(r[1] for r in rows), dtype=DTYPE
+            ).reshape(len(rows), dim)
+            i += len(rows)
+
+    if out is not None:
+        vectors.flush()
+    return ids, vectors
+
+
+def fetch_vectors(engine, ids, packed=HighDimDocVectorPacked, chunksize=10000):
+    """Read the packed vectors of some paper ids, sorted by id.
+
+    Ids without a vector are left out of the result.
+    """
+    table = packed.__table__
+    column = table.c[PACKED_COLUMN[packed]]
+    ids = np.unique(np.asarray(ids, dtype=np.int64))
+    found, blobs = [], []
+    with engine.connect() as conn:
+        for start in range(0, len(ids), chunksize):
+            chunk = ids[start : start + chunksize].tolist()
+            rows = conn.execute(
+                select([table.c.id, column])
+                .where(table.c.id.in_(chunk))
+                .where(column.isnot(None))
+                .order_by(table.c.id)
+            )
+            for paper_id, blob in rows:
+                found.append(paper_id)
+                blobs.append(bytes(blob))
+    if not blobs:
+        return np.empty(0, np.int64), np.empty((0, 0), DTYPE)
+    vectors = np.frombuffer(b"".join(blobs), dtype=DTYPE).reshape(len(blobs), -1)
+    return np.array(found, dtype=np.int64), vectors
+
+
+def vector_paths(packed, directory=VECTOR_DIR):
+    """Paths of the sidecar matrix and id index of a packed table."""
+    directory = Path(directory)
+    name = packed.__tablename__
+    return directory / f"{name}.npy", directory / f"{name}_ids.npy"
+
+
+def export_npy(engine, packed=HighDimDocVectorPacked, directory=VECTOR_DIR):
+    """Write the vectors of a packed table to a sidecar `.npy` matrix."""
+    matrix_path, ids_path = vector_paths(packed, directory)
+    matrix_path.parent.mkdir(parents=True, exist_ok=True)
+    ids, vectors = fetch_matrix(engine, packed, out=matrix_path)
+    np.save(ids_path, ids)
+    logger.info(f"Exported {vectors.shape} vectors to {matrix_path}")
+    return matrix_path, ids_path
+
+
+def load_vectors(packed=HighDimDocVectorPacked, directory=VECTOR_DIR):
+    """Memory-map the sidecar vectors of a packed table.
+
+    Returns:
+        ids (numpy.ndarray): Sorted paper ids, one per row.
+        vectors (numpy.memmap): Matrix of shape (n_papers, dim), float32.
+
+    """
+    matrix_path, ids_path = vector_paths(packed, directory)
+    return np.load(ids_path, mmap_mode="r"), np.load(matrix_path, mmap_mode="r")
+
+
+def rows_for(ids, paper_ids):
+    """Row positions of paper ids in a sorted id index. Missing ids are -1."""
+    paper_ids = np.asarray(paper_ids, dtype=np.int64)
+    if len(ids) == 0:
+        return np.full(len(paper_ids), -1)
+    rows = np.minimum(np.searchsorted(ids, paper_ids), len(ids) - 1)
+    return np.where(ids[rows] == paper_ids, rows, -1)
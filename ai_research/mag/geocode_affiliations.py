@@ -0,0 +1,374 @@
+"""Geocode affiliations with Google Places, once per distinct place.
+
+Affiliation strings without a `geocoded_places` row are normalised (ASCII,
+lower case, common abbreviations expanded) and clustered on their tokens
+without stop words, in order, so "Univ. of Oxford" and "University of Oxford"
+make one Places query. Word order is kept because it can tell institutions
+apart: "University of Washington" and "Washington University" are two places.
+Queries run concurrently behind a token bucket, and place details are fetched
+once per place id even when several clusters resolve to it.
+
+Every response, including "not found", is stored in `geocode_cache` before
+the locations of its affiliations are upserted, one checkpoint of
+`checkpoint_every` clusters at a time. A crashed or repeated run reads what it
+already paid for from the cache and resumes with the first uncached cluster.
+`stub_app` is a local stand-in for the Places API.
+
+    python ai_research/mag/geocode_affiliations.py
+"""
+import asyncio
+import datetime
+import json
+import logging
+import os
+import unicodedata
+from collections import Counter
+
+import aiohttp
+import pandas as pd
+from aiohttp import web
+from dotenv import find_dotenv, load_dotenv
+from sqlalchemy import any_, create_engine, literal, select
+from sqlalchemy.dialects.postgresql import ARRAY, TEXT
+
+import ai_research
+from ai_research.mag.bulk_load import batches, bulk_load
+from ai_research.mag.http_lookup import LookupFailed, TokenBucket, get_json, run
+from ai_research.mag.mag_orm import Affiliation, AffiliationLocation, GeocodeCache
+
+logger = logging.getLogger(__name__)
+
+affiliations = Affiliation.__table__
+locations = AffiliationLocation.__table__
+cache = GeocodeCache.__table__
+
+ABBREVIATIONS = {
+    "univ": "university",
+    "uni": "university",
+    "universidad": "university",
+    "universite": "university",
+    "universitat": "university",
+    "universita": "university",
+    "dept": "department",
+    "inst": "institute",
+    "natl": "national",
+    "ctr": "center",
+    "centre": "center",
+    "coll": "college",
+    "hosp": "hospital",
+    "lab": "laboratory",
+    "labs": "laboratories",
+    "tech": "technology",
+    "sci": "science",
+    "acad": "academy",
+    "res": "research",
+}
+STOP_WORDS = {"the", "of", "and", "at", "for", "in", "de", "del", "di", "la", "du"}
+ADDRESS_COMPONENTS = [
+    "postal_town",
+    "administrative_area_level_2",
+    "administrative_area_level_1",
+    "country",
+]
+DETAIL_FIELDS = "name,formatted_address,geometry,address_component,type,website"
+
+
+def normalise(name):
+    """ASCII, lower case tokens of an affiliation with abbreviations expanded."""
+    name = unicodedata.normalize("NFKD", name or "")
+    name = name.encode("ascii", errors="ignore").decode("ascii").lower()
+    name = "".join(c if c.isalnum() else " " for c in name.replace("&", " and "))
+    return [ABBREVIATIONS.get(token, token) for token in name.split()]
+
+
+def cluster_key(name):
+    """Key shared by near-duplicate affiliation strings."""
+    tokens = normalise(name)
+    return " ".join(t for t in tokens if t not in STOP_WORDS) or " ".join(tokens)
+
+
+def cluster_affiliations(df):
+    """Cluster affiliation strings and pick one query per cluster.
+
+    Args:
+        df (pandas.DataFrame): id and affiliation columns.
+
+    Returns:
+        (pandas.DataFrame) id, affiliation, key and query, where query is the
+        most common normalised spelling of the cluster.
+
+    """
+    df = df.assign(key=df.affiliation.map(cluster_key))
+    df = df[df.key != ""]
+    spellings = df.affiliation.map(lambda name: " ".join(normalise(name)))
+    queries = {}
+    for key, names in spellings.groupby(df.key):
+        counts = Counter(names)
+        queries[key] = min(counts, key=lambda name: (-counts[name], len(name), name))
+    return df.assign(query=df.key.map(queries))
+
+
+class PlacesProvider:
+    """Google Places text search and place details.
+
+    Args:
+        api_key (str): Places API key.
+        url (str): Base URL of the Places API.
+
+    """
+
+    def __init__(self, api_key=None, url="https://maps.googleapis.com/maps/api/place"):
+        self.api_key = api_key
+        self.url = url.rstrip("/")
+
+    async def _get(self, session, endpoint, params, limiter):
+        if self.api_key:
+            params["key"] = self.api_key
+        response = await get_json(
+            session, f"{self.url}/{endpoint}/json", params, limiter
+        )
+        status = response.get("status")
+        if status not in ("OK", "ZERO_RESULTS", "NOT_FOUND"):
+            raise LookupFailed(f"{endpoint}: {status}")
+        return response
+
+    async def find_place(self, session, query, limiter=None):
+        """Place id of the best match of a text query, None if there is none."""
+        response = await self._get(
+            session,
+            "findplacefromtext",
+            {"input": query, "inputtype": "textquery", "fields": "place_id"},
+            limiter,
+        )
+        candidates = response.get("candidates") or []
+        return candidates[0]["place_id"] if candidates else None
+
+    async def place_details(self, session, place_id, limiter=None):
+        """Location columns of a place, None if it is not found."""
+        response = await self._get(
+            session,
+            "details",
+            {"place_id": place_id, "fields": DETAIL_FIELDS},
+            limiter,
+        )
+        result = response.get("result")
+        return None if not result else parse_details(place_id, result)
+
+
+def parse_details(place_id, result):
+    """`geocoded_places` columns of a Places details result."""
+    location = result.get("geometry", {}).get("location", {})
+    row = {
+        "id": place_id,
+        "lat": location.get("lat"),
+        "lng": location.get("lng"),
+        "address": result.get("formatted_address"),
+        "name": result.get("name"),
+        "types": json.dumps(result.get("types", [])),
+        "website": result.get("website"),
+    }
+    for component in result.get("address_components", []):
+        for kind in component.get("types", []):
+            if kind in ADDRESS_COMPONENTS:
+                row.setdefault(kind, component.get("long_name"))
+    return row
+
+
+def read_affiliations(engine):
+    """id and affiliation of the affiliations without a location."""
+    query = (
+        select([affiliations.c.id, affiliations.c.affiliation])
+        .select_from(
+            affiliations.outerjoin(
+                locations, locations.c.affiliation_id == affiliations.c.id
+            )
+        )
+        .where(locations.c.affiliation_id.is_(None))
+        .where(affiliations.c.affiliation.isnot(None))
+        .order_by(affiliations.c.id)
+    )
+    return pd.read_sql(query, engine)
+
+
+def read_cache(engine, requests):
+    """Cached responses of requests, as a dict of request to decoded JSON."""
+    query = select([cache.c.request, cache.c.response]).where(
+        cache.c.request == any_(literal(list(requests), ARRAY(TEXT)))
+    )
+    with engine.connect() as conn:
+        return {r: json.loads(response) for r, response in conn.execute(query)}
+
+
+def write_cache(engine, responses):
+    now = datetime.datetime.now()
+    bulk_load(
+        engine,
+        GeocodeCache,
+        (
+            {"request": r, "response": json.dumps(response), "fetched_at": now}
+            for r, response in responses.items()
+        ),
+    )
+
+
+async def _gather(lookup, args, rate, concurrency):
+    """Run `lookup(session, arg, limiter)` for every arg, skipping failures."""
+    limiter = TokenBucket(rate)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(session, arg):
+        async with semaphore:
+            try:
+                return arg, await lookup(session, arg, limiter)
+            except (LookupFailed, aiohttp.ClientError) as e:
+                logger.warning(f"Geocoding {arg!r} failed: {e}")
+                return arg, LookupFailed
+
+    async with aiohttp.ClientSession() as session:
+        results = await asyncio.gather(*(one(session, arg) for arg in args))
+    return {arg: result for arg, result in results if result is not LookupFailed}
+
+
+def _cached_lookup(engine, prefix, lookup, args, rate, concurrency):
+    """Responses of `lookup` for args, from the cache or the API.
+
+    Returns:
+        responses (dict): Arg to response, for the args that did not fail.
+        n_requests (int): Number of args that were not cached.
+
+    """
+    requests = {f"{prefix}:{arg}": arg for arg in args}
+    cached = read_cache(engine, requests)
+    missing = [arg for request, arg in requests.items() if request not in cached]
+    fetched = {}
+    if missing:
+        fetched = run(_gather(lookup, missing, rate, concurrency))
+        write_cache(engine, {f"{prefix}:{arg}": r for arg, r in fetched.items()})
+    responses = {requests[r]: response for r, response in cached.items()}
+    responses.update(fetched)
+    return responses, len(missing)
+
+
+def geocode_affiliations(
+    engine, provider, rate=10, concurrency=16, checkpoint_every=500
+):
+    """Geocode the affiliations that have no `geocoded_places` row.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): Database with `mag_affiliation`.
+        provider (PlacesProvider): Places lookups.
+        rate (float): API requests per second.
+        concurrency (int): API requests in flight.
+        checkpoint_every (int): Clusters geocoded and saved at a time.
+
+    Returns:
+        (dict) Numbers of affiliations, clusters, API requests and locations
+        written.
+
+    """
+    clusters = cluster_affiliations(read_affiliations(engine))
+    queries = clusters.drop_duplicates("key").set_index("key")["query"]
+    counts = {"affiliations": len(clusters), "clusters": len(queries)}
+    counts.update(requests=0, locations=0)
+
+    for keys in batches(queries.index, checkpoint_every):
+        # Clusters are cached by key, so a new spelling of a cluster is free
+        place_ids, n = _cached_lookup(
+            engine,
+            "find",
+            lambda session, key, limiter: provider.find_place(
+                session, queries[key], limiter
+            ),
+            keys,
+            rate,
+            concurrency,
+        )
+        counts["requests"] += n
+        found = {key: pid for key, pid in place_ids.items() if pid is not None}
+        details, n = _cached_lookup(
+            engine,
+            "details",
+            provider.place_details,
+            sorted(set(found.values())),
+            rate,
+            concurrency,
+        )
+        counts["requests"] += n
+
+        members = clusters[clusters.key.isin(found)]
+        rows = []
+        for affiliation_id, key in zip(members.id, members.key):
+            place = details.get(found[key])
+            if place is not None:
+                rows.append(dict(place, affiliation_id=affiliation_id))
+        bulk_load(engine, AffiliationLocation, rows)
+        counts["locations"] += len(rows)
+        logger.info(f"Geocoding: {counts}")
+    return counts
+
+
+def stub_app(places, rate_limit=None):
+    """Local stand-in for the Places text search and details endpoints.
+
+    Args:
+        places (dict): Place id to a details result. A text search matches
+            the places whose name, lower-cased, is in the query.
+        rate_limit (int): Requests accepted per second. Extra requests get a
+            429 response.
+
+    The inputs and place ids it was asked for are kept in
+    app["served"]["findplacefromtext"] and app["served"]["details"].
+    """
+    app = web.Application()
+    served = app["served"] = {"findplacefromtext": [], "details": []}
+    window = {"start": 0.0, "count": 0}
+
+    def limited():
+        now = asyncio.get_event_loop().time()
+        if now - window["start"] >= 1:
+            window["start"], window["count"] = now, 0
+        window["count"] += 1
+        return rate_limit is not None and window["count"] > rate_limit
+
+    async def find(request):
+        if limited():
+            return web.json_response({}, status=429, headers={"Retry-After": "0.2"})
+        query = request.query["input"]
+        served["findplacefromtext"].append(query)
+        candidates = [
+            {"place_id": pid}
+            for pid, result in places.items()
+            if result["name"].lower() in query.lower()
+        ]
+        status = "OK" if candidates else "ZERO_RESULTS"
+        return web.json_response({"candidates": candidates, "status": status})
+
+    async def details(request):
+        if limited():
+            return web.json_response({}, status=429, headers={"Retry-After": "0.2"})
+        place_id = request.query["place_id"]
+        served["details"].append(place_id)
+        if place_id not in places:
+            return web.json_response({"status": "NOT_FOUND"})
+        return web.json_response({"result": places[place_id], "status": "OK"})
+
+    app.router.add_get("/findplacefromtext/json", find)
+    app.router.add_get("/details/json", details)
+    return app
+
+
+def main():
+    config = ai_research.config["geocoding"]
+    engine = create_engine(os.getenv("postgresdb"))
+    geocode_affiliations(
+        engine,
+        PlacesProvider(os.getenv("google_key")),
+        rate=config["rate"],
+        concurrency=config["concurrency"],
+        checkpoint_every=config["checkpoint_every"],
+    )
+
+
+if __name__ == "__main__":
+    load_dotenv(find_dotenv())
+    main()
@@ -0,0 +1,132 @@
+"""Rate-limited, retried requests to external lookup APIs.
+
+Lookups run concurrently on an asyncio event loop. A `TokenBucket` shared by
+all requests keeps them under the provider's rate limit, and `get_json`
+retries on rate limiting (429), server errors and dropped connections with
+exponential backoff, honouring Retry-After when the provider sends it.
+"""
+import asyncio
+import logging
+import threading
+import time
+
+import aiohttp
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Async token bucket.
+
+    Args:
+        rate (float): Tokens added per second.
+        capacity (int): Largest burst. Defaults to one second of tokens.
+
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens=1):
+        """Wait until `tokens` are available and take them."""
+        while True:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return
+            await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+
+class LookupFailed(Exception):
+    """A request still failed after all retries."""
+
+
+def _retry_after(headers, default):
+    for header in ("Retry-After", "X-Rate-Limit-Reset"):
+        try:
+            return float(headers[header])
+        except (KeyError, ValueError):
+            continue
+    return default
+
+
+async def get_json(session, url, params=None, limiter=None, retries=5, backoff=0.5):
+    """GET a JSON response, waiting for the limiter and retrying on failure.
+
+    Args:
+        session (aiohttp.ClientSession): Session to send the request with.
+        url (str): Endpoint.
+        params (dict or list of pairs): Query string parameters.
+        limiter (TokenBucket): Taken from before every attempt.
+        retries (int): Attempts after the first one.
+        backoff (float): Seconds before the first retry, doubled every retry.
+
+    Returns:
+        The decoded JSON body.
+
+    """
+    for attempt in range(retries + 1):
+        delay = backoff * 2 ** attempt
+        if limiter is not None:
+            await limiter.acquire()
+        try:
+            async with session.get(url, params=params) as resp:
+                if resp.status not in RETRY_STATUS:
+                    resp.raise_for_status()
+                    return await resp.json()
+                delay = _retry_after(resp.headers, delay)
+                error = f"HTTP {resp.status}"
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            error = repr(e)
+        if attempt < retries:
+            logger.debug(f"{url}: {error}, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+    raise LookupFailed(f"{url}: {error} after {retries + 1} attempts")
+
+
+def run(coroutine):
+    """Run a coroutine to completion on a fresh event loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def serve_in_thread(app, host="127.0.0.1", port=0):
+    """Serve an aiohttp application from a background thread.
+
+    Used to run local stand-ins of the lookup APIs.
+
+    Returns:
+        url (str): Base URL of the server.
+        stop (callable): Shuts the server down.
+
+    """
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(app, access_log=None)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, host, port)
+    loop.run_until_complete(site.start())
+    host, port = runner.addresses[0][:2]
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    def stop():
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+    return f"http://{host}:{port}", stop
@@ -1,13 +1,59 @@
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.dialects.postgresql import TEXT, VARCHAR, ARRAY, FLOAT, BYTEA
-from sqlalchemy import Column, ForeignKey
+from sqlalchemy import DDL, Column, Computed, ForeignKey, Index, and_, event, func
 from sqlalchemy.orm import relationship
-from sqlalchemy.types import Integer, Float, BIGINT
+from sqlalchemy.types import Integer, Float, BIGINT, TIMESTAMP, SmallInteger, Date
 
 Base = declarative_base()
 
+# Typed copies of the TEXT year and date columns, kept up to date by Postgres
+YEAR_INT = "CASE WHEN {column} ~ '^[0-9]{{4}}$' THEN {column}::smallint END"
+PUBLICATION_DATE = """CASE
+WHEN date ~ '^[0-9]{4}-(0[1-9]|1[0-2])-(0[1-9]|[12][0-9]|3[01])'
+THEN CASE WHEN substr(date, 1, 4)::int > 0
+    AND substr(date, 9, 2)::int <= CASE substr(date, 6, 2)::int
+    WHEN 2 THEN CASE WHEN substr(date, 1, 4)::int % 4 = 0
+        AND (substr(date, 1, 4)::int % 100 <> 0 OR substr(date, 1, 4)::int % 400 = 0)
+        THEN 29 ELSE 28 END
+    WHEN 4 THEN 30 WHEN 6 THEN 30 WHEN 9 THEN 30 WHEN 11 THEN 30 ELSE 31 END
+THEN make_date(
+    substr(date, 1, 4)::int, substr(date, 6, 2)::int, substr(date, 9, 2)::int
+) END END"""
+
+
+def typed_year(column="year"):
+    """Indexed SMALLINT generated from a TEXT year column, null if not a year."""
+    return Column(SmallInteger, Computed(YEAR_INT.format(column=column)), index=True)
+
+
+class YearRange:
+    """Year range filters on the typed `year_int` column.
+
+    Comparing `year_int` with constants lets Postgres use its index, and
+    prune the partitions of the tables partitioned by year.
+    """
+
+    @classmethod
+    def in_years(cls, first=None, last=None):
+        """Clause selecting the rows of the years first to last, inclusive."""
+        clauses = [cls.year_int.isnot(None)]
+        if first is not None:
+            clauses.append(cls.year_int >= first)
+        if last is not None:
+            clauses.append(cls.year_int <= last)
+        return and_(*clauses)
+
+
+def _default_partition(table):
+    """Add a DEFAULT partition to a partitioned table when it is created."""
+    event.listen(
+        table,
+        "after_create",
+        DDL("CREATE TABLE %(table)s_default PARTITION OF %(table)s DEFAULT"),
+    )
+
 
-class Paper(Base):
+class Paper(YearRange, Base):
     """MAG paper. Collected by matching its title with a title from BioRxiv."""
 
     __tablename__ = "mag_papers"
@@ -17,9 +63,11 @@ class Paper(Base):
     title = Column(TEXT)
     publication_type = Column(TEXT)
     year = Column(TEXT)
+    year_int = typed_year()
     date = Column(TEXT)
     citations = Column(Integer)
     original_title = Column(TEXT)
+    publication_date = Column(Date, Computed(PUBLICATION_DATE))
     references = Column(TEXT)
     doi = Column(VARCHAR(200))
     publisher = Column(TEXT)
@@ -109,6 +157,22 @@ class AuthorAffiliation(Base):
     authors = relationship("Author")
 
 
+# The natural key of `mag_author_affiliation`, with nulls as -1, that the bulk
+# loader looks rows up by. Must match the comparisons of `bulk_load._same_value`
+# used by `bulk_load._upsert_sql`
+Index(
+    "ix_mag_author_affiliation_natural_key",
+    *[
+        func.coalesce(column, -1)
+        for column in (
+            AuthorAffiliation.paper_id,
+            AuthorAffiliation.author_id,
+            AuthorAffiliation.affiliation_id,
+        )
+    ],
+)
+
+
 class FieldOfStudy(Base):
     """Fields of study."""
 
@@ -158,6 +222,16 @@ class AffiliationLocation(Base):
     geocoded_affiliation = relationship("Affiliation", back_populates="aff_location")
 
 
+class GeocodeCache(Base):
+    """Google Places responses, keyed by request. Cache of the geocoding."""
+
+    __tablename__ = "geocode_cache"
+
+    request = Column(TEXT, primary_key=True, autoincrement=False)
+    response = Column(TEXT)
+    fetched_at = Column(TIMESTAMP)
+
+
 class HighDimDocVector(Base):
     """High dimensional Abstract vector of a paper."""
 
@@ -181,6 +255,29 @@ class DocVector(Base):
     citations = Column(Integer)
 
 
+class HighDimDocVectorPacked(Base):
+    """High dimensional Abstract vector of a paper, packed as float32 bytes."""
+
+    __tablename__ = "high_dim_doc_vectors_packed"
+
+    id = Column(
+        BIGINT, ForeignKey("mag_papers.id"), primary_key=True, autoincrement=False
+    )
+    vector = Column(BYTEA)
+
+
+class DocVectorPacked(Base):
+    """Abstract vector of a paper, packed as float32 bytes."""
+
+    __tablename__ = "doc_vectors_packed"
+
+    id = Column(
+        BIGINT, ForeignKey("mag_papers.id"), primary_key=True, autoincrement=False
+    )
+    vector_3d = Column(BYTEA)
+    citations = Column(Integer)
+
+
 class FosHierarchy(Base):
     """Parent and child nodes of a FoS."""
 
@@ -211,7 +308,7 @@ class FosMetadata(Base):
     frequency = Column(Integer)
 
 
-class MetricCountryRCA(Base):
+class MetricCountryRCA(YearRange, Base):
     """Revealed comparative advantage of a country."""
 
     __tablename__ = "rca_country"
@@ -219,11 +316,12 @@ class MetricCountryRCA(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     rca_sum = Column(Float)
     year = Column(TEXT)
+    year_int = typed_year()
     entity = Column(TEXT)
     field_of_study_id = Column(BIGINT, ForeignKey("mag_fields_of_study.id"))
 
 
-class MetricAffiliationRCA(Base):
+class MetricAffiliationRCA(YearRange, Base):
     """Revealed comparative advantage of an institution."""
 
     __tablename__ = "rca_affiliation"
@@ -231,6 +329,7 @@ class MetricAffiliationRCA(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     rca_sum = Column(Float)
     year = Column(TEXT)
+    year_int = typed_year()
     entity = Column(BIGINT)
     field_of_study_id = Column(BIGINT, ForeignKey("mag_fields_of_study.id"))
 
@@ -250,7 +349,19 @@ class AuthorGender(Base):
     probability = Column(Float)
 
 
-class CountryCollaboration(Base):
+class FirstNameGender(Base):
+    """Gender inferred for a first name. Cache of the gender inference API."""
+
+    __tablename__ = "first_name_gender"
+
+    first_name = Column(VARCHAR(250), primary_key=True, autoincrement=False)
+    gender = Column(TEXT)
+    samples = Column(Integer)
+    probability = Column(Float)
+    fetched_at = Column(TIMESTAMP)
+
+
+class CountryCollaboration(YearRange, Base):
     """Collaborators of a country and their number of shared papers."""
 
     __tablename__ = "country_collaboration"
@@ -260,9 +371,10 @@ class CountryCollaboration(Base):
     country_b = Column(TEXT)
     weight = Column(Integer)
     year = Column(TEXT)
+    year_int = typed_year()
 
 
-class ResearchDiversityCountry(Base):
+class ResearchDiversityCountry(YearRange, Base):
     """Research diversity metrics for a country."""
 
     __tablename__ = "research_diversity_country"
@@ -272,11 +384,12 @@ class ResearchDiversityCountry(Base):
     simpson_e_diversity = Column(Float)
     simpson_diversity = Column(Float)
     year = Column(TEXT)
+    year_int = typed_year()
     entity = Column(TEXT)
     field_of_study_id = Column(BIGINT, ForeignKey("mag_fields_of_study.id"))
 
 
-class GenderDiversityCountry(Base):
+class GenderDiversityCountry(YearRange, Base):
     """Average number of female co-authors for a country."""
 
     __tablename__ = "gender_diversity_country"
@@ -284,11 +397,12 @@ class GenderDiversityCountry(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     female_share = Column(Float)
     year = Column(TEXT)
+    year_int = typed_year()
     entity = Column(TEXT)
     field_of_study_id = Column(BIGINT, ForeignKey("mag_fields_of_study.id"))
 
 
-class FilteredFos(Base):
+class FilteredFos(YearRange, Base):
     """Paper count and citation sum for a field of study"""
 
     __tablename__ = "mag_filtered_field_of_study"
@@ -296,12 +410,13 @@ class FilteredFos(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     field_of_study_id = Column(BIGINT, ForeignKey("mag_fields_of_study.id"))
     year = Column(TEXT)
+    year_int = typed_year()
     all_children = Column(ARRAY(BIGINT))
     paper_count = Column(Integer)
     total_citations = Column(Integer)
 
 
-class CountrySimilarity(Base):
+class CountrySimilarity(YearRange, Base):
     """Country similarity for each topic and year."""
 
     __tablename__ = "country_similarity"
@@ -311,10 +426,11 @@ class CountrySimilarity(Base):
     country_b = Column(TEXT)
     closeness = Column(Float)
     year = Column(TEXT)
+    year_int = typed_year()
     field_of_study_id = Column(BIGINT, ForeignKey("mag_fields_of_study.id"))
 
 
-class CountryTopicOutputsMetrics(Base):
+class CountryTopicOutputsMetrics(YearRange, Base):
     """Outputs and metrics for each country, topic and year. Used in front-end."""
 
     __tablename__ = "viz_metrics_and_outputs"
@@ -323,6 +439,7 @@ class CountryTopicOutputsMetrics(Base):
     country = Column(TEXT)
     field_of_study_id = Column(BIGINT, ForeignKey("mag_fields_of_study.id"))
     year = Column(TEXT)
+    year_int = typed_year()
     paper_count = Column(Integer)
     total_citations = Column(Integer)
     name = Column(TEXT)
@@ -331,13 +448,14 @@ class CountryTopicOutputsMetrics(Base):
     female_share = Column(Float)
 
 
-class AllMetrics(Base):
+class AllMetrics(YearRange, Base):
     """Consolidates metrics from other tables. Used in front-end."""
 
     __tablename__ = "viz_metrics_by_country"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     year = Column(TEXT)
+    year_int = typed_year()
     country = Column(TEXT)
     shannon_diversity = Column(Float)
     field_of_study_id = Column(BIGINT, ForeignKey("mag_fields_of_study.id"))
@@ -404,7 +522,7 @@ class AffiliationType(Base):
     type = Column(Integer)
 
 
-class WorldBankGDP(Base):
+class WorldBankGDP(YearRange, Base):
     """World Bank GDP indicator."""
 
     __tablename__ = "wb_gdp"
@@ -413,9 +531,10 @@ class WorldBankGDP(Base):
     country = Column(TEXT)
     indicator = Column(Float)
     year = Column(TEXT)
+    year_int = typed_year()
 
 
-class WorldBankResearchDevelopment(Base):
+class WorldBankResearchDevelopment(YearRange, Base):
     """World Bank Research and development expenditure (% of GDP) indicator."""
 
     __tablename__ = "wb_rnd_expenditure"
@@ -424,9 +543,10 @@ class WorldBankResearchDevelopment(Base):
     country = Column(TEXT)
     indicator = Column(Float)
     year = Column(TEXT)
+    year_int = typed_year()
 
 
-class WorldBankGovEducation(Base):
+class WorldBankGovEducation(YearRange, Base):
     """World Bank Government expenditure on education, total (% of GDP) indicator."""
 
     __tablename__ = "wb_edu_expenditure"
@@ -435,10 +555,12 @@ class WorldBankGovEducation(Base):
     country = Column(TEXT)
     indicator = Column(Float)
     year = Column(TEXT)
+    year_int = typed_year()
 
 
-class WorldBankFemaleLaborForce(Base):
-    """World Bank Ratio of female to male labor force participation rate (%) indicator."""
+class WorldBankFemaleLaborForce(YearRange, Base):
+    """World Bank Ratio of female to male labor force participation rate (%)
+    indicator."""
 
     __tablename__ = "wb_female_workforce"
 
@@ -446,6 +568,7 @@ class WorldBankFemaleLaborForce(Base):
     country = Column(TEXT)
     indicator = Column(Float)
     year = Column(TEXT)
+    year_int = typed_year()
 
 
 class CountryAssociation(Base):
@@ -483,6 +606,39 @@ class BlobArrow(Base):
     size = Column(BIGINT)
 
 
+class BlobArrowManifest(Base):
+    """Schema and size of an arrow dataset stored in chunks."""
+
+    __tablename__ = "blob_arrow_manifest"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(TEXT)
+    schema = Column(BYTEA)
+    num_chunks = Column(Integer)
+    num_rows = Column(BIGINT)
+    size = Column(BIGINT)
+    chunks = relationship("BlobArrowChunk", back_populates="manifest")
+
+
+class BlobArrowChunk(Base):
+    """Serialised arrow record batch of a chunked arrow dataset."""
+
+    __tablename__ = "blob_arrow_chunks"
+
+    manifest_id = Column(
+        Integer,
+        ForeignKey("blob_arrow_manifest.id"),
+        primary_key=True,
+        autoincrement=False,
+    )
+    index = Column(Integer, primary_key=True, autoincrement=False)
+    row_offset = Column(BIGINT)
+    num_rows = Column(Integer)
+    blob = Column(BYTEA)
+    size = Column(BIGINT)
+    manifest = relationship("BlobArrowManifest", back_populates="chunks")
+
+
 class OpenAccess(Base):
     """Flags open access journals."""
 
@@ -491,3 +647,67 @@ class OpenAccess(Base):
     id = Column(BIGINT, primary_key=True)
     open_access = Column(Integer)
     # journals = relationship("Journal", back_populates="journal_id")
+
+
+class PaperByYear(YearRange, Base):
+    """Papers with a known year, range partitioned by year.
+
+    Copy of the main columns of `mag_papers`, kept in sync by
+    `ai_research.mag.year_partitions`.
+    """
+
+    __tablename__ = "mag_papers_by_year"
+    __table_args__ = {"postgresql_partition_by": "RANGE (year_int)"}
+
+    year_int = Column(SmallInteger, primary_key=True, autoincrement=False)
+    id = Column(BIGINT, primary_key=True, autoincrement=False)
+    publication_date = Column(Date)
+    title = Column(TEXT)
+    publication_type = Column(TEXT)
+    citations = Column(Integer)
+    doi = Column(VARCHAR(200))
+
+
+class PaperFieldsOfStudyByYear(YearRange, Base):
+    """`mag_paper_fields_of_study` with the paper year, partitioned by year."""
+
+    __tablename__ = "mag_paper_fields_of_study_by_year"
+    __table_args__ = {"postgresql_partition_by": "RANGE (year_int)"}
+
+    year_int = Column(SmallInteger, primary_key=True, autoincrement=False)
+    paper_id = Column(BIGINT, primary_key=True, autoincrement=False)
+    field_of_study_id = Column(BIGINT, primary_key=True, autoincrement=False)
+
+
+class PaperAuthorByYear(YearRange, Base):
+    """`mag_paper_authors` with the paper year, partitioned by year."""
+
+    __tablename__ = "mag_paper_authors_by_year"
+    __table_args__ = {"postgresql_partition_by": "RANGE (year_int)"}
+
+    year_int = Column(SmallInteger, primary_key=True, autoincrement=False)
+    paper_id = Column(BIGINT, primary_key=True, autoincrement=False)
+    author_id = Column(BIGINT, primary_key=True, autoincrement=False)
+    order = Column(Integer)
+
+
+class AuthorAffiliationByYear(YearRange, Base):
+    """`mag_author_affiliation` with the paper year, partitioned by year."""
+
+    __tablename__ = "mag_author_affiliation_by_year"
+    __table_args__ = {"postgresql_partition_by": "RANGE (year_int)"}
+
+    year_int = Column(SmallInteger, primary_key=True, autoincrement=False)
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    affiliation_id = Column(BIGINT)
+    author_id = Column(BIGINT)
+    paper_id = Column(BIGINT)
+
+
+for _mapping in [
+    PaperByYear,
+    PaperFieldsOfStudyByYear,
+    PaperAuthorByYear,
+    AuthorAffiliationByYear,
+]:
+    _default_partition(_mapping.__table__)
@@ -0,0 +1,333 @@
+"""Bulk loading of papers with their authors, affiliations, venues and topics.
+
+Walking `Paper.authors`, `Paper.fields_of_study` or `Author.affiliation` on
+ORM objects runs a query per object. `load_bundle` instead reads a set of
+papers, given by id or by a year range and fields of study, and all their
+linked rows with one query per table for every `chunksize` papers. Each query
+filters on an array of paper ids (`= ANY(...)`) and is streamed out of
+Postgres with `COPY ... TO STDOUT` as CSV, which pandas parses in C, so no
+Python object is built per row. Column dtypes follow the SQL types rather
+than being inferred from the values: text stays text, and nullable integers
+are `Int64`.
+
+The result is a `PaperBundle` of DataFrames: `papers`, sorted by id, and one
+table per relationship whose `paper` column is the row of its paper in
+`papers`, sorted by that row. The rows of the i-th paper are a slice of each
+table:
+
+    bundle = load_bundle(engine, first_year=2015, fos_ids=[41008148])
+    authors = bundle.linked("authors", paper_id)
+    bundle["fields_of_study"].groupby("name").size()
+"""
+import datetime
+import io
+import logging
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import any_, literal, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import ARRAY, BIGINT
+
+from ai_research.mag.mag_orm import (
+    Paper,
+    PaperAuthor,
+    Author,
+    AuthorAffiliation,
+    Affiliation,
+    PaperFieldsOfStudy,
+    FieldOfStudy,
+    Journal,
+    Conference,
+)
+
+logger = logging.getLogger(__name__)
+
+papers = Paper.__table__
+paper_authors = PaperAuthor.__table__
+authors = Author.__table__
+author_aff = AuthorAffiliation.__table__
+affiliations = Affiliation.__table__
+paper_fos = PaperFieldsOfStudy.__table__
+fields = FieldOfStudy.__table__
+journals = Journal.__table__
+conferences = Conference.__table__
+
+PAPER_COLUMNS = [
+    "id",
+    "title",
+    "year_int",
+    "publication_date",
+    "publication_type",
+    "citations",
+    "doi",
+]
+
+# Linked table name to (columns, joined tables, paper id column, sort columns)
+LINKS = {
+    "authors": (
+        [
+            paper_authors.c.paper_id,
+            paper_authors.c.author_id,
+            paper_authors.c.order,
+            authors.c.name,
+        ],
+        paper_authors.outerjoin(authors, authors.c.id == paper_authors.c.author_id),
+        paper_authors.c.paper_id,
+        ["order", "author_id"],
+    ),
+    "affiliations": (
+        [
+            author_aff.c.paper_id,
+            author_aff.c.author_id,
+            author_aff.c.affiliation_id,
+            affiliations.c.affiliation,
+        ],
+        author_aff.outerjoin(
+            affiliations, affiliations.c.id == author_aff.c.affiliation_id
+        ),
+        author_aff.c.paper_id,
+        ["author_id", "affiliation_id"],
+    ),
+    "fields_of_study": (
+        [paper_fos.c.paper_id, paper_fos.c.field_of_study_id, fields.c.name],
+        paper_fos.outerjoin(fields, fields.c.id == paper_fos.c.field_of_study_id),
+        paper_fos.c.paper_id,
+        ["field_of_study_id"],
+    ),
+    "journals": (
+        [
+            journals.c.paper_id,
+            journals.c.id.label("journal_id"),
+            journals.c.journal_name,
+        ],
+        journals,
+        journals.c.paper_id,
+        [],
+    ),
+    "conferences": (
+        [
+            conferences.c.paper_id,
+            conferences.c.id.label("conference_id"),
+            conferences.c.conference_name,
+        ],
+        conferences,
+        conferences.c.paper_id,
+        [],
+    ),
+}
+
+
+def _id_array(ids):
+    return literal([int(i) for i in ids], ARRAY(BIGINT))
+
+
+def column_dtypes(columns):
+    """pandas dtypes of some SQL columns, and the names of the date columns.
+
+    Integers are nullable `Int64`, floats `float64`, booleans `boolean` and
+    dates and timestamps are parsed. Text and any other type is left as
+    `object`, so values that look like numbers stay strings.
+
+    Returns:
+        dtypes (dict): Column name to dtype, for the non date columns.
+        dates (list of str): Names of the date and timestamp columns.
+
+    """
+    dtypes, dates = {}, []
+    for column in columns:
+        try:
+            python_type = column.type.python_type
+        except NotImplementedError:
+            python_type = object
+        if issubclass(python_type, bool):
+            dtypes[column.name] = "boolean"
+        elif issubclass(python_type, int):
+            dtypes[column.name] = "Int64"
+        elif issubclass(python_type, float):
+            dtypes[column.name] = "float64"
+        elif issubclass(python_type, (datetime.date, datetime.datetime)):
+            dates.append(column.name)
+        else:
+            dtypes[column.name] = "object"
+    return dtypes, dates
+
+
+def empty_frame(columns):
+    """DataFrame without rows with the dtypes of some SQL columns."""
+    dtypes, _ = column_dtypes(columns)
+    return pd.DataFrame(
+        {c.name: pd.Series(dtype=dtypes.get(c.name, "datetime64[ns]")) for c in columns}
+    )
+
+
+def copy_frame(conn, query):
+    """Read the rows of a query with COPY, as a DataFrame.
+
+    Args:
+        conn (sqlalchemy.engine.Connection): Connection to Postgres (psycopg2).
+        query (sqlalchemy.sql.Select): Query to read. The dtypes of the
+            columns follow their SQL types (see `column_dtypes`).
+
+    """
+    dtypes, dates = column_dtypes(query.c)
+    compiled = query.compile(dialect=postgresql.dialect())
+    cursor = conn.connection.cursor()
+    try:
+        sql = cursor.mogrify(str(compiled), compiled.params).decode()
+        buf = io.BytesIO()
+        cursor.copy_expert(
+            f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER, NULL '\\N')", buf
+        )
+    finally:
+        cursor.close()
+    buf.seek(0)
+    return pd.read_csv(
+        buf,
+        dtype=dtypes,
+        parse_dates=dates,
+        na_values=["\\N"],
+        keep_default_na=False,
+    )
+
+
+def select_paper_ids(conn, first_year=None, last_year=None, fos_ids=None):
+    """Ids of the papers of a year range, tagged with any of some fields of study.
+
+    Returns:
+        (numpy.ndarray) Sorted paper ids.
+
+    """
+    query = select([papers.c.id])
+    if first_year is not None or last_year is not None:
+        query = query.where(Paper.in_years(first_year, last_year))
+    if fos_ids is not None:
+        tagged = select([paper_fos.c.paper_id]).where(
+            paper_fos.c.field_of_study_id == any_(_id_array(fos_ids))
+        )
+        query = query.where(papers.c.id.in_(tagged))
+    return np.sort(copy_frame(conn, query).id.to_numpy(np.int64))
+
+
+class PaperBundle:
+    """Papers and their linked rows, as DataFrames.
+
+    Args:
+        papers (pandas.DataFrame): One row per paper, sorted by `id`.
+        links (dict): Table name to a DataFrame with a `paper` column, the row
+            of the paper in `papers`, sorted by it.
+
+    """
+
+    def __init__(self, papers, links):
+        self.papers = papers
+        self.links = links
+        self.indptr = {
+            name: np.searchsorted(df.paper.values, np.arange(len(papers) + 1))
+            for name, df in links.items()
+        }
+
+    def __len__(self):
+        return len(self.papers)
+
+    def __getitem__(self, name):
+        return self.links[name]
+
+    def __repr__(self):
+        counts = ", ".join(f"{name}={len(df)}" for name, df in self.links.items())
+        return f"PaperBundle(papers={len(self)}, {counts})"
+
+    def row(self, paper_id):
+        """Row of a paper in `papers`.
+
+        Raises:
+            KeyError: If the paper is not in the bundle.
+
+        """
+        ids = self.papers.id.to_numpy(np.int64)
+        i = np.searchsorted(ids, paper_id)
+        if i == len(ids) or ids[i] != paper_id:
+            raise KeyError(paper_id)
+        return int(i)
+
+    def linked(self, name, paper_id):
+        """Rows of a linked table for one paper."""
+        i = self.row(paper_id)
+        indptr = self.indptr[name]
+        return self.links[name].iloc[indptr[i] : indptr[i + 1]]
+
+
+def load_bundle(
+    engine,
+    paper_ids=None,
+    first_year=None,
+    last_year=None,
+    fos_ids=None,
+    links=tuple(LINKS),
+    paper_columns=PAPER_COLUMNS,
+    chunksize=100000,
+):
+    """Read papers and their linked rows into a `PaperBundle`.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): Database with the MAG tables.
+        paper_ids (list of int): Papers to read. Ids without a paper are left
+            out. If None, the papers matching the year range and fields of
+            study.
+        first_year (int): Only papers from this year.
+        last_year (int): Only papers up to this year.
+        fos_ids (list of int): Only papers tagged with any of these fields of
+            study.
+        links (list of str): Linked tables to read, out of `LINKS`.
+        paper_columns (list of str): Columns of `mag_papers` to read.
+        chunksize (int): Number of papers read per query.
+
+    Returns:
+        (PaperBundle)
+
+    """
+    with engine.connect() as conn:
+        if paper_ids is None:
+            paper_ids = select_paper_ids(conn, first_year, last_year, fos_ids)
+        paper_ids = np.unique(np.asarray(paper_ids, dtype=np.int64))
+        columns = [papers.c[c] for c in paper_columns]
+        frames = {name: [] for name in ["papers"] + list(links)}
+        for start in range(0, len(paper_ids), chunksize):
+            chunk = _id_array(paper_ids[start : start + chunksize])
+            frames["papers"].append(
+                copy_frame(conn, select(columns).where(papers.c.id == any_(chunk)))
+            )
+            for name in links:
+                link_columns, source, paper_id, _ = LINKS[name]
+                query = (
+                    select(link_columns)
+                    .select_from(source)
+                    .where(paper_id == any_(chunk))
+                )
+                frames[name].append(copy_frame(conn, query))
+
+    bundle_papers = _concat(frames.pop("papers"), columns).sort_values("id")
+    bundle_papers = bundle_papers.reset_index(drop=True)
+    bundle_links = {}
+    for name, chunks in frames.items():
+        link_columns, _, _, order = LINKS[name]
+        df = _concat(chunks, link_columns)
+        df.insert(
+            0,
+            "paper",
+            np.searchsorted(
+                bundle_papers.id.to_numpy(np.int64), df.paper_id.to_numpy(np.int64)
+            ),
+        )
+        bundle_links[name] = df.sort_values(
+            ["paper"] + order, kind="mergesort"
+        ).reset_index(drop=True)
+    bundle = PaperBundle(bundle_papers, bundle_links)
+    logger.info(f"Loaded {bundle}")
+    return bundle
+
+
+def _concat(frames, columns):
+    if not frames:
+        return empty_frame(columns)
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,290 @@
+"""Local Parquet mirror of the MAG tables.
+
+Any table in `Base.metadata` can be mirrored to `data/interim/mag_mirror` and
+read back as an Arrow table or a pandas DataFrame. Refreshes are incremental:
+
+- "pk": appends rows whose primary key is above the last mirrored key. Rows
+  updated in place in the database are not picked up.
+- "year": re-pulls every year from the last mirrored year onwards and
+  replaces those partitions. Only for tables with a `year` column.
+- "full": replaces the whole mirror.
+
+Each table is stored as one directory per partition (a year, or `all`) with
+one Parquet file per fetched chunk. A refresh writes to a copy of the table's
+directory, where the files it keeps are hard links, and swaps it in together
+with the new watermark. A failed refresh leaves the mirror as it was.
+"""
+import json
+import logging
+import os
+import shutil
+from datetime import datetime
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from sqlalchemy import select, tuple_
+from sqlalchemy.dialects.postgresql import ARRAY, BYTEA
+from sqlalchemy.types import (
+    BigInteger,
+    Boolean,
+    Date,
+    DateTime,
+    Float,
+    Integer,
+    Numeric,
+    String,
+    Text,
+)
+
+import ai_research
+from ai_research.mag.mag_orm import Base
+
+logger = logging.getLogger(__name__)
+
+MIRROR_DIR = ai_research.project_dir / "data" / "interim" / "mag_mirror"
+ALL = "all"
+NULL_YEAR = "null"
+
+
+# Arrow types of the plain SQLAlchemy types, checked in order: BigInteger is
+# an Integer, and Float a Numeric
+_ARROW_TYPES = [
+    (BigInteger, pa.int64()),
+    (Integer, pa.int32()),
+    (Float, pa.float64()),
+    (Boolean, pa.bool_()),
+    (BYTEA, pa.binary()),
+    (Date, pa.date32()),
+    ((String, Text), pa.string()),
+]
+
+
+def arrow_type(sql_type):
+    """Arrow type of a SQLAlchemy column type."""
+    if isinstance(sql_type, ARRAY):
+        return pa.list_(arrow_type(sql_type.item_type))
+    for sql_types, type_ in _ARROW_TYPES:
+        if isinstance(sql_type, sql_types):
+            return type_
+    if isinstance(sql_type, DateTime):
+        return pa.timestamp("us", tz="UTC" if sql_type.timezone else None)
+    if isinstance(sql_type, Numeric):
+        # Decimals without a precision do not fit a fixed-size decimal128
+        if sql_type.precision is None:
+            return pa.float64()
+        return pa.decimal128(sql_type.precision, sql_type.scale or 0)
+    raise TypeError(f"No Arrow type for {sql_type!r}")
+
+
+def arrow_schema(table):
+    """Arrow schema of a SQLAlchemy table."""
+    return pa.schema([(c.name, arrow_type(c.type)) for c in table.columns])
+
+
+def get_table(table):
+    """Resolve a table name or ORM mapping to a table of `Base.metadata`."""
+    if isinstance(table, str):
+        return Base.metadata.tables[table]
+    return getattr(table, "__table__", table)
+
+
+class ParquetMirror:
+    """Mirrors database tables to partitioned Parquet files.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): Database holding the MAG tables.
+        root (str or Path): Directory of the mirror.
+        chunksize (int): Rows fetched from the database per Parquet file.
+
+    """
+
+    def __init__(self, engine, root=MIRROR_DIR, chunksize=500000):
+        self.engine = engine
+        self.root = Path(root)
+        self.chunksize = chunksize
+
+    def path(self, table):
+        return self.root / get_table(table).name
+
+    def state(self, table):
+        """Mode, watermark and refresh time of a mirrored table, if any."""
+        path = self.path(table) / "_state.json"
+        if not path.exists():
+            return None
+        with open(path, "rt") as f:
+            return json.load(f)
+
+    def _write_state(self, directory, mode, watermark):
+        state = {
+            "mode": mode,
+            "watermark": watermark,
+            "refreshed": datetime.utcnow().isoformat(),
+        }
+        # A new file, not the hard link to the state of the current mirror
+        tmp = directory / "_state.json.tmp"
+        with open(tmp, "wt") as f:
+            json.dump(state, f)
+        os.replace(tmp, directory / "_state.json")
+        return state
+
+    def refresh(self, table, mode=None):
+        """Bring the mirror of a table up to date with the database.
+
+        Args:
+            table (str, ORM class or Table): Table to mirror.
+            mode (str): "pk", "year" or "full". Defaults to the mode of the
+                last refresh, "year" for tables with a year column and "pk"
+                otherwise.
+
+        Returns:
+            (int) Number of rows fetched.
+
+        """
+        table = get_table(table)
+        state = self.state(table)
+        if mode is None:
+            mode = state["mode"] if state else default_mode(table)
+        if mode == "year" and "year" not in table.columns:
+            raise ValueError(f"{table.name} has no year column")
+        if mode not in ("pk", "year", "full"):
+            raise ValueError(f"Unknown refresh mode: {mode}")
+        if state is None or state["mode"] != mode:
+            mode_state, watermark = "full", None
+        else:
+            mode_state, watermark = mode, state["watermark"]
+
+        path = self.path(table)
+        staging = path.with_name(f".{path.name}.staging")
+        shutil.rmtree(staging, ignore_errors=True)
+        if mode_state == "full" or not path.exists():
+            staging.mkdir(parents=True)
+        else:
+            shutil.copytree(path, staging, copy_function=os.link)
+        try:
+            if mode == "year":
+                n, watermark = self._refresh_years(table, staging, watermark)
+            else:
+                n, watermark = self._refresh_pk(table, staging, watermark)
+            self._write_state(staging, mode, watermark)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        _swap(staging, path)
+        logger.info(f"{table.name}: mirrored {n} rows ({mode})")
+        return n
+
+    def _chunks(self, table, query):
+        """Stream a query over all columns of a table as Arrow record batches."""
+        schema = arrow_schema(table)
+        with self.engine.connect() as conn:
+            result = conn.execution_options(stream_results=True).execute(query)
+            while True:
+                rows = result.fetchmany(self.chunksize)
+                if not rows:
+                    return
+                columns = list(zip(*rows))
+                yield pa.RecordBatch.from_arrays(
+                    [pa.array(col, type=f.type) for col, f in zip(columns, schema)],
+                    schema=schema,
+                )
+
+    def _write(self, directory, partition, batch):
+        directory = directory / partition
+        directory.mkdir(exist_ok=True)
+        n = len(list(directory.glob("*.parquet")))
+        pq.write_table(
+            pa.Table.from_batches([batch]), directory / f"part-{n:05d}.parquet"
+        )
+
+    def _refresh_pk(self, table, directory, watermark):
+        keys = list(table.primary_key.columns)
+        query = select([table]).order_by(*keys)
+        if watermark is not None:
+            query = query.where(tuple_(*keys) > tuple_(*watermark))
+        n = 0
+        for batch in self._chunks(table, query):
+            self._write(directory, ALL, batch)
+            n += batch.num_rows
+            last = batch.slice(batch.num_rows - 1).to_pydict()
+            watermark = [last[k.name][0] for k in keys]
+        return n, watermark
+
+    def _refresh_years(self, table, directory, watermark):
+        n = 0
+        query = select([table]).order_by(table.c.year)
+        if watermark is not None:
+            query = query.where(table.c.year >= watermark)
+            for path in directory.iterdir():
+                if path.is_dir() and path.name != NULL_YEAR and path.name >= watermark:
+                    shutil.rmtree(path)
+        else:
+            query = query.where(table.c.year.isnot(None))
+            # Rows without a year are only mirrored on a full refresh
+            null_query = select([table]).where(table.c.year.is_(None))
+            for batch in self._chunks(table, null_query):
+                self._write(directory, NULL_YEAR, batch)
+                n += batch.num_rows
+
+        for batch in self._chunks(table, query):
+            years = batch.column(batch.schema.get_field_index("year"))
+            for year in pc.unique(years).to_pylist():
+                self._write(directory, year, batch.filter(pc.equal(years, year)))
+                watermark = year if watermark is None else max(watermark, year)
+            n += batch.num_rows
+        return n, watermark
+
+    def files(self, table, years=None):
+        """Parquet files of a mirrored table, optionally for some years only."""
+        path = self.path(table)
+        if not path.exists():
+            raise FileNotFoundError(f"{get_table(table).name} is not mirrored")
+        partitions = sorted(p for p in path.iterdir() if p.is_dir())
+        if years is not None:
+            years = {str(y) for y in years}
+            partitions = [p for p in partitions if p.name in years]
+        return [str(f) for p in partitions for f in sorted(p.glob("*.parquet"))]
+
+    def read(self, table, columns=None, years=None, as_pandas=False):
+        """Read a mirrored table from disk.
+
+        Args:
+            table (str, ORM class or Table): Mirrored table.
+            columns (list of str): Columns to read. Defaults to all.
+            years (list): Years to read, for tables mirrored by year.
+            as_pandas (bool): Return a DataFrame instead of an Arrow table.
+
+        Returns:
+            (pyarrow.Table or pandas.DataFrame) The mirrored rows.
+
+        """
+        table = get_table(table)
+        files = self.files(table, years)
+        if files:
+            data = pq.ParquetDataset(files, memory_map=True).read(columns=columns)
+        else:
+            data = arrow_schema(table).empty_table()
+            if columns is not None:
+                data = data.select(columns)
+        return data.to_pandas() if as_pandas else data
+
+    def load(self, table, columns=None, years=None, as_pandas=True, mode=None):
+        """Refresh a table and read it, by default as a DataFrame."""
+        self.refresh(table, mode=mode)
+        return self.read(table, columns=columns, years=years, as_pandas=as_pandas)
+
+
+def _swap(staging, path):
+    """Replace a mirrored table's directory with its refreshed copy."""
+    old = path.with_name(f".{path.name}.old")
+    shutil.rmtree(old, ignore_errors=True)
+    if path.exists():
+        path.rename(old)
+    staging.rename(path)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def default_mode(table):
+    """Refresh by year when the table has a year column, else by primary key."""
+    return "year" if "year" in table.columns else "pk"
@@ -0,0 +1,293 @@
+"""Opt-in profiling of the SQL statements run through SQLAlchemy.
+
+`QueryProfile` listens to the cursor events of an engine (or of every engine)
+and aggregates the statements it sees, with their parameters and literals
+replaced by "?": how often each ran, for how long, how many rows it returned,
+and from which lines of our code.
+
+It also looks for N+1 loads: the same single-table lookup by foreign or
+primary key run again and again from one line, as when `Paper.authors`,
+`Paper.fields_of_study` or `Author.affiliation` are walked lazily in a loop.
+Lookups are matched to the `mag_orm` relationships whose remote columns they
+filter on, so a report names the relationship to eager load (or the loop to
+rewrite as one query).
+
+    with QueryProfile(engine) as profile:
+        for paper in session.query(Paper).limit(1000):
+            names = [a.author.name for a in paper.authors]
+    profile.log()
+    profile.save("query_profile.json")
+
+`log` writes the report to the `ai_research.mag.query_profile` logger, which
+`logging.yaml` sends to the console and to `query_profile.log`, with N+1
+loads as warnings.
+"""
+import json
+import logging
+import os
+import re
+import sys
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+
+import pandas as pd
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import class_mapper
+
+import ai_research
+from ai_research.mag import mag_orm
+
+logger = logging.getLogger(__name__)
+
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PLACEHOLDERS = re.compile(r"\?(?:\s*,\s*\?)+")
+_LOOKUP = re.compile(
+    r'^SELECT .+? FROM "?(\w+)"?(?: AS \w+)? WHERE (.+?)(?: ORDER BY .+)?$'
+)
+_COLUMN = r'"?(\w+)"?\."?(\w+)"?'
+_KEY_EQUALS = re.compile(rf"^\(?(?:\? = {_COLUMN}|{_COLUMN} = \?)\)?$")
+
+# Frames skipped when looking for the line that ran a statement, including
+# the functions SQLAlchemy generates with exec
+_LIBRARIES = (
+    os.path.dirname(sqlalchemy.__file__),
+    os.path.dirname(pd.__file__),
+    __file__,
+    "<frozen",
+    "<string>",
+)
+
+
+def normalise(statement):
+    """Statement with its parameters and literals replaced by "?"."""
+    statement = " ".join(statement.split())
+    return _PLACEHOLDERS.sub("?, ...", _PLACEHOLDER.sub("?", statement))
+
+
+def relationship_keys(classes=None):
+    """Relationships of the mapped classes, by the lookup they lazy load.
+
+    Args:
+        classes (list): Mapped classes. Defaults to those of `mag_orm`.
+
+    Returns:
+        (dict) (table name, frozenset of column names) to the names of the
+        relationships whose lazy load filters that table on those columns,
+        e.g. `("mag_paper_authors", {"paper_id"})` to `["Paper.authors"]`.
+
+    """
+    if classes is None:
+        classes = [
+            c
+            for c in vars(mag_orm).values()
+            if isinstance(c, type)
+            and issubclass(c, mag_orm.Base)
+            and c is not mag_orm.Base
+        ]
+    keys = defaultdict(list)
+    for cls in classes:
+        for rel in class_mapper(cls).relationships:
+            if rel.secondary is not None:
+                continue
+            remote = [r for _, r in rel.local_remote_pairs]
+            key = (remote[0].table.name, frozenset(c.name for c in remote))
+            keys[key].append(f"{cls.__name__}.{rel.key}")
+    return dict(keys)
+
+
+def key_lookup(statement):
+    """Table and columns of a single-table lookup by key, or None.
+
+    Args:
+        statement (str): Normalised statement.
+
+    """
+    match = _LOOKUP.match(statement)
+    if match is None or " JOIN " in statement:
+        return None
+    table, where = match.groups()
+    columns = set()
+    for condition in where.split(" AND "):
+        equals = _KEY_EQUALS.match(condition)
+        if equals is None:
+            return None
+        column_table, column = [g for g in equals.groups() if g is not None]
+        if column_table != table:
+            return None
+        columns.add(column)
+    return table, frozenset(columns)
+
+
+def call_site():
+    """First line outside SQLAlchemy, pandas and this module on the stack."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        path = frame.f_code.co_filename
+        if not path.startswith(_LIBRARIES):
+            try:
+                path = str(Path(path).relative_to(ai_research.project_dir))
+            except ValueError:
+                pass
+            return f"{path}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return "unknown"
+
+
+class StatementStats:
+    """Aggregated runs of one normalised statement."""
+
+    def __init__(self, statement):
+        self.statement = statement
+        self.count = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+        self.sites = Counter()
+        self.site_seconds = Counter()
+
+    def add(self, seconds, rows, site):
+        self.count += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.rows += max(rows, 0)
+        self.sites[site] += 1
+        self.site_seconds[site] += seconds
+
+    def to_dict(self, top_sites=5):
+        return {
+            "statement": self.statement,
+            "count": self.count,
+            "seconds": round(self.seconds, 6),
+            "mean_ms": round(1000 * self.seconds / self.count, 3),
+            "max_ms": round(1000 * self.max_seconds, 3),
+            "rows": self.rows,
+            "sites": dict(self.sites.most_common(top_sites)),
+        }
+
+
+class QueryProfile:
+    """Statement timings and N+1 loads of the queries run while it is active.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): Engine to profile. Every engine,
+            including those created while profiling, if None.
+        n_plus_one (int): Number of runs of a key lookup from the same line
+            reported as an N+1 load.
+        classes (list): Mapped classes whose relationships name the N+1
+            loads. Defaults to those of `mag_orm`.
+
+    """
+
+    def __init__(self, engine=None, n_plus_one=10, classes=None):
+        self.target = Engine if engine is None else engine
+        self.n_plus_one = n_plus_one
+        self.relationships = relationship_keys(classes)
+        self.statements = {}
+        self.seconds = 0.0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        event.listen(self.target, "before_cursor_execute", self._before)
+        event.listen(self.target, "after_cursor_execute", self._after)
+        event.listen(self.target, "handle_error", self._error)
+
+    def stop(self):
+        event.remove(self.target, "before_cursor_execute", self._before)
+        event.remove(self.target, "after_cursor_execute", self._after)
+        event.remove(self.target, "handle_error", self._error)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_profile_start", []).append(time.perf_counter())
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info["query_profile_start"].pop()
+        statement = normalise(statement)
+        if statement not in self.statements:
+            self.statements[statement] = StatementStats(statement)
+        self.statements[statement].add(seconds, cursor.rowcount, call_site())
+        self.seconds += seconds
+
+    def _error(self, context):
+        starts = context.connection.info.get("query_profile_start")
+        if starts:
+            starts.pop()
+
+    def n_plus_one_loads(self):
+        """Key lookups run at least `n_plus_one` times from the same line.
+
+        Returns:
+            (list of dict) The relationship (or table and columns) looked up,
+            the line, and the number and total seconds of the lookups, most
+            frequent first.
+
+        """
+        loads = []
+        for stats in self.statements.values():
+            lookup = key_lookup(stats.statement)
+            if lookup is None:
+                continue
+            names = self.relationships.get(lookup)
+            relationship = (
+                " or ".join(names)
+                if names
+                else f"{lookup[0]}({', '.join(sorted(lookup[1]))})"
+            )
+            for site, count in stats.sites.items():
+                if count >= self.n_plus_one:
+                    loads.append(
+                        {
+                            "relationship": relationship,
+                            "site": site,
+                            "count": count,
+                            "seconds": round(stats.site_seconds[site], 6),
+                        }
+                    )
+        return sorted(loads, key=lambda load: -load["count"])
+
+    def report(self, top=20):
+        """Totals, the `top` statements by total time and the N+1 loads."""
+        statements = sorted(self.statements.values(), key=lambda s: -s.seconds)
+        return {
+            "queries": sum(s.count for s in statements),
+            "statements": len(statements),
+            "seconds": round(self.seconds, 6),
+            "top": [s.to_dict() for s in statements[:top]],
+            "n_plus_one": self.n_plus_one_loads(),
+        }
+
+    def log(self, top=10):
+        """Log the report, with N+1 loads as warnings."""
+        report = self.report(top)
+        logger.info(
+            f"{report['queries']} queries of {report['statements']} statements "
+            f"in {report['seconds']:.3f}s"
+        )
+        for s in report["top"]:
+            site, _ = next(iter(s["sites"].items()))
+            logger.info(
+                f"{s['seconds']:.3f}s {s['count']}x {s['mean_ms']:.1f}ms "
+                f"{s['rows']} rows from {site}: {s['statement'][:200]}"
+            )
+        for load in report["n_plus_one"]:
+            logger.warning(
+                f"N+1: {load['relationship']} loaded {load['count']} times "
+                f"({load['seconds']:.3f}s) from {load['site']}"
+            )
+        return report
+
+    def save(self, path, top=100):
+        """Write the report to a JSON file."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wt") as f:
+            json.dump(self.report(top), f, indent=1)
+        return path
@@ -0,0 +1,689 @@
+"""Synthetic MAG data for tests and scale benchmarks.
+
+`SyntheticMag` generates every table harvested into or looked up for the MAG
+database, with the skewed distributions of the real data:
+
+- papers per year growing by `growth` a year, citations drawn from a power
+  law and references to earlier papers picked in proportion to their
+  citations (preferential attachment), as "[id, id, ...]" text;
+- authors per paper drawn from a Zipf law, and papers per author from a
+  Pareto law, each author with a home affiliation and a first name of known
+  gender;
+- a field of study hierarchy of `fos_levels`, where some fields have two
+  parents, and Zipf-popular fields tagged on papers with their root;
+- affiliations of a few large and many small countries, geocoded, with
+  their industry / non-industry type, and World Bank indicators;
+- journals, conferences and document vectors clustered by root field.
+
+The derived tables (metrics, `viz_*`, the `*_by_year` partitions) are left
+to the pipeline, and the API caches (`geocode_cache`, `blob_arrow*`) are
+left empty.
+
+Papers are generated in blocks of `BLOCK` papers, each with its own random
+generator seeded from `seed` and the block number, so the same seed always
+gives the same data, whichever blocks are generated or loaded together.
+Only per-paper arrays are held in memory, so 10M papers fit in a few GB.
+
+    synthetic = SyntheticMag(100000, seed=1)
+    counts = load_synthetic(engine, synthetic)
+"""
+import json
+import logging
+import math
+import string
+import time
+
+import numpy as np
+import pandas as pd
+
+from ai_research.mag.bulk_load import bulk_load, sort_by_dependency
+from ai_research.mag.doc_vectors import pack
+from ai_research.mag.mag_orm import (
+    Paper,
+    Author,
+    Affiliation,
+    AffiliationLocation,
+    AffiliationType,
+    AuthorAffiliation,
+    AuthorGender,
+    Conference,
+    CountryAssociation,
+    CountryDetails,
+    DocVector,
+    DocVectorPacked,
+    FieldOfStudy,
+    FirstNameGender,
+    FosHierarchy,
+    FosMetadata,
+    HighDimDocVector,
+    HighDimDocVectorPacked,
+    Journal,
+    OpenAccess,
+    PaperAuthor,
+    PaperFieldsOfStudy,
+    WorldBankGDP,
+    WorldBankResearchDevelopment,
+    WorldBankGovEducation,
+    WorldBankFemaleLaborForce,
+)
+
+logger = logging.getLogger(__name__)
+
+BLOCK = 10000
+
+# Random streams, so that adding draws to one table does not change the others
+VOCABULARY, COUNTRIES, FIELDS, AFFILIATIONS, AUTHORS, PAPERS, VENUES = range(7)
+
+# fmt: off
+FIRST_NAMES = {
+    "female": [
+        "Alice", "Ana", "Chen", "Elena", "Fatima", "Hana", "Ingrid", "Julia",
+        "Keiko", "Laura", "Maria", "Nadia", "Olga", "Priya", "Sara", "Yasmin",
+    ],
+    "male": [
+        "Ahmed", "Carlos", "David", "Erik", "Hiro", "Ivan", "James", "Jorge",
+        "Lukas", "Marco", "Mohammed", "Paul", "Rahul", "Sven", "Tom", "Wei",
+    ],
+}
+# fmt: on
+AFFILIATION_KINDS = [
+    # Name pattern, geocoded type, non-industry (1) or industry (0)
+    ("University of {}", "university", 1),
+    ("{} Institute of Technology", "university", 1),
+    ("{} General Hospital", "hospital", 1),
+    ("{} Research Centre", "point_of_interest", 1),
+    ("{} Labs Inc.", "establishment", 0),
+    ("{} Systems Ltd", "establishment", 0),
+]
+PUBLICATION_TYPES = ["Journal", "Conference", "Repository"]
+DOC_TYPES = {"Journal": "a", "Conference": "p", "Repository": "r"}
+
+
+def _rng(seed, stream, block=0):
+    return np.random.default_rng([seed, stream, block])
+
+
+def _words(rng, n, syllables=(2, 4)):
+    """Pronounceable made-up words."""
+    onsets = list("bcdfghklmnprstvz") + ["ch", "sh", "th", "br", "tr"]
+    vowels = ["a", "e", "i", "o", "u", "ai", "ou"]
+    lengths = rng.integers(syllables[0], syllables[1] + 1, n)
+    onset = rng.integers(0, len(onsets), lengths.sum())
+    vowel = rng.integers(0, len(vowels), lengths.sum())
+    parts = [onsets[o] + vowels[v] for o, v in zip(onset, vowel)]
+    ends = np.cumsum(lengths)
+    return ["".join(parts[e - k : e]) for e, k in zip(ends, lengths)]
+
+
+def _zipf_weights(rng, n, exponent=1.0):
+    """Zipf popularity of n items, in random order."""
+    return rng.permutation(1 / np.arange(1, n + 1) ** exponent)
+
+
+def _cdf(weights):
+    cdf = np.cumsum(weights, dtype=np.float64)
+    return cdf / cdf[-1]
+
+
+def _sample(rng, cdf, n):
+    """Draw n indices from a cumulative distribution."""
+    return np.minimum(np.searchsorted(cdf, rng.random(n), side="right"), len(cdf) - 1)
+
+
+def _unique_pairs(first, second):
+    """Drop repeated (first, second) pairs, keeping the order of the rest."""
+    if not len(first):
+        return first, second
+    key = first.astype(np.int64) * (int(second.max()) + 1) + second
+    _, index = np.unique(key, return_index=True)
+    index.sort()
+    return first[index], second[index]
+
+
+def _rank_within(groups):
+    """Position of each element within its run of equal, sorted groups."""
+    starts = np.r_[0, np.flatnonzero(np.diff(groups)) + 1]
+    return np.arange(len(groups)) - np.repeat(
+        starts, np.diff(np.r_[starts, len(groups)])
+    )
+
+
+class SyntheticMag:
+    """Reproducible synthetic MAG database.
+
+    Args:
+        n_papers (int): Number of papers.
+        seed (int): Seed of every random draw.
+        first_year (int): Year of the first papers.
+        last_year (int): Year of the last papers.
+        growth (float): Yearly growth of the number of papers.
+        fos_levels (tuple of int): Number of fields of study at each level of
+            the hierarchy, from the roots.
+        n_countries (int): Number of countries.
+        mean_references (float): Mean number of references of a paper.
+        vector_dim (int): Dimension of `high_dim_doc_vectors`.
+        abstract_words (int): Mean length of the abstracts. No abstracts if 0.
+
+    """
+
+    def __init__(
+        self,
+        n_papers,
+        seed=0,
+        first_year=2000,
+        last_year=2019,
+        growth=1.08,
+        fos_levels=(20, 300, 3000),
+        n_countries=40,
+        mean_references=10,
+        vector_dim=64,
+        abstract_words=0,
+    ):
+        self.n_papers = n_papers
+        self.seed = seed
+        self.mean_references = mean_references
+        self.vector_dim = vector_dim
+        self.abstract_words = abstract_words
+        self.n_authors = max(100, int(n_papers * 0.8))
+        self.n_affiliations = max(20, n_papers // 400)
+        self.n_journals = max(10, n_papers // 1000)
+        self.n_conferences = max(5, n_papers // 5000)
+
+        self.vocabulary = np.array(_words(_rng(seed, VOCABULARY), 5000))
+        self.word_cdf = _cdf(_zipf_weights(_rng(seed, VOCABULARY, 1), 5000))
+
+        self.years = np.arange(first_year, last_year + 1)
+        year_cdf = _cdf(growth ** np.arange(len(self.years)))
+        self.paper_years = self.years[
+            np.searchsorted(year_cdf, (np.arange(n_papers) + 0.5) / n_papers)
+        ]
+        rng = _rng(seed, PAPERS)
+        self.citations = np.floor(rng.pareto(1.5, n_papers) * 5).astype(np.int32)
+        # Cumulative attachment weight, for references to earlier papers
+        self.citation_weight = np.cumsum(self.citations + 1.0)
+
+        self._countries(n_countries)
+        self._fields(fos_levels)
+        self._affiliations()
+        self._authors()
+
+    def _countries(self, n):
+        rng = _rng(self.seed, COUNTRIES)
+        letters = string.ascii_uppercase
+        names = []
+        while len(names) < n:
+            words = [w.capitalize() + "ia" for w in _words(rng, n, (1, 3))]
+            names = list(dict.fromkeys(names + words))[:n]
+        self.countries = pd.DataFrame(
+            {
+                "alpha2Code": [letters[i // 26] + letters[i % 26] for i in range(n)],
+                "alpha3Code": [
+                    letters[i // 26] + letters[i % 26] + "X" for i in range(n)
+                ],
+                "name": names,
+                "google_name": names,
+                "wb_name": names,
+                "region": [f"Region {i % 5}" for i in range(n)],
+                "subregion": [f"Subregion {i % 15}" for i in range(n)],
+                "population": (rng.pareto(1.0, n) * 1e6 + 1e5).astype(np.int64),
+                "capital": [w.capitalize() for w in _words(rng, n)],
+            }
+        )
+        self.country_cdf = _cdf(_zipf_weights(rng, n, 1.2))
+        self.country_centres = np.c_[rng.uniform(-60, 70, n), rng.uniform(-180, 180, n)]
+
+    def _fields(self, levels):
+        rng = _rng(self.seed, FIELDS)
+        level = np.repeat(np.arange(len(levels)), levels)
+        ids = np.arange(1, len(level) + 1)
+        starts = np.r_[0, np.cumsum(levels)]
+        first_parent = np.zeros(len(ids), dtype=np.int64)
+        second_parent = np.zeros(len(ids), dtype=np.int64)
+        root = ids.copy()
+        for k in range(1, len(levels)):
+            members = slice(starts[k], starts[k + 1])
+            parents = ids[starts[k - 1] : starts[k]]
+            first_parent[members] = rng.choice(parents, levels[k])
+            extra = rng.random(levels[k]) < 0.1
+            second_parent[members] = np.where(extra, rng.choice(parents, levels[k]), 0)
+            root[members] = root[first_parent[members] - 1]
+        second_parent[second_parent == first_parent] = 0
+        names = _words(rng, len(ids))
+        self.fields = pd.DataFrame(
+            {
+                "id": ids,
+                "name": [
+                    f"{n} {'studies' if k == 0 else 'theory'}"
+                    for n, k in zip(names, level)
+                ],
+                "level": level,
+                "first_parent": first_parent,
+                "second_parent": second_parent,
+                "root": root,
+            }
+        )
+        # Papers are tagged with fields below the roots, and with their roots
+        tagged = ids[level > 0] if len(levels) > 1 else ids
+        self.tagged_fields = tagged
+        self.field_cdf = _cdf(_zipf_weights(rng, len(tagged), 1.1))
+        self.root_index = {r: i for i, r in enumerate(ids[level == 0])}
+        self.centres = rng.normal(size=(len(self.root_index), self.vector_dim))
+        self.centres_3d = rng.normal(size=(len(self.root_index), 3)) * 3
+
+    def _affiliations(self):
+        rng = _rng(self.seed, AFFILIATIONS)
+        n = self.n_affiliations
+        kinds = rng.choice(
+            len(AFFILIATION_KINDS), n, p=[0.4, 0.1, 0.15, 0.1, 0.15, 0.1]
+        )
+        places = _words(rng, n)
+        self.affiliation_names = [
+            AFFILIATION_KINDS[k][0].format(p.capitalize())
+            for k, p in zip(kinds, places)
+        ]
+        self.affiliation_kinds = kinds
+        self.affiliation_places = places
+        self.affiliation_country = _sample(rng, self.country_cdf, n)
+        self.affiliation_cdf = _cdf(rng.pareto(1.2, n) + 1)
+
+    def _authors(self):
+        rng = _rng(self.seed, AUTHORS)
+        n = self.n_authors
+        self.first_names = FIRST_NAMES["female"] + FIRST_NAMES["male"]
+        self.author_first = rng.integers(0, len(self.first_names), n)
+        self.author_last = rng.integers(0, len(self.vocabulary), n)
+        self.author_cdf = _cdf(rng.pareto(1.3, n) + 1)
+        self.author_home = _sample(rng, self.affiliation_cdf, n)
+
+    # Tables that do not depend on the papers
+
+    def country_tables(self):
+        """Country details and World Bank indicators, by mapping."""
+        rng = _rng(self.seed, COUNTRIES, 1)
+        countries = self.countries
+        n, years = len(countries), self.years
+        yearly = pd.DataFrame(
+            {
+                "country": np.repeat(countries.wb_name.values, len(years)),
+                "year": np.tile(years.astype(str), n),
+            }
+        )
+
+        def indicator(low, high):
+            level = np.repeat(rng.uniform(low, high, n), len(years))
+            return yearly.assign(
+                indicator=level * rng.normal(1, 0.05, len(yearly)).clip(0.5)
+            )
+
+        gdp = yearly.assign(
+            indicator=np.repeat(rng.lognormal(25, 1.5, n), len(years))
+            * np.tile(1.03 ** np.arange(len(years)), n)
+        )
+        return {
+            CountryDetails: countries,
+            CountryAssociation: pd.DataFrame(
+                {
+                    "wb_country": countries.wb_name,
+                    "google_country": countries.google_name,
+                }
+            ),
+            WorldBankGDP: gdp,
+            WorldBankResearchDevelopment: indicator(0.2, 4),
+            WorldBankGovEducation: indicator(2, 7),
+            WorldBankFemaleLaborForce: indicator(20, 50),
+        }
+
+    def field_tables(self):
+        """Fields of study, their hierarchy and levels, by mapping."""
+        fields = self.fields
+        children = {}
+        for column in ("first_parent", "second_parent"):
+            linked = fields[fields[column] > 0]
+            for parent, child in zip(linked[column], linked.id):
+                children.setdefault(parent, []).append(int(child))
+        parents = [
+            [int(p) for p in pair if p] or None
+            for pair in zip(fields.first_parent, fields.second_parent)
+        ]
+        return {
+            FieldOfStudy: fields[["id", "name"]],
+            FosHierarchy: pd.DataFrame(
+                {
+                    "id": fields.id,
+                    "parent_id": parents,
+                    "child_id": [
+                        sorted(children.get(i, [])) or None for i in fields.id
+                    ],
+                }
+            ),
+            FosMetadata: pd.DataFrame({"id": fields.id, "level": fields.level}),
+        }
+
+    def affiliation_tables(self):
+        """Affiliations, their locations and types, by mapping."""
+        rng = _rng(self.seed, AFFILIATIONS, 1)
+        n = self.n_affiliations
+        ids = np.arange(1, n + 1)
+        kinds = [AFFILIATION_KINDS[k] for k in self.affiliation_kinds]
+        country = self.countries.iloc[self.affiliation_country]
+        towns = [w.capitalize() for w in _words(rng, n)]
+        centre = self.country_centres[self.affiliation_country]
+        places = pd.DataFrame(
+            {
+                "id": [f"place{i:08d}" for i in ids],
+                "affiliation_id": ids,
+                "lat": centre[:, 0] + rng.normal(0, 2, n),
+                "lng": centre[:, 1] + rng.normal(0, 2, n),
+                "address": [f"{t}, {c}" for t, c in zip(towns, country.google_name)],
+                "name": self.affiliation_names,
+                "types": [json.dumps([kind[1], "establishment"]) for kind in kinds],
+                "website": [
+                    f"https://www.{p}.example" for p in self.affiliation_places
+                ],
+                "postal_town": towns,
+                "administrative_area_level_2": towns,
+                "administrative_area_level_1": [
+                    f"{c} Province {i % 7}" for i, c in enumerate(country.google_name)
+                ],
+                "country": country.google_name.values,
+            }
+        )
+        return {
+            Affiliation: pd.DataFrame(
+                {"id": ids, "affiliation": self.affiliation_names}
+            ),
+            AffiliationLocation: places,
+            AffiliationType: pd.DataFrame(
+                {"id": ids, "type": [kind[2] for kind in kinds]}
+            ),
+        }
+
+    def author_tables(self):
+        """Authors and the genders of their first names, by mapping."""
+        rng = _rng(self.seed, AUTHORS, 1)
+        n = self.n_authors
+        n_female = len(FIRST_NAMES["female"])
+        genders = np.where(
+            np.arange(len(self.first_names)) < n_female, "female", "male"
+        )
+        samples = rng.integers(100, 100000, len(self.first_names))
+        probability = rng.uniform(0.6, 1.0, len(self.first_names)).round(2)
+        first = np.array(self.first_names)[self.author_first]
+        names = [
+            f"{f} {w.capitalize()}"
+            for f, w in zip(first, self.vocabulary[self.author_last])
+        ]
+        # Some authors only have initials, and no inferred gender
+        known = rng.random(n) < 0.85
+        return {
+            Author: pd.DataFrame({"id": np.arange(1, n + 1), "name": names}),
+            FirstNameGender: pd.DataFrame(
+                {
+                    "first_name": self.first_names,
+                    "gender": genders,
+                    "samples": samples,
+                    "probability": probability,
+                }
+            ),
+            AuthorGender: pd.DataFrame(
+                {
+                    "id": np.arange(1, n + 1)[known],
+                    "full_name": np.array(names)[known],
+                    "first_name": first[known],
+                    "gender": genders[self.author_first][known],
+                    "samples": samples[self.author_first][known],
+                    "probability": probability[self.author_first][known],
+                }
+            ),
+        }
+
+    def venue_tables(self):
+        """Open access flags of the journals."""
+        rng = _rng(self.seed, VENUES)
+        return {
+            OpenAccess: pd.DataFrame(
+                {
+                    "id": np.arange(1, self.n_journals + 1),
+                    "open_access": (rng.random(self.n_journals) < 0.3).astype(int),
+                }
+            )
+        }
+
+    def fixed_tables(self):
+        """Every table that does not depend on the papers, by mapping."""
+        tables = {}
+        for part in (
+            self.country_tables,
+            self.field_tables,
+            self.affiliation_tables,
+            self.author_tables,
+            self.venue_tables,
+        ):
+            tables.update(part())
+        return tables
+
+    # Papers and the tables linked to them
+
+    @property
+    def n_blocks(self):
+        return -(-self.n_papers // BLOCK)
+
+    def _titles(self, rng, n):
+        lengths = rng.integers(5, 13, n)
+        words = self.vocabulary[_sample(rng, self.word_cdf, lengths.sum())]
+        ends = np.cumsum(lengths)
+        titles = [
+            " ".join(words[e - k : e]).capitalize() for e, k in zip(ends, lengths)
+        ]
+        # Preprints and their published versions share a title
+        for i in np.flatnonzero(rng.random(n) < 0.01):
+            titles[i] = titles[rng.integers(0, n)]
+        return titles
+
+    def _references(self, rng, ids):
+        index = ids - 1
+        counts = np.minimum(rng.poisson(self.mean_references, len(ids)), index)
+        citing = np.repeat(index, counts)
+        citing = citing[citing > 0]
+        limit = self.citation_weight[citing - 1]
+        cited = np.searchsorted(self.citation_weight, rng.random(len(citing)) * limit)
+        citing, cited = _unique_pairs(citing, cited)
+        references = [None] * len(ids)
+        groups = np.split(cited + 1, np.flatnonzero(np.diff(citing)) + 1)
+        for paper, group in zip(np.unique(citing), groups):
+            references[paper - index[0]] = "[" + ", ".join(map(str, group)) + "]"
+        return references
+
+    def _paper_fields(self, rng, ids):
+        counts = 1 + np.minimum(rng.poisson(1.5, len(ids)), 6)
+        paper_ids = np.repeat(ids, counts)
+        fos = self.tagged_fields[_sample(rng, self.field_cdf, len(paper_ids))]
+        first = np.r_[0, np.cumsum(counts)[:-1]]
+        roots = self.fields.root.values[fos[first] - 1]
+        paper_ids, fos = _unique_pairs(
+            np.r_[paper_ids, ids], np.r_[fos, roots].astype(np.int64)
+        )
+        return paper_ids, fos, roots
+
+    def _paper_authors(self, rng, ids):
+        counts = np.minimum(rng.zipf(2.2, len(ids)), 100)
+        paper_ids, author_index = _unique_pairs(
+            np.repeat(ids, counts), _sample(rng, self.author_cdf, counts.sum())
+        )
+        order = _rank_within(paper_ids) + 1
+        affiliations = self.author_home[author_index]
+        moved = rng.random(len(paper_ids)) < 0.1
+        affiliations[moved] = _sample(rng, self.affiliation_cdf, moved.sum())
+        # Some authors also give a second affiliation
+        second = rng.random(len(paper_ids)) < 0.05
+        links = pd.DataFrame(
+            {
+                "paper_id": np.r_[paper_ids, paper_ids[second]],
+                "author_id": np.r_[author_index, author_index[second]] + 1,
+                "affiliation_id": np.r_[
+                    affiliations, _sample(rng, self.affiliation_cdf, second.sum())
+                ]
+                + 1,
+            }
+        )
+        authors = pd.DataFrame(
+            {"paper_id": paper_ids, "author_id": author_index + 1, "order": order}
+        )
+        return authors, links.drop_duplicates()
+
+    def _vectors(self, rng, ids, roots):
+        centre = np.array([self.root_index[r] for r in roots])
+        vectors = self.centres[centre] + rng.normal(0, 0.7, (len(ids), self.vector_dim))
+        vectors_3d = self.centres_3d[centre] + rng.normal(0, 1, (len(ids), 3))
+        vectors = vectors.astype(np.float32)
+        vectors_3d = vectors_3d.astype(np.float32)
+        citations = self.citations[ids - 1]
+        return {
+            HighDimDocVector: pd.DataFrame(
+                {"id": ids, "vector": [v.tolist() for v in vectors]}
+            ),
+            HighDimDocVectorPacked: pd.DataFrame(
+                {"id": ids, "vector": [pack(v) for v in vectors]}
+            ),
+            DocVector: pd.DataFrame(
+                {
+                    "id": ids,
+                    "vector_3d": [v.tolist() for v in vectors_3d],
+                    "citations": citations,
+                }
+            ),
+            DocVectorPacked: pd.DataFrame(
+                {
+                    "id": ids,
+                    "vector_3d": [pack(v) for v in vectors_3d],
+                    "citations": citations,
+                }
+            ),
+        }
+
+    def _venues(self, rng, ids, types):
+        journal = types == "Journal"
+        conference = types == "Conference"
+        journal_ids = np.minimum(rng.zipf(1.5, journal.sum()), self.n_journals)
+        conference_ids = np.minimum(rng.zipf(1.5, conference.sum()), self.n_conferences)
+        return {
+            Journal: pd.DataFrame(
+                {
+                    "id": journal_ids,
+                    "journal_name": [f"Journal of topic {i}" for i in journal_ids],
+                    "paper_id": ids[journal],
+                }
+            ),
+            Conference: pd.DataFrame(
+                {
+                    "id": conference_ids,
+                    "conference_name": [f"Conference {i}" for i in conference_ids],
+                    "paper_id": ids[conference],
+                }
+            ),
+        }
+
+    def paper_block(self, block):
+        """The papers of one block and the rows linked to them, by mapping."""
+        rng = _rng(self.seed, PAPERS, block + 1)
+        start = block * BLOCK
+        ids = np.arange(start, min(start + BLOCK, self.n_papers)) + 1
+        n = len(ids)
+        years = self.paper_years[ids - 1]
+        days = rng.integers(0, 365, n)
+        dates = (years - 1970).astype("datetime64[Y]").astype("datetime64[D]") + days
+        types = np.array(PUBLICATION_TYPES)[rng.choice(3, n, p=[0.6, 0.25, 0.15])]
+        titles = self._titles(rng, n)
+        abstracts = None
+        if self.abstract_words:
+            # Sentences of about 8 words, at least one per abstract
+            sentences = math.ceil(self.abstract_words / 8)
+            abstracts = self._titles(rng, n * sentences)
+            abstracts = [
+                ". ".join(abstracts[i : i + sentences])
+                for i in range(0, len(abstracts), sentences)
+            ]
+        papers = pd.DataFrame(
+            {
+                "id": ids,
+                "prob": rng.uniform(0.8, 1, n).round(4),
+                "title": [t.lower() for t in titles],
+                "publication_type": types,
+                "year": years.astype(str),
+                "date": dates.astype(str),
+                "citations": self.citations[ids - 1],
+                "original_title": titles,
+                "references": self._references(rng, ids),
+                "doi": [f"10.{1000 + i % 9000}/synthetic.{i}" for i in ids],
+                "publisher": [f"Publisher {i}" for i in rng.zipf(2.0, n).clip(max=500)],
+                "bibtex_doc_type": [DOC_TYPES[t] for t in types],
+                "abstract": abstracts,
+                "source": [
+                    json.dumps([f"https://papers.synthetic.example/{i}"]) for i in ids
+                ],
+            }
+        )
+        fos_paper_ids, fos, roots = self._paper_fields(rng, ids)
+        authors, links = self._paper_authors(rng, ids)
+        tables = {
+            Paper: papers,
+            PaperFieldsOfStudy: pd.DataFrame(
+                {"paper_id": fos_paper_ids, "field_of_study_id": fos}
+            ),
+            PaperAuthor: authors,
+            AuthorAffiliation: links,
+        }
+        tables.update(self._venues(rng, ids, types))
+        tables.update(self._vectors(rng, ids, roots))
+        return tables
+
+    def paper_blocks(self, start=0, stop=None):
+        """Yield the tables of the blocks start to stop, as `paper_block`."""
+        stop = self.n_blocks if stop is None else min(stop, self.n_blocks)
+        for block in range(start, stop):
+            yield self.paper_block(block)
+
+
+def _records(df):
+    return df.astype(object).where(df.notnull(), None).to_dict(orient="records")
+
+
+def load_synthetic(engine, synthetic, blocks_per_batch=10, on_conflict="update"):
+    """Load a synthetic database with `bulk_load`, parents first.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): Database with the MAG tables.
+        synthetic (SyntheticMag): Data to load.
+        blocks_per_batch (int): Number of paper blocks loaded together.
+        on_conflict (str): See `bulk_load`.
+
+    Returns:
+        (dict) Table name to the number of rows loaded and the seconds spent
+        generating and loading them.
+
+    """
+    stats = {}
+
+    def load(tables, seconds):
+        for mapping in sort_by_dependency(tables):
+            frame = tables[mapping]
+            start = time.perf_counter()
+            n = bulk_load(engine, mapping, _records(frame), on_conflict=on_conflict)
+            entry = stats.setdefault(mapping.__tablename__, {"rows": 0, "seconds": 0})
+            entry["rows"] += n
+            entry["seconds"] += time.perf_counter() - start + seconds / len(tables)
+
+    start = time.perf_counter()
+    load(synthetic.fixed_tables(), time.perf_counter() - start)
+    for first in range(0, synthetic.n_blocks, blocks_per_batch):
+        start = time.perf_counter()
+        blocks = list(synthetic.paper_blocks(first, first + blocks_per_batch))
+        tables = {
+            mapping: pd.concat([block[mapping] for block in blocks], ignore_index=True)
+            for mapping in blocks[0]
+        }
+        load(tables, time.perf_counter() - start)
+        logger.info(
+            f"Loaded {first * BLOCK + sum(len(b[Paper]) for b in blocks)} papers"
+        )
+    return stats
@@ -0,0 +1,228 @@
+"""Year partitioned copies of the papers and their link tables.
+
+`mag_papers` is referenced by foreign keys on its `id`, so it cannot be range
+partitioned in place (the partition key has to be part of every unique key,
+and Postgres does not partition on generated columns). Instead, the papers
+with a known year and their fields of study, authors and affiliations are
+copied to the `*_by_year` tables of `mag_orm`, which are partitioned by
+`year_int` with one partition per year. Queries comparing `year_int` with
+constants, e.g. `PaperByYear.in_years(2015, 2018)`, only scan the partitions
+of those years.
+
+`sync_year_partitions` rebuilds a year's partitions with INSERT ... SELECT on
+the server, and only for the years whose rows changed since the last sync.
+`migrate` adds the typed year and date columns to a database created before
+they existed.
+"""
+import logging
+import os
+
+from dotenv import find_dotenv, load_dotenv
+from sqlalchemy import create_engine, func, insert, inspect, select, text
+from sqlalchemy.schema import CreateColumn
+
+from ai_research.mag.mag_orm import (
+    Base,
+    Paper,
+    PaperFieldsOfStudy,
+    PaperAuthor,
+    AuthorAffiliation,
+    PaperByYear,
+    PaperFieldsOfStudyByYear,
+    PaperAuthorByYear,
+    AuthorAffiliationByYear,
+)
+from ai_research.transformers.partitions import (
+    PartitionState,
+    query_fingerprints,
+    STATE_DIR,
+)
+
+logger = logging.getLogger(__name__)
+
+papers = Paper.__table__
+paper_fos = PaperFieldsOfStudy.__table__
+paper_authors = PaperAuthor.__table__
+author_aff = AuthorAffiliation.__table__
+
+PARTITIONED = [
+    PaperByYear,
+    PaperFieldsOfStudyByYear,
+    PaperAuthorByYear,
+    AuthorAffiliationByYear,
+]
+
+
+def source_queries():
+    """Query selecting the rows of each partitioned table from its source.
+
+    Returns:
+        (dict): Partitioned table to a select of its columns, in order.
+
+    """
+
+    def linked(table, *columns):
+        return select([papers.c.year_int] + [table.c[c] for c in columns]).select_from(
+            table.join(papers, papers.c.id == table.c.paper_id)
+        )
+
+    queries = {
+        PaperByYear.__table__: select(
+            [papers.c[c.name] for c in PaperByYear.__table__.columns]
+        ),
+        PaperFieldsOfStudyByYear.__table__: linked(
+            paper_fos, "paper_id", "field_of_study_id"
+        ),
+        PaperAuthorByYear.__table__: linked(
+            paper_authors, "paper_id", "author_id", "order"
+        ),
+        AuthorAffiliationByYear.__table__: linked(
+            author_aff, "id", "affiliation_id", "author_id", "paper_id"
+        ),
+    }
+    return {
+        table: query.where(papers.c.year_int.isnot(None))
+        for table, query in queries.items()
+    }
+
+
+def migrate(engine):
+    """Add the generated columns, their indexes and the partitioned tables.
+
+    Existing tables are altered in place; Postgres computes the generated
+    columns of the rows already there.
+
+    Returns:
+        (list): Names of the added columns, as `table.column`.
+
+    """
+    inspector = inspect(engine)
+    existing = set(inspector.get_table_names())
+    added = []
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing:
+                continue
+            columns = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.computed is None or column.name in columns:
+                    continue
+                ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+                added.append(f"{table.name}.{column.name}")
+            # Not the inspector, which leaves out expression indexes
+            indexes = {
+                name
+                for name, in conn.execute(
+                    text("SELECT indexname FROM pg_indexes WHERE tablename = :name"),
+                    name=table.name,
+                )
+            }
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(conn)
+    Base.metadata.create_all(engine, tables=[m.__table__ for m in PARTITIONED])
+    for name in added:
+        logger.info(f"Added {name}")
+    return added
+
+
+def ensure_partition(conn, table, year):
+    """Create the partition of a year if it does not exist yet.
+
+    Returns:
+        (str): Name of the partition.
+
+    """
+    name = f"{table.name}_{year}"
+    if conn.execute(select([func.to_regclass(name)])).scalar() is None:
+        conn.execute(
+            f"CREATE TABLE {name} PARTITION OF {table.name} "
+            f"FOR VALUES FROM ({year}) TO ({year + 1})"
+        )
+    return name
+
+
+def year_fingerprints(engine, years=None):
+    """Row count and hash of the source rows of every year.
+
+    Args:
+        years (list of int): Only these years. All years if None.
+
+    Returns:
+        (dict): Year to a fingerprint of its rows in all the source tables.
+
+    """
+    keys = {}
+    for table, query in source_queries().items():
+        if years is not None:
+            query = query.where(papers.c.year_int.in_([int(y) for y in years]))
+        for year, key in query_fingerprints(engine, query).items():
+            keys.setdefault(year, []).append(f"{table.name}:{key}")
+    return {year: ",".join(key) for year, key in keys.items()}
+
+
+def sync_year_partitions(engine, years=None, force=False, state_dir=STATE_DIR):
+    """Copy the papers and their links to the partitioned tables.
+
+    A year is copied again only if the fingerprint of its source rows changed
+    since the last sync. Each year is replaced in one transaction, so readers
+    never see a partly copied year.
+
+    Args:
+        years (list of int): Only sync these years. All years if None.
+        force (bool): Copy every year, even the unchanged ones.
+        state_dir (str or Path): Where the fingerprints are kept.
+
+    Returns:
+        (list): The years that were copied or emptied.
+
+    """
+    state = PartitionState("year_partitions", state_dir)
+    keys = year_fingerprints(engine, years)
+    queries = source_queries()
+
+    def replace_year(year, copy):
+        with engine.begin() as conn:
+            for table, query in queries.items():
+                partition = ensure_partition(conn, table, year)
+                conn.execute(f"TRUNCATE {partition}")
+                if copy:
+                    conn.execute(
+                        insert(table).from_select(
+                            [c.name for c in table.columns],
+                            query.where(papers.c.year_int == year),
+                        )
+                    )
+
+    updated = []
+    for year in sorted(keys):
+        if not force and not state.changed(year, keys[year]):
+            continue
+        replace_year(year, copy=True)
+        state.update(year, keys[year])
+        updated.append(year)
+        logger.info(f"Synced the partitions of {year}")
+
+    # Years that no longer have any paper
+    stale = set(state.fingerprints) - {str(y) for y in keys}
+    if years is not None:
+        stale &= {str(y) for y in years}
+    for year in sorted(stale):
+        replace_year(int(year), copy=False)
+        del state.fingerprints[year]
+        state.save()
+        updated.append(int(year))
+    return updated
+
+
+def main():
+    engine = create_engine(os.getenv("postgresdb"))
+    migrate(engine)
+    years = sync_year_partitions(engine)
+    logger.info(f"Synced {len(years)} years")
+
+
+if __name__ == "__main__":
+    load_dotenv(find_dotenv())
+    main()
@@ -1,22 +1,303 @@
 # -*- coding: utf-8 -*-
 import logging
+import os
+from functools import partial
 from dotenv import find_dotenv, load_dotenv
+from sqlalchemy import create_engine, select
 # Important to import the module
 # This configures logging, file-paths, model config variables
 import ai_research
-
+from ai_research.mag.bulk_load import bulk_load_files, find_sources
+from ai_research.mag.mag_orm import (
+    Paper,
+    PaperFieldsOfStudy,
+    FieldOfStudy,
+    FosHierarchy,
+    FosMetadata,
+    AuthorAffiliation,
+    AffiliationLocation,
+    AuthorGender,
+    FilteredFos,
+    MetricCountryRCA,
+    ResearchDiversityCountry,
+    GenderDiversityCountry,
+    AllMetrics,
+)
+from ai_research.transformers import collaboration, diversity, rca, similarity
+from ai_research.transformers.collaboration import update_country_collaboration
+from ai_research.transformers.dag import Stage, run_dag, whole
+from ai_research.transformers.diversity import update_diversity
+from ai_research.transformers.fos_metrics import (
+    update_filtered_fos,
+    update_fos_frequency,
+)
+from ai_research.transformers.partitions import STATE_DIR
+from ai_research.transformers.rca import update_rca
+from ai_research.transformers.similarity import update_country_similarity
+from ai_research.visualisation import viz_tables
 
 logger = logging.getLogger(__name__)
 
+papers = Paper.__table__
+paper_fos = PaperFieldsOfStudy.__table__
+fields = FieldOfStudy.__table__
+author_aff = AuthorAffiliation.__table__
+locations = AffiliationLocation.__table__
+genders = AuthorGender.__table__
+
+
+def load_mag(engine, config):
+    """ Bulk loads the raw MAG harvest into the database.
+    """
+    input_dir = ai_research.project_dir / config["input_dir"]
+    sources = find_sources(input_dir)
+    if not sources:
+        logger.info(f"No MAG files found in {input_dir}")
+        return
+    counts = bulk_load_files(
+        engine,
+        sources,
+        batch_size=config["batch_size"],
+        on_conflict=config["on_conflict"],
+    )
+    logger.info(f"Loaded MAG tables: {counts}")
+
+
+def by_year(*columns, links=papers):
+    """Input of a stage partitioned by paper year.
+
+    Args:
+        columns: Columns whose changes trigger a recompute.
+        links: `mag_papers`, or a join of other tables with it.
+    """
+    return (
+        select([papers.c.year_int] + list(columns))
+        .select_from(links)
+        .where(papers.c.year_int.isnot(None))
+    )
+
+
+def metric_by_year(table, *columns):
+    """Input of a stage partitioned by the year of a metric table."""
+    return select([table.c.year_int] + [table.c[c] for c in columns])
+
+
+def stages(config, state_dir=STATE_DIR):
+    """The DAG of derived tables.
+
+    Args:
+        config (dict): The `derived_tables` section of `model_config.yaml`.
+        state_dir (str or Path): Where the stages that keep their own input
+            fingerprints store them.
+
+    Returns:
+        (list of Stage)
+
+    """
+    countries = author_aff.join(
+        locations, locations.c.affiliation_id == author_aff.c.affiliation_id
+    ).join(papers, papers.c.id == author_aff.c.paper_id)
+    affiliations = author_aff.join(papers, papers.c.id == author_aff.c.paper_id)
+    fos = paper_fos.join(papers, papers.c.id == paper_fos.c.paper_id)
+
+    year_countries = by_year(
+        author_aff.c.paper_id, locations.c.country, links=countries
+    )
+    year_affiliations = by_year(
+        author_aff.c.paper_id, author_aff.c.affiliation_id, links=affiliations
+    )
+    year_genders = by_year(
+        author_aff.c.paper_id,
+        genders.c.gender,
+        links=affiliations.outerjoin(genders, genders.c.id == author_aff.c.author_id),
+    )
+    year_fos = by_year(paper_fos.c.paper_id, paper_fos.c.field_of_study_id, links=fos)
+    year_citations = by_year(
+        paper_fos.c.paper_id,
+        paper_fos.c.field_of_study_id,
+        papers.c.citations,
+        links=fos,
+    )
+    names = whole(fields.c.id, fields.c.name)
+    hierarchy = whole(FosHierarchy.__table__)
+    levels = whole(FosMetadata.id, FosMetadata.level).where(
+        FosMetadata.level.isnot(None)
+    )
+
+    return [
+        Stage(
+            "fos_frequency",
+            update_fos_frequency,
+            [select([paper_fos.c.field_of_study_id, paper_fos.c.paper_id])],
+            ["mag_field_of_study_metadata"],
+        ),
+        Stage(
+            "filtered_fos",
+            update_filtered_fos,
+            [year_citations, hierarchy, levels],
+            ["mag_filtered_field_of_study"],
+            params={"min_papers": config["min_papers"]},
+        ),
+        Stage(
+            "rca_country",
+            partial(_update_rca, level="country", state_dir=state_dir),
+            [year_countries, year_fos],
+            ["rca_country"],
+            code=[rca],
+        ),
+        Stage(
+            "rca_affiliation",
+            partial(_update_rca, level="affiliation", state_dir=state_dir),
+            [year_affiliations, year_fos],
+            ["rca_affiliation"],
+            code=[rca],
+        ),
+        Stage(
+            "diversity",
+            partial(_update_diversity, state_dir=state_dir),
+            [year_countries, year_genders, year_fos],
+            ["research_diversity_country", "gender_diversity_country"],
+            code=[diversity],
+        ),
+        Stage(
+            "country_collaboration",
+            partial(_update_collaboration, state_dir=state_dir),
+            [year_countries],
+            ["country_collaboration"],
+            code=[collaboration],
+        ),
+        Stage(
+            "country_similarity",
+            partial(_update_similarity, state_dir=state_dir),
+            [year_countries, year_fos],
+            ["country_similarity"],
+            code=[similarity],
+        ),
+        Stage(
+            "all_metrics",
+            viz_tables.update_all_metrics,
+            [
+                metric_by_year(
+                    MetricCountryRCA.__table__, "entity", "field_of_study_id", "rca_sum"
+                ),
+                metric_by_year(
+                    ResearchDiversityCountry.__table__,
+                    "entity",
+                    "field_of_study_id",
+                    "shannon_diversity",
+                ),
+                metric_by_year(
+                    GenderDiversityCountry.__table__,
+                    "entity",
+                    "field_of_study_id",
+                    "female_share",
+                ),
+                names,
+            ],
+            ["viz_metrics_by_country"],
+        ),
+        Stage(
+            "outputs_metrics",
+            viz_tables.update_outputs_metrics,
+            [
+                year_countries,
+                year_citations,
+                metric_by_year(FilteredFos.__table__, "field_of_study_id"),
+                metric_by_year(
+                    AllMetrics.__table__,
+                    "country",
+                    "field_of_study_id",
+                    "shannon_diversity",
+                    "rca_sum",
+                    "female_share",
+                    "name",
+                ),
+                names,
+            ],
+            ["viz_metrics_and_outputs"],
+        ),
+        Stage(
+            "paper_year",
+            viz_tables.update_paper_year,
+            [by_year(papers.c.id)],
+            ["viz_paper_year"],
+        ),
+        Stage(
+            "paper_country",
+            viz_tables.update_paper_country,
+            [
+                select([locations.c.country, author_aff.c.paper_id])
+                .select_from(
+                    author_aff.join(
+                        locations,
+                        locations.c.affiliation_id == author_aff.c.affiliation_id,
+                    )
+                )
+                .where(locations.c.country.isnot(None))
+            ],
+            ["viz_paper_country"],
+            key_type=str,
+        ),
+        Stage(
+            "paper_topics",
+            viz_tables.update_paper_topics,
+            [
+                select([paper_fos.c.field_of_study_id, paper_fos.c.paper_id]),
+                select([fields.c.id, fields.c.name]),
+            ],
+            ["viz_paper_topics"],
+        ),
+        Stage(
+            "topics_grouped",
+            viz_tables.update_topics_grouped,
+            [
+                by_year(
+                    paper_fos.c.paper_id,
+                    fields.c.name,
+                    links=fos.join(
+                        fields, fields.c.id == paper_fos.c.field_of_study_id
+                    ),
+                )
+            ],
+            ["viz_topics_agg"],
+        ),
+    ]
+
+
+# The DAG has already found the partitions to recompute, so the updaters are
+# forced to rewrite them rather than check their own input fingerprints
+def _update_rca(engine, years, level, state_dir, **params):
+    update_rca(engine, level, years=years, force=True, state_dir=state_dir, **params)
+
+
+def _update_diversity(engine, years, state_dir, **params):
+    update_diversity(engine, years=years, force=True, state_dir=state_dir, **params)
+
+
+def _update_collaboration(engine, years, state_dir, **params):
+    update_country_collaboration(
+        engine, years=years, force=True, state_dir=state_dir, **params
+    )
+
+
+def _update_similarity(engine, years, state_dir, **params):
+    update_country_similarity(
+        engine, years=years, force=True, state_dir=state_dir, **params
+    )
+
+
 def main():
     """ Runs data processing scripts to turn raw data from (../raw) into
         cleaned data ready to be analyzed (saved in ../processed).
     """
 
     config = ai_research.config
+    engine = create_engine(os.getenv("postgresdb"))
 
-    return
-
+    load_mag(engine, config["bulk_load"])
+    derived = config["derived_tables"]
+    updated = run_dag(engine, stages(derived), n_jobs=derived["n_jobs"])
+    logger.info(f"Recomputed partitions: {updated}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,288 @@
+"""Industry / non-industry classification of affiliations.
+
+An affiliation is non-industry (1) if its name contains one of the
+non-industry keywords and industry (0) otherwise. Names are normalised as for
+geocoding and matched on whole words; a keyword ending in "*" matches any
+word starting with it ("universit*").
+
+All keywords, with the abbreviations normalisation would expand, are
+compiled into one Aho-Corasick automaton. A batch of names is normalised as
+a single text and scanned once, and matches are mapped back to names from
+their end positions. Batches run in a process pool.
+
+After a keyword change only the affiliations matching an added or removed
+keyword (found with an automaton of the changed keywords alone) and those
+without a type yet are re-scored and written.
+
+    python ai_research/transformers/affiliation_type.py
+"""
+import json
+import logging
+import os
+import string
+import time
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import ahocorasick
+import numpy as np
+import pandas as pd
+from dotenv import find_dotenv, load_dotenv
+from sqlalchemy import create_engine, select
+
+import ai_research
+from ai_research.mag.bulk_load import bulk_load
+from ai_research.mag.geocode_affiliations import ABBREVIATIONS, normalise
+from ai_research.mag.mag_orm import Affiliation, AffiliationType
+
+logger = logging.getLogger(__name__)
+
+affiliations = Affiliation.__table__
+affiliation_type = AffiliationType.__table__
+
+RULES_PATH = (
+    ai_research.project_dir / "data" / "interim" / "affiliation_type_rules.json"
+)
+SEPARATOR = "\x00"
+
+# Everything but letters, digits and the separator becomes a space
+_SPACES = str.maketrans(
+    {
+        chr(i): " "
+        for i in range(128)
+        if chr(i) not in string.ascii_letters + string.digits
+    }
+)
+del _SPACES[ord(SEPARATOR)]
+
+_automata = {}
+
+
+def _variants(token, prefix=False):
+    """Spellings of a normalised token that `normalise` maps to it.
+
+    Returns:
+        (list of tuple) Spelling and whether it may be followed by more
+        letters.
+
+    """
+    if prefix:
+        return [(token, True)] + [
+            (short, False)
+            for short, full in ABBREVIATIONS.items()
+            if full.startswith(token) and not short.startswith(token)
+        ]
+    return [(token, False)] + [
+        (short, False) for short, full in ABBREVIATIONS.items() if full == token
+    ]
+
+
+def keyword_patterns(keyword):
+    """Space delimited patterns matching a keyword in normalised text.
+
+    Abbreviations are matched as their own patterns ("univ", "dept"), so the
+    text itself does not need them expanded.
+    """
+    tokens = normalise(keyword.rstrip("*"))
+    if not tokens:
+        return []
+    prefix = keyword.endswith("*")
+    patterns = [("", False)]
+    for i, token in enumerate(tokens):
+        last = i == len(tokens) - 1
+        patterns = [
+            (f"{pattern} {spelling}", open_)
+            for pattern, _ in patterns
+            for spelling, open_ in _variants(token, prefix and last)
+        ]
+    return [pattern if open_ else pattern + " " for pattern, open_ in patterns]
+
+
+def build_automaton(keywords):
+    """Aho-Corasick automaton of the patterns of the keywords."""
+    automaton = ahocorasick.Automaton()
+    for i, keyword in enumerate(keywords):
+        for pattern in keyword_patterns(keyword):
+            automaton.add_word(pattern, i)
+    automaton.make_automaton()
+    return automaton
+
+
+def _automaton(keywords):
+    # Built once per process and keyword list
+    key = tuple(keywords)
+    if key not in _automata:
+        _automata[key] = build_automaton(keywords)
+    return _automata[key]
+
+
+def normalise_batch(names):
+    """Normalise names as `normalise` does, without expanding abbreviations.
+
+    Returns:
+        text (str): " name " of every name, separated by SEPARATOR.
+        ends (numpy.ndarray): Position of the separator after each name.
+
+    """
+    text = SEPARATOR.join(name or "" for name in names)
+    text = unicodedata.normalize("NFKD", text).encode("ascii", errors="ignore")
+    text = text.decode("ascii").lower().replace("&", " and ").translate(_SPACES)
+    tokens = text.replace(SEPARATOR, f" {SEPARATOR} ").split()
+    text = " " + " ".join(tokens) + f" {SEPARATOR}"
+    ends = np.flatnonzero(np.frombuffer(text.encode("ascii"), dtype=np.uint8) == 0)
+    return text, ends
+
+
+def match_keywords(names, keywords):
+    """Keywords found in each name, with one scan of the whole batch.
+
+    Args:
+        names (list of str): Affiliation names.
+        keywords (list of str): Keywords, see the module docstring.
+
+    Returns:
+        name_idx, keyword_idx (numpy.ndarray): One (name, keyword) pair per
+        match, possibly repeated.
+
+    """
+    automaton = _automaton(keywords)
+    if not len(names) or not len(automaton):
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    text, ends = normalise_batch(names)
+    matches = list(automaton.iter(text))
+    end_positions = np.array([m[0] for m in matches], dtype=np.int64)
+    keyword_idx = np.array([m[1] for m in matches], dtype=np.int64)
+    return np.searchsorted(ends, end_positions), keyword_idx
+
+
+def _classify_batch(args):
+    names, keywords = args
+    name_idx, _ = match_keywords(names, keywords)
+    types = np.zeros(len(names), dtype=np.int64)
+    types[name_idx] = 1
+    return types
+
+
+def _touched_batch(args):
+    names, keywords = args
+    name_idx, _ = match_keywords(names, keywords)
+    touched = np.zeros(len(names), dtype=bool)
+    touched[name_idx] = True
+    return touched
+
+
+def _run(func, names, keywords, n_jobs, batch_size):
+    tasks = [
+        (names[i : i + batch_size], keywords) for i in range(0, len(names), batch_size)
+    ]
+    if not tasks:
+        return []
+    if n_jobs == 1 or len(tasks) == 1:
+        return list(map(func, tasks))
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        return list(pool.map(func, tasks))
+
+
+def classify(names, keywords, n_jobs=None, batch_size=20000):
+    """Type (1: non-industry, 0: industry) of every name."""
+    results = _run(_classify_batch, list(names), keywords, n_jobs, batch_size)
+    return np.concatenate(results) if results else np.empty(0, dtype=np.int64)
+
+
+def touched_by(names, keywords, n_jobs=None, batch_size=20000):
+    """Whether each name contains any of the keywords."""
+    results = _run(_touched_batch, list(names), keywords, n_jobs, batch_size)
+    return np.concatenate(results) if results else np.empty(0, dtype=bool)
+
+
+def read_affiliations(engine):
+    """id, affiliation and current type (NaN if none) of every affiliation."""
+    query = select(
+        [affiliations.c.id, affiliations.c.affiliation, affiliation_type.c.type]
+    ).select_from(
+        affiliations.outerjoin(
+            affiliation_type, affiliation_type.c.id == affiliations.c.id
+        )
+    )
+    return pd.read_sql(query, engine)
+
+
+def load_rules(path=RULES_PATH):
+    """Keywords of the last classification run, None if there was none."""
+    path = Path(path)
+    if not path.exists():
+        return None
+    with open(path, "rt") as f:
+        return json.load(f)["keywords"]
+
+
+def save_rules(keywords, path=RULES_PATH):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wt") as f:
+        json.dump({"keywords": sorted(keywords)}, f, indent=1)
+
+
+def update_affiliation_types(
+    engine, keywords, n_jobs=None, batch_size=20000, rules_path=RULES_PATH, force=False
+):
+    """Write `affiliation_type` for new affiliations and those a rule change hits.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): Database with `mag_affiliation`.
+        keywords (list of str): Non-industry keywords.
+        n_jobs (int): Worker processes. Defaults to the number of CPUs.
+        batch_size (int): Names scanned at a time.
+        rules_path (str or Path): Where the keywords of the last run are kept.
+        force (bool): Re-score every affiliation.
+
+    Returns:
+        (dict) Numbers of affiliations scored and changed, and the scoring
+        throughput in affiliations per second.
+
+    """
+    df = read_affiliations(engine)
+    df["affiliation"] = df.affiliation.fillna("")
+    previous = None if force else load_rules(rules_path)
+    if previous is None:
+        todo = np.ones(len(df), dtype=bool)
+    else:
+        changed_keywords = sorted(set(previous) ^ set(keywords))
+        todo = df.type.isnull().values
+        if changed_keywords:
+            todo |= touched_by(df.affiliation, changed_keywords, n_jobs, batch_size)
+        logger.info(f"Affiliation types: {len(changed_keywords)} keywords changed")
+
+    start = time.perf_counter()
+    scored = df[todo]
+    types = classify(scored.affiliation, list(keywords), n_jobs, batch_size)
+    elapsed = time.perf_counter() - start
+
+    changed = scored.type.values != types
+    rows = pd.DataFrame({"id": scored.id.values[changed], "type": types[changed]})
+    bulk_load(engine, AffiliationType, rows.to_dict(orient="records"))
+    save_rules(keywords, rules_path)
+    stats = {
+        "scored": len(scored),
+        "changed": len(rows),
+        "per_second": len(scored) / elapsed if elapsed > 0 else float("inf"),
+    }
+    logger.info(
+        f"Affiliation types: scored {stats['scored']} "
+        f"({stats['per_second']:.0f}/s), {stats['changed']} changed"
+    )
+    return stats
+
+
+def main():
+    engine = create_engine(os.getenv("postgresdb"))
+    update_affiliation_types(
+        engine, ai_research.config["affiliation_type"]["non_industry"]
+    )
+
+
+if __name__ == "__main__":
+    load_dotenv(find_dotenv())
+    main()
@@ -0,0 +1,366 @@
+"""Academia / industry career timelines of authors.
+
+Every author - paper - affiliation row with a known year and affiliation type
+becomes an event. Events are collapsed to one state per author and year, the
+bitwise OR of ACADEMIA (non-industry affiliations) and INDUSTRY, so a year
+with both is ACADEMIA | INDUSTRY. Timelines are stored CSR-like: the states
+and years of author_ids[i] are states[indptr[i]:indptr[i + 1]], sorted by year.
+
+Spells (runs of years in the same state), transitions between them and
+cohort statistics are computed with segment operations on these arrays, not
+per author. Years come from `mag_papers.year`, or the start of `date` when the
+year is missing.
+
+Timelines are saved as `.npy` arrays with the ids of the papers they include,
+and `update_timelines` only reads the papers ingested since. Collapsing is
+idempotent, so re-reading a paper is harmless. Rebuild after affiliation
+types change.
+
+    python ai_research/transformers/career_trajectory.py
+"""
+import json
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from dotenv import find_dotenv, load_dotenv
+from sqlalchemy import any_, create_engine, literal, select
+from sqlalchemy.dialects.postgresql import ARRAY, BIGINT
+
+import ai_research
+from ai_research.mag.mag_orm import AffiliationType, AuthorAffiliation, Paper
+
+logger = logging.getLogger(__name__)
+
+papers = Paper.__table__
+author_aff = AuthorAffiliation.__table__
+affiliation_type = AffiliationType.__table__
+
+TIMELINE_DIR = ai_research.project_dir / "data" / "processed" / "career_trajectory"
+ARRAYS = ["author_ids", "indptr", "years", "states", "paper_ids"]
+
+ACADEMIA = 1
+INDUSTRY = 2
+
+
+def _collapse(authors, years, states):
+    """Sorted (author, year) rows and the OR of their states."""
+    order = np.lexsort((years, authors))
+    authors, years, states = authors[order], years[order], states[order]
+    new = np.ones(len(authors), dtype=bool)
+    new[1:] = (authors[1:] != authors[:-1]) | (years[1:] != years[:-1])
+    starts = np.flatnonzero(new)
+    if len(starts):
+        states = np.bitwise_or.reduceat(states, starts)
+    return authors[starts], years[starts], states
+
+
+class Timelines:
+    """Per-author sequences of (year, state).
+
+    Args:
+        author_ids (array of int): Sorted author ids.
+        indptr (array of int): Bounds of the timeline of each author.
+        years (array of int): Years with at least one event.
+        states (array of int): ACADEMIA, INDUSTRY or both, in each year.
+        paper_ids (array of int): Sorted ids of the papers included.
+
+    """
+
+    def __init__(self, author_ids, indptr, years, states, paper_ids):
+        self.author_ids = author_ids
+        self.indptr = indptr
+        self.years = years
+        self.states = states
+        self.paper_ids = paper_ids
+
+    @classmethod
+    def empty(cls):
+        return cls.from_events([], [], [])
+
+    @classmethod
+    def from_events(cls, authors, years, states, paper_ids=()):
+        """Timelines of author, year and state events."""
+        authors, years, states = _collapse(
+            np.asarray(authors, dtype=np.int64),
+            np.asarray(years, dtype=np.int16),
+            np.asarray(states, dtype=np.uint8),
+        )
+        boundaries = np.flatnonzero(authors[1:] != authors[:-1]) + 1
+        indptr = np.concatenate([[0], boundaries, [len(authors)]]).astype(np.int64)
+        author_ids = authors[indptr[:-1]] if len(authors) else authors
+        return cls(
+            author_ids,
+            indptr if len(authors) else np.zeros(1, np.int64),
+            years,
+            states,
+            np.unique(np.asarray(paper_ids, dtype=np.int64)),
+        )
+
+    def __len__(self):
+        return len(self.author_ids)
+
+    def _rows(self):
+        # Author index of every (year, state) entry
+        return np.repeat(np.arange(len(self)), np.diff(self.indptr))
+
+    def extend(self, authors, years, states, paper_ids=()):
+        """New timelines with the events of newly read papers added."""
+        return Timelines.from_events(
+            np.concatenate([self.author_ids[self._rows()], authors]),
+            np.concatenate([self.years, np.asarray(years, dtype=np.int16)]),
+            np.concatenate([self.states, np.asarray(states, dtype=np.uint8)]),
+            np.concatenate([self.paper_ids, np.asarray(paper_ids, dtype=np.int64)]),
+        )
+
+    def timeline(self, author_id):
+        """Years and states of one author."""
+        i = np.searchsorted(self.author_ids, author_id)
+        if i == len(self) or self.author_ids[i] != author_id:
+            raise KeyError(f"Unknown author id: {author_id}")
+        bounds = slice(self.indptr[i], self.indptr[i + 1])
+        return self.years[bounds], self.states[bounds]
+
+    def first_years(self):
+        """Year of the first event of every author."""
+        return self.years[self.indptr[:-1]]
+
+    def spells(self):
+        """Runs of consecutive entries of an author in the same state.
+
+        Returns:
+            (pandas.DataFrame) author_id, state, start and end year, years
+            (entries in the spell) and dwell: years until the next spell
+            starts. The last spell of an author is censored, its dwell runs
+            to the end of its last year.
+
+        """
+        rows = self._rows()
+        years = np.asarray(self.years, dtype=np.int64)
+        new = np.ones(len(rows), dtype=bool)
+        new[1:] = (rows[1:] != rows[:-1]) | (self.states[1:] != self.states[:-1])
+        starts = np.flatnonzero(new)
+        ends = np.append(starts[1:], len(rows)) - 1
+        authors = rows[starts]
+        censored = np.append(authors[1:] != authors[:-1], True)
+        next_start = np.append(years[starts][1:], 0)
+        dwell = np.where(
+            censored,
+            years[ends] - years[starts] + 1,
+            next_start - years[starts],
+        )
+        return pd.DataFrame(
+            {
+                "author_id": self.author_ids[authors],
+                "state": self.states[starts],
+                "start": years[starts],
+                "end": years[ends],
+                "years": ends - starts + 1,
+                "dwell": dwell,
+                "censored": censored,
+            }
+        )
+
+    def transitions(self, source=ACADEMIA, target=INDUSTRY, first_only=True):
+        """Moves from a spell in `source` only to a spell including `target`.
+
+        Args:
+            source, target (int): States, e.g. ACADEMIA and INDUSTRY.
+            first_only (bool): Keep the first move of every author.
+
+        Returns:
+            (pandas.DataFrame) author_id, year (first year in `target`),
+            previous_year (last year in `source`) and tenure (years since the
+            first event of the author).
+
+        """
+        spells = self.spells()
+        state = spells.state.values
+        same_author = spells.author_id.values[1:] == spells.author_id.values[:-1]
+        moves = np.flatnonzero(
+            same_author
+            & (state[:-1] & source).astype(bool)
+            & ~(state[:-1] & target).astype(bool)
+            & (state[1:] & target).astype(bool)
+        )
+        author_ids = spells.author_id.values[moves]
+        if first_only:
+            _, first = np.unique(author_ids, return_index=True)
+            moves, author_ids = moves[first], author_ids[first]
+        year = spells.start.values[moves + 1]
+        first_years = self.first_years()[np.searchsorted(self.author_ids, author_ids)]
+        return pd.DataFrame(
+            {
+                "author_id": author_ids,
+                "year": year,
+                "previous_year": spells.end.values[moves],
+                "tenure": year - first_years,
+            }
+        )
+
+    def cohorts(self, source=ACADEMIA, target=INDUSTRY):
+        """Transition statistics by the year of the first event of authors.
+
+        Returns:
+            (pandas.DataFrame) Indexed by cohort: authors, ever_source and
+            ever_target (authors ever in either state), movers (authors with
+            a transition), share_moved (movers / ever_source) and
+            median_tenure of the movers.
+
+        """
+        if not len(self):
+            return pd.DataFrame(
+                columns=[
+                    "authors",
+                    "ever_source",
+                    "ever_target",
+                    "movers",
+                    "share_moved",
+                    "median_tenure",
+                ]
+            )
+        cohort = np.asarray(self.first_years(), dtype=np.int64)
+        ever = np.bitwise_or.reduceat(self.states, self.indptr[:-1])
+        moves = self.transitions(source, target)
+        mover_cohort = cohort[np.searchsorted(self.author_ids, moves.author_id.values)]
+
+        labels, codes = np.unique(cohort, return_inverse=True)
+        n = len(labels)
+        stats = pd.DataFrame(
+            {
+                "authors": np.bincount(codes, minlength=n),
+                "ever_source": np.bincount(codes[(ever & source) > 0], minlength=n),
+                "ever_target": np.bincount(codes[(ever & target) > 0], minlength=n),
+                "movers": np.bincount(
+                    np.searchsorted(labels, mover_cohort), minlength=n
+                ),
+            },
+            index=pd.Index(labels, name="cohort"),
+        )
+        stats["share_moved"] = stats.movers / stats.ever_source.where(
+            stats.ever_source > 0
+        )
+        stats["median_tenure"] = moves.tenure.groupby(mover_cohort).median()
+        return stats
+
+    def save(self, directory=TIMELINE_DIR):
+        """Write the arrays as `.npy` files and a small metadata file."""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        for name in ARRAYS:
+            np.save(directory / f"{name}.npy", getattr(self, name))
+        with open(directory / "timelines.json", "wt") as f:
+            json.dump({"authors": len(self), "papers": len(self.paper_ids)}, f)
+
+    @classmethod
+    def load(cls, directory=TIMELINE_DIR, mmap_mode="r"):
+        """Load saved timelines, memory-mapped by default."""
+        directory = Path(directory)
+        if not (directory / "timelines.json").exists():
+            return cls.empty()
+        arrays = [
+            np.load(directory / f"{name}.npy", mmap_mode=mmap_mode) for name in ARRAYS
+        ]
+        return cls(*arrays)
+
+
+def read_events(engine, paper_ids=None):
+    """author_id, paper_id, year, date and affiliation type of author rows.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): Database with
+            `mag_author_affiliation`.
+        paper_ids (list of int): Only read these papers. Defaults to all.
+
+    """
+    query = select(
+        [
+            author_aff.c.author_id,
+            author_aff.c.paper_id,
+            papers.c.year,
+            papers.c.date,
+            affiliation_type.c.type,
+        ]
+    ).select_from(
+        author_aff.join(papers, papers.c.id == author_aff.c.paper_id).outerjoin(
+            affiliation_type, affiliation_type.c.id == author_aff.c.affiliation_id
+        )
+    )
+    query = query.where(author_aff.c.author_id.isnot(None))
+    if paper_ids is not None:
+        query = query.where(
+            author_aff.c.paper_id
+            == any_(literal([int(i) for i in paper_ids], ARRAY(BIGINT)))
+        )
+    return pd.read_sql(query, engine)
+
+
+def encode_events(events):
+    """Integer arrays of the events with a known year and affiliation type.
+
+    Returns:
+        authors, years, states (numpy.ndarray): The usable events.
+        complete (numpy.ndarray): Ids of the papers whose events were all
+            usable. The others are read again by the next update.
+
+    """
+    year = pd.to_numeric(events.year, errors="coerce")
+    year = year.fillna(pd.to_numeric(events.date.str[:4], errors="coerce"))
+    usable = (year.notnull() & events.type.notnull()).values
+    states = np.where(events.type.values[usable] == 1, ACADEMIA, INDUSTRY)
+    paper_ids = events.paper_id.values
+    complete = np.setdiff1d(paper_ids, paper_ids[~usable])
+    return (
+        events.author_id.values[usable].astype(np.int64),
+        year.values[usable].astype(np.int16),
+        states.astype(np.uint8),
+        complete,
+    )
+
+
+def update_timelines(engine, directory=TIMELINE_DIR, rebuild=False):
+    """Add the papers not in the saved timelines yet.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): Database with
+            `mag_author_affiliation`.
+        directory (str or Path): Where the timelines are saved.
+        rebuild (bool): Read every paper again, e.g. after affiliation types
+            changed.
+
+    Returns:
+        (Timelines) The updated timelines.
+
+    """
+    timelines = Timelines.empty() if rebuild else Timelines.load(directory, None)
+    with engine.connect() as conn:
+        db_ids = np.array(
+            [i for i, in conn.execute(select([author_aff.c.paper_id]).distinct())],
+            dtype=np.int64,
+        )
+    new_ids = np.setdiff1d(db_ids, timelines.paper_ids)
+    if not len(new_ids):
+        logger.info("Career timelines: no new papers")
+        return timelines
+
+    authors, years, states, complete = encode_events(read_events(engine, new_ids))
+    timelines = timelines.extend(authors, years, states, complete)
+    timelines.save(directory)
+    logger.info(
+        f"Career timelines: read {len(new_ids)} papers, {len(authors)} events, "
+        f"{len(timelines)} authors"
+    )
+    return Timelines.load(directory)
+
+
+def main():
+    engine = create_engine(os.getenv("postgresdb"))
+    timelines = update_timelines(engine)
+    logger.info(f"Academia to industry moves by cohort:\n{timelines.cohorts()}")
+
+
+if __name__ == "__main__":
+    load_dotenv(find_dotenv())
+    main()
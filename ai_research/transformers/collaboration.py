@@ -0,0 +1,149 @@
+"""Collaboration networks of countries and affiliations.
+
+For every year, papers and the entities (countries or affiliations) of their
+authors form a binary paper x entity incidence matrix A. The co-occurrence
+matrix Aᵀ·A holds the number of papers every pair of entities shares; its
+strict upper triangle is the weighted, undirected collaboration network.
+Papers with a single entity cannot contribute a pair and are dropped before
+the product. Years are independent and run in a process pool.
+"""
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import networkx as nx
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from ai_research.mag.bulk_load import replace_rows
+from ai_research.mag.mag_orm import CountryCollaboration
+from ai_research.transformers.partitions import (
+    PartitionState,
+    fingerprint,
+    STATE_DIR,
+)
+from ai_research.transformers.rca import read_paper_entities
+
+logger = logging.getLogger(__name__)
+
+
+def collaboration_pairs(paper_ids, entities):
+    """Weighted entity pairs of one set of paper - entity links.
+
+    Args:
+        paper_ids, entities (array): Distinct paper - entity links.
+
+    Returns:
+        (pandas.DataFrame) entity_a, entity_b and weight, with
+        entity_a < entity_b.
+
+    """
+    paper_codes, _ = pd.factorize(paper_ids)
+    entity_codes, labels = pd.factorize(entities, sort=True)
+    incidence = sparse.csr_matrix(
+        (np.ones(len(paper_codes), dtype=np.int64), (paper_codes, entity_codes)),
+        shape=(paper_codes.max() + 1 if len(paper_codes) else 0, len(labels)),
+    )
+    incidence.data[:] = 1
+    incidence = incidence[np.diff(incidence.indptr) > 1]
+    pairs = sparse.triu(incidence.T @ incidence, k=1).tocoo()
+    labels = np.asarray(labels)
+    return pd.DataFrame(
+        {
+            "entity_a": labels[pairs.row],
+            "entity_b": labels[pairs.col],
+            "weight": pairs.data,
+        }
+    )
+
+
+def _year_pairs(args):
+    year, paper_ids, entities = args
+    pairs = collaboration_pairs(paper_ids, entities)
+    pairs["year"] = year
+    return pairs
+
+
+def collaboration_network(links, n_jobs=None):
+    """Collaboration pairs of every year, computed in parallel.
+
+    Args:
+        links (pandas.DataFrame): paper_id, entity and year columns, as
+            returned by `read_paper_entities`.
+        n_jobs (int): Worker processes. Defaults to the number of CPUs.
+
+    Returns:
+        (pandas.DataFrame) entity_a, entity_b, weight and year.
+
+    """
+    tasks = [
+        (year, group.paper_id.values, group.entity.values)
+        for year, group in links.groupby("year")
+    ]
+    if not tasks:
+        return pd.DataFrame(columns=["entity_a", "entity_b", "weight", "year"])
+    if n_jobs == 1 or len(tasks) == 1:
+        results = list(map(_year_pairs, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            results = list(pool.map(_year_pairs, tasks))
+    return pd.concat(results, ignore_index=True)
+
+
+def to_graph(pairs):
+    """Weighted undirected networkx graph of collaboration pairs."""
+    return nx.from_pandas_edgelist(
+        pairs, "entity_a", "entity_b", edge_attr="weight", create_using=nx.Graph()
+    )
+
+
+def affiliation_network(engine, years=None, n_jobs=None):
+    """Collaboration pairs of affiliations (ids) per year."""
+    links = read_paper_entities(engine, "affiliation", years)
+    return collaboration_network(links, n_jobs=n_jobs)
+
+
+def update_country_collaboration(
+    engine, years=None, n_jobs=None, force=False, state_dir=STATE_DIR
+):
+    """Rewrite `country_collaboration` for the years whose inputs changed.
+
+    The rows of the years that no longer have any input are removed.
+
+    Returns:
+        (list) Years that were recomputed or removed.
+
+    """
+    state = PartitionState(CountryCollaboration.__tablename__, state_dir)
+    links = read_paper_entities(engine, "country", years)
+
+    # Years that no longer have any input
+    stale = state.stale(links.year.unique(), years)
+    for year in stale:
+        replace_rows(
+            engine, CountryCollaboration, CountryCollaboration.year == year, []
+        )
+        state.remove(year)
+
+    changed = {}
+    for year, group in links.groupby("year"):
+        key = fingerprint(group.paper_id.values, group.entity.values.astype(str))
+        if force or state.changed(year, key):
+            changed[year] = key
+    if not changed:
+        return stale
+
+    pairs = collaboration_network(links[links.year.isin(changed)], n_jobs=n_jobs)
+    pairs = pairs.rename(columns={"entity_a": "country_a", "entity_b": "country_b"})
+    pairs_by_year = dict(tuple(pairs.groupby("year")))
+    for year, key in changed.items():
+        year_pairs = pairs_by_year.get(year, pairs.iloc[:0])
+        replace_rows(
+            engine,
+            CountryCollaboration,
+            CountryCollaboration.year == year,
+            year_pairs.to_dict(orient="records"),
+        )
+        state.update(year, key)
+        logger.info(f"country_collaboration: wrote {len(year_pairs)} pairs for {year}")
+    return sorted(changed) + stale
@@ -0,0 +1,328 @@
+"""Incremental materialisation of the derived tables.
+
+Derived tables are written by stages. A stage declares the tables it writes
+and its input queries, whose first column is the partition key of the stage
+(e.g. the year of a paper, a field of study id or a country). Before a stage
+runs, the rows of each input are fingerprinted per partition in the database
+and compared with the fingerprints of its last run: only the partitions that
+changed, appeared or disappeared are recomputed. An input whose key is `ALL`
+is not partitioned, and any change to it recomputes every partition.
+
+Every fingerprint also holds the version of the stage, a hash of the source
+of its code and of its parameters from `model_config.yaml`, so editing either
+recomputes all of its partitions, and only its partitions.
+
+Stages run in their own processes, several at a time, as soon as the stages
+they read from are done. Dependencies are found by matching the tables stages
+read with the tables other stages write, so the partitions rewritten by one
+stage are picked up by the stages downstream of it. Each stage runs in a
+fresh process, whose wall time and peak resident memory are logged and saved
+to `pipeline_report.json` next to the fingerprints.
+"""
+import hashlib
+import inspect
+import json
+import logging
+import multiprocessing
+import resource
+import time
+import traceback
+from functools import partial
+from multiprocessing.connection import wait
+from pathlib import Path
+
+from sqlalchemy import Table, create_engine, literal_column, select
+from sqlalchemy.sql.util import find_tables
+
+from ai_research.transformers.partitions import (
+    PartitionState,
+    query_fingerprints,
+    STATE_DIR,
+)
+
+logger = logging.getLogger(__name__)
+
+ALL = "*"
+
+
+def whole(*columns):
+    """Input query over some columns, not partitioned."""
+    return select([literal_column(f"'{ALL}'").label("key")] + list(columns))
+
+
+def read_tables(query):
+    """Names of the tables a query reads."""
+    return {
+        t.name for t in find_tables(query, include_joins=True) if isinstance(t, Table)
+    }
+
+
+class Stage:
+    """One derivation of the DAG.
+
+    Args:
+        name (str): Unique name, also used for its fingerprint file.
+        run (callable): `run(engine, keys)` recomputes the given partitions of
+            the outputs, removing those that no longer have any input.
+        inputs (list of sqlalchemy.sql.Select): Queries whose first column is
+            the partition key, or `whole` queries. At least one of them is
+            partitioned.
+        outputs (list of str): Names of the tables the stage writes.
+        key_type (type): Type of the partition keys passed to `run`.
+        params (dict): Keyword arguments of `run`, e.g. from the config.
+        code (list of module): Modules whose source is part of the version.
+            Defaults to the module defining `run`.
+
+    `run` is called in another process, so it has to be picklable: a module
+    level function, or a `functools.partial` of one.
+    """
+
+    def __init__(
+        self, name, run, inputs, outputs, key_type=int, params=None, code=None
+    ):
+        self.name = name
+        self.run = run
+        self.inputs = inputs
+        self.outputs = list(outputs)
+        self.key_type = key_type
+        self.params = params or {}
+        if code is None:
+            func = run
+            while isinstance(func, partial):
+                func = func.func
+            code = [inspect.getmodule(func)]
+        self.code = code
+
+    def __repr__(self):
+        return f"Stage({self.name!r})"
+
+    @property
+    def tables(self):
+        """Names of the tables read by the inputs."""
+        return set().union(*[read_tables(query) for query in self.inputs])
+
+    @property
+    def version(self):
+        """Hash of the source of the stage's code and of its parameters."""
+        h = hashlib.md5()
+        for module in self.code:
+            h.update(inspect.getsource(module).encode())
+        h.update(json.dumps(self.params, sort_keys=True, default=str).encode())
+        return h.hexdigest()[:12]
+
+
+def upstream_stages(stages):
+    """The stages each stage reads from."""
+    writers = {table: stage for stage in stages for table in stage.outputs}
+    return {
+        stage: {writers[t] for t in stage.tables if t in writers} - {stage}
+        for stage in stages
+    }
+
+
+def stage_order(stages):
+    """Sort stages so that every stage comes after the stages it reads from.
+
+    Raises:
+        ValueError: If the stages have a cycle.
+
+    """
+    upstream = upstream_stages(stages)
+    ordered = []
+    while upstream:
+        ready = [s for s in stages if s in upstream and not upstream[s]]
+        if not ready:
+            raise ValueError(f"Cycle between the stages {list(upstream)}")
+        for stage in ready:
+            del upstream[stage]
+            for parents in upstream.values():
+                parents.discard(stage)
+        ordered.extend(ready)
+    return ordered
+
+
+class Fingerprints:
+    """Per-partition fingerprints of input queries, shared by the stages.
+
+    Stages often read the same inputs, so fingerprints are computed once per
+    run and dropped when a stage rewrites one of the tables they read.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._cache = {}
+
+    def get(self, query):
+        sql = str(
+            query.compile(
+                dialect=self.engine.dialect, compile_kwargs={"literal_binds": True}
+            )
+        )
+        if sql not in self._cache:
+            self._cache[sql] = (
+                read_tables(query),
+                query_fingerprints(self.engine, query),
+            )
+        return self._cache[sql][1]
+
+    def invalidate(self, tables):
+        """Forget the fingerprints of the queries reading any of these tables."""
+        tables = set(tables)
+        for sql in [sql for sql, (read, _) in self._cache.items() if read & tables]:
+            del self._cache[sql]
+
+
+def partition_keys(stage, fingerprints):
+    """Current fingerprint of every partition of a stage's inputs."""
+    keys = {}
+    for i, query in enumerate(stage.inputs):
+        for key, value in fingerprints.get(query).items():
+            keys.setdefault(str(key), [stage.version]).append(f"{i}:{value}")
+    return {key: ",".join(values) for key, values in keys.items()}
+
+
+def plan_stage(stage, fingerprints, force=False, state_dir=STATE_DIR):
+    """Partitions of a stage whose inputs, code or parameters changed.
+
+    Returns:
+        keys (list): Partitions to recompute.
+        state (PartitionState): Fingerprints of the last run.
+        current (dict): Fingerprints to save once the stage has run.
+
+    """
+    state = PartitionState(f"dag_{stage.name}", state_dir)
+    current = partition_keys(stage, fingerprints)
+    dirty = {k for k, v in current.items() if force or state.changed(k, v)}
+    dirty |= set(state.fingerprints) - set(current)
+    if ALL in dirty:
+        dirty |= set(current) | set(state.fingerprints)
+    keys = sorted(stage.key_type(k) for k in dirty - {ALL})
+    if dirty and not keys:
+        # Only unpartitioned inputs changed, and there is nothing to recompute
+        state.fingerprints = current
+        state.save()
+    return keys, state, current
+
+
+def run_in_process(conn, run, url, keys, params):
+    """Run a stage in a child process and send back how it went.
+
+    Sends ("done", wall time in seconds, peak resident memory in MB), or
+    ("failed", traceback).
+    """
+    try:
+        engine = create_engine(url)
+        start = time.perf_counter()
+        try:
+            run(engine, keys, **params)
+        finally:
+            engine.dispose()
+        seconds = time.perf_counter() - start
+        peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        conn.send(("done", seconds, peak_mb))
+    except BaseException:
+        conn.send(("failed", traceback.format_exc()))
+    finally:
+        conn.close()
+
+
+def start_stage(engine, stage, keys):
+    """Start a process running a stage on some partitions."""
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(
+        target=run_in_process,
+        args=(sender, stage.run, engine.url, keys, stage.params),
+        name=stage.name,
+    )
+    process.start()
+    sender.close()
+    return receiver, process
+
+
+def stage_result(stage, receiver, process):
+    """Wall time and peak memory of a finished stage.
+
+    Raises:
+        RuntimeError: If the stage failed.
+
+    """
+    try:
+        status, *result = receiver.recv()
+    except EOFError:
+        status, result = "failed", [f"exit code {process.exitcode}"]
+    process.join()
+    if status == "failed":
+        raise RuntimeError(f"Stage {stage.name} failed:\n{result[0]}")
+    return result
+
+
+def run_dag(engine, stages, force=False, state_dir=STATE_DIR, n_jobs=1):
+    """Bring every derived table up to date.
+
+    Stages are planned in the main process, as soon as their upstream stages
+    are done, and the ones with partitions to recompute each run in a new
+    process, at most `n_jobs` at a time. Stages may start process pools of
+    their own.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): Database holding the MAG tables.
+        stages (list of Stage): The DAG, in any order.
+        force (bool): Recompute every partition of every stage.
+        state_dir (str or Path): Where the input fingerprints are kept.
+        n_jobs (int): Number of stages run at the same time.
+
+    Returns:
+        (dict) Stage name to the partitions that were recomputed.
+
+    """
+    upstream = upstream_stages(stage_order(stages))
+    fingerprints = Fingerprints(engine)
+    updated, report, running = {}, {}, {}
+
+    def finish(stage, keys):
+        updated[stage.name] = keys
+        for parents in upstream.values():
+            parents.discard(stage)
+
+    try:
+        while upstream or running:
+            ready = [s for s in stages if s in upstream and not upstream[s]]
+            for stage in ready[: n_jobs - len(running)]:
+                del upstream[stage]
+                keys, state, current = plan_stage(stage, fingerprints, force, state_dir)
+                if not keys:
+                    logger.info(f"{stage.name}: up to date")
+                    finish(stage, [])
+                    continue
+                receiver, process = start_stage(engine, stage, keys)
+                running[receiver] = (stage, process, keys, state, current)
+            if not running:
+                continue
+
+            for receiver in wait(list(running)):
+                stage, process, keys, state, current = running.pop(receiver)
+                seconds, peak_mb = stage_result(stage, receiver, process)
+                state.fingerprints = current
+                state.save()
+                fingerprints.invalidate(stage.outputs)
+                report[stage.name] = {
+                    "partitions": len(keys),
+                    "seconds": round(seconds, 3),
+                    "peak_mb": round(peak_mb, 1),
+                }
+                logger.info(
+                    f"{stage.name}: recomputed {len(keys)} partitions in "
+                    f"{seconds:.1f}s, peak memory {peak_mb:.0f} MB"
+                )
+                finish(stage, keys)
+    finally:
+        # Stages still running when another one failed
+        for _, process, *_ in running.values():
+            process.terminate()
+            process.join()
+
+    path = Path(state_dir) / "pipeline_report.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wt") as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+    return updated
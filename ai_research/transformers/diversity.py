@@ -0,0 +1,328 @@
+"""Research and gender diversity of countries, in one pass.
+
+A group is a (country, year, field of study) triple. A paper belongs to the
+groups of every country of its authors' affiliations and every field of study
+it is tagged with (and, with a `FosClosure`, every ancestor of them). For each
+group the engine keeps:
+
+- the counts of the group's papers over their fields of study, from which
+  Shannon, Simpson and Simpson evenness diversity are computed, and
+- the number of female and of gendered authors on the group's papers, whose
+  ratio is the female share.
+
+Counts are sparse group x category matrices and every index is computed for
+all groups at once.
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sqlalchemy import select
+
+from ai_research.mag.bulk_load import replace_tables
+from ai_research.mag.mag_orm import (
+    Paper,
+    PaperFieldsOfStudy,
+    AuthorAffiliation,
+    AffiliationLocation,
+    AuthorGender,
+    ResearchDiversityCountry,
+    GenderDiversityCountry,
+)
+from ai_research.transformers.partitions import (
+    PartitionState,
+    fingerprint,
+    STATE_DIR,
+)
+
+logger = logging.getLogger(__name__)
+
+papers = Paper.__table__
+paper_fos = PaperFieldsOfStudy.__table__
+author_aff = AuthorAffiliation.__table__
+locations = AffiliationLocation.__table__
+genders = AuthorGender.__table__
+
+
+def read_paper_authors(engine, years=None, chunksize=500000):
+    """Countries and gendered author counts of every paper, in one scan.
+
+    Returns:
+        paper_countries (pandas.DataFrame): Distinct paper_id, country, year.
+        paper_genders (pandas.DataFrame): paper_id, female and gendered author
+            counts.
+
+    """
+    query = (
+        select(
+            [
+                author_aff.c.paper_id,
+                author_aff.c.author_id,
+                papers.c.year,
+                locations.c.country,
+                genders.c.gender,
+            ]
+        )
+        .select_from(
+            author_aff.join(papers, papers.c.id == author_aff.c.paper_id)
+            .outerjoin(
+                locations, locations.c.affiliation_id == author_aff.c.affiliation_id
+            )
+            .outerjoin(genders, genders.c.id == author_aff.c.author_id)
+        )
+        .where(papers.c.year_int.isnot(None))
+    )
+    if years is not None:
+        query = query.where(papers.c.year_int.in_([int(y) for y in years]))
+
+    countries, authors = [], []
+    with engine.connect() as conn:
+        # A server side cursor, so only one chunk is held in memory at a time
+        conn = conn.execution_options(stream_results=True)
+        for chunk in pd.read_sql(query, conn, chunksize=chunksize):
+            countries.append(
+                chunk.loc[
+                    chunk.country.notnull(), ["paper_id", "country", "year"]
+                ].drop_duplicates()
+            )
+            authors.append(
+                chunk[["paper_id", "author_id", "gender"]].drop_duplicates(
+                    ["paper_id", "author_id"]
+                )
+            )
+    if not countries:
+        return (
+            pd.DataFrame(columns=["paper_id", "country", "year"]),
+            pd.DataFrame(columns=["paper_id", "female", "gendered"]),
+        )
+    paper_countries = pd.concat(countries).drop_duplicates()
+    authors = pd.concat(authors).drop_duplicates(["paper_id", "author_id"])
+    paper_genders = (
+        authors.assign(
+            female=(authors.gender == "female").astype(np.int64),
+            gendered=authors.gender.isin(["female", "male"]).astype(np.int64),
+        )
+        .groupby("paper_id")[["female", "gendered"]]
+        .sum()
+        .reset_index()
+    )
+    return paper_countries, paper_genders
+
+
+def read_paper_fields(engine, years=None):
+    """paper_id and field_of_study_id of papers with a known year."""
+    query = (
+        select([paper_fos.c.paper_id, paper_fos.c.field_of_study_id])
+        .select_from(paper_fos.join(papers, papers.c.id == paper_fos.c.paper_id))
+        .where(papers.c.year_int.isnot(None))
+    )
+    if years is not None:
+        query = query.where(papers.c.year_int.in_([int(y) for y in years]))
+    return pd.read_sql(query, engine)
+
+
+def diversity_indices(counts):
+    """Shannon, Simpson and Simpson evenness of every row of a count matrix.
+
+    Args:
+        counts (scipy.sparse matrix): Groups x categories.
+
+    Returns:
+        shannon, simpson, simpson_e (numpy.ndarray): One value per row. Rows
+        without counts are NaN.
+
+    """
+    counts = sparse.coo_matrix(counts)
+    n_rows = counts.shape[0]
+    totals = np.bincount(counts.row, counts.data, minlength=n_rows)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p = counts.data / totals[counts.row]
+        shannon = -np.bincount(counts.row, p * np.log(p), minlength=n_rows)
+        dominance = np.bincount(counts.row, p * p, minlength=n_rows)
+        richness = np.bincount(counts.row, counts.data > 0, minlength=n_rows)
+        simpson = 1 - dominance
+        simpson_e = (1 / dominance) / richness
+    empty = totals == 0
+    for values in (shannon, simpson, simpson_e):
+        values[empty] = np.nan
+    return shannon, simpson, simpson_e
+
+
+def group_profiles(paper_countries, paper_fields, closure=None):
+    """Sparse (country, year, topic) group memberships and paper categories.
+
+    Args:
+        paper_countries (pandas.DataFrame): paper_id, country, year.
+        paper_fields (pandas.DataFrame): paper_id, field_of_study_id.
+        closure (FosClosure): If given, papers also belong to the groups of
+            the ancestors of their fields of study.
+
+    Returns:
+        groups (pandas.MultiIndex): country, year and field_of_study_id of
+            each group.
+        membership (scipy.sparse.csr_matrix): Binary groups x papers.
+        categories (scipy.sparse.csr_matrix): Binary papers x direct fields
+            of study. `membership @ categories` counts the papers of every
+            group in each field of study.
+        papers (pandas.Index): Paper id of each paper column.
+
+    """
+    fields = paper_fields
+    if closure is not None:
+        paper_ids, fos_ids = closure.expand(
+            fields.paper_id.values, fields.field_of_study_id.values
+        )
+        topics = pd.DataFrame({"paper_id": paper_ids, "field_of_study_id": fos_ids})
+    else:
+        topics = fields
+
+    # Paper memberships of (country, year, topic) groups
+    members = paper_countries.merge(topics, on="paper_id")
+    group_codes, groups = pd.factorize(
+        pd.MultiIndex.from_arrays(
+            [members.country, members.year, members.field_of_study_id]
+        )
+    )
+    paper_codes, paper_index = pd.factorize(
+        np.concatenate([members.paper_id.values, fields.paper_id.values])
+    )
+    n_groups, n_papers = len(groups), len(paper_index)
+    membership = sparse.csr_matrix(
+        (
+            np.ones(len(members), dtype=np.int64),
+            (group_codes, paper_codes[: len(members)]),
+        ),
+        shape=(n_groups, n_papers),
+    )
+    membership.data[:] = 1
+
+    # Paper x category (direct fields of study) incidence
+    category_codes, _ = pd.factorize(fields.field_of_study_id)
+    categories = sparse.csr_matrix(
+        (
+            np.ones(len(fields), dtype=np.int64),
+            (paper_codes[len(members) :], category_codes),
+        ),
+        shape=(n_papers, category_codes.max() + 1 if len(fields) else 0),
+    )
+    categories.data[:] = 1
+    return groups, membership, categories, pd.Index(paper_index)
+
+
+def group_metrics(paper_countries, paper_genders, paper_fields, closure=None):
+    """Diversity and female share of every (country, year, topic) group.
+
+    Args:
+        paper_countries (pandas.DataFrame): paper_id, country, year.
+        paper_genders (pandas.DataFrame): paper_id, female, gendered.
+        paper_fields (pandas.DataFrame): paper_id, field_of_study_id.
+        closure (FosClosure): If given, papers also belong to the groups of
+            the ancestors of their fields of study.
+
+    Returns:
+        (pandas.DataFrame) entity, year, field_of_study_id,
+        shannon_diversity, simpson_diversity, simpson_e_diversity and
+        female_share columns.
+
+    """
+    groups, membership, categories, paper_index = group_profiles(
+        paper_countries, paper_fields, closure
+    )
+    shannon, simpson, simpson_e = diversity_indices(membership @ categories)
+
+    # Author gender counts of the papers, summed per group
+    genders = (
+        paper_genders.set_index("paper_id")
+        .reindex(paper_index)
+        .fillna(0)[["female", "gendered"]]
+        .values
+    )
+    female, gendered = (membership @ genders).T
+    with np.errstate(divide="ignore", invalid="ignore"):
+        female_share = np.where(gendered > 0, female / gendered, np.nan)
+
+    return pd.DataFrame(
+        {
+            "entity": groups.get_level_values(0),
+            "year": groups.get_level_values(1),
+            "field_of_study_id": groups.get_level_values(2),
+            "shannon_diversity": shannon,
+            "simpson_diversity": simpson,
+            "simpson_e_diversity": simpson_e,
+            "female_share": female_share,
+        }
+    )
+
+
+def _records(df, columns):
+    df = df[columns].astype(object).where(df[columns].notnull(), None)
+    return df.to_dict(orient="records")
+
+
+def update_diversity(
+    engine, years=None, closure=None, force=False, state_dir=STATE_DIR
+):
+    """Recompute both diversity tables for the years whose inputs changed.
+
+    Writes `research_diversity_country` and `gender_diversity_country`, and
+    removes the rows of the years that no longer have any input.
+
+    Returns:
+        (list) Years that were recomputed or removed.
+
+    """
+    state = PartitionState("diversity_country", state_dir)
+    paper_countries, paper_genders = read_paper_authors(engine, years)
+    paper_fields = read_paper_fields(engine, years)
+
+    updated = []
+    for year, countries in paper_countries.groupby("year"):
+        ids = countries.paper_id.unique()
+        year_genders = paper_genders[paper_genders.paper_id.isin(ids)]
+        year_fields = paper_fields[paper_fields.paper_id.isin(ids)]
+        key = "".join(
+            [
+                fingerprint(countries.paper_id.values, countries.country.values),
+                fingerprint(*year_genders[["paper_id", "female", "gendered"]].values.T),
+                fingerprint(*year_fields[["paper_id", "field_of_study_id"]].values.T),
+            ]
+        )
+        if not force and not state.changed(year, key):
+            continue
+
+        metrics = group_metrics(countries, year_genders, year_fields, closure)
+        research = ["shannon_diversity", "simpson_diversity", "simpson_e_diversity"]
+        keys = ["year", "entity", "field_of_study_id"]
+        # Both tables of a year are replaced together, so they always agree
+        replace_tables(
+            engine,
+            [
+                (
+                    ResearchDiversityCountry,
+                    ResearchDiversityCountry.year == year,
+                    _records(metrics, keys + research),
+                ),
+                (
+                    GenderDiversityCountry,
+                    GenderDiversityCountry.year == year,
+                    _records(metrics, keys + ["female_share"]),
+                ),
+            ],
+        )
+        state.update(year, key)
+        updated.append(year)
+        logger.info(f"Diversity: wrote {len(metrics)} groups for {year}")
+
+    # Years that no longer have any input
+    for year in state.stale(paper_countries.year.unique(), years):
+        replace_tables(
+            engine,
+            [
+                (table, table.year == year, [])
+                for table in (ResearchDiversityCountry, GenderDiversityCountry)
+            ],
+        )
+        state.remove(year)
+        updated.append(year)
+    return updated
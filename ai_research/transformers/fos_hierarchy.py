@@ -0,0 +1,245 @@
+"""Transitive closure index of the field of study hierarchy.
+
+The MAG hierarchy is a DAG: a field of study can have several parents, on
+a higher level. The closure is built once with sparse matrix products and
+stored as two CSR structures over a dense index of the field of study ids,
+one for ancestors and one for descendants. Lookups are array slices and
+`is_under` is a binary search in the sorted ancestors of a node.
+"""
+import logging
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy import select
+
+from ai_research.mag.mag_orm import FosHierarchy, FosMetadata
+
+logger = logging.getLogger(__name__)
+
+
+def csr_ranges(indptr, rows):
+    """Positions of the entries of some rows of a CSR structure.
+
+    Args:
+        indptr (array of int): CSR row pointers.
+        rows (array of int): Rows to gather.
+
+    Returns:
+        positions (numpy.ndarray): Positions in `indices` of the entries of
+            the rows, concatenated in the order of `rows`.
+        owner (numpy.ndarray): Index in `rows` of the row of each position.
+
+    """
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    owner = np.repeat(np.arange(len(rows)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(
+        np.cumsum(lengths) - lengths, lengths
+    )
+    return starts[owner] + offsets, owner
+
+
+class FosClosure:
+    """Ancestor and descendant lookups over the field of study hierarchy.
+
+    Args:
+        ids (array of int): Field of study ids.
+        ancestors (scipy.sparse.csr_matrix): Boolean matrix where row i holds
+            the strict ancestors of ids[i].
+        levels (array of int): Level of each id, -1 if unknown.
+
+    """
+
+    def __init__(self, ids, ancestors, levels=None):
+        order = np.argsort(ids)
+        self.ids = np.asarray(ids, dtype=np.int64)[order]
+        ancestors = sparse.csr_matrix(ancestors)[order][:, order]
+        ancestors.sort_indices()
+        self._anc = ancestors
+        self._desc = ancestors.T.tocsr()
+        self._desc.sort_indices()
+        # Sorted (row, ancestor) keys for binary search in is_under
+        rows = np.repeat(np.arange(len(self.ids)), np.diff(ancestors.indptr))
+        self._anc_keys = rows.astype(np.int64) * len(self.ids) + ancestors.indices
+        self.levels = (
+            np.full(len(self.ids), -1, dtype=np.int32)
+            if levels is None
+            else np.asarray(levels, dtype=np.int32)[order]
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_edges(cls, child_ids, parent_ids, levels=None):
+        """Build the closure from child -> parent edges.
+
+        Args:
+            child_ids, parent_ids (array of int): One edge per position.
+            levels (dict): Field of study id to level. When given, edges whose
+                parent is not on a higher level are dropped, which also rules
+                out cycles between fields of study with known levels.
+
+        """
+        child_ids = np.asarray(child_ids, dtype=np.int64)
+        parent_ids = np.asarray(parent_ids, dtype=np.int64)
+        nodes = np.union1d(child_ids, parent_ids)
+        if levels is not None:
+            nodes = np.union1d(nodes, np.fromiter(levels, dtype=np.int64))
+            level = np.array([levels.get(i, -1) for i in nodes.tolist()], np.int32)
+            child_level = level[np.searchsorted(nodes, child_ids)]
+            parent_level = level[np.searchsorted(nodes, parent_ids)]
+            keep = (child_level < 0) | (parent_level < 0)
+            keep |= child_level > parent_level
+            if (~keep).any():
+                logger.info(f"Dropped {(~keep).sum()} edges inconsistent with levels")
+            child_ids, parent_ids = child_ids[keep], parent_ids[keep]
+        else:
+            level = None
+
+        keep = child_ids != parent_ids
+        child_ids, parent_ids = child_ids[keep], parent_ids[keep]
+        n = len(nodes)
+        edges = sparse.csr_matrix(
+            (
+                np.ones(len(child_ids), dtype=bool),
+                (np.searchsorted(nodes, child_ids), np.searchsorted(nodes, parent_ids)),
+            ),
+            shape=(n, n),
+        )
+
+        # Paths of length t + 1 are added at step t, until none are new
+        closure = edges.copy()
+        frontier = edges
+        while frontier.nnz:
+            frontier = (frontier @ edges).astype(bool)
+            updated = (closure + frontier).astype(bool)
+            if updated.nnz == closure.nnz:
+                break
+            closure = updated
+        # A cycle would make nodes their own ancestors
+        closure = closure.tocoo()
+        keep = closure.row != closure.col
+        closure = sparse.csr_matrix(
+            (closure.data[keep], (closure.row[keep], closure.col[keep])), shape=(n, n)
+        )
+        return cls(nodes, closure, level)
+
+    def _index(self, fos_ids):
+        fos_ids = np.asarray(fos_ids, dtype=np.int64)
+        idx = np.searchsorted(self.ids, fos_ids)
+        idx = np.minimum(idx, len(self.ids) - 1)
+        if not (self.ids[idx] == fos_ids).all():
+            missing = fos_ids[self.ids[idx] != fos_ids]
+            raise KeyError(f"Unknown field of study ids: {missing[:10].tolist()}")
+        return idx
+
+    def _lookup(self, matrix, fos_id, include_self, level):
+        i = self._index([fos_id])[0]
+        found = matrix.indices[matrix.indptr[i] : matrix.indptr[i + 1]]
+        if include_self:
+            found = np.union1d(found, [i])
+        if level is not None:
+            found = found[self.levels[found] == level]
+        return self.ids[found]
+
+    def ancestors(self, fos_id, include_self=False, level=None):
+        """Sorted ids of all fields of study above `fos_id`."""
+        return self._lookup(self._anc, fos_id, include_self, level)
+
+    def descendants(self, fos_id, include_self=False, level=None):
+        """Sorted ids of all fields of study below `fos_id`."""
+        return self._lookup(self._desc, fos_id, include_self, level)
+
+    def is_under(self, fos_ids, ancestor_ids):
+        """Whether each field of study is strictly below its paired ancestor.
+
+        Accepts scalars or arrays of equal length.
+        """
+        scalar = np.ndim(fos_ids) == 0 and np.ndim(ancestor_ids) == 0
+        rows = np.atleast_1d(self._index(np.atleast_1d(fos_ids)))
+        cols = np.atleast_1d(self._index(np.atleast_1d(ancestor_ids)))
+        rows, cols = np.broadcast_arrays(rows, cols)
+        keys = rows.astype(np.int64) * len(self.ids) + cols
+        if len(self._anc_keys):
+            pos = np.searchsorted(self._anc_keys, keys)
+            pos = np.minimum(pos, len(self._anc_keys) - 1)
+            result = self._anc_keys[pos] == keys
+        else:
+            result = np.zeros(len(keys), dtype=bool)
+        return bool(result[0]) if scalar else result
+
+    def expand(self, paper_ids, fos_ids, level=None):
+        """Add all ancestors to paper - field of study memberships.
+
+        Args:
+            paper_ids, fos_ids (array of int): Memberships, e.g. the rows of
+                `mag_paper_fields_of_study`.
+            level (int): Only keep fields of study of this level.
+
+        Returns:
+            paper_ids, fos_ids (numpy.ndarray): Unique memberships including
+            the original ones, sorted by paper and field of study.
+
+        """
+        paper_ids = np.asarray(paper_ids, dtype=np.int64)
+        idx = self._index(fos_ids)
+        positions, owner = csr_ranges(self._anc.indptr, idx)
+        papers = np.concatenate([paper_ids, paper_ids[owner]])
+        fos = np.concatenate([idx, self._anc.indices[positions]])
+        if level is not None:
+            keep = self.levels[fos] == level
+            papers, fos = papers[keep], fos[keep]
+        order = np.lexsort((fos, papers))
+        papers, fos = papers[order], fos[order]
+        first = np.ones(len(papers), dtype=bool)
+        first[1:] = (papers[1:] != papers[:-1]) | (fos[1:] != fos[:-1])
+        return papers[first], self.ids[fos[first]]
+
+    def save(self, path):
+        """Save the closure to a `.npz` file."""
+        np.savez(
+            path,
+            ids=self.ids,
+            levels=self.levels,
+            indptr=self._anc.indptr,
+            indices=self._anc.indices,
+        )
+
+    @classmethod
+    def load(cls, path):
+        """Load a closure saved with `save`."""
+        with np.load(path) as data:
+            n = len(data["ids"])
+            ancestors = sparse.csr_matrix(
+                (np.ones(len(data["indices"]), bool), data["indices"], data["indptr"]),
+                shape=(n, n),
+            )
+            return cls(data["ids"], ancestors, data["levels"])
+
+
+def load_closure(engine):
+    """Build the closure from `mag_field_of_study_hierarchy` and its levels."""
+    hierarchy = FosHierarchy.__table__
+    metadata = FosMetadata.__table__
+    children, parents = [], []
+    with engine.connect() as conn:
+        for fos_id, parent_ids, child_ids in conn.execute(
+            select([hierarchy.c.id, hierarchy.c.parent_id, hierarchy.c.child_id])
+        ):
+            for parent_id in parent_ids or []:
+                children.append(fos_id)
+                parents.append(parent_id)
+            for child_id in child_ids or []:
+                children.append(child_id)
+                parents.append(fos_id)
+        levels = dict(
+            conn.execute(
+                select([metadata.c.id, metadata.c.level]).where(
+                    metadata.c.level.isnot(None)
+                )
+            ).fetchall()
+        )
+    closure = FosClosure.from_edges(children, parents, levels)
+    logger.info(f"Built the closure of {len(closure)} fields of study")
+    return closure
@@ -0,0 +1,153 @@
+"""Paper counts of the fields of study.
+
+- `update_fos_frequency` sets `mag_field_of_study_metadata.frequency`, the
+  number of papers tagged with a field of study, keeping its level.
+- `update_filtered_fos` writes `mag_filtered_field_of_study`: for every year,
+  the papers and citations of each field of study and its descendants in the
+  hierarchy, for the fields of study with at least `min_papers` papers.
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+
+from ai_research.mag.bulk_load import replace_rows
+from ai_research.mag.mag_orm import (
+    Paper,
+    PaperFieldsOfStudy,
+    FieldOfStudy,
+    FosMetadata,
+    FilteredFos,
+)
+from ai_research.transformers.fos_hierarchy import load_closure
+
+logger = logging.getLogger(__name__)
+
+papers = Paper.__table__
+paper_fos = PaperFieldsOfStudy.__table__
+fields = FieldOfStudy.__table__
+metadata = FosMetadata.__table__
+
+
+def update_fos_frequency(engine, fos_ids):
+    """Recount the papers of some fields of study.
+
+    Returns:
+        (int) Number of fields of study updated.
+
+    """
+    counts = (
+        select([fields.c.id, func.count(paper_fos.c.paper_id).label("frequency")])
+        .select_from(
+            fields.outerjoin(paper_fos, paper_fos.c.field_of_study_id == fields.c.id)
+        )
+        .where(fields.c.id.in_([int(i) for i in fos_ids]))
+        .group_by(fields.c.id)
+    )
+    upsert = insert(metadata).from_select(["id", "frequency"], counts)
+    upsert = upsert.on_conflict_do_update(
+        index_elements=[metadata.c.id],
+        set_={"frequency": upsert.excluded.frequency},
+    )
+    with engine.begin() as conn:
+        return conn.execute(upsert).rowcount
+
+
+def read_year_fields(engine, year):
+    """paper_id, field_of_study_id and citations of the papers of a year."""
+    query = (
+        select(
+            [paper_fos.c.paper_id, paper_fos.c.field_of_study_id, papers.c.citations]
+        )
+        .select_from(paper_fos.join(papers, papers.c.id == paper_fos.c.paper_id))
+        .where(papers.c.year_int == int(year))
+    )
+    return pd.read_sql(query, engine)
+
+
+def fos_counts(year_fields, closure=None):
+    """Papers and citations of every field of study of one year.
+
+    Args:
+        year_fields (pandas.DataFrame): paper_id, field_of_study_id and
+            citations, as from `read_year_fields`.
+        closure (FosClosure): If given, papers also count towards every
+            ancestor of their fields of study.
+
+    Returns:
+        (pandas.DataFrame) field_of_study_id, paper_count and total_citations.
+
+    """
+    paper_ids = year_fields.paper_id.values
+    fos_ids = year_fields.field_of_study_id.values
+    if closure is not None and len(closure):
+        known = np.isin(fos_ids, closure.ids)
+        expanded = closure.expand(paper_ids[known], fos_ids[known])
+        paper_ids = np.concatenate([expanded[0], paper_ids[~known]])
+        fos_ids = np.concatenate([expanded[1], fos_ids[~known]])
+    citations = (
+        year_fields.drop_duplicates("paper_id")
+        .set_index("paper_id")
+        .citations.fillna(0)
+        .reindex(paper_ids)
+        .values
+    )
+    members = pd.DataFrame(
+        {"paper_id": paper_ids, "field_of_study_id": fos_ids, "citations": citations}
+    ).drop_duplicates(["paper_id", "field_of_study_id"])
+    return (
+        members.groupby("field_of_study_id")
+        .agg({"paper_id": "size", "citations": "sum"})
+        .rename(columns={"paper_id": "paper_count", "citations": "total_citations"})
+        .astype(np.int64)
+        .reset_index()
+    )
+
+
+def update_filtered_fos(engine, years, closure=None, min_papers=1):
+    """Rewrite `mag_filtered_field_of_study` for some years.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): Database holding the MAG tables.
+        years (list of int): Years to recompute. Years without papers are
+            emptied.
+        closure (FosClosure): Field of study hierarchy. Loaded from the
+            database if None.
+        min_papers (int): Leave out the fields of study with fewer papers.
+
+    Returns:
+        (int) Number of rows written.
+
+    """
+    if closure is None:
+        closure = load_closure(engine)
+    descendants = {}
+    n = 0
+    for year in years:
+        counts = fos_counts(read_year_fields(engine, year), closure)
+        counts = counts[counts.paper_count >= min_papers]
+        records = []
+        for row in counts.itertuples(index=False):
+            fos_id = int(row.field_of_study_id)
+            if fos_id not in descendants:
+                descendants[fos_id] = (
+                    closure.descendants(fos_id).tolist()
+                    if fos_id in closure.ids
+                    else []
+                )
+            records.append(
+                {
+                    "field_of_study_id": fos_id,
+                    "year": str(year),
+                    "all_children": descendants[fos_id],
+                    "paper_count": int(row.paper_count),
+                    "total_citations": int(row.total_citations),
+                }
+            )
+        n += replace_rows(engine, FilteredFos, FilteredFos.year == str(year), records)
+        logger.info(
+            f"mag_filtered_field_of_study: wrote {len(records)} rows for {year}"
+        )
+    return n
@@ -0,0 +1,107 @@
+"""Fingerprints of the input partitions of derived tables.
+
+A derived table is recomputed one partition (e.g. one year) at a time. The
+fingerprint of the inputs of each partition is kept in a small JSON file so
+that a rerun only recomputes the partitions whose inputs changed.
+"""
+import hashlib
+import json
+from pathlib import Path
+
+import numpy as np
+from sqlalchemy import func, literal_column, select
+
+import ai_research
+
+STATE_DIR = ai_research.project_dir / "data" / "interim" / "partition_state"
+
+
+def fingerprint(*arrays):
+    """Hash of the contents of some arrays, independent of their row order."""
+    h = hashlib.md5()
+    arrays = [np.asarray(a) for a in arrays]
+    if arrays and len(arrays[0]):
+        order = np.lexsort(arrays[::-1])
+        arrays = [a[order] for a in arrays]
+    for a in arrays:
+        if a.dtype == object:
+            a = a.astype(str)
+        h.update(str(a.dtype).encode())
+        h.update(np.ascontiguousarray(a).tobytes())
+    return h.hexdigest()
+
+
+class PartitionState:
+    """Input fingerprints of the partitions of a derived table.
+
+    Args:
+        name (str): Name of the derived table or stage.
+        directory (str or Path): Where the state files are kept.
+
+    """
+
+    def __init__(self, name, directory=STATE_DIR):
+        self.path = Path(directory) / f"{name}.json"
+        self.fingerprints = {}
+        if self.path.exists():
+            with open(self.path, "rt") as f:
+                self.fingerprints = json.load(f)
+
+    def changed(self, partition, value):
+        """Whether a partition's fingerprint differs from the stored one."""
+        return self.fingerprints.get(str(partition)) != value
+
+    def update(self, partition, value):
+        """Record the fingerprint of a recomputed partition and save."""
+        self.fingerprints[str(partition)] = value
+        self.save()
+
+    def stale(self, present, partitions=None):
+        """Partitions that no longer have any input.
+
+        Args:
+            present (iterable): Partitions that have inputs.
+            partitions (list): The partitions asked for, whether or not they
+                have a fingerprint. Every recorded partition if None.
+
+        Returns:
+            (list of str) Sorted partitions whose rows should be removed.
+
+        """
+        if partitions is None:
+            stale = set(self.fingerprints)
+        else:
+            stale = {str(p) for p in partitions}
+        return sorted(stale - {str(p) for p in present})
+
+    def remove(self, partition):
+        """Forget a partition that no longer has any input and save."""
+        self.fingerprints.pop(str(partition), None)
+        self.save()
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "wt") as f:
+            json.dump(self.fingerprints, f, indent=1, sort_keys=True)
+
+
+def query_fingerprints(engine, query):
+    """Row count and hash of the rows of a query, for each partition.
+
+    Rows are hashed and the hashes summed in the database, so the result does
+    not depend on the row order and only one row per partition is fetched.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): PostgreSQL engine.
+        query (sqlalchemy.sql.Select): Its first column is the partition key.
+
+    Returns:
+        (dict) Partition key to a "count:hash" string.
+
+    """
+    rows = query.alias("rows")
+    key = list(rows.columns)[0]
+    row_hash = func.hashtext(literal_column("rows::text"))
+    summary = select([key, func.count(), func.sum(row_hash)]).group_by(key)
+    with engine.connect() as conn:
+        return {k: f"{count}:{total}" for k, count, total in conn.execute(summary)}
@@ -0,0 +1,223 @@
+"""Revealed comparative advantage of countries and affiliations.
+
+For every year, papers are linked to entities (countries or affiliations)
+through `mag_author_affiliation` and to fields of study through
+`mag_paper_fields_of_study`. The entity x field of study paper counts are one
+sparse product of the two binary incidence matrices, and
+
+    RCA[e, f] = (X[e, f] / X[e, :]) / (X[:, f] / X[:, :])
+
+is computed on the non-zero counts only. A paper counts once per entity and
+field of study, however many of its authors share them.
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sqlalchemy import select
+
+from ai_research.mag.bulk_load import replace_rows
+from ai_research.mag.mag_orm import (
+    Paper,
+    PaperFieldsOfStudy,
+    AuthorAffiliation,
+    AffiliationLocation,
+    MetricCountryRCA,
+    MetricAffiliationRCA,
+)
+from ai_research.transformers.partitions import (
+    PartitionState,
+    fingerprint,
+    STATE_DIR,
+)
+
+logger = logging.getLogger(__name__)
+
+papers = Paper.__table__
+paper_fos = PaperFieldsOfStudy.__table__
+author_aff = AuthorAffiliation.__table__
+locations = AffiliationLocation.__table__
+
+TARGETS = {"country": MetricCountryRCA, "affiliation": MetricAffiliationRCA}
+
+
+def _year_filter(query, years):
+    query = query.where(papers.c.year_int.isnot(None))
+    if years is not None:
+        query = query.where(papers.c.year_int.in_([int(y) for y in years]))
+    return query
+
+
+def read_paper_entities(engine, level="country", years=None):
+    """Distinct (paper_id, entity, year) rows of papers with a known year."""
+    if level == "country":
+        query = (
+            select(
+                [
+                    author_aff.c.paper_id,
+                    locations.c.country.label("entity"),
+                    papers.c.year,
+                ]
+            )
+            .select_from(
+                author_aff.join(
+                    locations, locations.c.affiliation_id == author_aff.c.affiliation_id
+                ).join(papers, papers.c.id == author_aff.c.paper_id)
+            )
+            .where(locations.c.country.isnot(None))
+        )
+    elif level == "affiliation":
+        query = select(
+            [
+                author_aff.c.paper_id,
+                author_aff.c.affiliation_id.label("entity"),
+                papers.c.year,
+            ]
+        ).select_from(author_aff.join(papers, papers.c.id == author_aff.c.paper_id))
+        query = query.where(author_aff.c.affiliation_id.isnot(None))
+    else:
+        raise ValueError(f"Unknown RCA level: {level}")
+    return pd.read_sql(_year_filter(query, years).distinct(), engine)
+
+
+def read_paper_fields(engine, years=None):
+    """(paper_id, field_of_study_id, year) rows of papers with a known year."""
+    query = select(
+        [paper_fos.c.paper_id, paper_fos.c.field_of_study_id, papers.c.year]
+    ).select_from(paper_fos.join(papers, papers.c.id == paper_fos.c.paper_id))
+    return pd.read_sql(_year_filter(query, years), engine)
+
+
+def incidence(rows, cols, n_rows, n_cols):
+    """Binary sparse matrix with ones at (rows, cols)."""
+    m = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int64), (rows, cols)), shape=(n_rows, n_cols)
+    )
+    m.data[:] = 1
+    return m
+
+
+def count_matrix(entity_papers, entities, fos_papers, fos):
+    """Entity x field of study paper counts.
+
+    Args:
+        entity_papers, entities (array): Paper - entity links.
+        fos_papers, fos (array): Paper - field of study links.
+
+    Returns:
+        counts (scipy.sparse.coo_matrix): Paper counts.
+        entity_labels, fos_labels (numpy.ndarray): Row and column labels.
+
+    """
+    paper_codes, _ = pd.factorize(np.concatenate([entity_papers, fos_papers]))
+    n_papers = paper_codes.max() + 1 if len(paper_codes) else 0
+    entity_codes, entity_labels = pd.factorize(entities, sort=True)
+    fos_codes, fos_labels = pd.factorize(fos, sort=True)
+    a = incidence(
+        paper_codes[: len(entity_papers)], entity_codes, n_papers, len(entity_labels)
+    )
+    b = incidence(
+        paper_codes[len(entity_papers) :], fos_codes, n_papers, len(fos_labels)
+    )
+    counts = (a.T @ b).tocoo()
+    counts.sum_duplicates()
+    return counts, np.asarray(entity_labels), np.asarray(fos_labels)
+
+
+def revealed_comparative_advantage(counts):
+    """RCA of the non-zero cells of a count matrix, in COO order."""
+    entity_totals = np.bincount(counts.row, counts.data, minlength=counts.shape[0])
+    fos_totals = np.bincount(counts.col, counts.data, minlength=counts.shape[1])
+    total = counts.data.sum()
+    share = counts.data / entity_totals[counts.row]
+    expected = fos_totals[counts.col] / total
+    return share / expected
+
+
+def year_rca(entities, fields):
+    """RCA of one year of paper - entity and paper - field of study links.
+
+    Returns:
+        (pandas.DataFrame) entity, field_of_study_id and rca_sum columns.
+        rca_sum is the RCA of the entity's paper counts.
+
+    """
+    counts, entity_labels, fos_labels = count_matrix(
+        entities.paper_id.values,
+        entities.entity.values,
+        fields.paper_id.values,
+        fields.field_of_study_id.values,
+    )
+    return pd.DataFrame(
+        {
+            "entity": entity_labels[counts.row],
+            "field_of_study_id": fos_labels[counts.col],
+            "rca_sum": revealed_comparative_advantage(counts),
+        }
+    )
+
+
+def update_rca(
+    engine, level="country", years=None, closure=None, force=False, state_dir=STATE_DIR
+):
+    """Recompute the RCA tables for the years whose inputs changed.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): Database holding the MAG tables.
+        level (str): "country" (`rca_country`) or "affiliation"
+            (`rca_affiliation`).
+        years (list): Only consider these years. Defaults to all.
+        closure (FosClosure): If given, papers also count towards every
+            ancestor of their fields of study.
+        force (bool): Recompute every year, changed or not.
+        state_dir (str or Path): Where the input fingerprints are kept.
+
+    Returns:
+        (list) Years that were recomputed or removed.
+
+    """
+    target = TARGETS[level]
+    state = PartitionState(target.__tablename__, state_dir)
+    entities = read_paper_entities(engine, level, years)
+    fields = read_paper_fields(engine, years)
+    if closure is not None:
+        paper_year = fields.drop_duplicates("paper_id").set_index("paper_id").year
+        paper_ids, fos_ids = closure.expand(
+            fields.paper_id.values, fields.field_of_study_id.values
+        )
+        fields = pd.DataFrame(
+            {
+                "paper_id": paper_ids,
+                "field_of_study_id": fos_ids,
+                "year": paper_year.reindex(paper_ids).values,
+            }
+        )
+
+    updated = []
+    fields_by_year = dict(tuple(fields.groupby("year")))
+    for year, year_entities in entities.groupby("year"):
+        year_fields = fields_by_year.get(year, fields.iloc[:0])
+        key = fingerprint(
+            year_entities.paper_id.values,
+            year_entities.entity.values.astype(str),
+        ) + fingerprint(
+            year_fields.paper_id.values, year_fields.field_of_study_id.values
+        )
+        if not force and not state.changed(year, key):
+            continue
+        rca = year_rca(year_entities, year_fields)
+        rca["year"] = year
+        n = replace_rows(
+            engine, target, target.year == year, rca.to_dict(orient="records")
+        )
+        state.update(year, key)
+        updated.append(year)
+        logger.info(f"{target.__tablename__}: wrote {n} rows for {year}")
+
+    # Years that no longer have any input
+    for year in state.stale(entities.year.unique(), years):
+        replace_rows(engine, target, target.year == year, [])
+        state.remove(year)
+        updated.append(year)
+    return updated
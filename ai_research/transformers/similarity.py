@@ -0,0 +1,209 @@
+"""Country similarity for every field of study and year.
+
+The profile of a country in a (year, topic) slice is the count of its papers
+in that topic over their fields of study, i.e. its row of the group x category
+matrix of `diversity.group_profiles`. Closeness is the cosine similarity of
+two profiles.
+
+Each slice is compared in blocks of `block_size` countries against all
+countries of the slice, so memory stays at block_size x n_countries floats
+per worker whatever the number of countries, topics and years. Slices are
+spread over a process pool. With `top_k`, only the k closest countries of
+every country are kept.
+"""
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from ai_research.mag.bulk_load import replace_rows
+from ai_research.mag.mag_orm import CountrySimilarity
+from ai_research.transformers.diversity import group_profiles, read_paper_fields
+from ai_research.transformers.partitions import (
+    PartitionState,
+    fingerprint,
+    STATE_DIR,
+)
+from ai_research.transformers.rca import read_paper_entities
+
+logger = logging.getLogger(__name__)
+
+
+def normalise_rows(matrix):
+    """Scale the rows of a sparse matrix to unit length."""
+    matrix = sparse.csr_matrix(matrix, dtype=np.float64)
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms) @ matrix
+
+
+def cosine_pairs(profiles, top_k=None, block_size=1024):
+    """Cosine similarity between the rows of a profile matrix, in blocks.
+
+    Args:
+        profiles (scipy.sparse matrix): One row per country.
+        top_k (int): Keep the k most similar rows of every row. By default all
+            pairs with a positive similarity are kept, once (a < b).
+        block_size (int): Rows compared at a time.
+
+    Returns:
+        a, b (numpy.ndarray): Row indices of each pair.
+        closeness (numpy.ndarray): Cosine similarity of each pair.
+
+    """
+    profiles = normalise_rows(profiles)
+    transposed = profiles.T.tocsc()
+    n = profiles.shape[0]
+    rows, cols, values = [], [], []
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        block = (profiles[start:stop] @ transposed).toarray()
+        local = np.arange(stop - start)
+        block[local, local + start] = 0
+        if top_k is not None:
+            k = min(top_k, n - 1)
+            if k <= 0:
+                continue
+            cols_ = np.argpartition(-block, k - 1, axis=1)[:, :k]
+            rows_ = np.repeat(local, k)
+            cols_ = cols_.ravel()
+        else:
+            rows_, cols_ = np.nonzero(np.triu(block, k=start + 1))
+        vals = block[rows_, cols_]
+        keep = vals > 0
+        rows.append(rows_[keep] + start)
+        cols.append(cols_[keep])
+        values.append(vals[keep])
+    if not rows:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0)
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(values)
+
+
+def _slice_similarity(args):
+    year, topic, countries, profiles, top_k, block_size = args
+    a, b, closeness = cosine_pairs(profiles, top_k, block_size)
+    return pd.DataFrame(
+        {
+            "country_a": countries[a],
+            "country_b": countries[b],
+            "closeness": closeness,
+            "year": year,
+            "field_of_study_id": topic,
+        }
+    )
+
+
+def country_similarity(
+    paper_countries,
+    paper_fields,
+    closure=None,
+    top_k=None,
+    n_jobs=None,
+    block_size=1024,
+):
+    """Closeness of country pairs for every (year, field of study) slice.
+
+    Args:
+        paper_countries (pandas.DataFrame): paper_id, country, year.
+        paper_fields (pandas.DataFrame): paper_id, field_of_study_id.
+        closure (FosClosure): If given, papers also count towards the
+            ancestors of their fields of study.
+        top_k (int): Keep only the k closest countries of every country.
+        n_jobs (int): Worker processes. Defaults to the number of CPUs.
+        block_size (int): Countries compared at a time.
+
+    Returns:
+        (pandas.DataFrame) country_a, country_b, closeness, year and
+        field_of_study_id.
+
+    """
+    groups, membership, categories, _ = group_profiles(
+        paper_countries, paper_fields, closure
+    )
+    profiles = (membership @ categories).tocsr()
+    slices = pd.DataFrame(
+        {
+            "row": np.arange(len(groups)),
+            "country": groups.get_level_values(0),
+            "year": groups.get_level_values(1),
+            "topic": groups.get_level_values(2),
+        }
+    )
+    tasks = (
+        (
+            year,
+            topic,
+            group.country.values,
+            profiles[group.row.values],
+            top_k,
+            block_size,
+        )
+        for (year, topic), group in slices.groupby(["year", "topic"])
+        if len(group) > 1
+    )
+    if n_jobs == 1:
+        results = list(map(_slice_similarity, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            results = list(pool.map(_slice_similarity, tasks, chunksize=64))
+    if not results:
+        return pd.DataFrame(
+            columns=["country_a", "country_b", "closeness", "year", "field_of_study_id"]
+        )
+    return pd.concat(results, ignore_index=True)
+
+
+def update_country_similarity(
+    engine,
+    years=None,
+    closure=None,
+    top_k=None,
+    n_jobs=None,
+    force=False,
+    state_dir=STATE_DIR,
+):
+    """Rewrite `country_similarity` for the years whose inputs changed.
+
+    The rows of the years that no longer have any input are removed.
+
+    Returns:
+        (list) Years that were recomputed or removed.
+
+    """
+    state = PartitionState(CountrySimilarity.__tablename__, state_dir)
+    paper_countries = read_paper_entities(engine, "country", years).rename(
+        columns={"entity": "country"}
+    )
+    paper_fields = read_paper_fields(engine, years)
+
+    updated = []
+    for year, countries in paper_countries.groupby("year"):
+        fields = paper_fields[paper_fields.paper_id.isin(countries.paper_id)]
+        key = fingerprint(
+            countries.paper_id.values, countries.country.values.astype(str)
+        ) + fingerprint(fields.paper_id.values, fields.field_of_study_id.values)
+        key += f":{top_k}"
+        if not force and not state.changed(year, key):
+            continue
+        pairs = country_similarity(
+            countries, fields, closure, top_k=top_k, n_jobs=n_jobs
+        )
+        replace_rows(
+            engine,
+            CountrySimilarity,
+            CountrySimilarity.year == year,
+            pairs.to_dict(orient="records"),
+        )
+        state.update(year, key)
+        updated.append(year)
+        logger.info(f"country_similarity: wrote {len(pairs)} pairs for {year}")
+
+    # Years that no longer have any input
+    for year in state.stale(paper_countries.year.unique(), years):
+        replace_rows(engine, CountrySimilarity, CountrySimilarity.year == year, [])
+        state.remove(year)
+        updated.append(year)
+    return updated
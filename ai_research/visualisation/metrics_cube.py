@@ -0,0 +1,475 @@
+"""In-memory metrics cube and cached query service for the front-end.
+
+The cube holds one cell per (country, field_of_study_id, year) of
+`viz_metrics_and_outputs`, completed with `viz_metrics_by_country`. Every
+cell has the additive measures paper_count and total_citations and the
+metrics shannon_diversity, rca_sum and female_share.
+
+Roll-ups are precomputed for every combination of
+
+- geo: "country" or "region" (from `country_details.region`),
+- period: "year" or "all" years,
+- hierarchy: "fos" (the fields of study of the table) or "ancestors" (every
+  cell also counts towards the ancestors of its field of study).
+
+Measures are summed. Metrics are not additive and are rolled up as their mean
+weighted by paper_count. In the "ancestors" roll-up a paper tagged with two
+children of a topic counts twice towards it.
+
+`MetricsService` answers slices from an LRU cache keyed on the cube they were
+computed from, so a slice of a replaced cube is never served, and `make_app`
+serves it over HTTP as JSON or Arrow.
+
+    python ai_research/visualisation/metrics_cube.py --port 8080
+"""
+import argparse
+import asyncio
+import logging
+import os
+import threading
+from functools import lru_cache, partial
+from itertools import product
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from aiohttp import web
+from dotenv import find_dotenv, load_dotenv
+from sqlalchemy import create_engine, func, select
+
+from ai_research.mag.mag_orm import (
+    CountryTopicOutputsMetrics,
+    AllMetrics,
+    CountryDetails,
+)
+from ai_research.transformers.fos_hierarchy import load_closure
+
+logger = logging.getLogger(__name__)
+
+outputs = CountryTopicOutputsMetrics.__table__
+all_metrics = AllMetrics.__table__
+country_details = CountryDetails.__table__
+
+KEYS = ["country", "field_of_study_id", "year"]
+MEASURES = ["paper_count", "total_citations"]
+METRICS = ["shannon_diversity", "rca_sum", "female_share"]
+GEOS = ("country", "region")
+PERIODS = ("year", "all")
+HIERARCHIES = ("fos", "ancestors")
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+
+
+def read_cells(engine):
+    """Cells of `viz_metrics_and_outputs`, completed with `viz_metrics_by_country`.
+
+    Returns:
+        (pandas.DataFrame) The KEYS, MEASURES and METRICS columns, one row per
+        (country, field_of_study_id, year).
+
+    """
+    cells = pd.read_sql(
+        select([outputs.c[c] for c in KEYS + MEASURES + METRICS]), engine
+    ).drop_duplicates(KEYS, keep="last")
+    extra = pd.read_sql(
+        select([all_metrics.c[c] for c in KEYS + METRICS]), engine
+    ).drop_duplicates(KEYS, keep="last")
+    cells = cells.set_index(KEYS).combine_first(extra.set_index(KEYS))
+    cells[MEASURES] = cells[MEASURES].fillna(0).astype(np.int64)
+    return cells[MEASURES + METRICS].reset_index()
+
+
+def read_regions(engine):
+    """Region of every country name used in `country_details`."""
+    details = pd.read_sql(
+        select(
+            [
+                country_details.c.name,
+                country_details.c.google_name,
+                country_details.c.wb_name,
+                country_details.c.region,
+            ]
+        ).where(country_details.c.region.isnot(None)),
+        engine,
+    )
+    regions = {}
+    for column in ["wb_name", "name", "google_name"]:
+        named = details[details[column].notnull()]
+        regions.update(zip(named[column], named.region))
+    return regions
+
+
+def table_signature(engine):
+    """Cheap fingerprint of the source tables.
+
+    Tables are rewritten with fresh autoincrement ids, so the row count and
+    highest id change whenever they are refreshed.
+    """
+    with engine.connect() as conn:
+        return tuple(
+            tuple(conn.execute(query).first())
+            for query in [
+                select([func.count(), func.max(outputs.c.id)]),
+                select([func.count(), func.max(all_metrics.c.id)]),
+                select([func.count()]).select_from(country_details),
+            ]
+        )
+
+
+def rollup(
+    cells, geo="country", period="year", hierarchy="fos", regions=None, closure=None
+):
+    """Aggregate cells to one roll-up of the cube.
+
+    Args:
+        cells (pandas.DataFrame): As returned by `read_cells`.
+        geo, period, hierarchy (str): See the module docstring.
+        regions (dict): Country to region, for geo="region".
+        closure (FosClosure): Field of study hierarchy, for
+            hierarchy="ancestors".
+
+    Returns:
+        (pandas.DataFrame) MEASURES and METRICS indexed by KEYS, sorted.
+
+    """
+    df = cells
+    if geo == "region":
+        df = df.assign(country=df.country.map(regions))
+        df = df[df.country.notnull()]
+    if period == "all":
+        df = df.assign(year="all")
+    if hierarchy == "ancestors":
+        # Fields of study missing from the hierarchy only count towards
+        # themselves
+        known = np.isin(df.field_of_study_id.values, closure.ids)
+        rows, fos_ids = closure.expand(
+            np.flatnonzero(known), df.field_of_study_id.values[known]
+        )
+        df = pd.concat(
+            [df.iloc[rows].assign(field_of_study_id=fos_ids), df[~known]],
+            ignore_index=True,
+        )
+
+    # Metrics are averaged over the paper counts of the cells that have them
+    weights = df.paper_count.values.astype(np.float64)
+    weighted = {}
+    for metric in METRICS:
+        values = df[metric].values.astype(np.float64)
+        known = ~np.isnan(values)
+        weighted[metric] = np.where(known, values * weights, 0)
+        weighted[f"{metric}_weight"] = np.where(known, weights, 0)
+    sums = (
+        pd.concat(
+            [df[KEYS + MEASURES].reset_index(drop=True), pd.DataFrame(weighted)], axis=1
+        )
+        .groupby(KEYS, sort=True)
+        .sum()
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for metric in METRICS:
+            weight = sums.pop(f"{metric}_weight")
+            sums[metric] = np.where(weight > 0, sums[metric] / weight, np.nan)
+    return sums[MEASURES + METRICS]
+
+
+class MetricsCube:
+    """Precomputed roll-ups of the metrics cells.
+
+    Args:
+        cells (pandas.DataFrame): As returned by `read_cells`.
+        regions (dict): Country to region. Without it, there is no "region"
+            roll-up.
+        closure (FosClosure): Field of study hierarchy. Without it, there is
+            no "ancestors" roll-up.
+
+    """
+
+    def __init__(self, cells, regions=None, closure=None):
+        self.views = {}
+        for geo, period, hierarchy in product(GEOS, PERIODS, HIERARCHIES):
+            if (geo == "region" and regions is None) or (
+                hierarchy == "ancestors" and closure is None
+            ):
+                continue
+            view = rollup(cells, geo, period, hierarchy, regions, closure)
+            self.views[geo, period, hierarchy] = (
+                view.reset_index(),
+                [np.asarray(codes) for codes in view.index.codes],
+                list(view.index.levels),
+            )
+
+    @classmethod
+    def from_engine(cls, engine, closure=None):
+        return cls(read_cells(engine), read_regions(engine), closure)
+
+    def slice(
+        self,
+        countries=None,
+        topics=None,
+        years=None,
+        geo="country",
+        period="year",
+        hierarchy="fos",
+    ):
+        """Cells of one roll-up, filtered on any of its keys.
+
+        Args:
+            countries, topics, years (list): Keep these countries (or regions),
+                fields of study and years. All are kept by default.
+            geo, period, hierarchy (str): The roll-up, see the module
+                docstring.
+
+        Returns:
+            (pandas.DataFrame) KEYS, MEASURES and METRICS columns.
+
+        """
+        try:
+            frame, codes, levels = self.views[geo, period, hierarchy]
+        except KeyError:
+            raise ValueError(f"No roll-up for {geo}, {period}, {hierarchy}")
+
+        # Views are sorted by country, so each country is one range of rows
+        if countries is None:
+            rows = np.arange(len(frame))
+        else:
+            wanted = _codes(levels[0], countries)
+            starts = np.searchsorted(codes[0], wanted, side="left")
+            stops = np.searchsorted(codes[0], wanted, side="right")
+            rows = np.concatenate(
+                [np.arange(a, b) for a, b in zip(starts, stops)] + [[]]
+            ).astype(np.int64)
+        for i, values in [(1, topics), (2, years)]:
+            if values is not None:
+                rows = rows[np.isin(codes[i][rows], _codes(levels[i], values))]
+        return frame.iloc[rows].reset_index(drop=True)
+
+
+def _codes(level, values):
+    codes = level.get_indexer(list(values))
+    return np.unique(codes[codes >= 0])
+
+
+def _key(values):
+    return None if values is None else tuple(sorted(set(values)))
+
+
+class MetricsService:
+    """Cached slices of the metrics cube of a database.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): Database with the front-end tables.
+            If None, `cube` is served as is.
+        closure (FosClosure): Field of study hierarchy for the "ancestors"
+            roll-up.
+        maxsize (int): Number of slices kept in the LRU cache.
+        cube (MetricsCube): Cube to serve instead of loading it.
+
+    """
+
+    def __init__(self, engine=None, closure=None, maxsize=1024, cube=None):
+        self.engine = engine
+        self.closure = closure
+        self.signature = None
+        self.cube = cube
+        self._lock = threading.Lock()
+        self._slice = lru_cache(maxsize=maxsize)(self._compute)
+        self._render = lru_cache(maxsize=maxsize)(self._encode)
+        if cube is None:
+            self.refresh()
+
+    # The cube is part of the cache keys: a request that started before a
+    # refresh caches its slice under the old cube, where it is never read again
+    def _compute(self, cube, countries, topics, years, geo, period, hierarchy):
+        return cube.slice(countries, topics, years, geo, period, hierarchy)
+
+    def _encode(self, fmt, cube, *key):
+        df = self._slice(cube, *key)
+        if fmt == "arrow":
+            return to_arrow(df)
+        return df.to_json(orient="records").encode()
+
+    def refresh(self, force=False):
+        """Reload the cube and clear the cache if the source tables changed.
+
+        Returns:
+            (bool) Whether the cube was reloaded.
+
+        """
+        if self.engine is None:
+            return False
+        with self._lock:
+            signature = table_signature(self.engine)
+            if not force and signature == self.signature:
+                return False
+            self.cube = MetricsCube.from_engine(self.engine, self.closure)
+            self.signature = signature
+            # Frees the slices of the old cube
+            self._slice.cache_clear()
+            self._render.cache_clear()
+        logger.info(f"Loaded metrics cube: {signature}")
+        return True
+
+    def query(
+        self,
+        countries=None,
+        topics=None,
+        years=None,
+        geo="country",
+        period="year",
+        hierarchy="fos",
+    ):
+        """Cached `MetricsCube.slice`. The returned frame must not be modified."""
+        return self._slice(
+            self.cube,
+            _key(countries),
+            _key(topics),
+            _key(years),
+            geo,
+            period,
+            hierarchy,
+        )
+
+    def render(
+        self,
+        fmt="json",
+        countries=None,
+        topics=None,
+        years=None,
+        geo="country",
+        period="year",
+        hierarchy="fos",
+    ):
+        """Cached slice encoded as JSON records or an Arrow IPC stream."""
+        if fmt not in ("json", "arrow"):
+            raise ValueError(f"Unknown format: {fmt}")
+        return self._render(
+            fmt,
+            self.cube,
+            _key(countries),
+            _key(topics),
+            _key(years),
+            geo,
+            period,
+            hierarchy,
+        )
+
+    def cache_info(self):
+        """Statistics of the slice and encoded response caches."""
+        return {
+            "slices": self._slice.cache_info()._asdict(),
+            "responses": self._render.cache_info()._asdict(),
+        }
+
+
+def to_arrow(df):
+    """Arrow IPC stream of a DataFrame."""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    writer = pa.RecordBatchStreamWriter(sink, table.schema)
+    writer.write_table(table)
+    writer.close()
+    return sink.getvalue().to_pybytes()
+
+
+def _params(request):
+    query = request.query
+    try:
+        topics = [int(t) for t in query.getall("topic", [])] or None
+    except ValueError:
+        raise web.HTTPBadRequest(text="topic must be a field of study id")
+    return dict(
+        countries=query.getall("country", []) or None,
+        topics=topics,
+        years=query.getall("year", []) or None,
+        geo=query.get("geo", "country"),
+        period=query.get("period", "year"),
+        hierarchy=query.get("hierarchy", "fos"),
+    )
+
+
+async def handle_slice(request):
+    """GET /slice of the cube as JSON records or, with format=arrow, Arrow.
+
+    The country, topic and year parameters can be repeated. geo, period and
+    hierarchy select the roll-up.
+    """
+    service = request.app["service"]
+    params = _params(request)
+    fmt = request.query.get("format", "json")
+    loop = asyncio.get_event_loop()
+    try:
+        body = await loop.run_in_executor(None, partial(service.render, fmt, **params))
+    except ValueError as e:
+        raise web.HTTPBadRequest(text=str(e))
+    content_type = ARROW_STREAM if fmt == "arrow" else "application/json"
+    return web.Response(body=body, content_type=content_type)
+
+
+async def handle_refresh(request):
+    """POST /refresh reloads the cube if the tables changed."""
+    loop = asyncio.get_event_loop()
+    refreshed = await loop.run_in_executor(None, request.app["service"].refresh)
+    return web.json_response({"refreshed": refreshed})
+
+
+async def handle_stats(request):
+    """GET /stats returns the cache statistics."""
+    return web.json_response(request.app["service"].cache_info())
+
+
+async def _watch(app):
+    loop = asyncio.get_event_loop()
+    while True:
+        await asyncio.sleep(app["refresh_interval"])
+        try:
+            await loop.run_in_executor(None, app["service"].refresh)
+        except Exception:
+            logger.exception("Metrics cube refresh failed")
+
+
+async def _start_watch(app):
+    app["watch"] = asyncio.ensure_future(_watch(app))
+
+
+async def _stop_watch(app):
+    app["watch"].cancel()
+
+
+def make_app(service, refresh_interval=None):
+    """aiohttp application serving a MetricsService.
+
+    Args:
+        service (MetricsService): Slices to serve.
+        refresh_interval (float): If given, seconds between checks for
+            refreshed source tables.
+
+    """
+    app = web.Application()
+    app["service"] = service
+    app.router.add_get("/slice", handle_slice)
+    app.router.add_post("/refresh", handle_refresh)
+    app.router.add_get("/stats", handle_stats)
+    if refresh_interval:
+        app["refresh_interval"] = refresh_interval
+        app.on_startup.append(_start_watch)
+        app.on_cleanup.append(_stop_watch)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the metrics cube over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--cache-size", type=int, default=1024)
+    parser.add_argument("--refresh-interval", type=float, default=300)
+    args = parser.parse_args()
+
+    engine = create_engine(os.getenv("postgresdb"))
+    service = MetricsService(engine, load_closure(engine), maxsize=args.cache_size)
+    web.run_app(
+        make_app(service, args.refresh_interval), host=args.host, port=args.port
+    )
+
+
+if __name__ == "__main__":
+    load_dotenv(find_dotenv())
+    main()
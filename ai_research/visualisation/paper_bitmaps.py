@@ -0,0 +1,224 @@
+"""Compressed bitmap postings of papers by country, topic and year.
+
+These replace the paper id arrays of `viz_paper_country`, `viz_paper_topics`
+and `viz_paper_year` for filtering. Paper ids are remapped to dense positions
+in their sorted order and every (dimension, key) is a roaring bitmap of
+positions, so filters such as "country X and topic Y and year Z" are bitmap
+intersections and only the requested page of paper ids is materialised.
+"""
+import array
+import json
+import logging
+import numbers
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from pyroaring import BitMap
+from sqlalchemy import select
+
+import ai_research
+from ai_research.mag.mag_orm import (
+    Paper,
+    PaperFieldsOfStudy,
+    AuthorAffiliation,
+    AffiliationLocation,
+)
+
+logger = logging.getLogger(__name__)
+
+INDEX_DIR = ai_research.project_dir / "data" / "processed" / "paper_bitmaps"
+
+
+def to_bitmap(positions):
+    """Roaring bitmap of an array of dense positions."""
+    values = array.array("I")
+    values.frombytes(np.asarray(positions, dtype=np.uint32).tobytes())
+    return BitMap(values)
+
+
+class PaperBitmapIndex:
+    """Bitmap postings of papers per country, topic and year.
+
+    Args:
+        paper_ids (array of int): All indexed paper ids.
+        postings (dict): Dimension to a dict of key to BitMap of positions in
+            the sorted paper ids.
+
+    """
+
+    def __init__(self, paper_ids, postings):
+        self.paper_ids = np.asarray(paper_ids, dtype=np.int64)
+        self.postings = postings
+        self.all = BitMap(range(len(self.paper_ids)))
+        # Dimensions keyed by integers, e.g. topic ids and years
+        self._integer_keys = {
+            dimension
+            for dimension, keys in postings.items()
+            if keys and isinstance(next(iter(keys)), numbers.Integral)
+        }
+
+    @classmethod
+    def from_links(cls, links):
+        """Build the index from paper - key links.
+
+        Args:
+            links (dict): Dimension to a DataFrame of paper_id and key columns.
+
+        """
+        frames = [df.paper_id.values for df in links.values()]
+        paper_ids = (
+            np.unique(np.concatenate(frames)) if frames else np.empty(0, dtype=np.int64)
+        )
+        postings = {}
+        for dimension, df in links.items():
+            df = df.assign(position=np.searchsorted(paper_ids, df.paper_id.values))
+            postings[dimension] = {
+                key: to_bitmap(np.sort(group.position.values))
+                for key, group in df.groupby("key")
+            }
+        return cls(paper_ids, postings)
+
+    def keys(self, dimension):
+        """Sorted keys of a dimension."""
+        return sorted(self.postings[dimension])
+
+    def bitmap(self, dimension, keys):
+        """Union of the postings of some keys of a dimension.
+
+        Keys of the integer dimensions can be given as strings, so year=2019
+        and year="2019" are the same filter. A key without any paper, e.g. a
+        year that is not in the data, matches nothing.
+
+        Raises:
+            ValueError: If a key of an integer dimension is not an integer.
+
+        """
+        postings = self.postings[dimension]
+        if not isinstance(keys, (list, tuple, set, range, np.ndarray)):
+            keys = [keys]
+        if dimension in self._integer_keys:
+            try:
+                keys = [int(k) for k in keys]
+            except ValueError:
+                raise ValueError(f"{dimension} keys are integers, not {keys!r}")
+        found = [postings[k] for k in keys if k in postings]
+        return BitMap.union(*found) if found else BitMap()
+
+    def select(self, exclude=None, **filters):
+        """Papers matching all filters and none of the exclusions.
+
+        Args:
+            exclude (dict): Dimension to keys whose papers are removed.
+            **filters: Dimension to one key or a list of keys. Keys of a
+                dimension are ORed and dimensions are ANDed, e.g.
+                `select(country=["UK", "DK"], year=2019)`. See `bitmap` for
+                how keys are matched.
+
+        Returns:
+            (pyroaring.BitMap) Positions of the matching papers.
+
+        """
+        bitmaps = [self.bitmap(dim, keys) for dim, keys in filters.items()]
+        result = BitMap.intersection(*bitmaps) if bitmaps else self.all.copy()
+        for dimension, keys in (exclude or {}).items():
+            result -= self.bitmap(dimension, keys)
+        return result
+
+    def count(self, exclude=None, **filters):
+        """Number of papers matching a filter, see `select`."""
+        return len(self.select(exclude, **filters))
+
+    def page(self, offset=0, limit=100, exclude=None, **filters):
+        """Sorted paper ids of one page of the papers matching a filter."""
+        positions = self.select(exclude, **filters)[offset : offset + limit]
+        return self.paper_ids[np.frombuffer(positions.to_array(), dtype=np.uint32)]
+
+    def paper_ids_of(self, bitmap):
+        """Paper ids of a bitmap of positions."""
+        return self.paper_ids[np.frombuffer(bitmap.to_array(), dtype=np.uint32)]
+
+    def save(self, directory=INDEX_DIR):
+        """Write the index as one bitmap file and key table per dimension."""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        np.save(directory / "paper_ids.npy", self.paper_ids)
+        for dimension, postings in self.postings.items():
+            keys = []
+            with open(directory / f"{dimension}.bin", "wb") as f:
+                for key, bitmap in postings.items():
+                    blob = bitmap.serialize()
+                    keys.append([_json_key(key), f.tell(), len(blob), len(bitmap)])
+                    f.write(blob)
+            with open(directory / f"{dimension}.json", "wt") as f:
+                json.dump(keys, f)
+
+    @classmethod
+    def load(cls, directory=INDEX_DIR):
+        """Read an index written by `save`."""
+        directory = Path(directory)
+        paper_ids = np.load(directory / "paper_ids.npy", mmap_mode="r")
+        postings = {}
+        for path in sorted(directory.glob("*.json")):
+            with open(path, "rt") as f:
+                keys = json.load(f)
+            with open(directory / f"{path.stem}.bin", "rb") as f:
+                data = f.read()
+            postings[path.stem] = {
+                key: BitMap.deserialize(data[offset : offset + size])
+                for key, offset, size, _ in keys
+            }
+        return cls(paper_ids, postings)
+
+
+def _json_key(key):
+    return key.item() if isinstance(key, np.generic) else key
+
+
+def read_links(engine, closure=None):
+    """Paper - key links of the country, topic and year dimensions.
+
+    Years are the integer `year_int` of the papers. With a `FosClosure`,
+    papers are also posted under the ancestors of their fields of study.
+    """
+    papers = Paper.__table__
+    paper_fos = PaperFieldsOfStudy.__table__
+    author_aff = AuthorAffiliation.__table__
+    locations = AffiliationLocation.__table__
+
+    year = pd.read_sql(
+        select([papers.c.id.label("paper_id"), papers.c.year_int.label("key")]).where(
+            papers.c.year_int.isnot(None)
+        ),
+        engine,
+    )
+    country = pd.read_sql(
+        select([author_aff.c.paper_id, locations.c.country.label("key")])
+        .select_from(
+            author_aff.join(
+                locations, locations.c.affiliation_id == author_aff.c.affiliation_id
+            )
+        )
+        .where(locations.c.country.isnot(None))
+        .distinct(),
+        engine,
+    )
+    topic = pd.read_sql(
+        select([paper_fos.c.paper_id, paper_fos.c.field_of_study_id.label("key")]),
+        engine,
+    )
+    if closure is not None:
+        paper_ids, fos_ids = closure.expand(topic.paper_id.values, topic.key.values)
+        topic = pd.DataFrame({"paper_id": paper_ids, "key": fos_ids})
+    return {"country": country, "topic": topic, "year": year}
+
+
+def build_index(engine, closure=None, directory=INDEX_DIR):
+    """Build the bitmap index from the source tables and save it."""
+    index = PaperBitmapIndex.from_links(read_links(engine, closure))
+    index.save(directory)
+    logger.info(
+        f"Indexed {len(index.paper_ids)} papers: "
+        + ", ".join(f"{len(p)} {d} keys" for d, p in index.postings.items())
+    )
+    return index
@@ -0,0 +1,273 @@
+"""Front-end tables derived from the MAG and metric tables.
+
+Each function recomputes some partitions of one table and replaces them in a
+single transaction:
+
+- `viz_paper_year`, `viz_paper_country` and `viz_paper_topics`: the ids of
+  the papers of every year, country and field of study.
+- `viz_topics_agg`: the field of study names of every paper, by paper year.
+- `viz_metrics_by_country`: RCA, research diversity and female share of
+  every (country, field of study, year) with any of them.
+- `viz_metrics_and_outputs`: paper and citation counts of every (country,
+  field of study, year) of `mag_filtered_field_of_study`, with its metrics.
+
+They are the front-end stages of the DAG run by `make_dataset`.
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import distinct, func, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+
+from ai_research.mag.bulk_load import replace_from_select, replace_rows
+from ai_research.mag.mag_orm import (
+    Paper,
+    PaperFieldsOfStudy,
+    FieldOfStudy,
+    AuthorAffiliation,
+    AffiliationLocation,
+    FilteredFos,
+    MetricCountryRCA,
+    ResearchDiversityCountry,
+    GenderDiversityCountry,
+    AllMetrics,
+    CountryTopicOutputsMetrics,
+    PaperYear,
+    PaperCountry,
+    PaperTopics,
+    PaperTopicsGrouped,
+)
+
+logger = logging.getLogger(__name__)
+
+papers = Paper.__table__
+paper_fos = PaperFieldsOfStudy.__table__
+fields = FieldOfStudy.__table__
+author_aff = AuthorAffiliation.__table__
+locations = AffiliationLocation.__table__
+filtered_fos = FilteredFos.__table__
+rca = MetricCountryRCA.__table__
+research_diversity = ResearchDiversityCountry.__table__
+gender_diversity = GenderDiversityCountry.__table__
+all_metrics = AllMetrics.__table__
+
+KEYS = ["country", "field_of_study_id", "year"]
+METRICS = ["shannon_diversity", "rca_sum", "female_share"]
+
+
+def _paper_ids(column):
+    return func.array_agg(aggregate_order_by(distinct(column), column))
+
+
+def update_paper_year(engine, years):
+    """Rewrite the `viz_paper_year` rows of some years."""
+    query = (
+        select(
+            [
+                papers.c.year,
+                func.count().label("count"),
+                _paper_ids(papers.c.id).label("paper_ids"),
+            ]
+        )
+        .where(papers.c.year_int.in_([int(y) for y in years]))
+        .group_by(papers.c.year)
+    )
+    condition = PaperYear.year.in_([str(y) for y in years])
+    return replace_from_select(engine, PaperYear, condition, query)
+
+
+def update_paper_country(engine, countries):
+    """Rewrite the `viz_paper_country` rows of some countries."""
+    query = (
+        select(
+            [
+                locations.c.country,
+                func.count(distinct(author_aff.c.paper_id)).label("count"),
+                _paper_ids(author_aff.c.paper_id).label("paper_ids"),
+            ]
+        )
+        .select_from(
+            author_aff.join(
+                locations, locations.c.affiliation_id == author_aff.c.affiliation_id
+            )
+        )
+        .where(locations.c.country.in_(list(countries)))
+        .where(author_aff.c.paper_id.isnot(None))
+        .group_by(locations.c.country)
+    )
+    condition = PaperCountry.country.in_(list(countries))
+    return replace_from_select(engine, PaperCountry, condition, query)
+
+
+def update_paper_topics(engine, fos_ids):
+    """Rewrite the `viz_paper_topics` rows of some fields of study."""
+    fos_ids = [int(i) for i in fos_ids]
+    query = (
+        select(
+            [
+                paper_fos.c.field_of_study_id,
+                fields.c.name,
+                func.count().label("count"),
+                _paper_ids(paper_fos.c.paper_id).label("paper_ids"),
+            ]
+        )
+        .select_from(
+            paper_fos.join(fields, fields.c.id == paper_fos.c.field_of_study_id)
+        )
+        .where(paper_fos.c.field_of_study_id.in_(fos_ids))
+        .group_by(paper_fos.c.field_of_study_id, fields.c.name)
+    )
+    condition = PaperTopics.field_of_study_id.in_(fos_ids)
+    return replace_from_select(engine, PaperTopics, condition, query)
+
+
+def update_topics_grouped(engine, years):
+    """Rewrite the `viz_topics_agg` rows of the papers of some years."""
+    years = [int(y) for y in years]
+    year_papers = select([papers.c.id]).where(papers.c.year_int.in_(years))
+    query = (
+        select(
+            [
+                paper_fos.c.paper_id.label("id"),
+                func.array_agg(aggregate_order_by(fields.c.name, fields.c.name)).label(
+                    "field_of_study"
+                ),
+            ]
+        )
+        .select_from(
+            paper_fos.join(fields, fields.c.id == paper_fos.c.field_of_study_id)
+        )
+        .where(paper_fos.c.paper_id.in_(year_papers))
+        .group_by(paper_fos.c.paper_id)
+    )
+    condition = PaperTopicsGrouped.id.in_(year_papers)
+    return replace_from_select(engine, PaperTopicsGrouped, condition, query)
+
+
+def read_metrics(engine, year):
+    """RCA, research diversity and female share of the groups of one year.
+
+    Returns:
+        (pandas.DataFrame) KEYS and METRICS columns, one row per group with
+        any of the metrics.
+
+    """
+    sources = [
+        (rca, "rca_sum"),
+        (research_diversity, "shannon_diversity"),
+        (gender_diversity, "female_share"),
+    ]
+    frames = []
+    for table, metric in sources:
+        frame = pd.read_sql(
+            select(
+                [
+                    table.c.entity.label("country"),
+                    table.c.field_of_study_id,
+                    table.c[metric],
+                ]
+            ).where(table.c.year == str(year)),
+            engine,
+        )
+        frames.append(frame.drop_duplicates(KEYS[:2], keep="last").set_index(KEYS[:2]))
+    metrics = pd.concat(frames, axis=1).reset_index()
+    metrics["year"] = str(year)
+    return metrics[KEYS + METRICS]
+
+
+def _names(engine, fos_ids):
+    query = select([fields.c.id, fields.c.name]).where(
+        fields.c.id.in_([int(i) for i in np.unique(fos_ids)])
+    )
+    with engine.connect() as conn:
+        return dict(conn.execute(query).fetchall())
+
+
+def _records(df):
+    return df.astype(object).where(df.notnull(), None).to_dict(orient="records")
+
+
+def update_all_metrics(engine, years):
+    """Rewrite the `viz_metrics_by_country` rows of some years."""
+    n = 0
+    for year in years:
+        metrics = read_metrics(engine, year)
+        metrics["name"] = metrics.field_of_study_id.map(
+            _names(engine, metrics.field_of_study_id)
+        )
+        n += replace_rows(
+            engine, AllMetrics, AllMetrics.year == str(year), _records(metrics)
+        )
+        logger.info(f"viz_metrics_by_country: wrote {len(metrics)} rows for {year}")
+    return n
+
+
+def read_outputs(engine, year):
+    """Papers and citations of the groups of the filtered fields of study.
+
+    A paper counts once per country of its authors and field of study.
+    """
+    paper_countries = (
+        select([author_aff.c.paper_id, locations.c.country])
+        .distinct()
+        .select_from(
+            author_aff.join(
+                locations, locations.c.affiliation_id == author_aff.c.affiliation_id
+            ).join(papers, papers.c.id == author_aff.c.paper_id)
+        )
+        .where(papers.c.year_int == int(year))
+        .where(locations.c.country.isnot(None))
+        .alias("paper_countries")
+    )
+    query = (
+        select(
+            [
+                paper_countries.c.country,
+                paper_fos.c.field_of_study_id,
+                func.count().label("paper_count"),
+                func.coalesce(func.sum(papers.c.citations), 0).label("total_citations"),
+            ]
+        )
+        .select_from(
+            paper_countries.join(
+                paper_fos, paper_fos.c.paper_id == paper_countries.c.paper_id
+            )
+            .join(papers, papers.c.id == paper_countries.c.paper_id)
+            .join(
+                filtered_fos,
+                (filtered_fos.c.field_of_study_id == paper_fos.c.field_of_study_id)
+                & (filtered_fos.c.year == str(year)),
+            )
+        )
+        .group_by(paper_countries.c.country, paper_fos.c.field_of_study_id)
+    )
+    outputs = pd.read_sql(query, engine)
+    outputs["year"] = str(year)
+    return outputs
+
+
+def update_outputs_metrics(engine, years):
+    """Rewrite the `viz_metrics_and_outputs` rows of some years."""
+    n = 0
+    for year in years:
+        outputs = read_outputs(engine, year)
+        metrics = pd.read_sql(
+            select([all_metrics.c[c] for c in KEYS + METRICS + ["name"]]).where(
+                all_metrics.c.year == str(year)
+            ),
+            engine,
+        ).drop_duplicates(KEYS, keep="last")
+        outputs = outputs.merge(metrics, on=KEYS, how="left")
+        missing = outputs.name.isnull()
+        outputs.loc[missing, "name"] = outputs.field_of_study_id[missing].map(
+            _names(engine, outputs.field_of_study_id[missing])
+        )
+        n += replace_rows(
+            engine,
+            CountryTopicOutputsMetrics,
+            CountryTopicOutputsMetrics.year == str(year),
+            _records(outputs),
+        )
+        logger.info(f"viz_metrics_and_outputs: wrote {len(outputs)} rows for {year}")
+    return n
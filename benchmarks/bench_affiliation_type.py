@@ -0,0 +1,68 @@
+"""Affiliation classifier against a per-row regex loop.
+
+The baseline searches every name with one regex per keyword, as the
+affiliation types used to be computed. Both run on random in-memory names, so
+no database is needed.
+
+    python benchmarks/bench_affiliation_type.py --names 1000000
+"""
+import argparse
+import re
+import time
+import numpy as np
+import ai_research
+from ai_research.transformers.affiliation_type import classify
+
+WORDS = [
+    "acme", "systems", "research", "labs", "global", "data", "ai", "networks",
+    "department", "computer", "science", "engineering", "oxford", "beijing",
+    "tokyo", "california", "munich", "paris", "inc", "ltd", "gmbh", "corporation",
+]  # fmt: skip
+
+
+def make_names(n_names, keywords, seed=0):
+    rng = np.random.RandomState(seed)
+    words = np.array(
+        WORDS + [k.rstrip("*") + "y" if k.endswith("*") else k for k in keywords]
+    )
+    lengths = rng.randint(2, 7, size=n_names)
+    tokens = rng.choice(words, size=lengths.sum())
+    bounds = np.concatenate([[0], np.cumsum(lengths)])
+    return [" ".join(tokens[a:b]) for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+def per_row(names, keywords):
+    patterns = [
+        re.compile(
+            r"\b" + re.escape(k.rstrip("*")) + (r"" if k.endswith("*") else r"\b")
+        )
+        for k in keywords
+    ]
+    return [int(any(p.search(name.lower()) for p in patterns)) for name in names]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--names", type=int, default=200000)
+    parser.add_argument("--jobs", type=int, default=None)
+    parser.add_argument("--skip-baseline", action="store_true")
+    args = parser.parse_args()
+
+    keywords = ai_research.config["affiliation_type"]["non_industry"]
+    names = make_names(args.names, keywords)
+    start = time.perf_counter()
+    types = classify(names, keywords, n_jobs=args.jobs)
+    elapsed = time.perf_counter() - start
+    print(
+        f"automaton: {len(names) / elapsed:,.0f} affiliations/s "
+        f"({types.mean():.2f} non-industry)"
+    )
+    if not args.skip_baseline:
+        start = time.perf_counter()
+        per_row(names, keywords)
+        elapsed = time.perf_counter() - start
+        print(f"baseline:  {len(names) / elapsed:,.0f} affiliations/s")
+
+
+if __name__ == "__main__":
+    main()
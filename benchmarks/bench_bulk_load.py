@@ -0,0 +1,89 @@
+"""Rows per second of the COPY bulk loader against ORM inserts.
+
+Runs against the local database in the `test_postgresdb` environment variable.
+The MAG tables are created and dropped by the benchmark.
+
+    python benchmarks/bench_bulk_load.py --papers 100000
+"""
+import argparse
+import os
+import random
+import time
+from dotenv import load_dotenv, find_dotenv
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from ai_research.mag.mag_orm import Base, Paper, Author, PaperAuthor
+from ai_research.mag.bulk_load import bulk_load
+
+
+def make_records(n_papers, seed=0):
+    """Random papers with one to five authors each."""
+    rng = random.Random(seed)
+    papers = [
+        {
+            "id": i,
+            "title": f"paper {i}",
+            "year": str(rng.randint(2000, 2020)),
+            "citations": rng.randint(0, 500),
+            "abstract": "lorem ipsum " * rng.randint(10, 50),
+        }
+        for i in range(n_papers)
+    ]
+    n_authors = max(1, n_papers // 2)
+    authors = [{"id": i, "name": f"author {i}"} for i in range(n_authors)]
+    paper_authors = [
+        {"paper_id": p["id"], "author_id": a, "order": k}
+        for p in papers
+        for k, a in enumerate(rng.sample(range(n_authors), rng.randint(1, 5)))
+    ]
+    return {Paper: papers, Author: authors, PaperAuthor: paper_authors}
+
+
+def run_orm(engine, records):
+    session = sessionmaker(engine)()
+    for mapping in (Paper, Author, PaperAuthor):
+        session.add_all(mapping(**r) for r in records[mapping])
+        session.flush()
+    session.commit()
+    session.close()
+
+
+def run_copy(engine, records, batch_size):
+    for mapping in (Paper, Author, PaperAuthor):
+        bulk_load(engine, mapping, records[mapping], batch_size=batch_size)
+
+
+def timed(engine, fn, *args):
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    start = time.perf_counter()
+    fn(engine, *args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--papers", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=50000)
+    parser.add_argument("--skip-orm", action="store_true")
+    args = parser.parse_args()
+
+    load_dotenv(find_dotenv())
+    engine = create_engine(os.getenv("test_postgresdb"))
+    records = make_records(args.papers)
+    n_rows = sum(len(r) for r in records.values())
+
+    results = {"copy": timed(engine, run_copy, records, args.batch_size)}
+    if not args.skip_orm:
+        results["orm"] = timed(engine, run_orm, records)
+    Base.metadata.drop_all(engine)
+
+    for name, seconds in results.items():
+        print(
+            f"{name:>5}: {n_rows} rows in {seconds:.2f}s "
+            f"({n_rows / seconds:,.0f} rows/s)"
+        )
+
+
+if __name__ == "__main__":
+    main()
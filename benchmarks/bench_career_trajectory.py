@@ -0,0 +1,79 @@
+"""Career timelines against walking every author's history in pandas.
+
+The baseline sorts the events, groups them by author and loops over each
+author's years to find their first academia to industry move. Both run on
+random in-memory events, so no database is needed.
+
+    python benchmarks/bench_career_trajectory.py --authors 500000
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from ai_research.transformers.career_trajectory import (
+    ACADEMIA,
+    INDUSTRY,
+    Timelines,
+)
+
+
+def make_events(n_authors, mean_events=10, industry_share=0.2, seed=0):
+    rng = np.random.RandomState(seed)
+    counts = rng.poisson(mean_events, size=n_authors) + 1
+    authors = np.repeat(np.cumsum(rng.randint(1, 1000, size=n_authors)), counts)
+    start = np.repeat(rng.randint(1990, 2015, size=n_authors), counts)
+    years = start + rng.poisson(4, size=counts.sum())
+    # Later events are more likely to be in industry
+    p = industry_share * (years - start) / 4
+    states = np.where(rng.rand(counts.sum()) < p, INDUSTRY, ACADEMIA)
+    return authors, years, states
+
+
+def baseline(authors, years, states):
+    events = pd.DataFrame({"author_id": authors, "year": years, "state": states})
+    events = events.groupby(["author_id", "year"]).state.agg(np.bitwise_or.reduce)
+    moves = {}
+    for author_id, timeline in events.groupby(level=0):
+        previous = None
+        for (_, year), state in timeline.items():
+            if previous == ACADEMIA and state & INDUSTRY:
+                moves[author_id] = year
+                break
+            previous = state
+    return moves
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--authors", type=int, default=100000)
+    parser.add_argument("--skip-baseline", action="store_true")
+    args = parser.parse_args()
+
+    authors, years, states = make_events(args.authors)
+    print(f"{len(authors)} events")
+    start = time.perf_counter()
+    timelines = Timelines.from_events(authors, years, states)
+    print(f"build:       {time.perf_counter() - start:.2f}s")
+    start = time.perf_counter()
+    moves = timelines.transitions()
+    print(f"transitions: {time.perf_counter() - start:.2f}s, {len(moves)} movers")
+    start = time.perf_counter()
+    timelines.cohorts()
+    print(f"cohorts:     {time.perf_counter() - start:.2f}s")
+
+    half = len(authors) // 2
+    start = time.perf_counter()
+    Timelines.from_events(authors[:half], years[:half], states[:half]).extend(
+        authors[half:], years[half:], states[half:]
+    )
+    print(f"extend:      {time.perf_counter() - start:.2f}s (build of half included)")
+
+    if not args.skip_baseline:
+        start = time.perf_counter()
+        expected = baseline(authors, years, states)
+        print(f"baseline:    {time.perf_counter() - start:.2f}s")
+        assert expected == dict(zip(moves.author_id, moves.year))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Citation graph build and queries against re-parsing references.
+
+The baseline computes in-degrees by decoding every paper's references with
+json.loads, as each analysis had to. Both run on random in-memory
+references, so no database is needed.
+
+    python benchmarks/bench_citation_graph.py --papers 1000000
+"""
+import argparse
+import json
+import time
+from collections import Counter
+import numpy as np
+from ai_research.transformers.citation_graph import CitationGraph, parse_edges
+
+
+def make_references(n_papers, mean_refs=20, seed=0):
+    rng = np.random.RandomState(seed)
+    ids = np.cumsum(rng.randint(1, 1000, size=n_papers))
+    counts = rng.poisson(mean_refs, size=n_papers)
+    # Older papers are cited more
+    cited = ids[(rng.power(0.5, size=counts.sum()) * n_papers).astype(np.int64)]
+    bounds = np.concatenate([[0], np.cumsum(counts)])
+    references = [
+        json.dumps(cited[a:b].tolist()) for a, b in zip(bounds[:-1], bounds[1:])
+    ]
+    return ids, references
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--papers", type=int, default=200000)
+    parser.add_argument("--jobs", type=int, default=None)
+    parser.add_argument("--skip-baseline", action="store_true")
+    args = parser.parse_args()
+
+    ids, references = make_references(args.papers)
+    start = time.perf_counter()
+    citing, cited = parse_edges(ids, references, n_jobs=args.jobs)
+    graph = CitationGraph.empty().add(citing, cited, parsed_ids=ids)
+    print(f"build:     {time.perf_counter() - start:.2f}s, {graph.n_edges} edges")
+
+    start = time.perf_counter()
+    graph.in_degree()
+    print(f"in-degree: {time.perf_counter() - start:.3f}s")
+    start = time.perf_counter()
+    graph.pagerank()
+    print(f"pagerank:  {time.perf_counter() - start:.2f}s")
+    start = time.perf_counter()
+    found, _ = graph.neighbourhood(ids[-100:], k=2, direction="both")
+    print(f"2-hop:     {time.perf_counter() - start:.3f}s, {len(found)} papers")
+
+    if not args.skip_baseline:
+        start = time.perf_counter()
+        degree = Counter()
+        for refs in references:
+            degree.update(set(json.loads(refs)))
+        print(f"baseline in-degree: {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
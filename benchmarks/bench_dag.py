@@ -0,0 +1,100 @@
+"""Full build of the derived tables against incremental runs.
+
+Runs against the local database in the `test_postgresdb` environment variable.
+The MAG tables are created and dropped by the benchmark. Papers have years
+2000-2019, two fields of study out of 200 and authors from 50 countries; the
+incremental runs follow the load of a year of 2020 papers and a change of
+the `min_papers` parameter.
+
+    python benchmarks/bench_dag.py --papers 500000 --jobs 4
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+from dotenv import load_dotenv, find_dotenv
+from sqlalchemy import create_engine, text
+from ai_research.mag.mag_orm import Base
+from ai_research.make_dataset import stages
+from ai_research.transformers.dag import run_dag
+
+FIXED = """
+INSERT INTO mag_fields_of_study (id, name)
+    SELECT g, 'topic ' || g FROM generate_series(1, 200) g;
+INSERT INTO mag_affiliation (id) SELECT g FROM generate_series(1, 500) g;
+INSERT INTO geocoded_places (id, affiliation_id, country)
+    SELECT g::text, g, 'country ' || mod(g, 50) FROM generate_series(1, 500) g;
+INSERT INTO mag_authors (id) SELECT g FROM generate_series(1, 20000) g;
+"""
+
+PAPERS = """
+INSERT INTO mag_papers (id, year, citations)
+    SELECT g, (:first_year + mod(g, :years))::text, mod(g * 7, 100)
+    FROM generate_series(:start, :stop) g;
+INSERT INTO mag_paper_fields_of_study (paper_id, field_of_study_id)
+    SELECT g, 1 + mod(g * 13, 200) FROM generate_series(:start, :stop) g
+    UNION SELECT g, 1 + mod(g * 31, 200) FROM generate_series(:start, :stop) g;
+INSERT INTO mag_author_affiliation (paper_id, author_id, affiliation_id)
+    SELECT g, 1 + mod(g * k, 20000), 1 + mod(g * k * 3, 500)
+    FROM generate_series(:start, :stop) g, generate_series(1, 2) k;
+"""
+
+
+def execute(engine, script, **params):
+    with engine.begin() as conn:
+        for statement in script.split(";"):
+            if statement.strip():
+                conn.execute(text(statement), **params)
+
+
+def timed_run(engine, state_dir, n_jobs, min_papers=1):
+    start = time.perf_counter()
+    updated = run_dag(
+        engine,
+        stages({"min_papers": min_papers}, state_dir),
+        state_dir=state_dir,
+        n_jobs=n_jobs,
+    )
+    elapsed = time.perf_counter() - start
+    return elapsed, sum(len(keys) for keys in updated.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--papers", type=int, default=100000)
+    parser.add_argument("--jobs", type=int, default=1)
+    args = parser.parse_args()
+    logging.getLogger("ai_research").setLevel(logging.WARNING)
+
+    engine = create_engine(os.getenv("test_postgresdb"))
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    try:
+        execute(engine, FIXED)
+        execute(engine, PAPERS, start=1, stop=args.papers, first_year=2000, years=20)
+        with tempfile.TemporaryDirectory() as tmp:
+            elapsed, n = timed_run(engine, tmp, args.jobs)
+            print(f"full build:  {elapsed:.2f}s, {n} partitions")
+            elapsed, n = timed_run(engine, tmp, args.jobs)
+            print(f"no changes:  {elapsed:.2f}s, {n} partitions")
+            new = args.papers // 20
+            execute(
+                engine,
+                PAPERS,
+                start=args.papers + 1,
+                stop=args.papers + new,
+                first_year=2020,
+                years=1,
+            )
+            elapsed, n = timed_run(engine, tmp, args.jobs)
+            print(f"new year:    {elapsed:.2f}s, {n} partitions")
+            elapsed, n = timed_run(engine, tmp, args.jobs, min_papers=100)
+            print(f"min_papers:  {elapsed:.2f}s, {n} partitions")
+    finally:
+        Base.metadata.drop_all(engine)
+
+
+if __name__ == "__main__":
+    load_dotenv(find_dotenv())
+    main()
@@ -0,0 +1,87 @@
+"""Single-pass diversity engine against one groupby per metric.
+
+The baseline computes each index with its own pandas groupby over the joined
+paper/country/topic data, as the metric tables used to be built. Both run on
+random in-memory data, so no database is needed.
+
+    python benchmarks/bench_diversity.py --papers 200000
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from ai_research.transformers.diversity import group_metrics
+
+
+def make_data(n_papers, n_countries=60, n_fields=2000, seed=0):
+    rng = np.random.RandomState(seed)
+    paper_countries = pd.DataFrame(
+        {
+            "paper_id": np.repeat(np.arange(n_papers), 2),
+            "country": rng.randint(n_countries, size=2 * n_papers).astype(str),
+            "year": "2019",
+        }
+    ).drop_duplicates()
+    paper_fields = pd.DataFrame(
+        {
+            "paper_id": np.repeat(np.arange(n_papers), 3),
+            "field_of_study_id": rng.zipf(1.5, size=3 * n_papers) % n_fields,
+        }
+    ).drop_duplicates()
+    gendered = rng.randint(1, 6, size=n_papers)
+    paper_genders = pd.DataFrame(
+        {
+            "paper_id": np.arange(n_papers),
+            "female": rng.binomial(gendered, 0.25),
+            "gendered": gendered,
+        }
+    )
+    return paper_countries, paper_genders, paper_fields
+
+
+def per_metric(paper_countries, paper_genders, paper_fields):
+    """One scan of the joined data per index."""
+    joined = paper_countries.merge(paper_fields, on="paper_id").merge(
+        paper_fields.rename(columns={"field_of_study_id": "category"}), on="paper_id"
+    )
+    keys = ["country", "year", "field_of_study_id"]
+
+    def proportions(group):
+        counts = group.category.value_counts()
+        return counts / counts.sum()
+
+    shannon = joined.groupby(keys).apply(
+        lambda g: -(proportions(g) * np.log(proportions(g))).sum()
+    )
+    simpson = joined.groupby(keys).apply(lambda g: 1 - (proportions(g) ** 2).sum())
+    simpson_e = joined.groupby(keys).apply(
+        lambda g: 1 / (proportions(g) ** 2).sum() / g.category.nunique()
+    )
+    gender = (
+        paper_countries.merge(paper_fields, on="paper_id")
+        .merge(paper_genders, on="paper_id")
+        .groupby(keys)[["female", "gendered"]]
+        .sum()
+    )
+    female_share = gender.female / gender.gendered
+    return shannon, simpson, simpson_e, female_share
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--papers", type=int, default=50000)
+    parser.add_argument("--skip-baseline", action="store_true")
+    args = parser.parse_args()
+
+    data = make_data(args.papers)
+    start = time.perf_counter()
+    metrics = group_metrics(*data)
+    print(f"engine:   {time.perf_counter() - start:.2f}s for {len(metrics)} groups")
+    if not args.skip_baseline:
+        start = time.perf_counter()
+        per_metric(*data)
+        print(f"baseline: {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
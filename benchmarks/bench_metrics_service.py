@@ -0,0 +1,132 @@
+"""Local load test of the metrics cube HTTP endpoint.
+
+A cube of random cells is served on localhost and hit with concurrent slice
+requests drawn from a fixed pool, so the LRU cache warms up over the run.
+Latency percentiles are reported for the cold (first) and warm passes. No
+database is needed.
+
+    python benchmarks/bench_metrics_service.py --requests 5000 --concurrency 50
+"""
+import argparse
+import asyncio
+import time
+import aiohttp
+import numpy as np
+import pandas as pd
+from aiohttp import web
+from ai_research.transformers.fos_hierarchy import FosClosure
+from ai_research.visualisation.metrics_cube import (
+    MetricsCube,
+    MetricsService,
+    make_app,
+)
+
+
+def make_cube(n_countries=150, n_topics=500, n_years=20, seed=0):
+    rng = np.random.RandomState(seed)
+    countries = [f"c{i}" for i in range(n_countries)]
+    years = [str(2000 + i) for i in range(n_years)]
+    index = pd.MultiIndex.from_product(
+        [countries, np.arange(n_topics) + 100, years], names=["country", "fos", "year"]
+    )
+    n = len(index)
+    cells = pd.DataFrame(
+        {
+            "country": index.get_level_values(0),
+            "field_of_study_id": index.get_level_values(1),
+            "year": index.get_level_values(2),
+            "paper_count": rng.poisson(20, n),
+            "total_citations": rng.poisson(200, n),
+            "shannon_diversity": rng.rand(n) * 4,
+            "rca_sum": rng.rand(n) * 2,
+            "female_share": rng.rand(n),
+        }
+    )
+    regions = {c: f"r{i % 8}" for i, c in enumerate(countries)}
+    # Topics hang from 10 level 0 roots
+    children = np.arange(n_topics) + 100
+    closure = FosClosure.from_edges(children, children % 10, None)
+    return MetricsCube(cells, regions, closure), countries, years
+
+
+def make_queries(countries, years, n_topics, n_queries, seed=1):
+    rng = np.random.RandomState(seed)
+    queries = []
+    for _ in range(n_queries):
+        params = [("country", c) for c in rng.choice(countries, rng.randint(1, 4))]
+        params += [("year", y) for y in rng.choice(years, rng.randint(0, 3))]
+        params.append(("topic", str(100 + rng.randint(n_topics))))
+        params.append(("geo", "country"))
+        params.append(("period", rng.choice(["year", "all"])))
+        if rng.rand() < 0.2:
+            params.append(("format", "arrow"))
+        queries.append(params)
+    return queries
+
+
+async def load(url, queries, concurrency):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(session, params):
+        async with semaphore:
+            start = time.perf_counter()
+            async with session.get(url, params=params) as resp:
+                await resp.read()
+                assert resp.status == 200, resp.status
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(one(session, q) for q in queries))
+    return time.perf_counter() - start, np.array(latencies)
+
+
+def report(name, elapsed, latencies):
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    print(
+        f"{name}: {len(latencies) / elapsed:.0f} req/s, "
+        f"p50 {p50:.1f}ms, p95 {p95:.1f}ms, p99 {p99:.1f}ms"
+    )
+
+
+async def run(args):
+    start = time.perf_counter()
+    cube, countries, years = make_cube(n_topics=args.topics)
+    print(f"built cube in {time.perf_counter() - start:.1f}s")
+    service = MetricsService(cube=cube, maxsize=args.cache_size)
+
+    runner = web.AppRunner(make_app(service), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", args.port)
+    await site.start()
+    try:
+        url = f"http://127.0.0.1:{args.port}/slice"
+        pool = make_queries(countries, years, args.topics, args.distinct)
+        rng = np.random.RandomState(2)
+        queries = [pool[i] for i in rng.randint(len(pool), size=args.requests)]
+        report("cold", *await load(url, pool, args.concurrency))
+        report("mixed", *await load(url, queries, args.concurrency))
+        print(service.cache_info())
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--distinct", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--topics", type=int, default=200)
+    parser.add_argument("--cache-size", type=int, default=1024)
+    parser.add_argument("--port", type=int, default=8089)
+    args = parser.parse_args()
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(run(args))
+    finally:
+        loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Recall and latency of the IVF index against exact search.
+
+Uses random clustered vectors, or the sidecar vectors exported with
+`ai_research.mag.doc_vectors.export_npy` when --sidecar is given.
+
+    python benchmarks/bench_nearest_neighbours.py --papers 200000 --dim 300
+"""
+import argparse
+import time
+import numpy as np
+from ai_research.estimators.nearest_neighbours import IVFIndex, exact_search
+from ai_research.mag.doc_vectors import load_vectors
+
+
+def clustered_vectors(n, dim, n_clusters, seed=0):
+    rng = np.random.RandomState(seed)
+    centres = rng.normal(size=(n_clusters, dim))
+    labels = rng.randint(n_clusters, size=n)
+    return (centres[labels] + 0.5 * rng.normal(size=(n, dim))).astype(np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--papers", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=300)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--sidecar", action="store_true")
+    args = parser.parse_args()
+
+    if args.sidecar:
+        ids, vectors = load_vectors()
+        vectors = np.asarray(vectors)
+    else:
+        vectors = clustered_vectors(args.papers, args.dim, n_clusters=500)
+        ids = np.arange(len(vectors))
+    queries = vectors[np.random.RandomState(1).choice(len(vectors), args.queries)]
+
+    start = time.perf_counter()
+    _, exact = exact_search(ids, vectors, queries, k=args.k)
+    exact_time = time.perf_counter() - start
+    print(f"exact: {1000 * exact_time / len(queries):.2f} ms/query")
+
+    n_lists = int(np.sqrt(len(ids)))
+    start = time.perf_counter()
+    index = IVFIndex(n_lists=n_lists).train(vectors)
+    index.add(ids, vectors)
+    print(f"build: {time.perf_counter() - start:.1f}s for {len(ids)} vectors")
+
+    for n_probe in (1, 4, 8, 16, 32):
+        start = time.perf_counter()
+        _, approx = index.search(queries, k=args.k, n_probe=n_probe)
+        elapsed = time.perf_counter() - start
+        recall = np.mean([len(set(a) & set(e)) / args.k for a, e in zip(approx, exact)])
+        print(
+            f"n_probe={n_probe:>3}: recall@{args.k}={recall:.3f} "
+            f"{1000 * elapsed / len(queries):.2f} ms/query "
+            f"({exact_time / elapsed:.1f}x faster than exact)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Paper bundles against ORM lazy loading, read_sql and a raw COPY.
+
+Runs against the local database in the `test_postgresdb` environment variable.
+The MAG tables are created, filled with `SyntheticMag` papers and dropped by
+the benchmark. The same papers with their authors, affiliations, fields of
+study and venues are read:
+
+- with the ORM, walking the relationships of each paper (on a sample, and
+  extrapolated);
+- with `pd.read_sql` of the queries `load_bundle` runs;
+- with `load_bundle`;
+- as a lower bound, with a COPY of the same columns of the whole tables, left
+  unparsed.
+
+    python benchmarks/bench_paper_bundle.py --papers 300000
+"""
+import argparse
+import io
+import logging
+import os
+import time
+import pandas as pd
+from dotenv import load_dotenv, find_dotenv
+from sqlalchemy import any_, create_engine, select
+from sqlalchemy.orm import sessionmaker
+from ai_research.mag.mag_orm import Base, Paper
+from ai_research.mag.paper_bundle import LINKS, PAPER_COLUMNS, _id_array, load_bundle
+from ai_research.mag.synthetic import SyntheticMag, load_synthetic
+
+
+def orm_walk(engine, paper_ids):
+    session = sessionmaker(engine)()
+    rows = 0
+    for paper in session.query(Paper).filter(Paper.id.in_(paper_ids)):
+        for author in paper.authors:
+            rows += 1 + len(author.author.affiliation)
+        rows += len(paper.fields_of_study)
+    session.close()
+    return rows
+
+
+def read_sql(engine, paper_ids, chunksize=100000):
+    frames = []
+    papers = Paper.__table__
+    for start in range(0, len(paper_ids), chunksize):
+        chunk = _id_array(paper_ids[start : start + chunksize])
+        columns = [papers.c[c] for c in PAPER_COLUMNS]
+        frames.append(
+            pd.read_sql(select(columns).where(papers.c.id == any_(chunk)), engine)
+        )
+        for columns, source, paper_id, _ in LINKS.values():
+            query = select(columns).select_from(source).where(paper_id == any_(chunk))
+            frames.append(pd.read_sql(query, engine))
+    return sum(len(f) for f in frames)
+
+
+def raw_copy(engine):
+    papers = Paper.__table__
+    queries = [select([papers.c[c] for c in PAPER_COLUMNS])] + [
+        select(columns).select_from(source) for columns, source, _, _ in LINKS.values()
+    ]
+    conn = engine.raw_connection()
+    size = 0
+    try:
+        cursor = conn.cursor()
+        for query in queries:
+            buf = io.BytesIO()
+            sql = str(query.compile(dialect=engine.dialect))
+            cursor.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv)", buf)
+            size += buf.tell()
+    finally:
+        conn.close()
+    return size
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--papers", type=int, default=100000)
+    parser.add_argument("--orm-sample", type=int, default=2000)
+    args = parser.parse_args()
+    logging.getLogger("ai_research").setLevel(logging.WARNING)
+
+    engine = create_engine(os.getenv("test_postgresdb"))
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    try:
+        load_synthetic(engine, SyntheticMag(args.papers, seed=0, vector_dim=4))
+        engine.execute("ANALYZE")
+        paper_ids = list(range(1, args.papers + 1))
+
+        elapsed, _ = timed(orm_walk, engine, paper_ids[: args.orm_sample])
+        estimate = elapsed * args.papers / args.orm_sample
+        print(f"ORM lazy loads: {estimate:.2f}s (extrapolated)")
+        elapsed, n = timed(read_sql, engine, paper_ids)
+        print(f"read_sql:       {elapsed:.2f}s, {n} rows")
+        elapsed, bundle = timed(load_bundle, engine, paper_ids)
+        print(f"load_bundle:    {elapsed:.2f}s, {bundle}")
+        elapsed, size = timed(raw_copy, engine)
+        print(f"raw COPY:       {elapsed:.2f}s, {size / 2 ** 20:.0f} MB")
+    finally:
+        Base.metadata.drop_all(engine)
+
+
+if __name__ == "__main__":
+    load_dotenv(find_dotenv())
+    main()
@@ -0,0 +1,261 @@
+"""Ingest, join and metric timings on synthetic MAG databases of several sizes.
+
+For each size, a `SyntheticMag` database is loaded with `bulk_load`, copied to
+the year partitions, queried with the joins the pipeline and the front-end
+run most, and the derived tables are built by the DAG of `make_dataset`, whose
+per-stage times are read from its report.
+
+The database is a throwaway cluster started with `initdb` and `pg_ctl` from
+`--pg-bin` (or the PATH), so that runs do not share a server with anything
+else. Without them, it runs against the database in the `test_postgresdb`
+environment variable, whose MAG tables are created and dropped.
+
+Every run is appended to `--results` as a JSON line, and each timing is
+compared with the median of the last `--window` runs of the same size and
+seed: timings more than `--tolerance` slower are flagged, and `--check` exits
+with an error if any is.
+
+    python benchmarks/bench_scale.py --papers 10000 100000 1000000 --seed 0
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from dotenv import load_dotenv, find_dotenv
+from sqlalchemy import create_engine
+import ai_research
+from ai_research.mag.mag_orm import Base
+from ai_research.mag.synthetic import SyntheticMag, load_synthetic
+from ai_research.mag.year_partitions import sync_year_partitions
+from ai_research.make_dataset import stages
+from ai_research.transformers.dag import run_dag
+
+RESULTS = ai_research.project_dir / "data" / "interim" / "benchmarks" / "scale.jsonl"
+
+JOINS = {
+    "papers_by_country": """
+        SELECT g.country, count(DISTINCT a.paper_id)
+        FROM mag_author_affiliation a
+        JOIN geocoded_places g ON g.affiliation_id = a.affiliation_id
+        GROUP BY 1""",
+    "fields_by_year": """
+        SELECT p.year, f.name, count(*), sum(p.citations)
+        FROM mag_paper_fields_of_study pf
+        JOIN mag_papers p ON p.id = pf.paper_id
+        JOIN mag_fields_of_study f ON f.id = pf.field_of_study_id
+        GROUP BY 1, 2""",
+    "fields_by_country_year": """
+        SELECT g.country, pf.field_of_study_id, p.year_int, count(*)
+        FROM mag_author_affiliation a
+        JOIN geocoded_places g ON g.affiliation_id = a.affiliation_id
+        JOIN mag_papers p ON p.id = a.paper_id
+        JOIN mag_paper_fields_of_study pf ON pf.paper_id = a.paper_id
+        GROUP BY 1, 2, 3""",
+    "coauthor_pairs": """
+        SELECT count(*) FROM mag_paper_authors a
+        JOIN mag_paper_authors b ON a.paper_id = b.paper_id
+        AND a.author_id < b.author_id""",
+    "female_share": """
+        SELECT pa.paper_id, avg((g.gender = 'female')::int)
+        FROM mag_paper_authors pa JOIN author_gender g ON g.id = pa.author_id
+        GROUP BY 1""",
+    "partitioned_year_range": """
+        SELECT field_of_study_id, count(*) FROM mag_paper_fields_of_study_by_year
+        WHERE year_int BETWEEN 2015 AND 2018 GROUP BY 1""",
+}
+
+
+@contextmanager
+def local_postgres(bin_dir=None):
+    """Start a throwaway Postgres cluster listening on a socket in a temp dir.
+
+    Yields:
+        (str) Database URL of the cluster.
+
+    """
+    initdb = shutil.which("initdb", path=bin_dir)
+    pg_ctl = shutil.which("pg_ctl", path=bin_dir)
+    if initdb is None or pg_ctl is None:
+        raise FileNotFoundError(f"initdb and pg_ctl not found in {bin_dir or 'PATH'}")
+    with tempfile.TemporaryDirectory() as tmp:
+        data = os.path.join(tmp, "data")
+        subprocess.run(
+            [initdb, "-D", data, "-U", "postgres", "-A", "trust", "-E", "UTF8"],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        options = f"-k {tmp} -c listen_addresses=''"
+        subprocess.run(
+            [pg_ctl, "-D", data, "-o", options, "-l", f"{tmp}/log", "-w", "start"],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        try:
+            yield f"postgresql+psycopg2://postgres@/postgres?host={tmp}"
+        finally:
+            subprocess.run(
+                [pg_ctl, "-D", data, "-m", "fast", "-w", "stop"],
+                stdout=subprocess.DEVNULL,
+            )
+
+
+@contextmanager
+def test_database():
+    yield os.getenv("test_postgresdb")
+
+
+def best_of(engine, sql, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        engine.execute(sql).fetchall()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run_scale(engine, n_papers, seed, repeat):
+    """Timings in seconds of one size, by name."""
+    timings = {}
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    try:
+        start = time.perf_counter()
+        loaded = load_synthetic(engine, SyntheticMag(n_papers, seed=seed))
+        timings["ingest/total"] = time.perf_counter() - start
+        for table, stats in loaded.items():
+            timings[f"ingest/{table}"] = stats["seconds"]
+        engine.execute("ANALYZE")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            start = time.perf_counter()
+            sync_year_partitions(engine, state_dir=tmp)
+            timings["ingest/year_partitions"] = time.perf_counter() - start
+            engine.execute("ANALYZE")
+
+            for name, sql in JOINS.items():
+                timings[f"join/{name}"] = best_of(engine, sql, repeat)
+
+            start = time.perf_counter()
+            run_dag(engine, stages({"min_papers": 1}, tmp), state_dir=tmp)
+            timings["metric/dag_build"] = time.perf_counter() - start
+            with open(Path(tmp) / "pipeline_report.json") as f:
+                for stage, report in json.load(f).items():
+                    timings[f"metric/{stage}"] = report["seconds"]
+            start = time.perf_counter()
+            run_dag(engine, stages({"min_papers": 1}, tmp), state_dir=tmp)
+            timings["metric/dag_up_to_date"] = time.perf_counter() - start
+    finally:
+        Base.metadata.drop_all(engine)
+    return timings
+
+
+def git_commit():
+    result = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"],
+        cwd=ai_research.project_dir,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        universal_newlines=True,
+    )
+    return result.stdout.strip() or None
+
+
+def read_history(path, n_papers, seed, window):
+    """The timings of the last runs of the same size and seed."""
+    if not Path(path).exists():
+        return []
+    with open(path) as f:
+        runs = [json.loads(line) for line in f if line.strip()]
+    runs = [r for r in runs if r["papers"] == n_papers and r["seed"] == seed]
+    return [r["timings"] for r in runs[-window:]]
+
+
+def compare(timings, history, tolerance, min_seconds=0.05):
+    """Print the timings against their baseline.
+
+    The baseline of a timing is its median over the previous runs. A timing is
+    a regression if it is more than `tolerance` and `min_seconds` slower.
+
+    Returns:
+        (list) Names of the regressed timings.
+
+    """
+    regressions = []
+    print(f"{'':40} {'baseline':>10} {'now':>10} {'change':>8}")
+    for name, seconds in sorted(timings.items()):
+        previous = [run[name] for run in history if name in run]
+        if not previous:
+            print(f"{name:40} {'':>10} {seconds:10.3f}")
+            continue
+        baseline = statistics.median(previous)
+        change = seconds / baseline - 1 if baseline else 0
+        flag = ""
+        if change > tolerance and seconds - baseline > min_seconds:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        elif change < -tolerance and baseline - seconds > min_seconds:
+            flag = "  faster"
+        print(f"{name:40} {baseline:10.3f} {seconds:10.3f} {change:+8.0%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--papers", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--pg-bin", help="Directory of initdb and pg_ctl")
+    parser.add_argument("--results", type=Path, default=RESULTS)
+    parser.add_argument("--window", type=int, default=5)
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--check", action="store_true")
+    args = parser.parse_args()
+    logging.getLogger("ai_research").setLevel(logging.WARNING)
+
+    if args.pg_bin or shutil.which("pg_ctl"):
+        server = local_postgres(args.pg_bin)
+    else:
+        server = test_database()
+
+    regressions = []
+    with server as url:
+        engine = create_engine(url)
+        version = engine.execute("SHOW server_version").scalar()
+        for n_papers in args.papers:
+            print(f"\n{n_papers} papers, seed {args.seed}")
+            history = read_history(args.results, n_papers, args.seed, args.window)
+            timings = run_scale(engine, n_papers, args.seed, args.repeat)
+            regressions += compare(timings, history, args.tolerance)
+            record = {
+                "date": datetime.datetime.now().isoformat(timespec="seconds"),
+                "commit": git_commit(),
+                "server_version": version,
+                "papers": n_papers,
+                "seed": args.seed,
+                "timings": {k: round(v, 4) for k, v in timings.items()},
+            }
+            args.results.parent.mkdir(parents=True, exist_ok=True)
+            with open(args.results, "at") as f:
+                f.write(json.dumps(record) + "\n")
+        engine.dispose()
+
+    if regressions:
+        print(f"\n{len(regressions)} regressions: {', '.join(regressions)}")
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    load_dotenv(find_dotenv())
+    main()
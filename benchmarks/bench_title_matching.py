@@ -0,0 +1,78 @@
+"""Title index build, batch matching and duplicate scan against pairwise search.
+
+Titles are random words; queries are indexed titles with typos, and one in
+a hundred titles is indexed twice with different punctuation. The baseline
+compares a few queries with every title by exact shingle Jaccard and is
+extrapolated to all queries.
+
+    python benchmarks/bench_title_matching.py --papers 1000000
+"""
+import argparse
+import time
+import numpy as np
+from ai_research.estimators.title_matching import TitleIndex, shingles
+
+
+def make_titles(n, seed=0):
+    rng = np.random.RandomState(seed)
+    letters = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+    words = np.array(["".join(w) for w in letters[rng.randint(26, size=(50000, 7))]])
+    return [" ".join(w) for w in words[rng.randint(len(words), size=(n, 9))]]
+
+
+def typo(title, rng):
+    i = rng.randint(len(title))
+    return title[:i] + title[i + 1 :]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--papers", type=int, default=200000)
+    parser.add_argument("--queries", type=int, default=10000)
+    parser.add_argument("--baseline-queries", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(1)
+    titles = make_titles(args.papers)
+    duplicated = np.arange(0, args.papers, 100)
+    ids = np.arange(args.papers + len(duplicated))
+    indexed = titles + [titles[i].title() + "." for i in duplicated]
+
+    start = time.perf_counter()
+    index = TitleIndex()
+    index.add(ids, indexed)
+    print(f"build:      {time.perf_counter() - start:.2f}s, {len(index)} titles")
+
+    targets = rng.randint(args.papers, size=args.queries)
+    queries = [typo(titles[i], rng) for i in targets]
+    start = time.perf_counter()
+    matches = index.match(queries)
+    elapsed = time.perf_counter() - start
+    found = dict(zip(matches["query"], matches.paper_id))
+    recall = np.mean([found.get(q) == t for q, t in enumerate(targets)])
+    print(f"match:      {elapsed:.2f}s for {args.queries} queries, recall {recall:.3f}")
+
+    start = time.perf_counter()
+    clusters = index.duplicate_clusters()
+    elapsed = time.perf_counter() - start
+    print(
+        f"duplicates: {elapsed:.2f}s, {clusters.cluster.nunique()} clusters "
+        f"({len(duplicated)} planted)"
+    )
+
+    grams, owner = shingles(indexed)
+    bounds = np.searchsorted(owner, np.arange(len(indexed) + 1))
+    sets = [set(grams[a:b].tolist()) for a, b in zip(bounds[:-1], bounds[1:])]
+    start = time.perf_counter()
+    for query in queries[: args.baseline_queries]:
+        q = set(shingles([query])[0].tolist())
+        max(len(q & s) / len(q | s) for s in sets)
+    per_query = (time.perf_counter() - start) / args.baseline_queries
+    print(
+        f"baseline:   {per_query:.2f}s per query, "
+        f"{per_query * args.queries:.0f}s for {args.queries} queries"
+    )
+
+
+if __name__ == "__main__":
+    main()
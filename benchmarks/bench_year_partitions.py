@@ -0,0 +1,121 @@
+"""Year range queries on TEXT years, typed years and year partitions.
+
+Runs against the local database in the `test_postgresdb` environment variable.
+The MAG tables are created and dropped by the benchmark. Papers have years
+2000-2020, three fields of study and two authors each. The same two-year paper
+count per field of study is run on `mag_papers` filtered on the TEXT `year`,
+on the typed `year_int`, and on the tables partitioned by year.
+
+    python benchmarks/bench_year_partitions.py --papers 1000000
+"""
+import argparse
+import os
+import re
+import time
+import tempfile
+import numpy as np
+from dotenv import load_dotenv, find_dotenv
+from sqlalchemy import create_engine
+from ai_research.mag.mag_orm import (
+    Base,
+    Paper,
+    Author,
+    PaperAuthor,
+    FieldOfStudy,
+    PaperFieldsOfStudy,
+)
+from ai_research.mag.bulk_load import bulk_load
+from ai_research.mag.year_partitions import sync_year_partitions
+
+QUERIES = {
+    "text year": """
+        SELECT f.field_of_study_id, count(*) FROM mag_paper_fields_of_study f
+        JOIN mag_papers p ON p.id = f.paper_id
+        WHERE p.year IN ('2015', '2016') GROUP BY 1""",
+    "year_int": """
+        SELECT f.field_of_study_id, count(*) FROM mag_paper_fields_of_study f
+        JOIN mag_papers p ON p.id = f.paper_id
+        WHERE p.year_int BETWEEN 2015 AND 2016 GROUP BY 1""",
+    "partitioned": """
+        SELECT field_of_study_id, count(*) FROM mag_paper_fields_of_study_by_year
+        WHERE year_int BETWEEN 2015 AND 2016 GROUP BY 1""",
+}
+
+
+def make_records(n_papers, seed=0):
+    rng = np.random.RandomState(seed)
+    ids = np.arange(n_papers)
+    years = rng.randint(2000, 2021, size=n_papers)
+    papers = [
+        {"id": int(i), "title": f"paper {i}", "year": str(y), "date": f"{y}-01-31"}
+        for i, y in zip(ids, years)
+    ]
+    n_authors = max(1, n_papers // 2)
+    authors = [{"id": i, "name": f"author {i}"} for i in range(n_authors)]
+    paper_authors = [
+        {"paper_id": int(i), "author_id": int(a), "order": k}
+        for k in range(2)
+        for i, a in zip(ids, (ids * 2 + k) % n_authors)
+    ]
+    fields = [{"id": i, "name": f"field {i}"} for i in range(100)]
+    paper_fields = [
+        {"paper_id": int(i), "field_of_study_id": int(f)}
+        for k in range(3)
+        for i, f in zip(ids, (ids * 7 + k * 31) % 100)
+    ]
+    return [
+        (Paper, papers),
+        (Author, authors),
+        (PaperAuthor, paper_authors),
+        (FieldOfStudy, fields),
+        (PaperFieldsOfStudy, paper_fields),
+    ]
+
+
+def best_of(engine, sql, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        engine.execute(sql).fetchall()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--papers", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    engine = create_engine(os.getenv("test_postgresdb"))
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    try:
+        for mapping, records in make_records(args.papers):
+            bulk_load(engine, mapping, records)
+        with tempfile.TemporaryDirectory() as tmp:
+            start = time.perf_counter()
+            years = sync_year_partitions(engine, state_dir=tmp)
+            print(
+                f"sync:        {time.perf_counter() - start:.2f}s, {len(years)} years"
+            )
+            start = time.perf_counter()
+            sync_year_partitions(engine, state_dir=tmp)
+            print(f"resync:      {time.perf_counter() - start:.2f}s, no changes")
+        engine.execute("ANALYZE")
+
+        for name, sql in QUERIES.items():
+            elapsed = best_of(engine, sql, args.repeat)
+            plan = "\n".join(r[0] for r in engine.execute(f"EXPLAIN {sql}"))
+            scanned = len(set(re.findall(r"_by_year_(\d{4}|default)", plan)))
+            print(
+                f"{name + ':':12} {elapsed * 1000:.0f}ms"
+                + (f", {scanned} partitions scanned" if scanned else "")
+            )
+    finally:
+        Base.metadata.drop_all(engine)
+
+
+if __name__ == "__main__":
+    load_dotenv(find_dotenv())
+    main()
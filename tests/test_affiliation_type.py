@@ -0,0 +1,96 @@
+import unittest
+import os
+import tempfile
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine
+from ai_research.mag.mag_orm import Base, Affiliation, AffiliationType
+from ai_research.transformers.affiliation_type import (
+    classify,
+    match_keywords,
+    update_affiliation_types,
+)
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv(find_dotenv())
+
+KEYWORDS = ["universit*", "institute", "hospital", "max planck"]
+
+
+class TestClassify(unittest.TestCase):
+    def test_classify(self):
+        names = [
+            "Univ. of Oxford",
+            "Google Inc.",
+            "Max-Planck-Institut für Informatik",
+            "Hospitality Ltd",
+            "Universität Zürich",
+            None,
+        ]
+        self.assertEqual(
+            classify(names, KEYWORDS, n_jobs=1).tolist(), [1, 0, 1, 0, 1, 0]
+        )
+        name_idx, keyword_idx = match_keywords(names, KEYWORDS)
+        self.assertEqual(sorted(zip(name_idx, keyword_idx)), [(0, 0), (2, 3), (4, 0)])
+
+    def test_batches(self):
+        names = ["Acme Corp", "General Hospital"] * 50
+        types = classify(names, KEYWORDS, n_jobs=2, batch_size=7)
+        self.assertEqual(types.tolist(), [0, 1] * 50)
+
+
+class TestUpdateAffiliationTypes(unittest.TestCase):
+    """Only affiliations touched by a keyword change are re-scored"""
+
+    engine = create_engine(os.getenv("test_postgresdb"))
+    Session = sessionmaker(engine)
+
+    def setUp(self):
+        Base.metadata.create_all(self.engine)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.rules = os.path.join(self.tmp.name, "rules.json")
+        s = self.Session()
+        s.add_all(
+            [
+                Affiliation(id=1, affiliation="University of Oxford"),
+                Affiliation(id=2, affiliation="DeepMind"),
+                Affiliation(id=3, affiliation="Allen Institute for AI"),
+                Affiliation(id=4, affiliation="Mayo Clinic"),
+            ]
+        )
+        s.commit()
+        s.close()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        Base.metadata.drop_all(self.engine)
+
+    def types(self):
+        s = self.Session()
+        types = {r.id: r.type for r in s.query(AffiliationType)}
+        s.close()
+        return types
+
+    def update(self, keywords):
+        stats = update_affiliation_types(
+            self.engine, keywords, n_jobs=1, rules_path=self.rules
+        )
+        return stats["scored"], stats["changed"]
+
+    def test_update(self):
+        self.assertEqual(self.update(KEYWORDS), (4, 4))
+        self.assertEqual(self.types(), {1: 1, 2: 0, 3: 1, 4: 0})
+        self.assertEqual(self.update(KEYWORDS), (0, 0))
+
+        # Adding "clinic" only re-scores Mayo Clinic
+        self.assertEqual(self.update(KEYWORDS + ["clinic"]), (1, 1))
+        # Removing "institute" re-scores the Allen Institute, a new row is scored
+        s = self.Session()
+        s.add(Affiliation(id=5, affiliation="Stanford University"))
+        s.commit()
+        s.close()
+        self.assertEqual(self.update(["universit*", "clinic"]), (2, 2))
+        self.assertEqual(self.types(), {1: 1, 2: 0, 3: 0, 4: 1, 5: 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import unittest
+import os
+import datetime
+import pandas as pd
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine
+from ai_research.mag.mag_orm import Base, Author, AuthorGender, FirstNameGender
+from ai_research.mag.author_gender import (
+    GenderizeProvider,
+    first_names,
+    infer_genders,
+    stub_app,
+)
+from ai_research.mag.http_lookup import serve_in_thread
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv(find_dotenv())
+
+GENDERS = {"ana": ("female", 0.98, 120), "john": ("male", 0.99, 900)}
+
+
+class TestFirstNames(unittest.TestCase):
+    def test_first_names(self):
+        names = pd.Series(
+            [
+                "J. Ana-María López",
+                "john smith",
+                "j smith",
+                "smith",
+                None,
+                "a. b. ana c",
+            ]
+        )
+        self.assertEqual(
+            first_names(names).tolist(), ["ana-maria", "john", None, None, None, "ana"]
+        )
+
+
+class TestInferGenders(unittest.TestCase):
+    """Run the pipeline against the local stand-in API"""
+
+    engine = create_engine(os.getenv("test_postgresdb"))
+    Session = sessionmaker(engine)
+
+    def setUp(self):
+        Base.metadata.create_all(self.engine)
+        s = self.Session()
+        s.add_all(
+            [
+                Author(id=1, name="ana lopez"),
+                Author(id=2, name="Ana Smith"),
+                Author(id=3, name="john doe"),
+                Author(id=4, name="k. jones"),
+                Author(id=5, name="zed zed"),
+            ]
+        )
+        s.commit()
+        s.close()
+        # Two requests per second forces the client to back off and retry
+        self.app = stub_app(GENDERS, batch_size=2, rate_limit=2)
+        url, self.stop = serve_in_thread(self.app)
+        self.provider = GenderizeProvider(url + "/", batch_size=2)
+
+    def tearDown(self):
+        self.stop()
+        Base.metadata.drop_all(self.engine)
+
+    def test_infer_genders(self):
+        counts = infer_genders(self.engine, self.provider, rate=20, chunksize=3)
+        self.assertEqual(counts, {"authors": 5, "queried": 3})
+        self.assertEqual(sorted(self.app["served"]["names"]), ["ana", "john", "zed"])
+
+        s = self.Session()
+        rows = {r.id: r for r in s.query(AuthorGender)}
+        self.assertEqual(rows[2].first_name, "ana")
+        self.assertEqual(rows[2].gender, "female")
+        self.assertEqual(rows[2].samples, 120)
+        self.assertEqual(rows[3].gender, "male")
+        self.assertIsNone(rows[4].first_name)
+        self.assertIsNone(rows[5].gender)
+        self.assertEqual(s.query(FirstNameGender).count(), 3)
+
+        # Only the new author's unseen name is queried
+        s.add_all([Author(id=6, name="john roe"), Author(id=7, name="mia roe")])
+        s.commit()
+        counts = infer_genders(self.engine, self.provider, rate=20)
+        self.assertEqual(counts, {"authors": 2, "queried": 1})
+        self.assertEqual(self.app["served"]["names"][-1], "mia")
+
+        # Expired cache entries are queried again
+        s.query(FirstNameGender).update({"fetched_at": datetime.datetime(2000, 1, 1)})
+        s.commit()
+        counts = infer_genders(self.engine, self.provider, all_authors=True)
+        self.assertEqual(counts, {"authors": 7, "queried": 4})
+        s.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
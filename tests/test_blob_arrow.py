@@ -0,0 +1,115 @@
+import unittest
+import os
+import tempfile
+from pathlib import Path
+import pyarrow as pa
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine
+from ai_research.mag.mag_orm import Base, BlobArrow, BlobArrowChunk, BlobArrowManifest
+from ai_research.mag.blob_arrow import (
+    BlobArrowWriter,
+    write_batches,
+    iter_batches,
+    read_rows,
+    read_table,
+    spill,
+    open_spill,
+    from_blob_arrow,
+)
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv(find_dotenv())
+
+
+class TestBlobArrow(unittest.TestCase):
+    """Check that arrow datasets round-trip through chunked blobs"""
+
+    engine = create_engine(os.getenv("test_postgresdb"))
+    Session = sessionmaker(engine)
+
+    def setUp(self):
+        """Create the temporary tables"""
+        Base.metadata.create_all(self.engine)
+        self.table = pa.table(
+            {"id": pa.array(range(25), pa.int64()), "name": [str(i) for i in range(25)]}
+        )
+
+    def tearDown(self):
+        """Drop the temporary tables"""
+        Base.metadata.drop_all(self.engine)
+
+    def test_chunked_roundtrip(self):
+        with BlobArrowWriter(
+            self.engine, "test", self.table.schema, chunk_rows=10
+        ) as writer:
+            for batch in self.table.to_batches(max_chunksize=7):
+                writer.write_batch(batch)
+
+        s = self.Session()
+        manifest = s.query(BlobArrowManifest).get(writer.manifest_id)
+        self.assertEqual((manifest.num_chunks, manifest.num_rows), (3, 25))
+        self.assertEqual(
+            [
+                c.num_rows
+                for c in s.query(BlobArrowChunk).order_by(BlobArrowChunk.index)
+            ],
+            [10, 10, 5],
+        )
+        s.close()
+
+        self.assertTrue(read_table(self.engine, writer.manifest_id).equals(self.table))
+        batches = list(iter_batches(self.engine, writer.manifest_id, 1, 2, ["id"]))
+        self.assertEqual(batches[0].column(0).to_pylist(), list(range(10, 20)))
+
+    def test_failed_write(self):
+        with self.assertRaises(RuntimeError):
+            with BlobArrowWriter(
+                self.engine, "test", self.table.schema, chunk_rows=10
+            ) as writer:
+                writer.write_table(self.table)
+                # Not visible to readers before the writer is closed
+                s = self.Session()
+                self.assertEqual(s.query(BlobArrowManifest).count(), 0)
+                s.close()
+                raise RuntimeError("failed")
+
+        s = self.Session()
+        self.assertEqual(s.query(BlobArrowManifest).count(), 0)
+        self.assertEqual(s.query(BlobArrowChunk).count(), 0)
+        s.close()
+
+        with self.assertRaises(ValueError):
+            write_batches(self.engine, "test", [])
+        manifest_id = write_batches(self.engine, "test", [], self.table.schema)
+        self.assertEqual(read_table(self.engine, manifest_id).num_rows, 0)
+
+    def test_range_reads(self):
+        manifest_id = write_batches(
+            self.engine, "test", self.table.to_batches(), chunk_rows=10
+        )
+        rows = read_rows(self.engine, manifest_id, 8, 5)
+        self.assertEqual(rows.column("id").to_pylist(), [8, 9, 10, 11, 12])
+        self.assertEqual(read_rows(self.engine, manifest_id, 30, 5).num_rows, 0)
+
+    def test_spill(self):
+        manifest_id = write_batches(self.engine, "test", self.table.to_batches())
+        with tempfile.TemporaryDirectory() as tmp:
+            path = spill(self.engine, manifest_id, Path(tmp) / "test.arrow")
+            self.assertTrue(open_spill(path).equals(self.table))
+
+    def test_from_blob_arrow(self):
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_file(sink, self.table.schema) as writer:
+            writer.write_table(self.table)
+        blob = sink.getvalue().to_pybytes()
+        s = self.Session()
+        s.add(BlobArrow(id=1, blob=blob, size=len(blob)))
+        s.commit()
+        s.close()
+
+        manifest_id = from_blob_arrow(self.engine, 1, chunk_rows=10)
+        self.assertTrue(read_table(self.engine, manifest_id).equals(self.table))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+import unittest
+import os
+import json
+import tempfile
+from pathlib import Path
+import psycopg2
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine
+from ai_research.mag.mag_orm import (
+    Base,
+    Paper,
+    Author,
+    PaperAuthor,
+    AuthorAffiliation,
+    Affiliation,
+    ResearchDiversityCountry,
+    GenderDiversityCountry,
+)
+from ai_research.mag.bulk_load import (
+    bulk_load,
+    bulk_load_files,
+    replace_tables,
+    sort_by_dependency,
+)
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv(find_dotenv())
+
+
+class TestBulkLoad(unittest.TestCase):
+    """Check that COPY-based loading upserts MAG tables"""
+
+    engine = create_engine(os.getenv("test_postgresdb"))
+    Session = sessionmaker(engine)
+
+    def setUp(self):
+        """Create the temporary tables"""
+        Base.metadata.create_all(self.engine)
+        self.s = self.Session()
+
+    def tearDown(self):
+        """Drop the temporary tables"""
+        self.s.close()
+        Base.metadata.drop_all(self.engine)
+
+    def test_sort_by_dependency(self):
+        order = sort_by_dependency([PaperAuthor, AuthorAffiliation, Author, Paper])
+        self.assertLess(order.index(Paper), order.index(PaperAuthor))
+        self.assertLess(order.index(Author), order.index(PaperAuthor))
+        self.assertLess(order.index(Author), order.index(AuthorAffiliation))
+
+    def test_upsert_papers(self):
+        papers = [
+            {"id": 1, "title": "a\ttab", "year": "2019", "citations": 3},
+            {"id": 2, "title": None, "abstract": "line\nbreak \\ slash"},
+        ]
+        n = bulk_load(self.engine, Paper, papers, batch_size=1)
+        self.assertEqual(n, 2)
+
+        bulk_load(self.engine, Paper, [{"id": 1, "title": "new", "citations": 4}])
+        rows = {p.id: p for p in self.s.query(Paper)}
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1].title, "new")
+        self.assertEqual(rows[1].citations, 4)
+        self.assertIsNone(rows[2].title)
+        self.assertEqual(rows[2].abstract, "line\nbreak \\ slash")
+
+    def test_ignore_conflicts_and_duplicates(self):
+        papers = [{"id": 1, "title": "first"}, {"id": 1, "title": "duplicate"}]
+        bulk_load(self.engine, Paper, papers)
+        bulk_load(self.engine, Paper, [{"id": 1, "title": "x"}], on_conflict="ignore")
+        self.assertEqual(self.s.query(Paper).count(), 1)
+        self.assertNotEqual(self.s.query(Paper.title).scalar(), "x")
+
+    def test_surrogate_key_duplicates_with_nulls(self):
+        bulk_load(self.engine, Paper, [{"id": 1}])
+        bulk_load(self.engine, Author, [{"id": 10}])
+        rows = [
+            {"paper_id": 1, "author_id": 10, "affiliation_id": None},
+            {"paper_id": 1, "author_id": 10, "affiliation_id": None},
+        ]
+        bulk_load(self.engine, AuthorAffiliation, rows)
+        bulk_load(self.engine, AuthorAffiliation, rows[:1])
+        self.assertEqual(self.s.query(AuthorAffiliation).count(), 1)
+
+    def test_replace_tables(self):
+        def replace(female_share, field_of_study_id=None):
+            return replace_tables(
+                self.engine,
+                [
+                    (
+                        ResearchDiversityCountry,
+                        ResearchDiversityCountry.year == "2019",
+                        [{"year": "2019", "entity": "UK", "shannon_diversity": 1}],
+                    ),
+                    (
+                        GenderDiversityCountry,
+                        GenderDiversityCountry.year == "2019",
+                        [
+                            {
+                                "year": "2019",
+                                "entity": "UK",
+                                "female_share": female_share,
+                                "field_of_study_id": field_of_study_id,
+                            }
+                        ],
+                    ),
+                ],
+            )
+
+        self.assertEqual(replace(0.5), [1, 1])
+        # The second table fails, so neither is replaced
+        with self.assertRaises(psycopg2.IntegrityError):
+            replace(0.25, field_of_study_id=999)
+        self.assertEqual(self.s.query(ResearchDiversityCountry).count(), 1)
+        female_share = self.s.query(GenderDiversityCountry.female_share)
+        self.assertEqual(female_share.scalar(), 0.5)
+        self.assertEqual(replace(0.25), [1, 1])
+        self.assertEqual(female_share.scalar(), 0.25)
+
+    def test_load_files_in_dependency_order(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            with open(tmp / "authors.jsonl", "w") as f:
+                f.write(json.dumps({"id": 10, "name": "Ada"}) + "\n")
+            with open(tmp / "papers.json", "w") as f:
+                json.dump([{"id": 1, "title": "t"}], f)
+            with open(tmp / "affiliations.csv", "w") as f:
+                f.write("id,affiliation\n5,Nesta\n")
+            with open(tmp / "paper_authors.csv", "w") as f:
+                f.write("paper_id,author_id,order\n1,10,1\n")
+            with open(tmp / "author_affiliation.csv", "w") as f:
+                f.write("affiliation_id,author_id,paper_id\n5,10,1\n5,10,1\n")
+
+            sources = {
+                PaperAuthor: tmp / "paper_authors.csv",
+                AuthorAffiliation: tmp / "author_affiliation.csv",
+                Affiliation: tmp / "affiliations.csv",
+                Author: tmp / "authors.jsonl",
+                Paper: tmp / "papers.json",
+            }
+            bulk_load_files(self.engine, sources)
+            # Surrogate-key tables skip rows that are already present
+            bulk_load_files(self.engine, sources)
+
+        self.assertEqual(self.s.query(PaperAuthor).one().order, 1)
+        self.assertEqual(self.s.query(AuthorAffiliation).count(), 1)
+        self.assertEqual(self.s.query(Author).one().name, "Ada")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,165 @@
+import unittest
+import os
+import tempfile
+import numpy as np
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine
+from ai_research.mag.mag_orm import (
+    Base,
+    Paper,
+    Author,
+    Affiliation,
+    AffiliationType,
+    AuthorAffiliation,
+)
+from ai_research.transformers.career_trajectory import (
+    ACADEMIA,
+    INDUSTRY,
+    Timelines,
+    update_timelines,
+)
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv(find_dotenv())
+
+A, I, B = ACADEMIA, INDUSTRY, ACADEMIA | INDUSTRY
+
+# Author 1: academia 2010-2012, both in 2013, industry 2015
+# Author 2: academia 2012, industry 2013, academia 2014, industry 2016
+# Author 3: industry only, from 2013
+EVENTS = [
+    (1, 2010, A),
+    (1, 2012, A),
+    (1, 2011, A),
+    (1, 2013, A),
+    (1, 2013, I),
+    (1, 2015, I),
+    (2, 2012, A),
+    (2, 2013, I),
+    (2, 2014, A),
+    (2, 2016, I),
+    (3, 2013, I),
+]
+
+
+class TestTimelines(unittest.TestCase):
+    def setUp(self):
+        self.timelines = Timelines.from_events(*zip(*EVENTS))
+
+    def test_timelines(self):
+        years, states = self.timelines.timeline(1)
+        self.assertEqual(years.tolist(), [2010, 2011, 2012, 2013, 2015])
+        self.assertEqual(states.tolist(), [A, A, A, B, I])
+        self.assertEqual(self.timelines.first_years().tolist(), [2010, 2012, 2013])
+        with self.assertRaises(KeyError):
+            self.timelines.timeline(4)
+
+    def test_spells(self):
+        spells = self.timelines.spells()
+        first = spells[spells.author_id == 1]
+        self.assertEqual(first.state.tolist(), [A, B, I])
+        self.assertEqual(first.years.tolist(), [3, 1, 1])
+        self.assertEqual(first.dwell.tolist(), [3, 2, 1])
+        self.assertEqual(first.censored.tolist(), [False, False, True])
+
+    def test_transitions(self):
+        moves = self.timelines.transitions()
+        self.assertEqual(moves.author_id.tolist(), [1, 2])
+        self.assertEqual(moves.year.tolist(), [2013, 2013])
+        self.assertEqual(moves.previous_year.tolist(), [2012, 2012])
+        self.assertEqual(moves.tenure.tolist(), [3, 1])
+        moves = self.timelines.transitions(first_only=False)
+        self.assertEqual(moves.author_id.tolist(), [1, 2, 2])
+        back = self.timelines.transitions(INDUSTRY, ACADEMIA)
+        self.assertEqual(back.author_id.tolist(), [2])
+
+    def test_cohorts(self):
+        cohorts = self.timelines.cohorts()
+        self.assertEqual(cohorts.index.tolist(), [2010, 2012, 2013])
+        self.assertEqual(cohorts.movers.tolist(), [1, 1, 0])
+        self.assertEqual(cohorts.ever_source.tolist(), [1, 1, 0])
+        self.assertEqual(cohorts.share_moved.tolist()[:2], [1.0, 1.0])
+        self.assertTrue(np.isnan(cohorts.share_moved.iloc[2]))
+        self.assertEqual(cohorts.median_tenure.tolist()[:2], [3, 1])
+
+    def test_extend(self):
+        split = 6
+        first = Timelines.from_events(*zip(*EVENTS[:split]))
+        extended = first.extend(*map(list, zip(*EVENTS[split:])))
+        # Events that are already included change nothing
+        extended = extended.extend(*map(list, zip(*EVENTS[:2])))
+        for name in ["author_ids", "indptr", "years", "states"]:
+            np.testing.assert_array_equal(
+                getattr(extended, name), getattr(self.timelines, name)
+            )
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.timelines.save(tmp)
+            loaded = Timelines.load(tmp)
+            self.assertIsInstance(loaded.states, np.memmap)
+            self.assertEqual(loaded.timeline(3)[0].tolist(), [2013])
+            del loaded
+        self.assertEqual(len(Timelines.load(tmp)), 0)
+
+
+class TestUpdateTimelines(unittest.TestCase):
+    engine = create_engine(os.getenv("test_postgresdb"))
+    Session = sessionmaker(engine)
+
+    def setUp(self):
+        Base.metadata.create_all(self.engine)
+        self.tmp = tempfile.TemporaryDirectory()
+        s = self.Session()
+        s.add_all(
+            [
+                Author(id=1, name="a"),
+                Affiliation(id=10, affiliation="Uni"),
+                Affiliation(id=20, affiliation="Corp"),
+                Paper(id=100, year="2010"),
+                Paper(id=101, year=None, date="2012-03-01"),
+            ]
+        )
+        s.flush()
+        s.add_all(
+            [
+                AffiliationType(id=10, type=1),
+                AffiliationType(id=20, type=0),
+                AuthorAffiliation(author_id=1, paper_id=100, affiliation_id=10),
+                AuthorAffiliation(author_id=1, paper_id=101, affiliation_id=20),
+            ]
+        )
+        s.commit()
+        s.close()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        Base.metadata.drop_all(self.engine)
+
+    def test_update(self):
+        timelines = update_timelines(self.engine, self.tmp.name)
+        years, states = timelines.timeline(1)
+        self.assertEqual(years.tolist(), [2010, 2012])
+        self.assertEqual(states.tolist(), [A, I])
+
+        # A new paper whose affiliation has no type yet is read again later
+        s = self.Session()
+        s.add_all([Affiliation(id=30, affiliation="Lab"), Paper(id=102, year="2014")])
+        s.flush()
+        s.add(AuthorAffiliation(author_id=1, paper_id=102, affiliation_id=30))
+        s.commit()
+        timelines = update_timelines(self.engine, self.tmp.name)
+        self.assertEqual(timelines.paper_ids.tolist(), [100, 101])
+
+        s.add(AffiliationType(id=30, type=1))
+        s.commit()
+        s.close()
+        timelines = update_timelines(self.engine, self.tmp.name)
+        self.assertEqual(timelines.timeline(1)[1].tolist(), [A, I, A])
+        self.assertEqual(
+            timelines.transitions(INDUSTRY, ACADEMIA).year.tolist(), [2014]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
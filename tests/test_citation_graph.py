@@ -0,0 +1,122 @@
+import unittest
+import os
+import tempfile
+import networkx as nx
+import numpy as np
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine
+from ai_research.mag.mag_orm import Base, Paper
+from ai_research.transformers.citation_graph import (
+    CitationGraph,
+    citation_counts,
+    parse_edges,
+    parse_references,
+    update_citation_graph,
+)
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv(find_dotenv())
+
+# 1 -> 2, 3; 2 -> 3; 3 -> 4 (not parsed); 5 cites nothing
+REFERENCES = {1: "[2, 3, 3]", 2: "[3]", 3: "[4]", 5: None}
+
+
+class TestCitationGraph(unittest.TestCase):
+    def setUp(self):
+        ids = list(REFERENCES)
+        citing, cited = parse_edges(ids, list(REFERENCES.values()), n_jobs=1)
+        self.graph = CitationGraph.empty().add(citing, cited, parsed_ids=ids)
+
+    def test_parse(self):
+        counts, cited = parse_references(['["10", "2"]', None, "7 8\n9", "[]"])
+        self.assertEqual(counts.tolist(), [2, 0, 3, 0])
+        self.assertEqual(cited.tolist(), [10, 2, 7, 8, 9])
+        counts, cited = parse_references(["[12é34, «5»]", "١٢ 6"])
+        self.assertEqual(counts.tolist(), [3, 1])
+        self.assertEqual(cited.tolist(), [12, 34, 5, 6])
+        citing, cited = parse_edges([1, 2, 3], ["[4]", "[5, 6]", ""], chunksize=2)
+        self.assertEqual(list(zip(citing, cited)), [(1, 4), (2, 5), (2, 6)])
+
+    def test_structure(self):
+        graph = self.graph
+        self.assertEqual(graph.ids.tolist(), [1, 2, 3, 4, 5])
+        self.assertEqual(graph.n_edges, 4)
+        self.assertEqual(graph.in_degree().tolist(), [0, 1, 2, 1, 0])
+        self.assertEqual(graph.out_degree([1, 5]).tolist(), [2, 0])
+        self.assertEqual(graph.parsed.tolist(), [True, True, True, False, True])
+        with self.assertRaises(KeyError):
+            graph.index([6])
+
+    def test_incremental(self):
+        # 4 is ingested later and cites 1 and a new paper 6
+        graph = self.graph.add([4, 4], [1, 6])
+        full = CitationGraph.empty().add(
+            [1, 1, 2, 3, 4, 4], [2, 3, 3, 4, 1, 6], [1, 2, 3, 4, 5]
+        )
+        for name in ["ids", "indptr", "indices", "parsed"]:
+            np.testing.assert_array_equal(getattr(graph, name), getattr(full, name))
+
+    def test_neighbourhood(self):
+        ids, hops = self.graph.neighbourhood([1], k=2)
+        self.assertEqual(dict(zip(ids, hops)), {2: 1, 3: 1, 4: 2})
+        ids, hops = self.graph.neighbourhood([3], k=5, direction="in")
+        self.assertEqual(dict(zip(ids, hops)), {1: 1, 2: 1})
+        ids, _ = self.graph.neighbourhood([2], k=1, direction="both")
+        self.assertEqual(ids.tolist(), [1, 3])
+
+    def test_pagerank(self):
+        rank = self.graph.pagerank()
+        g = nx.DiGraph()
+        g.add_nodes_from(self.graph.ids.tolist())
+        g.add_edges_from([(1, 2), (1, 3), (2, 3), (3, 4)])
+        expected = nx.pagerank(g, tol=1e-12)
+        for paper_id, value in zip(self.graph.ids, rank):
+            self.assertAlmostEqual(value, expected[paper_id], places=6)
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.graph.save(tmp)
+            loaded = CitationGraph.load(tmp)
+            self.assertIsInstance(loaded.indices, np.memmap)
+            self.assertEqual(loaded.in_degree([3]).tolist(), [2])
+            del loaded
+
+
+class TestUpdateCitationGraph(unittest.TestCase):
+    engine = create_engine(os.getenv("test_postgresdb"))
+    Session = sessionmaker(engine)
+
+    def setUp(self):
+        Base.metadata.create_all(self.engine)
+        self.tmp = tempfile.TemporaryDirectory()
+        s = self.Session()
+        s.add_all(
+            [
+                Paper(id=1, references="[2, 3]", citations=0),
+                Paper(id=2, references="[3]", citations=1),
+                Paper(id=3, references=None, citations=2),
+            ]
+        )
+        s.commit()
+        s.close()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        Base.metadata.drop_all(self.engine)
+
+    def test_update(self):
+        graph = update_citation_graph(self.engine, self.tmp.name, n_jobs=1)
+        counts = citation_counts(self.engine, graph)
+        self.assertEqual(counts.citations.tolist(), counts.in_degree.tolist())
+
+        s = self.Session()
+        s.add(Paper(id=4, references="[1, 3]"))
+        s.commit()
+        s.close()
+        graph = update_citation_graph(self.engine, self.tmp.name, n_jobs=1)
+        self.assertEqual(graph.in_degree([1, 3]).tolist(), [1, 3])
+        self.assertEqual(graph.parsed.sum(), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+import os
+import tempfile
+import pandas as pd
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine
+from ai_research.mag.mag_orm import (
+    Base,
+    Paper,
+    Author,
+    Affiliation,
+    AuthorAffiliation,
+    AffiliationLocation,
+    CountryCollaboration,
+)
+from ai_research.transformers.collaboration import (
+    collaboration_pairs,
+    collaboration_network,
+    to_graph,
+    update_country_collaboration,
+)
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv(find_dotenv())
+
+
+class TestCollaborationPairs(unittest.TestCase):
+    """Check co-occurrence weights of entity pairs"""
+
+    def test_pairs(self):
+        pairs = collaboration_pairs(
+            [1, 1, 1, 2, 2, 3], ["UK", "DK", "US", "DK", "UK", "US"]
+        )
+        weights = {(a, b): w for a, b, w in pairs.values}
+        self.assertEqual(weights, {("DK", "UK"): 2, ("DK", "US"): 1, ("UK", "US"): 1})
+
+    def test_network_in_parallel(self):
+        links = pd.DataFrame(
+            {
+                "paper_id": [1, 1, 2, 2, 3],
+                "entity": ["a", "b", "a", "b", "a"],
+                "year": ["2019", "2019", "2020", "2020", "2020"],
+            }
+        )
+        pairs = collaboration_network(links, n_jobs=2)
+        self.assertEqual(sorted(pairs.year), ["2019", "2020"])
+        self.assertEqual(to_graph(pairs).number_of_edges(), 1)
+
+
+class TestUpdateCountryCollaboration(unittest.TestCase):
+    """Check that country_collaboration is written per year"""
+
+    engine = create_engine(os.getenv("test_postgresdb"))
+    Session = sessionmaker(engine)
+
+    def setUp(self):
+        Base.metadata.create_all(self.engine)
+        self.tmp = tempfile.TemporaryDirectory()
+        s = self.Session()
+        s.add_all([Paper(id=1, year="2019"), Author(id=1), Author(id=2)])
+        s.add_all([Affiliation(id=5), Affiliation(id=6)])
+        s.flush()
+        s.add_all(
+            [
+                AffiliationLocation(id="x", affiliation_id=5, country="UK"),
+                AffiliationLocation(id="y", affiliation_id=6, country="DK"),
+                AuthorAffiliation(paper_id=1, author_id=1, affiliation_id=5),
+                AuthorAffiliation(paper_id=1, author_id=2, affiliation_id=6),
+            ]
+        )
+        s.commit()
+        s.close()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        Base.metadata.drop_all(self.engine)
+
+    def test_update(self):
+        years = update_country_collaboration(self.engine, state_dir=self.tmp.name)
+        self.assertEqual(years, ["2019"])
+        self.assertEqual(
+            update_country_collaboration(self.engine, state_dir=self.tmp.name), []
+        )
+        s = self.Session()
+        row = s.query(CountryCollaboration).one()
+        self.assertEqual((row.country_a, row.country_b, row.weight), ("DK", "UK", 1))
+
+        # The rows of a year without papers are removed
+        s.query(Paper).update({"year": "2020"})
+        s.commit()
+        years = update_country_collaboration(self.engine, state_dir=self.tmp.name)
+        self.assertEqual(years, ["2020", "2019"])
+        self.assertEqual(s.query(CountryCollaboration).one().year, "2020")
+        s.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
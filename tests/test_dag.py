@@ -0,0 +1,234 @@
+import unittest
+import os
+import json
+import tempfile
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, select
+from ai_research.mag.mag_orm import (
+    Base,
+    Paper,
+    Author,
+    Affiliation,
+    AuthorAffiliation,
+    AffiliationLocation,
+    FieldOfStudy,
+    PaperFieldsOfStudy,
+    FosMetadata,
+    FilteredFos,
+    MetricCountryRCA,
+    ResearchDiversityCountry,
+    GenderDiversityCountry,
+    CountryCollaboration,
+    CountrySimilarity,
+    AllMetrics,
+    CountryTopicOutputsMetrics,
+    PaperYear,
+    PaperCountry,
+    PaperTopics,
+    PaperTopicsGrouped,
+)
+from ai_research.transformers.dag import Stage, run_dag, stage_order
+from ai_research.make_dataset import stages
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv(find_dotenv())
+
+papers = Paper.__table__
+
+
+class TestStageOrder(unittest.TestCase):
+    def test_stage_order(self):
+        def stage(name, reads, writes):
+            return Stage(name, None, [select([papers.c.id]).select_from(reads)], writes)
+
+        a = stage("a", papers, ["viz_paper_year"])
+        b = stage("b", PaperYear.__table__, ["viz_paper_country"])
+        c = stage("c", PaperCountry.__table__, ["mag_papers"])
+        self.assertEqual(stage_order([b, a]), [a, b])
+        with self.assertRaises(ValueError):
+            stage_order([a, b, c])
+
+
+class TestRunDag(unittest.TestCase):
+    engine = create_engine(os.getenv("test_postgresdb"))
+    Session = sessionmaker(engine)
+
+    def setUp(self):
+        Base.metadata.create_all(self.engine)
+        self.tmp = tempfile.TemporaryDirectory()
+        s = self.Session()
+        s.add_all(
+            [FieldOfStudy(id=i, name=f"topic {i}") for i in (1, 2)]
+            + [Author(id=i) for i in (1, 2)]
+            + [Affiliation(id=i) for i in (1, 2)]
+        )
+        s.flush()
+        s.add_all(
+            [
+                AffiliationLocation(id="a", affiliation_id=1, country="UK"),
+                AffiliationLocation(id="b", affiliation_id=2, country="DK"),
+            ]
+        )
+        self.add_papers(s, [(1, "2018"), (2, "2018"), (3, "2019")])
+        s.commit()
+        s.close()
+
+    def tearDown(self):
+        Base.metadata.drop_all(self.engine)
+        self.tmp.cleanup()
+
+    def add_papers(self, session, papers):
+        session.add_all([Paper(id=i, year=y, citations=i) for i, y in papers])
+        session.flush()
+        for i, _ in papers:
+            session.add_all(
+                [
+                    PaperFieldsOfStudy(paper_id=i, field_of_study_id=1 + i % 2),
+                    AuthorAffiliation(paper_id=i, author_id=1, affiliation_id=1),
+                    AuthorAffiliation(paper_id=i, author_id=2, affiliation_id=2),
+                ]
+            )
+
+    def run_dag(self, min_papers=1, n_jobs=1):
+        return run_dag(
+            self.engine,
+            stages({"min_papers": min_papers}, state_dir=self.tmp.name),
+            state_dir=self.tmp.name,
+            n_jobs=n_jobs,
+        )
+
+    def test_incremental(self):
+        updated = self.run_dag()
+        self.assertEqual(updated["paper_year"], [2018, 2019])
+        self.assertEqual(updated["paper_country"], ["DK", "UK"])
+        self.assertEqual(updated["outputs_metrics"], [2018, 2019])
+
+        s = self.Session()
+        self.assertEqual(
+            s.query(FosMetadata.frequency).order_by(FosMetadata.id).all(), [(1,), (2,)]
+        )
+        self.assertEqual(
+            s.query(PaperYear.paper_ids).filter_by(year="2018").scalar(), [1, 2]
+        )
+        self.assertEqual(
+            s.query(PaperCountry.count).filter_by(country="UK").scalar(), 3
+        )
+        self.assertEqual(
+            s.query(PaperTopics.paper_ids).filter_by(field_of_study_id=2).scalar(),
+            [1, 3],
+        )
+        self.assertEqual(
+            s.query(PaperTopicsGrouped.field_of_study).filter_by(id=2).scalar(),
+            ["topic 1"],
+        )
+        outputs = (
+            s.query(CountryTopicOutputsMetrics)
+            .filter_by(year="2018", country="UK", field_of_study_id=2)
+            .one()
+        )
+        self.assertEqual(
+            (outputs.paper_count, outputs.total_citations, outputs.name),
+            (1, 1, "topic 2"),
+        )
+        self.assertEqual(outputs.rca_sum, 1)
+        self.assertEqual(s.query(AllMetrics).count(), 6)
+        s.close()
+
+        self.assertFalse(any(self.run_dag().values()))
+
+        # A new year only recomputes that year, downstream too
+        s = self.Session()
+        self.add_papers(s, [(4, "2020")])
+        s.commit()
+        s.close()
+        updated = self.run_dag()
+        self.assertEqual(updated["filtered_fos"], [2020])
+        self.assertEqual(updated["rca_country"], [2020])
+        self.assertEqual(updated["all_metrics"], [2020])
+        self.assertEqual(updated["outputs_metrics"], [2020])
+        self.assertEqual(updated["fos_frequency"], [1])
+        self.assertEqual(updated["paper_country"], ["DK", "UK"])
+
+        # Renaming a field of study reaches every year of the tables with names
+        s = self.Session()
+        s.query(FieldOfStudy).filter_by(id=1).update({"name": "renamed"})
+        s.commit()
+        updated = self.run_dag()
+        self.assertEqual(updated["paper_topics"], [1])
+        self.assertEqual(updated["all_metrics"], [2018, 2019, 2020])
+        self.assertEqual(updated["paper_year"], [])
+        self.assertEqual(
+            s.query(FilteredFos).filter_by(year="2020").one().field_of_study_id, 1
+        )
+        s.close()
+
+    def test_config_change(self):
+        self.run_dag(n_jobs=3)
+        with open(os.path.join(self.tmp.name, "pipeline_report.json")) as f:
+            report = json.load(f)
+        self.assertEqual(report["paper_year"]["partitions"], 2)
+        self.assertGreater(report["rca_country"]["peak_mb"], 0)
+
+        # Only the stage using the parameter and the slices it changed rerun
+        updated = self.run_dag(min_papers=2, n_jobs=3)
+        self.assertEqual(updated["filtered_fos"], [2018, 2019])
+        self.assertEqual(updated["outputs_metrics"], [2018, 2019])
+        self.assertEqual(updated["rca_country"], [])
+        self.assertEqual(updated["all_metrics"], [])
+        s = self.Session()
+        self.assertEqual(s.query(CountryTopicOutputsMetrics).count(), 0)
+        s.close()
+
+    def test_params_change(self):
+        self.run_dag()
+        s = self.Session()
+        s.query(MetricCountryRCA).update({"rca_sum": -1})
+        s.query(CountrySimilarity).update({"closeness": -1})
+        s.commit()
+
+        # Stages whose version changed rewrite their rows, even though their
+        # own input fingerprints did not change
+        dag = stages({"min_papers": 1}, state_dir=self.tmp.name)
+        similarity = next(stage for stage in dag if stage.name == "country_similarity")
+        similarity.params = {"top_k": 5}
+        updated = run_dag(self.engine, dag, state_dir=self.tmp.name)
+        self.assertEqual(updated["country_similarity"], [2018, 2019])
+        self.assertEqual(updated["rca_country"], [])
+        self.assertEqual({r.closeness for r in s.query(CountrySimilarity)}, {1.0})
+
+        updated = run_dag(self.engine, dag, force=True, state_dir=self.tmp.name)
+        self.assertEqual(updated["rca_country"], [2018, 2019])
+        self.assertNotIn(-1, {r.rca_sum for r in s.query(MetricCountryRCA)})
+        s.close()
+
+    def test_removed_partition(self):
+        self.run_dag()
+
+        # Every derived table drops the rows of a year without papers
+        s = self.Session()
+        s.query(AuthorAffiliation).filter_by(paper_id=3).delete()
+        s.query(PaperFieldsOfStudy).filter_by(paper_id=3).delete()
+        s.query(PaperTopicsGrouped).filter_by(id=3).delete()
+        s.query(Paper).filter_by(id=3).delete()
+        s.commit()
+        updated = self.run_dag()
+        for name in ["rca_country", "diversity", "country_similarity"]:
+            self.assertEqual(updated[name], [2019])
+        for table in [
+            MetricCountryRCA,
+            ResearchDiversityCountry,
+            GenderDiversityCountry,
+            CountryCollaboration,
+            CountrySimilarity,
+            FilteredFos,
+            AllMetrics,
+            CountryTopicOutputsMetrics,
+            PaperYear,
+        ]:
+            years = {year for year, in s.query(table.year).distinct()}
+            self.assertEqual(years, {"2018"}, table.__tablename__)
+        s.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
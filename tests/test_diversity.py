@@ -0,0 +1,123 @@
+import unittest
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine
+from ai_research.mag.mag_orm import (
+    Base,
+    Paper,
+    Author,
+    Affiliation,
+    AuthorAffiliation,
+    AffiliationLocation,
+    AuthorGender,
+    FieldOfStudy,
+    PaperFieldsOfStudy,
+    ResearchDiversityCountry,
+    GenderDiversityCountry,
+)
+from ai_research.transformers.diversity import (
+    diversity_indices,
+    group_metrics,
+    update_diversity,
+)
+from ai_research.transformers.fos_hierarchy import FosClosure
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv(find_dotenv())
+
+
+class TestDiversityMath(unittest.TestCase):
+    """Check the vectorised indices against their definitions"""
+
+    def test_diversity_indices(self):
+        counts = np.array([[1, 1, 2], [4, 0, 0], [0, 0, 0]])
+        shannon, simpson, simpson_e = diversity_indices(sparse.csr_matrix(counts))
+        p = np.array([0.25, 0.25, 0.5])
+        self.assertAlmostEqual(shannon[0], -(p * np.log(p)).sum())
+        self.assertAlmostEqual(simpson[0], 1 - (p ** 2).sum())
+        self.assertAlmostEqual(simpson_e[0], 1 / (p ** 2).sum() / 3)
+        self.assertEqual((shannon[1], simpson[1], simpson_e[1]), (0, 0, 1))
+        self.assertTrue(np.isnan(shannon[2]))
+
+    def test_group_metrics(self):
+        paper_countries = pd.DataFrame(
+            {"paper_id": [1, 2, 2], "country": ["UK", "UK", "DK"], "year": "2019"}
+        )
+        paper_genders = pd.DataFrame(
+            {"paper_id": [1, 2], "female": [1, 0], "gendered": [2, 1]}
+        )
+        paper_fields = pd.DataFrame(
+            {"paper_id": [1, 1, 2], "field_of_study_id": [10, 11, 11]}
+        )
+        closure = FosClosure.from_edges([10, 11], [1, 1])
+        metrics = group_metrics(
+            paper_countries, paper_genders, paper_fields, closure
+        ).set_index(["entity", "field_of_study_id"])
+
+        # UK papers under topic 1: categories 10, 11 (paper 1) and 11 (paper 2)
+        uk = metrics.loc[("UK", 1)]
+        p = np.array([1 / 3, 2 / 3])
+        self.assertAlmostEqual(uk.shannon_diversity, -(p * np.log(p)).sum())
+        self.assertAlmostEqual(uk.female_share, 1 / 3)
+        self.assertEqual(metrics.loc[("DK", 11)].female_share, 0)
+        self.assertEqual(len(metrics), 5)
+
+
+class TestUpdateDiversity(unittest.TestCase):
+    """Check that both diversity tables are written"""
+
+    engine = create_engine(os.getenv("test_postgresdb"))
+    Session = sessionmaker(engine)
+
+    def setUp(self):
+        Base.metadata.create_all(self.engine)
+        self.tmp = tempfile.TemporaryDirectory()
+        s = self.Session()
+        s.add_all(
+            [Paper(id=1, year="2019"), Author(id=1), Author(id=2), Affiliation(id=5)]
+            + [FieldOfStudy(id=10)]
+        )
+        s.flush()
+        s.add_all(
+            [
+                AffiliationLocation(id="x", affiliation_id=5, country="UK"),
+                AuthorAffiliation(paper_id=1, author_id=1, affiliation_id=5),
+                AuthorAffiliation(paper_id=1, author_id=2, affiliation_id=5),
+                AuthorGender(id=1, gender="female"),
+                AuthorGender(id=2, gender="male"),
+                PaperFieldsOfStudy(paper_id=1, field_of_study_id=10),
+            ]
+        )
+        s.commit()
+        s.close()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        Base.metadata.drop_all(self.engine)
+
+    def test_update(self):
+        self.assertEqual(
+            update_diversity(self.engine, state_dir=self.tmp.name), ["2019"]
+        )
+        self.assertEqual(update_diversity(self.engine, state_dir=self.tmp.name), [])
+        s = self.Session()
+        self.assertEqual(s.query(GenderDiversityCountry).one().female_share, 0.5)
+        research = s.query(ResearchDiversityCountry).one()
+        self.assertEqual((research.entity, research.shannon_diversity), ("UK", 0))
+
+        # The rows of a year without papers are removed
+        s.query(Paper).update({"year": "2020"})
+        s.commit()
+        updated = update_diversity(self.engine, state_dir=self.tmp.name)
+        self.assertEqual(updated, ["2020", "2019"])
+        self.assertEqual({r.year for r in s.query(ResearchDiversityCountry)}, {"2020"})
+        self.assertEqual({r.year for r in s.query(GenderDiversityCountry)}, {"2020"})
+        s.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+import os
+import tempfile
+import numpy as np
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine
+from ai_research.mag.mag_orm import (
+    Base,
+    Paper,
+    HighDimDocVector,
+    HighDimDocVectorPacked,
+    DocVector,
+    DocVectorPacked,
+)
+from ai_research.mag.doc_vectors import (
+    migrate,
+    fetch_matrix,
+    export_npy,
+    load_vectors,
+    rows_for,
+    unpack,
+)
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv(find_dotenv())
+
+
+class TestDocVectors(unittest.TestCase):
+    """Check that vectors are packed and memory-mapped"""
+
+    engine = create_engine(os.getenv("test_postgresdb"))
+    Session = sessionmaker(engine)
+
+    def setUp(self):
+        """Create the temporary tables with a few vectors"""
+        Base.metadata.create_all(self.engine)
+        self.s = self.Session()
+        self.s.add_all([Paper(id=i) for i in (3, 1, 2)])
+        self.s.flush()
+        self.s.add_all(
+            [
+                HighDimDocVector(id=3, vector=[0.5, 1.5, 2.5, 3.5]),
+                HighDimDocVector(id=1, vector=[1.0, 2.0, 3.0, 4.0]),
+                HighDimDocVector(id=2, vector=None),
+                DocVector(id=1, vector_3d=[0.1, 0.2, 0.3], citations=7),
+            ]
+        )
+        self.s.commit()
+
+    def tearDown(self):
+        """Drop the temporary tables"""
+        self.s.close()
+        Base.metadata.drop_all(self.engine)
+
+    def test_migrate_and_fetch(self):
+        self.assertEqual(migrate(self.engine, HighDimDocVector), 3)
+        ids, vectors = fetch_matrix(self.engine, HighDimDocVectorPacked)
+        np.testing.assert_array_equal(ids, [1, 3])
+        self.assertEqual(vectors.dtype, np.float32)
+        np.testing.assert_allclose(vectors[1], [0.5, 1.5, 2.5, 3.5])
+
+        migrate(self.engine, DocVector)
+        packed = self.s.query(DocVectorPacked).one()
+        self.assertEqual(packed.citations, 7)
+        np.testing.assert_allclose(unpack(packed.vector_3d), [0.1, 0.2, 0.3], 1e-6)
+
+    def test_export_and_load(self):
+        migrate(self.engine, HighDimDocVector)
+        with tempfile.TemporaryDirectory() as tmp:
+            export_npy(self.engine, HighDimDocVectorPacked, directory=tmp)
+            ids, vectors = load_vectors(HighDimDocVectorPacked, directory=tmp)
+            self.assertIsInstance(vectors, np.memmap)
+            self.assertEqual(vectors.shape, (2, 4))
+            rows = rows_for(ids, [3, 2, 1, 99])
+            np.testing.assert_array_equal(rows, [1, -1, 0, -1])
+            np.testing.assert_allclose(vectors[rows[0]], [0.5, 1.5, 2.5, 3.5])
+            del vectors
+
+
+if __name__ == "__main__":
+    unittest.main()
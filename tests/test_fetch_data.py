@@ -0,0 +1,139 @@
+import unittest
+import os
+import json
+import tempfile
+from pathlib import Path
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine
+from ai_research.mag.mag_orm import Base, Paper, AuthorAffiliation
+from ai_research.mag.bulk_load import bulk_load_files, find_sources
+from ai_research.mag.http_lookup import serve_in_thread
+from ai_research.fetch_data import (
+    MagClient,
+    harvest,
+    invert_abstract,
+    parse_paper,
+    stub_app,
+)
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv(find_dotenv())
+
+FIELDS = ["machine learning", "deep learning"]
+YEARS = [2018, 2019]
+
+
+def make_entity(paper_id):
+    # Every third paper is in both fields, so two shards return it
+    fields = [{"FId": 1 + paper_id % 2, "DFN": FIELDS[paper_id % 2].title()}]
+    if paper_id % 3 == 0:
+        fields.append({"FId": 2 - paper_id % 2, "DFN": FIELDS[1 - paper_id % 2]})
+    return {
+        "Id": paper_id,
+        "Ti": f"paper {paper_id}",
+        "Y": YEARS[paper_id % 4 // 2],
+        "RId": [paper_id + 1000],
+        "AA": [
+            {"AuId": 10 + paper_id % 5, "DAuN": "A", "AfId": 7, "DAfN": "Uni", "S": 1}
+        ],
+        "F": fields,
+    }
+
+
+ENTITIES = [make_entity(i) for i in range(1, 31)]
+
+
+def read_jsonl(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+class TestParsePaper(unittest.TestCase):
+    def test_parse_paper(self):
+        entity = dict(
+            ENTITIES[2],
+            IA={"IndexLength": 3, "InvertedIndex": {"a": [0, 2], "b": [1]}},
+            J={"JId": 5, "JN": "jmlr"},
+            S=[{"U": "http://x"}],
+        )
+        rows = parse_paper(entity)
+        paper = rows["mag_papers"][0]
+        self.assertEqual(paper["year"], "2019")
+        self.assertEqual(paper["abstract"], "a b a")
+        self.assertEqual(json.loads(paper["references"]), [1003])
+        self.assertEqual(json.loads(paper["source"]), ["http://x"])
+        self.assertEqual(len(rows["mag_paper_fields_of_study"]), 2)
+        self.assertEqual(rows["mag_paper_journal"][0]["journal_name"], "jmlr")
+        self.assertEqual(rows["mag_paper_conferences"], [])
+        self.assertIsNone(invert_abstract(None))
+
+
+class TestHarvest(unittest.TestCase):
+    """Harvest from the local stand-in API, interrupt it and resume"""
+
+    engine = create_engine(os.getenv("test_postgresdb"))
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.output_dir = Path(self.tmp.name) / "raw"
+        self.state_dir = Path(self.tmp.name) / "state"
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _harvest(self, app):
+        url, stop = serve_in_thread(app)
+        try:
+            client = MagClient(
+                url=f"{url}/evaluate", page_size=3, retries=1, backoff=0.01
+            )
+            return harvest(
+                client,
+                FIELDS,
+                YEARS,
+                self.output_dir,
+                self.state_dir,
+                rate=1000,
+                concurrency=2,
+            )
+        finally:
+            stop()
+
+    def test_resume(self):
+        failing = stub_app(ENTITIES, fail_after=5)
+        counts = self._harvest(failing)
+        self.assertTrue(counts["failed"])
+        first_run = read_jsonl(self.output_dir / "mag_papers.jsonl")
+        self.assertTrue(0 < len(first_run) < len(ENTITIES))
+
+        app = stub_app(ENTITIES)
+        counts = self._harvest(app)
+        self.assertEqual(counts["failed"], [])
+        # Pages fetched before the failure are not requested again
+        self.assertFalse(set(failing["served"]) & set(app["served"]))
+
+        papers = read_jsonl(self.output_dir / "mag_papers.jsonl")
+        ids = [p["id"] for p in papers]
+        self.assertEqual(sorted(ids), [e["Id"] for e in ENTITIES])
+        self.assertEqual(counts["papers"], len(ENTITIES) - len(first_run))
+
+        app = stub_app(ENTITIES)
+        self.assertEqual(self._harvest(app)["papers"], 0)
+        self.assertEqual(app["served"], [])
+
+    def test_load(self):
+        self._harvest(stub_app(ENTITIES))
+        Base.metadata.create_all(self.engine)
+        try:
+            counts = bulk_load_files(self.engine, find_sources(self.output_dir))
+            self.assertEqual(counts["mag_papers"], len(ENTITIES))
+            s = sessionmaker(self.engine)()
+            self.assertEqual(s.query(Paper).count(), len(ENTITIES))
+            self.assertEqual(s.query(AuthorAffiliation).count(), len(ENTITIES))
+            s.close()
+        finally:
+            Base.metadata.drop_all(self.engine)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+import os
+import tempfile
+import numpy as np
+from ai_research.transformers.fos_hierarchy import FosClosure
+
+# 1 is the root, 2 and 3 its children, 4 is under both 2 and 3, 5 under 4.
+CHILDREN = [2, 3, 4, 4, 5]
+PARENTS = [1, 1, 2, 3, 4]
+LEVELS = {1: 0, 2: 1, 3: 1, 4: 2, 5: 3, 6: 0}
+
+
+class TestFosClosure(unittest.TestCase):
+    """Check ancestor and descendant lookups"""
+
+    def setUp(self):
+        self.closure = FosClosure.from_edges(CHILDREN, PARENTS, LEVELS)
+
+    def test_lookups(self):
+        np.testing.assert_array_equal(self.closure.ancestors(5), [1, 2, 3, 4])
+        np.testing.assert_array_equal(self.closure.ancestors(5, level=1), [2, 3])
+        np.testing.assert_array_equal(self.closure.descendants(3), [4, 5])
+        np.testing.assert_array_equal(
+            self.closure.descendants(3, include_self=True), [3, 4, 5]
+        )
+        self.assertEqual(len(self.closure.ancestors(6)), 0)
+        with self.assertRaises(KeyError):
+            self.closure.ancestors(99)
+
+    def test_is_under(self):
+        self.assertTrue(self.closure.is_under(5, 1))
+        self.assertFalse(self.closure.is_under(1, 5))
+        np.testing.assert_array_equal(
+            self.closure.is_under([4, 2, 5, 6], [3, 3, 2, 1]),
+            [True, False, True, False],
+        )
+
+    def test_inconsistent_edges_are_dropped(self):
+        closure = FosClosure.from_edges(CHILDREN + [1], PARENTS + [5], LEVELS)
+        self.assertFalse(closure.is_under(1, 5))
+
+    def test_expand(self):
+        papers, fos = self.closure.expand([10, 10, 11], [5, 2, 6])
+        self.assertEqual(
+            list(zip(papers, fos)),
+            [(10, 1), (10, 2), (10, 3), (10, 4), (10, 5), (11, 6)],
+        )
+        papers, fos = self.closure.expand([10, 11], [5, 6], level=0)
+        self.assertEqual(list(zip(papers, fos)), [(10, 1), (11, 6)])
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "closure.npz")
+            self.closure.save(path)
+            loaded = FosClosure.load(path)
+        np.testing.assert_array_equal(loaded.ancestors(5), [1, 2, 3, 4])
+        np.testing.assert_array_equal(loaded.levels, self.closure.levels)
+
+
+if __name__ == "__main__":
+    unittest.main()
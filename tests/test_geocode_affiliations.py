@@ -0,0 +1,117 @@
+import unittest
+import os
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine
+from ai_research.mag.mag_orm import (
+    Base,
+    Affiliation,
+    AffiliationLocation,
+    GeocodeCache,
+)
+from ai_research.mag.geocode_affiliations import (
+    PlacesProvider,
+    cluster_key,
+    geocode_affiliations,
+    stub_app,
+)
+from ai_research.mag.http_lookup import serve_in_thread
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv(find_dotenv())
+
+
+def place(name, country, lat):
+    return {
+        "name": name,
+        "formatted_address": f"{name}, {country}",
+        "geometry": {"location": {"lat": lat, "lng": 1.0}},
+        "types": ["university"],
+        "address_components": [
+            {"long_name": country, "types": ["country", "political"]}
+        ],
+    }
+
+
+PLACES = {
+    "p1": place("Oxford", "United Kingdom", 51.7),
+    "p2": place("Aarhus", "Denmark", 56.1),
+}
+
+
+class TestClusterKey(unittest.TestCase):
+    def test_cluster_key(self):
+        keys = {
+            cluster_key(name)
+            for name in ["Univ. of Oxford", "University of Oxford", "university oxford"]
+        }
+        self.assertEqual(keys, {"university oxford"})
+        self.assertEqual(cluster_key("Universität Zürich"), "university zurich")
+        self.assertNotEqual(
+            cluster_key("University of Washington"),
+            cluster_key("Washington University"),
+        )
+
+
+class TestGeocodeAffiliations(unittest.TestCase):
+    """Geocode against the local stand-in Places API"""
+
+    engine = create_engine(os.getenv("test_postgresdb"))
+    Session = sessionmaker(engine)
+
+    def setUp(self):
+        Base.metadata.create_all(self.engine)
+        s = self.Session()
+        s.add_all(
+            [
+                Affiliation(id=1, affiliation="University of Oxford"),
+                Affiliation(id=2, affiliation="Univ. of Oxford"),
+                Affiliation(id=3, affiliation="Oxford University"),
+                Affiliation(id=4, affiliation="Dept. of Physics, Oxford"),
+                Affiliation(id=5, affiliation="Aarhus University"),
+                Affiliation(id=6, affiliation="Nowhere Institute"),
+            ]
+        )
+        s.commit()
+        s.close()
+        self.app = stub_app(PLACES, rate_limit=3)
+        url, self.stop = serve_in_thread(self.app)
+        self.provider = PlacesProvider(url=url)
+
+    def tearDown(self):
+        self.stop()
+        Base.metadata.drop_all(self.engine)
+
+    def test_geocode(self):
+        counts = geocode_affiliations(
+            self.engine, self.provider, rate=20, checkpoint_every=2
+        )
+        # 5 distinct clusters, 2 distinct places
+        self.assertEqual(
+            counts, {"affiliations": 6, "clusters": 5, "requests": 7, "locations": 5}
+        )
+        served = self.app["served"]
+        self.assertEqual(sorted(served["details"]), ["p1", "p2"])
+
+        s = self.Session()
+        rows = {r.affiliation_id: r for r in s.query(AffiliationLocation)}
+        self.assertEqual(sorted(rows), [1, 2, 3, 4, 5])
+        self.assertEqual(rows[2].id, "p1")
+        self.assertEqual(rows[5].country, "Denmark")
+        self.assertAlmostEqual(rows[5].lat, 56.1)
+
+        # A rerun, e.g. after a crash, is served from the cache
+        s.query(AffiliationLocation).filter(
+            AffiliationLocation.affiliation_id.in_([1, 5])
+        ).delete(synchronize_session=False)
+        s.add(Affiliation(id=7, affiliation="The University of Oxford"))
+        s.commit()
+        counts = geocode_affiliations(self.engine, self.provider)
+        self.assertEqual(counts["requests"], 0)
+        self.assertEqual(counts["locations"], 3)
+        self.assertEqual(len(served["findplacefromtext"]), 5)
+        self.assertEqual(s.query(GeocodeCache).count(), 7)
+        s.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,192 @@
+import unittest
+import asyncio
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from aiohttp.test_utils import TestClient, TestServer
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from ai_research.mag.mag_orm import (
+    Base,
+    FieldOfStudy,
+    CountryTopicOutputsMetrics,
+    AllMetrics,
+    CountryDetails,
+)
+from ai_research.transformers.fos_hierarchy import FosClosure
+from ai_research.visualisation.metrics_cube import (
+    MetricsCube,
+    MetricsService,
+    make_app,
+)
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv(find_dotenv())
+
+CELLS = pd.DataFrame(
+    {
+        "country": ["UK", "UK", "DK", "UK"],
+        "field_of_study_id": [2, 3, 2, 2],
+        "year": ["2019", "2019", "2019", "2020"],
+        "paper_count": [10, 30, 5, 10],
+        "total_citations": [1, 2, 3, 4],
+        "shannon_diversity": [1.0, 2.0, np.nan, 3.0],
+        "rca_sum": [1.0, 1.0, 1.0, 1.0],
+        "female_share": [0.5, 0.1, 0.2, np.nan],
+    }
+)
+REGIONS = {"UK": "Europe", "DK": "Europe"}
+# 2 and 3 are children of 1
+CLOSURE = FosClosure.from_edges([2, 3], [1, 1], {1: 0, 2: 1, 3: 1})
+
+
+class TestMetricsCube(unittest.TestCase):
+    """Check the precomputed roll-ups"""
+
+    cube = MetricsCube(CELLS, REGIONS, CLOSURE)
+
+    def test_slice(self):
+        df = self.cube.slice(countries=["UK"], years=["2019"])
+        self.assertEqual(df.field_of_study_id.tolist(), [2, 3])
+        self.assertEqual(len(self.cube.slice()), 4)
+
+    def test_rollups(self):
+        df = self.cube.slice(geo="region", period="all", hierarchy="ancestors")
+        top = df.set_index("field_of_study_id").loc[1]
+        self.assertEqual(top.country, "Europe")
+        self.assertEqual(top.paper_count, 55)
+        self.assertEqual(top.total_citations, 10)
+        # Weighted by the paper counts of the cells with a value
+        self.assertAlmostEqual(top.shannon_diversity, (10 + 60 + 30) / 50)
+        self.assertAlmostEqual(top.female_share, (5 + 3 + 1) / 45)
+
+        uk = self.cube.slice(countries=["UK"], topics=[2], period="all")
+        self.assertEqual(uk.paper_count.tolist(), [20])
+        with self.assertRaises(ValueError):
+            MetricsCube(CELLS).slice(geo="region")
+
+    def test_fos_outside_hierarchy(self):
+        # 4 is not in the hierarchy, so it only counts towards itself
+        cells = CELLS.assign(field_of_study_id=[2, 3, 2, 4])
+        df = MetricsCube(cells, REGIONS, CLOSURE).slice(hierarchy="ancestors")
+        self.assertEqual(df.paper_count.sum(), 45 * 2 + 10)
+        self.assertEqual(
+            df[df.year == "2020"][["field_of_study_id", "paper_count"]].values.tolist(),
+            [[4, 10]],
+        )
+
+
+class TestMetricsService(unittest.TestCase):
+    """Check the cache and the HTTP endpoint"""
+
+    def setUp(self):
+        self.service = MetricsService(cube=MetricsCube(CELLS, REGIONS, CLOSURE))
+
+    def test_cache(self):
+        first = self.service.query(countries=["UK", "DK"], years=["2019"])
+        second = self.service.query(countries=("DK", "UK"), years=["2019"])
+        self.assertIs(first, second)
+        self.assertEqual(self.service.cache_info()["slices"]["hits"], 1)
+
+    def test_refresh_during_query(self):
+        service = self.service
+        new_cube = MetricsCube(CELLS[CELLS.country == "DK"])
+
+        class RacingCube(MetricsCube):
+            def slice(self, *args):
+                # The cube is replaced while the slice is computed
+                service.cube = new_cube
+                return super().slice(*args)
+
+        service.cube = RacingCube(CELLS)
+        self.assertEqual(len(service.query()), 4)
+        self.assertEqual(service.query().country.tolist(), ["DK"])
+        self.assertEqual(service.cache_info()["slices"]["currsize"], 2)
+
+    def test_endpoint(self):
+        async def requests():
+            client = TestClient(TestServer(make_app(self.service)))
+            await client.start_server()
+            try:
+                resp = await client.get(
+                    "/slice", params=[("country", "UK"), ("topic", "2")]
+                )
+                records = await resp.json()
+                resp = await client.get(
+                    "/slice", params={"geo": "region", "format": "arrow"}
+                )
+                body = await resp.read()
+                bad = await client.get("/slice", params={"topic": "x"})
+                return records, body, bad.status
+            finally:
+                await client.close()
+
+        loop = asyncio.new_event_loop()
+        try:
+            records, body, status = loop.run_until_complete(requests())
+        finally:
+            loop.close()
+        self.assertEqual([r["year"] for r in records], ["2019", "2020"])
+        self.assertIsNone(records[1]["female_share"])
+        table = pa.ipc.open_stream(body).read_all()
+        self.assertEqual(table.num_rows, 3)
+        self.assertEqual(status, 400)
+
+
+class TestMetricsServiceRefresh(unittest.TestCase):
+    """Load the cube from the front-end tables and reload it on refresh"""
+
+    engine = create_engine(os.getenv("test_postgresdb"))
+    Session = sessionmaker(engine)
+
+    def setUp(self):
+        Base.metadata.create_all(self.engine)
+        s = self.Session()
+        s.add(FieldOfStudy(id=2))
+        s.flush()
+        s.add_all(
+            [
+                CountryTopicOutputsMetrics(
+                    country="UK", field_of_study_id=2, year="2019", paper_count=3
+                ),
+                AllMetrics(country="DK", field_of_study_id=2, year="2019", rca_sum=2.0),
+                CountryDetails(
+                    alpha2Code="GB",
+                    alpha3Code="GBR",
+                    google_name="UK",
+                    wb_name="United Kingdom",
+                    region="Europe",
+                ),
+            ]
+        )
+        s.commit()
+        s.close()
+
+    def tearDown(self):
+        Base.metadata.drop_all(self.engine)
+
+    def test_refresh(self):
+        service = MetricsService(self.engine)
+        df = service.query()
+        self.assertEqual(df.country.tolist(), ["DK", "UK"])
+        self.assertEqual(df.paper_count.tolist(), [0, 3])
+        self.assertEqual(service.query(geo="region").paper_count.tolist(), [3])
+        self.assertFalse(service.refresh())
+
+        s = self.Session()
+        s.query(CountryTopicOutputsMetrics).delete()
+        s.add(
+            CountryTopicOutputsMetrics(
+                country="UK", field_of_study_id=2, year="2019", paper_count=4
+            )
+        )
+        s.commit()
+        s.close()
+        self.assertTrue(service.refresh())
+        self.assertEqual(service.cache_info()["slices"]["currsize"], 0)
+        self.assertEqual(service.query(countries=["UK"]).paper_count.tolist(), [4])
+
+
+if __name__ == "__main__":
+    unittest.main()
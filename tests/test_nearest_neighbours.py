@@ -0,0 +1,96 @@
+import unittest
+import os
+import tempfile
+import numpy as np
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine
+from ai_research.mag.mag_orm import Base, Paper
+from ai_research.estimators.nearest_neighbours import (
+    IVFIndex,
+    exact_search,
+    paper_years,
+    MISSING_YEAR,
+)
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv(find_dotenv())
+
+
+def clustered_vectors(n=2000, dim=16, n_clusters=20, seed=0):
+    rng = np.random.RandomState(seed)
+    centres = rng.normal(size=(n_clusters, dim))
+    labels = rng.randint(n_clusters, size=n)
+    return (centres[labels] + 0.3 * rng.normal(size=(n, dim))).astype(np.float32)
+
+
+class TestIVFIndex(unittest.TestCase):
+    """Check approximate search against exact search"""
+
+    def setUp(self):
+        self.vectors = clustered_vectors()
+        self.ids = np.arange(len(self.vectors)) * 10
+        self.years = 2000 + np.arange(len(self.vectors)) % 20
+        self.index = IVFIndex(n_lists=20).train(self.vectors)
+        self.index.add(self.ids, self.vectors, self.years)
+
+    def test_all_lists_is_exact(self):
+        queries = self.vectors[:50]
+        _, exact = exact_search(self.ids, self.vectors, queries, k=5)
+        _, approx = self.index.search(queries, k=5, n_probe=20)
+        np.testing.assert_array_equal(exact, approx)
+
+    def test_recall(self):
+        queries = self.vectors[:200]
+        _, exact = exact_search(self.ids, self.vectors, queries, k=10)
+        _, approx = self.index.search(queries, k=10, n_probe=3)
+        recall = np.mean([len(set(a) & set(e)) / 10 for a, e in zip(approx, exact)])
+        self.assertGreater(recall, 0.9)
+
+    def test_filters(self):
+        _, ids = self.index.search(self.vectors[:10], k=5, years=(2005, 2006))
+        years = dict(zip(self.ids, self.years))
+        self.assertTrue(all(2005 <= years[i] <= 2006 for i in ids[ids >= 0]))
+
+        allowed = self.ids[:3]
+        _, ids = self.index.search(self.vectors[:2], k=5, allowed_ids=allowed)
+        self.assertTrue(set(ids[ids >= 0]) <= set(allowed))
+        self.assertTrue((ids[:, 3:] == -1).all())
+
+    def test_incremental_add_and_persistence(self):
+        index = IVFIndex(n_lists=20).train(self.vectors)
+        self.assertEqual(index.add(self.ids[:1000], self.vectors[:1000]), 1000)
+        self.assertEqual(index.add(self.ids[500:], self.vectors[500:]), 1000)
+        self.assertEqual(len(index), len(self.ids))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "index.npz")
+            index.save(path)
+            loaded = IVFIndex.load(path)
+        self.assertIn(self.ids[-1], loaded)
+        np.testing.assert_array_equal(
+            loaded.search(self.vectors[:5], k=3)[1],
+            index.search(self.vectors[:5], k=3)[1],
+        )
+
+
+class TestPaperYears(unittest.TestCase):
+    engine = create_engine(os.getenv("test_postgresdb"))
+    Session = sessionmaker(engine)
+
+    def setUp(self):
+        Base.metadata.create_all(self.engine)
+        s = self.Session()
+        s.add_all([Paper(id=1, year="2019"), Paper(id=2, year=None)])
+        s.commit()
+        s.close()
+
+    def tearDown(self):
+        Base.metadata.drop_all(self.engine)
+
+    def test_paper_years(self):
+        years = paper_years(self.engine, np.array([2, 1, 3]))
+        np.testing.assert_array_equal(years, [MISSING_YEAR, 2019, MISSING_YEAR])
+
+
+if __name__ == "__main__":
+    unittest.main()
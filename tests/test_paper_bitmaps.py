@@ -0,0 +1,113 @@
+import unittest
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine
+from ai_research.mag.mag_orm import (
+    Base,
+    Paper,
+    Author,
+    Affiliation,
+    AuthorAffiliation,
+    AffiliationLocation,
+    FieldOfStudy,
+    PaperFieldsOfStudy,
+)
+from ai_research.visualisation.paper_bitmaps import PaperBitmapIndex, build_index
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv(find_dotenv())
+
+
+class TestPaperBitmapIndex(unittest.TestCase):
+    """Check bitmap queries against set operations on the paper ids"""
+
+    def setUp(self):
+        self.links = {
+            "country": pd.DataFrame(
+                {
+                    "paper_id": [30, 10, 20, 30, 40],
+                    "key": ["UK", "UK", "DK", "DK", "FR"],
+                }
+            ),
+            "topic": pd.DataFrame({"paper_id": [10, 20, 30], "key": [1, 1, 2]}),
+            "year": pd.DataFrame(
+                {"paper_id": [10, 20, 30, 40], "key": [2019, 2019, 2020, 2020]}
+            ),
+        }
+        self.index = PaperBitmapIndex.from_links(self.links)
+
+    def test_query(self):
+        index = self.index
+        np.testing.assert_array_equal(index.paper_ids, [10, 20, 30, 40])
+        self.assertEqual(index.keys("country"), ["DK", "FR", "UK"])
+        self.assertEqual(index.count(country="UK"), 2)
+        self.assertEqual(index.count(country=["UK", "FR"], year=2020), 2)
+        self.assertEqual(list(index.page(country="UK", topic=1)), [10])
+        self.assertEqual(
+            list(index.page(exclude={"country": "DK"}, year=[2019, 2020])),
+            [10, 40],
+        )
+        self.assertEqual(list(index.page(offset=1, limit=2)), [20, 30])
+        self.assertEqual(index.count(country="ES"), 0)
+
+    def test_keys(self):
+        index = self.index
+        # Integer keys can be given as strings, unknown keys match nothing
+        self.assertEqual(index.count(year="2019"), index.count(year=2019))
+        self.assertEqual(index.count(topic=["1", 2]), 3)
+        self.assertEqual(index.count(year=2018), 0)
+        with self.assertRaises(ValueError):
+            index.select(year="n/a")
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.index.save(tmp)
+            loaded = PaperBitmapIndex.load(tmp)
+        self.assertEqual(set(loaded.postings), {"country", "topic", "year"})
+        self.assertEqual(loaded.count(year="2020"), 2)
+        for dimension, postings in self.index.postings.items():
+            self.assertEqual(loaded.postings[dimension], postings)
+        self.assertEqual(list(loaded.page(topic=2, country="DK")), [30])
+
+
+class TestBuildIndex(unittest.TestCase):
+    """Build the index from the MAG tables"""
+
+    engine = create_engine(os.getenv("test_postgresdb"))
+    Session = sessionmaker(engine)
+
+    def setUp(self):
+        Base.metadata.create_all(self.engine)
+        s = self.Session()
+        s.add_all(
+            [Paper(id=1, year="2019"), Paper(id=2, year="2020")]
+            + [Author(id=1), Affiliation(id=5), FieldOfStudy(id=10)]
+        )
+        s.flush()
+        s.add_all(
+            [
+                AffiliationLocation(id="x", affiliation_id=5, country="UK"),
+                AuthorAffiliation(paper_id=1, author_id=1, affiliation_id=5),
+                PaperFieldsOfStudy(paper_id=2, field_of_study_id=10),
+            ]
+        )
+        s.commit()
+        s.close()
+
+    def tearDown(self):
+        Base.metadata.drop_all(self.engine)
+
+    def test_build_index(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            index = build_index(self.engine, directory=tmp)
+        self.assertEqual(list(index.page(country="UK")), [1])
+        self.assertEqual(list(index.page(topic=10, year=2020)), [2])
+        self.assertEqual(index.count(year=["2019", "2020"]), 2)
+        self.assertEqual(index.keys("year"), [2019, 2020])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+import os
+import numpy as np
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine
+from ai_research.mag.mag_orm import (
+    Base,
+    Paper,
+    Author,
+    Affiliation,
+    PaperAuthor,
+    AuthorAffiliation,
+    FieldOfStudy,
+    PaperFieldsOfStudy,
+    Journal,
+)
+from ai_research.mag.paper_bundle import load_bundle
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv(find_dotenv())
+
+
+class TestPaperBundle(unittest.TestCase):
+    engine = create_engine(os.getenv("test_postgresdb"))
+    Session = sessionmaker(engine)
+
+    def setUp(self):
+        Base.metadata.create_all(self.engine)
+        s = self.Session()
+        s.add_all(
+            [
+                Paper(id=1, title='a, "quoted"\ntitle', year="2015", date="2015-03-01"),
+                Paper(id=2, title="NA", year="2016", doi="0042", citations=3),
+                Paper(id=3, title=None, year="2019"),
+                Author(id=10, name="Ada"),
+                Author(id=11, name="Alan"),
+                Affiliation(id=100, affiliation="University of Synthia"),
+                FieldOfStudy(id=7, name="biology"),
+                FieldOfStudy(id=8, name="physics"),
+            ]
+        )
+        s.flush()
+        s.add_all(
+            [
+                PaperAuthor(paper_id=1, author_id=11, order=2),
+                PaperAuthor(paper_id=1, author_id=10, order=1),
+                PaperAuthor(paper_id=3, author_id=10, order=1),
+                AuthorAffiliation(paper_id=1, author_id=10, affiliation_id=100),
+                AuthorAffiliation(paper_id=1, author_id=11, affiliation_id=None),
+                PaperFieldsOfStudy(paper_id=1, field_of_study_id=7),
+                PaperFieldsOfStudy(paper_id=2, field_of_study_id=8),
+                PaperFieldsOfStudy(paper_id=3, field_of_study_id=7),
+                Journal(paper_id=2, id=5, journal_name="Nature"),
+            ]
+        )
+        s.commit()
+        s.close()
+
+    def tearDown(self):
+        Base.metadata.drop_all(self.engine)
+
+    def test_load_ids(self):
+        bundle = load_bundle(self.engine, [3, 1, 2, 99], chunksize=2)
+        self.assertEqual(bundle.papers.id.tolist(), [1, 2, 3])
+        self.assertEqual(bundle.papers.title[0], 'a, "quoted"\ntitle')
+        self.assertEqual(bundle.papers.title[1], "NA")
+        self.assertTrue(np.isnan(bundle.papers.title[2]))
+        self.assertEqual(str(bundle.papers.publication_date[0].date()), "2015-03-01")
+
+        # Dtypes follow the SQL types, in every chunk
+        self.assertEqual(bundle.papers.doi[1], "0042")
+        self.assertEqual(str(bundle.papers.citations.dtype), "Int64")
+        self.assertEqual(bundle.papers.citations.tolist()[1], 3)
+        self.assertEqual(bundle.papers.title.dtype, object)
+
+        authors = bundle.linked("authors", 1)
+        self.assertEqual(authors.name.tolist(), ["Ada", "Alan"])
+        self.assertEqual(authors.paper.tolist(), [0, 0])
+        self.assertEqual(bundle["authors"].paper.tolist(), [0, 0, 2])
+        self.assertEqual(len(bundle.linked("authors", 2)), 0)
+
+        affiliations = bundle.linked("affiliations", 1)
+        self.assertEqual(
+            affiliations.affiliation.fillna("").tolist(), ["University of Synthia", ""]
+        )
+        self.assertEqual(bundle.linked("journals", 2).journal_name.tolist(), ["Nature"])
+        self.assertEqual(len(bundle["conferences"]), 0)
+        with self.assertRaises(KeyError):
+            bundle.linked("authors", 99)
+
+    def test_load_filter(self):
+        bundle = load_bundle(self.engine, first_year=2015, last_year=2018, fos_ids=[7])
+        self.assertEqual(bundle.papers.id.tolist(), [1])
+        self.assertEqual(bundle["fields_of_study"].name.tolist(), ["biology"])
+
+        bundle = load_bundle(self.engine, fos_ids=[7], links=["fields_of_study"])
+        self.assertEqual(bundle.papers.id.tolist(), [1, 3])
+        self.assertEqual(list(bundle.links), ["fields_of_study"])
+
+        bundle = load_bundle(self.engine, first_year=2020)
+        self.assertEqual(len(bundle), 0)
+        self.assertEqual(len(bundle["authors"]), 0)
+        self.assertEqual(str(bundle["authors"].author_id.dtype), "Int64")
+
+
+if __name__ == "__main__":
+    unittest.main()
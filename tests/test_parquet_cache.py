@@ -0,0 +1,121 @@
+import unittest
+import os
+import tempfile
+from datetime import datetime
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine
+from ai_research.mag.mag_orm import Base, Paper, PaperAuthor, Author, FosHierarchy
+from ai_research.mag.mag_orm import FieldOfStudy, FirstNameGender
+from ai_research.mag.parquet_cache import ParquetMirror, arrow_schema
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv(find_dotenv())
+
+
+class TestParquetMirror(unittest.TestCase):
+    """Check that tables are mirrored and refreshed incrementally"""
+
+    engine = create_engine(os.getenv("test_postgresdb"))
+    Session = sessionmaker(engine)
+
+    def setUp(self):
+        """Create the temporary tables and mirror directory"""
+        Base.metadata.create_all(self.engine)
+        self.s = self.Session()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.mirror = ParquetMirror(self.engine, root=self.tmp.name, chunksize=2)
+
+    def tearDown(self):
+        """Drop the temporary tables and mirror directory"""
+        self.s.close()
+        self.tmp.cleanup()
+        Base.metadata.drop_all(self.engine)
+
+    def test_year_refresh(self):
+        self.s.add_all(
+            [
+                Paper(id=1, year="2018", title="a"),
+                Paper(id=2, year="2019", title="b"),
+                Paper(id=3, year=None, title="c"),
+            ]
+        )
+        self.s.commit()
+        self.assertEqual(self.mirror.refresh(Paper), 3)
+        self.assertEqual(self.mirror.state(Paper)["watermark"], "2019")
+
+        self.s.add_all([Paper(id=4, year="2019"), Paper(id=5, year="2020")])
+        self.s.commit()
+        # Only 2019 onwards is fetched again
+        self.assertEqual(self.mirror.refresh(Paper), 3)
+
+        df = self.mirror.read(Paper, as_pandas=True)
+        self.assertEqual(sorted(df.id), [1, 2, 3, 4, 5])
+        table = self.mirror.read("mag_papers", columns=["id"], years=[2019])
+        self.assertEqual(sorted(table.column("id").to_pylist()), [2, 4])
+
+    def test_composite_pk_refresh(self):
+        self.s.add_all([Paper(id=i) for i in range(3)] + [Author(id=1), Author(id=2)])
+        self.s.add_all(
+            [PaperAuthor(paper_id=0, author_id=1), PaperAuthor(paper_id=1, author_id=1)]
+        )
+        self.s.commit()
+        self.assertEqual(self.mirror.refresh(PaperAuthor), 2)
+
+        self.s.add_all(
+            [PaperAuthor(paper_id=1, author_id=2), PaperAuthor(paper_id=2, author_id=1)]
+        )
+        self.s.commit()
+        self.assertEqual(self.mirror.refresh(PaperAuthor), 2)
+        self.assertEqual(self.mirror.refresh(PaperAuthor), 0)
+        self.assertEqual(self.mirror.read(PaperAuthor).num_rows, 4)
+
+    def test_failed_refresh(self):
+        class FailingMirror(ParquetMirror):
+            writes = 0
+
+            def _write(self, *args):
+                if self.writes == 1:
+                    raise RuntimeError("failed")
+                self.writes += 1
+                super()._write(*args)
+
+        self.s.add_all([Author(id=i) for i in range(2)])
+        self.s.commit()
+        self.assertEqual(self.mirror.refresh(Author), 2)
+        self.s.add_all([Author(id=i) for i in range(2, 6)])
+        self.s.commit()
+
+        # A refresh that fails after writing a chunk leaves the mirror as it was
+        failing = FailingMirror(self.engine, root=self.tmp.name, chunksize=2)
+        with self.assertRaises(RuntimeError):
+            failing.refresh(Author)
+        self.assertEqual(self.mirror.read(Author).num_rows, 2)
+        self.assertEqual(self.mirror.state(Author)["watermark"], [1])
+
+        self.assertEqual(self.mirror.refresh(Author), 4)
+        ids = self.mirror.read(Author).column("id").to_pylist()
+        self.assertEqual(sorted(ids), list(range(6)))
+        self.assertEqual(os.listdir(self.tmp.name), ["mag_authors"])
+
+    def test_arrays_and_empty_tables(self):
+        self.s.add(FieldOfStudy(id=1, name="ml"))
+        self.s.flush()
+        self.s.add(FosHierarchy(id=1, parent_id=[2, 3], child_id=None))
+        self.s.commit()
+        df = self.mirror.load(FosHierarchy)
+        self.assertEqual(list(df.parent_id[0]), [2, 3])
+        self.assertEqual(self.mirror.load(Author).shape, (0, 2))
+
+    def test_every_table(self):
+        for table in Base.metadata.sorted_tables:
+            self.assertEqual(len(arrow_schema(table)), len(table.columns))
+
+        fetched_at = datetime(2019, 12, 1, 10, 30, 15, 123456)
+        self.s.add(FirstNameGender(first_name="ada", fetched_at=fetched_at))
+        self.s.commit()
+        df = self.mirror.load(FirstNameGender)
+        self.assertEqual(df.fetched_at[0].to_pydatetime(), fetched_at)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+import unittest
+import os
+import json
+import tempfile
+from sqlalchemy.orm import sessionmaker, selectinload
+from sqlalchemy import create_engine
+from ai_research.mag.mag_orm import (
+    Base,
+    Paper,
+    Author,
+    Affiliation,
+    PaperAuthor,
+    AuthorAffiliation,
+)
+from ai_research.mag.query_profile import (
+    QueryProfile,
+    key_lookup,
+    normalise,
+    relationship_keys,
+)
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv(find_dotenv())
+
+
+class TestStatements(unittest.TestCase):
+    def test_normalise(self):
+        self.assertEqual(
+            normalise(
+                "SELECT id FROM mag_papers\n WHERE id IN (%(id_1)s, %(id_2)s)"
+                " AND year = '2019' LIMIT 10"
+            ),
+            "SELECT id FROM mag_papers WHERE id IN (?, ...) AND year = ? LIMIT ?",
+        )
+        self.assertEqual(
+            normalise("SELECT * FROM mag_papers_by_year_2019 WHERE id = %s"),
+            "SELECT * FROM mag_papers_by_year_2019 WHERE id = ?",
+        )
+
+    def test_key_lookup(self):
+        self.assertEqual(
+            key_lookup(
+                'SELECT mag_paper_authors.paper_id AS a, mag_paper_authors."order"'
+                " AS b FROM mag_paper_authors WHERE ? = mag_paper_authors.paper_id"
+            ),
+            ("mag_paper_authors", frozenset(["paper_id"])),
+        )
+        self.assertEqual(
+            key_lookup("SELECT mag_papers.id FROM mag_papers WHERE mag_papers.id = ?"),
+            ("mag_papers", frozenset(["id"])),
+        )
+        self.assertIsNone(
+            key_lookup("SELECT id FROM mag_papers WHERE mag_papers.year_int > ?")
+        )
+        self.assertIsNone(
+            key_lookup(
+                "SELECT a.id FROM mag_papers JOIN mag_paper_authors "
+                "ON mag_papers.id = mag_paper_authors.paper_id WHERE mag_papers.id = ?"
+            )
+        )
+
+    def test_relationship_keys(self):
+        keys = relationship_keys()
+        self.assertEqual(
+            keys[("mag_paper_authors", frozenset(["paper_id"]))], ["Paper.authors"]
+        )
+        self.assertEqual(
+            keys[("mag_author_affiliation", frozenset(["author_id"]))],
+            ["Author.affiliation"],
+        )
+
+
+class TestQueryProfile(unittest.TestCase):
+    engine = create_engine(os.getenv("test_postgresdb"))
+    Session = sessionmaker(engine)
+
+    def setUp(self):
+        Base.metadata.create_all(self.engine)
+        s = self.Session()
+        s.add_all(
+            [Paper(id=i, year="2019") for i in range(20)]
+            + [Author(id=i) for i in range(20)]
+            + [Affiliation(id=1)]
+        )
+        s.flush()
+        s.add_all(
+            [PaperAuthor(paper_id=i, author_id=i, order=1) for i in range(20)]
+            + [
+                AuthorAffiliation(paper_id=i, author_id=i, affiliation_id=1)
+                for i in range(20)
+            ]
+        )
+        s.commit()
+        s.close()
+
+    def tearDown(self):
+        Base.metadata.drop_all(self.engine)
+
+    def test_n_plus_one(self):
+        s = self.Session()
+        with QueryProfile(self.engine) as profile:
+            for paper in s.query(Paper):
+                [a.author_id for a in paper.authors]
+            for author in s.query(Author):
+                author.affiliation
+        s.close()
+
+        report = profile.report()
+        self.assertEqual(report["queries"], 42)
+        loads = {load["relationship"]: load for load in report["n_plus_one"]}
+        self.assertEqual(set(loads), {"Paper.authors", "Author.affiliation"})
+        self.assertEqual(loads["Paper.authors"]["count"], 20)
+        self.assertIn("tests/test_query_profile.py", loads["Paper.authors"]["site"])
+        self.assertEqual(report["top"][0]["count"], 20)
+        self.assertEqual(report["top"][0]["rows"], 20)
+
+        # Queries after the profile are not recorded
+        self.engine.execute("SELECT 1")
+        self.assertEqual(profile.report()["queries"], 42)
+
+    def test_eager_load(self):
+        s = self.Session()
+        with QueryProfile(self.engine) as profile:
+            for paper in s.query(Paper).options(selectinload(Paper.authors)):
+                [a.author_id for a in paper.authors]
+        s.close()
+        self.assertEqual(profile.report()["n_plus_one"], [])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = profile.save(os.path.join(tmp, "profile.json"))
+            with open(path) as f:
+                self.assertEqual(json.load(f)["queries"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+import unittest
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine
+from ai_research.mag.mag_orm import (
+    Base,
+    Paper,
+    Author,
+    Affiliation,
+    AuthorAffiliation,
+    AffiliationLocation,
+    FieldOfStudy,
+    PaperFieldsOfStudy,
+    MetricCountryRCA,
+    MetricAffiliationRCA,
+)
+from ai_research.transformers.rca import count_matrix, year_rca, update_rca
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv(find_dotenv())
+
+
+class TestRCAMath(unittest.TestCase):
+    """Check the sparse RCA against a dense computation"""
+
+    def test_year_rca(self):
+        entities = pd.DataFrame(
+            {"paper_id": [1, 1, 2, 3, 3, 3], "entity": ["a", "a", "a", "b", "a", "b"]}
+        )
+        fields = pd.DataFrame(
+            {"paper_id": [1, 2, 2, 3], "field_of_study_id": [10, 10, 20, 20]}
+        )
+        counts, rows, cols = count_matrix(
+            entities.paper_id,
+            entities.entity,
+            fields.paper_id,
+            fields.field_of_study_id,
+        )
+        dense = counts.toarray()
+        np.testing.assert_array_equal(dense, [[2, 2], [0, 1]])
+
+        expected = (dense / dense.sum(1, keepdims=True)) / (
+            dense.sum(0, keepdims=True) / dense.sum()
+        )
+        rca = year_rca(entities, fields).set_index(["entity", "field_of_study_id"])
+        self.assertEqual(len(rca), 3)
+        for (entity, fos), value in rca.rca_sum.items():
+            i, j = list(rows).index(entity), list(cols).index(fos)
+            self.assertAlmostEqual(value, expected[i, j])
+
+
+class TestUpdateRCA(unittest.TestCase):
+    """Check that RCA tables are only rewritten for changed years"""
+
+    engine = create_engine(os.getenv("test_postgresdb"))
+    Session = sessionmaker(engine)
+
+    def setUp(self):
+        Base.metadata.create_all(self.engine)
+        self.tmp = tempfile.TemporaryDirectory()
+        s = self.Session()
+        s.add_all(
+            [
+                Paper(id=1, year="2019"),
+                Paper(id=2, year="2019"),
+                Paper(id=3, year="2020"),
+            ]
+            + [Author(id=1), Affiliation(id=5), Affiliation(id=6)]
+            + [FieldOfStudy(id=10), FieldOfStudy(id=20)]
+        )
+        s.flush()
+        s.add_all(
+            [
+                AffiliationLocation(id="x", affiliation_id=5, country="UK"),
+                AffiliationLocation(id="y", affiliation_id=6, country="DK"),
+                AuthorAffiliation(paper_id=1, author_id=1, affiliation_id=5),
+                AuthorAffiliation(paper_id=2, author_id=1, affiliation_id=6),
+                AuthorAffiliation(paper_id=3, author_id=1, affiliation_id=5),
+                PaperFieldsOfStudy(paper_id=1, field_of_study_id=10),
+                PaperFieldsOfStudy(paper_id=2, field_of_study_id=20),
+                PaperFieldsOfStudy(paper_id=3, field_of_study_id=10),
+            ]
+        )
+        s.commit()
+        s.close()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        Base.metadata.drop_all(self.engine)
+
+    def test_incremental_update(self):
+        updated = update_rca(self.engine, "country", state_dir=self.tmp.name)
+        self.assertEqual(updated, ["2019", "2020"])
+        self.assertEqual(update_rca(self.engine, state_dir=self.tmp.name), [])
+
+        s = self.Session()
+        rows = {(r.year, r.entity): r.rca_sum for r in s.query(MetricCountryRCA)}
+        self.assertEqual(
+            rows, {("2019", "UK"): 2.0, ("2019", "DK"): 2.0, ("2020", "UK"): 1.0}
+        )
+
+        s.add(PaperFieldsOfStudy(paper_id=3, field_of_study_id=20))
+        s.commit()
+        self.assertEqual(update_rca(self.engine, state_dir=self.tmp.name), ["2020"])
+        self.assertEqual(s.query(MetricCountryRCA).count(), 4)
+
+        update_rca(self.engine, "affiliation", state_dir=self.tmp.name)
+        self.assertEqual({r.entity for r in s.query(MetricAffiliationRCA)}, {5, 6})
+        s.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+import unittest
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine
+from ai_research.mag.mag_orm import (
+    Base,
+    Paper,
+    Author,
+    Affiliation,
+    AuthorAffiliation,
+    AffiliationLocation,
+    FieldOfStudy,
+    PaperFieldsOfStudy,
+    CountrySimilarity,
+)
+from ai_research.transformers.similarity import (
+    cosine_pairs,
+    country_similarity,
+    update_country_similarity,
+)
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv(find_dotenv())
+
+
+class TestCosinePairs(unittest.TestCase):
+    """Check blocked similarity against a dense computation"""
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.profiles = sparse.random(50, 30, density=0.2, random_state=rng)
+        dense = self.profiles.toarray()
+        norms = np.linalg.norm(dense, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        self.expected = (dense / norms) @ (dense / norms).T
+
+    def test_all_pairs(self):
+        a, b, closeness = cosine_pairs(self.profiles, block_size=7)
+        self.assertTrue((a < b).all())
+        np.testing.assert_allclose(closeness, self.expected[a, b])
+        upper = np.triu(self.expected, k=1)
+        self.assertEqual(len(a), (upper > 0).sum())
+
+    def test_top_k(self):
+        a, b, closeness = cosine_pairs(self.profiles, top_k=3, block_size=16)
+        self.assertTrue((np.bincount(a, minlength=50) <= 3).all())
+        self.assertFalse((a == b).any())
+        np.fill_diagonal(self.expected, 0)
+        best = np.sort(self.expected, axis=1)[:, -3:]
+        for row in np.unique(a):
+            np.testing.assert_allclose(
+                np.sort(closeness[a == row]), best[row][best[row] > 0]
+            )
+
+
+class TestCountrySimilarity(unittest.TestCase):
+    """Check country pairs per topic and year"""
+
+    def test_slices(self):
+        paper_countries = pd.DataFrame(
+            {
+                "paper_id": [1, 2, 3, 4],
+                "country": ["UK", "DK", "US", "UK"],
+                "year": ["2019", "2019", "2019", "2020"],
+            }
+        )
+        paper_fields = pd.DataFrame(
+            {"paper_id": [1, 2, 3, 4], "field_of_study_id": [10, 10, 10, 10]}
+        )
+        for n_jobs in (1, 2):
+            pairs = country_similarity(paper_countries, paper_fields, n_jobs=n_jobs)
+            self.assertEqual(len(pairs), 3)
+            self.assertTrue((pairs.year == "2019").all())
+            np.testing.assert_allclose(pairs.closeness, 1)
+
+
+class TestUpdateCountrySimilarity(unittest.TestCase):
+    """Check that country_similarity is written and emptied per year"""
+
+    engine = create_engine(os.getenv("test_postgresdb"))
+    Session = sessionmaker(engine)
+
+    def setUp(self):
+        Base.metadata.create_all(self.engine)
+        self.tmp = tempfile.TemporaryDirectory()
+        s = self.Session()
+        s.add_all([Paper(id=1, year="2019"), Paper(id=2, year="2019")])
+        s.add_all([Author(id=1), Affiliation(id=5), Affiliation(id=6)])
+        s.add(FieldOfStudy(id=10))
+        s.flush()
+        s.add_all(
+            [
+                AffiliationLocation(id="x", affiliation_id=5, country="UK"),
+                AffiliationLocation(id="y", affiliation_id=6, country="DK"),
+                AuthorAffiliation(paper_id=1, author_id=1, affiliation_id=5),
+                AuthorAffiliation(paper_id=2, author_id=1, affiliation_id=6),
+                PaperFieldsOfStudy(paper_id=1, field_of_study_id=10),
+                PaperFieldsOfStudy(paper_id=2, field_of_study_id=10),
+            ]
+        )
+        s.commit()
+        s.close()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        Base.metadata.drop_all(self.engine)
+
+    def test_update(self):
+        years = update_country_similarity(
+            self.engine, n_jobs=1, state_dir=self.tmp.name
+        )
+        self.assertEqual(years, ["2019"])
+        s = self.Session()
+        self.assertEqual(s.query(CountrySimilarity).count(), 1)
+
+        # The rows of a year without papers are removed
+        s.query(Paper).update({"year": "2020"})
+        s.commit()
+        years = update_country_similarity(
+            self.engine, n_jobs=1, state_dir=self.tmp.name
+        )
+        self.assertEqual(years, ["2020", "2019"])
+        self.assertEqual(s.query(CountrySimilarity).one().year, "2020")
+        s.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
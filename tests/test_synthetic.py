@@ -0,0 +1,119 @@
+import unittest
+import os
+import json
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from ai_research.mag.mag_orm import (
+    Base,
+    Paper,
+    PaperAuthor,
+    AffiliationLocation,
+    PaperFieldsOfStudy,
+    FosHierarchy,
+    HighDimDocVectorPacked,
+)
+from ai_research.mag.doc_vectors import unpack
+from ai_research.mag.synthetic import SyntheticMag, load_synthetic, BLOCK
+from ai_research.transformers.citation_graph import parse_references
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv(find_dotenv())
+
+
+class TestSyntheticMag(unittest.TestCase):
+    synthetic = SyntheticMag(2 * BLOCK + 500, seed=7, vector_dim=8)
+
+    def test_reproducible(self):
+        again = SyntheticMag(2 * BLOCK + 500, seed=7, vector_dim=8)
+        other = SyntheticMag(2 * BLOCK + 500, seed=8, vector_dim=8)
+        block = self.synthetic.paper_block(1)
+        pd.testing.assert_frame_equal(block[Paper], again.paper_block(1)[Paper])
+        pd.testing.assert_frame_equal(
+            block[PaperAuthor], list(again.paper_blocks(1, 2))[0][PaperAuthor]
+        )
+        self.assertFalse(block[Paper].title.equals(other.paper_block(1)[Paper].title))
+        self.assertEqual(self.synthetic.n_blocks, 3)
+        self.assertEqual(len(list(self.synthetic.paper_blocks(2, 10))), 1)
+
+    def test_papers(self):
+        block = self.synthetic.paper_block(1)
+        papers = block[Paper]
+        self.assertEqual(papers.id.iloc[0], BLOCK + 1)
+        self.assertTrue(papers.year.astype(int).is_monotonic_increasing)
+
+        # References only cite earlier papers, once each
+        counts, cited = parse_references(papers.references.tolist())
+        citing = np.repeat(papers.id.values, counts)
+        self.assertTrue((cited < citing).all())
+        self.assertFalse(pd.Series(citing * 10 ** 6 + cited).duplicated().any())
+
+        authors = block[PaperAuthor]
+        self.assertFalse(authors.duplicated(["paper_id", "author_id"]).any())
+        first = authors.groupby("paper_id").order.agg(["min", "max", "size"])
+        self.assertTrue((first["min"] == 1).all())
+        self.assertTrue((first["max"] == first["size"]).all())
+        self.assertGreater(first["size"].max(), 5)
+
+        # Every paper has a root field of study
+        fields = self.synthetic.fields.set_index("id")
+        tagged = block[PaperFieldsOfStudy].join(fields, on="field_of_study_id")
+        self.assertEqual(
+            tagged[tagged.level == 0].paper_id.nunique(), len(papers.id.unique())
+        )
+        vector = unpack(block[HighDimDocVectorPacked].vector.iloc[0])
+        self.assertEqual(len(vector), 8)
+
+        # JSON lists, as written by the harvester and the geocoder
+        self.assertEqual(len(json.loads(papers.source.iloc[0])), 1)
+        places = self.synthetic.affiliation_tables()[AffiliationLocation]
+        self.assertIn("establishment", json.loads(places.types.iloc[0]))
+
+    def test_short_abstracts(self):
+        for words in (5, 12):
+            papers = SyntheticMag(200, abstract_words=words).paper_block(0)[Paper]
+            self.assertEqual(papers.abstract.notnull().sum(), 200)
+
+    def test_hierarchy(self):
+        hierarchy = self.synthetic.field_tables()[FosHierarchy]
+        level = self.synthetic.fields.set_index("id").level
+        for row in hierarchy.itertuples():
+            for parent in row.parent_id or []:
+                self.assertEqual(level[parent], level[row.id] - 1)
+        self.assertTrue(hierarchy.parent_id.map(lambda p: p and len(p) > 1).any())
+
+
+class TestLoadSynthetic(unittest.TestCase):
+    engine = create_engine(os.getenv("test_postgresdb"))
+
+    def setUp(self):
+        Base.metadata.create_all(self.engine)
+
+    def tearDown(self):
+        Base.metadata.drop_all(self.engine)
+
+    def test_load(self):
+        synthetic = SyntheticMag(3000, seed=1, vector_dim=4)
+        stats = load_synthetic(self.engine, synthetic)
+        self.assertEqual(stats["mag_papers"]["rows"], 3000)
+        for table in Base.metadata.tables:
+            n = self.engine.execute(f'SELECT count(*) FROM "{table}"').scalar()
+            if table in stats:
+                self.assertGreater(n, 0, table)
+
+        countries = self.engine.execute(
+            """SELECT count(DISTINCT g.country) FROM mag_author_affiliation a
+            JOIN geocoded_places g USING (affiliation_id)
+            JOIN country_details c ON c.google_name = g.country"""
+        ).scalar()
+        self.assertGreater(countries, 5)
+
+        # Loading again leaves the tables as they are
+        again = load_synthetic(self.engine, synthetic)
+        n = self.engine.execute("SELECT count(*) FROM mag_author_affiliation").scalar()
+        self.assertEqual(n, stats["mag_author_affiliation"]["rows"])
+        self.assertEqual(again["mag_papers"]["rows"], 3000)
+
+
+if __name__ == "__main__":
+    unittest.main()
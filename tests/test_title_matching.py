@@ -0,0 +1,125 @@
+import unittest
+import os
+import tempfile
+import numpy as np
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine
+from ai_research.mag.mag_orm import Base, Paper
+from ai_research.estimators.title_matching import (
+    EMPTY,
+    MinHasher,
+    TitleIndex,
+    build_index,
+    match_probability,
+    shingles,
+    update_index,
+)
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv(find_dotenv())
+
+
+def random_titles(n, seed=0):
+    rng = np.random.RandomState(seed)
+    letters = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+    words = np.array(["".join(w) for w in letters[rng.randint(26, size=(5000, 6))]])
+    return [" ".join(w) for w in words[rng.randint(5000, size=(n, 8))]]
+
+
+def jaccard(a, b, k=3):
+    grams = [set(shingles([t], k)[0].tolist()) for t in (a, b)]
+    return len(grams[0] & grams[1]) / len(grams[0] | grams[1])
+
+
+class TestShingles(unittest.TestCase):
+    def test_shingles(self):
+        grams, owner = shingles(["Ab, c!", "", None, "ab c"])
+        self.assertEqual(owner.tolist(), [0, 0, 0, 0, 3, 3, 3, 3])
+        np.testing.assert_array_equal(grams[:4], grams[4:])
+        grams, _ = shingles(["Émile"], k=2)
+        self.assertEqual(len(grams), 6)
+
+    def test_similarity_estimate(self):
+        a = "Attention is all you need"
+        b = "Attention is all you need!! (extended version)"
+        hasher = MinHasher(num_perm=512)
+        sig = hasher.signatures([a, b, ""])
+        self.assertAlmostEqual((sig[0] == sig[1]).mean(), jaccard(a, b), delta=0.06)
+        self.assertTrue((sig[2] == EMPTY).all())
+
+
+class TestTitleIndex(unittest.TestCase):
+    def setUp(self):
+        self.titles = random_titles(2000)
+        self.ids = np.arange(len(self.titles)) * 10 + 5
+        self.index = TitleIndex()
+        self.index.add(self.ids, self.titles)
+
+    def test_match(self):
+        queries = [t.upper() + "." for t in self.titles[:100]]
+        queries += [t[:-2] for t in self.titles[100:200]]
+        queries.append("completely unrelated title about cooking")
+        matches = self.index.match(queries)
+        found = dict(zip(matches["query"], matches.paper_id))
+        self.assertEqual([found.get(i) for i in range(200)], self.ids[:200].tolist())
+        self.assertNotIn(200, found)
+        exact = matches[matches["query"] < 100]
+        self.assertTrue((exact.similarity == 1).all())
+        self.assertTrue((exact.prob > 0.99).all())
+
+    def test_probability(self):
+        prob = match_probability([0.3, 0.7, 0.8, 0.9, 1.0], 64, threshold=0.8)
+        self.assertTrue((np.diff(prob) > 0).all())
+        self.assertLess(prob[0], 1e-6)
+        self.assertTrue(0.4 < prob[2] < 0.6)
+
+    def test_duplicates(self):
+        titles = ["Graph neural networks: a review", "graph neural networks a review"]
+        self.index.add([1, 3], titles)
+        clusters = self.index.duplicate_clusters()
+        self.assertEqual(clusters.paper_id.tolist(), [1, 3])
+        self.assertEqual(clusters.cluster.tolist(), [1, 1])
+
+    def test_add_save_load(self):
+        self.assertEqual(self.index.add(self.ids[:10], self.titles[:10]), 0)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "titles.npz")
+            self.index.save(path)
+            loaded = TitleIndex.load(path)
+        np.testing.assert_array_equal(loaded.signatures, self.index.signatures)
+        self.assertEqual(loaded.match(self.titles[5:6]).paper_id.tolist(), [55])
+
+
+class TestBuildIndex(unittest.TestCase):
+    engine = create_engine(os.getenv("test_postgresdb"))
+    Session = sessionmaker(engine)
+
+    def setUp(self):
+        Base.metadata.create_all(self.engine)
+        s = self.Session()
+        s.add_all(
+            [
+                Paper(id=1, title="deep learning for graphs"),
+                Paper(id=2, title=None, original_title="Reinforcement Learning"),
+            ]
+        )
+        s.commit()
+        s.close()
+
+    def tearDown(self):
+        Base.metadata.drop_all(self.engine)
+
+    def test_build_update(self):
+        index = build_index(self.engine)
+        self.assertEqual(index.ids.tolist(), [1, 2])
+        s = self.Session()
+        s.add(Paper(id=3, title="Deep learning for graphs."))
+        s.commit()
+        s.close()
+        self.assertEqual(update_index(index, self.engine), 1)
+        self.assertEqual(index.match(["reinforcement learning"]).paper_id.tolist(), [2])
+        self.assertEqual(index.duplicate_clusters().paper_id.tolist(), [1, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import unittest
+import os
+import datetime
+import tempfile
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, select, func
+from ai_research.mag.mag_orm import (
+    Base,
+    Paper,
+    PaperFieldsOfStudy,
+    FieldOfStudy,
+    MetricCountryRCA,
+    PaperByYear,
+    PaperFieldsOfStudyByYear,
+)
+from ai_research.mag.year_partitions import migrate, sync_year_partitions
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv(find_dotenv())
+
+
+class TestYearPartitions(unittest.TestCase):
+    engine = create_engine(os.getenv("test_postgresdb"))
+    Session = sessionmaker(engine)
+
+    def setUp(self):
+        Base.metadata.create_all(self.engine)
+        self.tmp = tempfile.TemporaryDirectory()
+        s = self.Session()
+        s.add(FieldOfStudy(id=1, name="ml"))
+        s.add_all(
+            [
+                Paper(id=1, year="2018", date="2018-05-01"),
+                Paper(id=2, year="2019", date="2019-02-29"),
+                Paper(id=3, year="2019", date="2020-02-29"),
+                Paper(id=4, year="n/a", date="unknown"),
+            ]
+        )
+        s.flush()
+        s.add_all(
+            [PaperFieldsOfStudy(paper_id=i, field_of_study_id=1) for i in range(1, 5)]
+        )
+        s.commit()
+        s.close()
+
+    def tearDown(self):
+        Base.metadata.drop_all(self.engine)
+        self.tmp.cleanup()
+
+    def test_typed_columns(self):
+        s = self.Session()
+        # There is no year 0 date, so it must be null rather than fail the insert
+        s.add(Paper(id=5, year="0000", date="0000-01-01"))
+        s.commit()
+        rows = s.query(Paper.id, Paper.year_int, Paper.publication_date).order_by(
+            Paper.id
+        )
+        self.assertEqual(
+            rows.all(),
+            [
+                (1, 2018, datetime.date(2018, 5, 1)),
+                (2, 2019, None),
+                (3, 2019, datetime.date(2020, 2, 29)),
+                (4, None, None),
+                (5, 0, None),
+            ],
+        )
+        ids = s.query(Paper.id).filter(Paper.in_years(2019)).order_by(Paper.id)
+        self.assertEqual([i for i, in ids], [2, 3])
+        s.add(MetricCountryRCA(year="2017", entity="UK", field_of_study_id=1))
+        s.commit()
+        self.assertEqual(s.query(MetricCountryRCA.year_int).scalar(), 2017)
+        s.close()
+
+    def test_migrate(self):
+        self.engine.execute("ALTER TABLE mag_papers DROP COLUMN year_int")
+        self.assertEqual(migrate(self.engine), ["mag_papers.year_int"])
+        self.assertEqual(migrate(self.engine), [])
+        s = self.Session()
+        self.assertEqual(s.query(func.sum(Paper.year_int)).scalar(), 2018 + 2019 * 2)
+        s.close()
+
+    def count(self, table):
+        return self.engine.execute(select([func.count()]).select_from(table)).scalar()
+
+    def test_sync(self):
+        def sync():
+            return sync_year_partitions(self.engine, state_dir=self.tmp.name)
+
+        self.assertEqual(sync(), [2018, 2019])
+        s = self.Session()
+        self.assertEqual(
+            s.query(PaperByYear.id).filter(PaperByYear.in_years(2019)).count(), 2
+        )
+        self.assertEqual(s.query(PaperFieldsOfStudyByYear).count(), 3)
+        s.close()
+        self.assertEqual(sync(), [])
+
+        self.engine.execute("DELETE FROM mag_paper_fields_of_study WHERE paper_id = 2")
+        self.engine.execute("UPDATE mag_papers SET year = '2020' WHERE id = 1")
+        self.assertEqual(sync(), [2019, 2020, 2018])
+        self.assertEqual(self.count(PaperByYear.__table__), 3)
+        self.assertEqual(self.count(PaperFieldsOfStudyByYear.__table__), 2)
+
+        # Only the partitions of the selected years are scanned
+        query = select([PaperByYear.id]).where(PaperByYear.in_years(2019, 2020))
+        sql = query.compile(compile_kwargs={"literal_binds": True})
+        plan = "\n".join(row[0] for row in self.engine.execute(f"EXPLAIN {sql}"))
+        self.assertIn("mag_papers_by_year_2019", plan)
+        self.assertNotIn("mag_papers_by_year_2018", plan)
+        self.assertNotIn("mag_papers_by_year_default", plan)
+
+
+if __name__ == "__main__":
+    unittest.main()